@@ -32,6 +32,7 @@ from __future__ import division, print_function
 
 import os
 import sys
+import importlib
 from os.path import join
 from collections import namedtuple
 import logging
@@ -60,16 +61,8 @@ from . import workspace  # noqa: F401
 from . import topbar  # noqa: F401
 from . import drawwindow  # noqa: F401
 from . import backgroundwindow
-from . import preferenceswindow
-from . import brusheditor
 from . import layerswindow  # noqa: F401
-from . import previewwindow  # noqa: F401
-from . import optionspanel  # noqa: F401
 from . import framewindow  # noqa: F401
-from . import scratchwindow  # noqa: F401
-from . import inputtestwindow
-from . import brushiconeditor
-from . import history  # noqa: F401
 from . import colortools  # noqa: F401
 from . import brushmodifier
 from . import toolbar  # noqa: F401
@@ -77,7 +70,6 @@ from . import linemode
 from . import colors  # noqa: F401
 from . import colorpreview  # noqa: F401
 from . import fill  # noqa: F401
-from . import accelmap  # noqa: F401
 from .brushcolor import BrushColorManager
 from .overlays import LastPaintPosOverlay  # noqa: F401
 from .overlays import ScaleOverlay  # noqa: F401
@@ -87,14 +79,42 @@ import gui.cursor
 import lib.fileutils
 import gui.picker
 import gui.factoryaction  # registration only
+import gui.objfactory
 import gui.autorecover
 import lib.xml
 import gui.profiling
+import lib.instrumentation
 from lib.pycompat import unicode
 
 logger = logging.getLogger(__name__)
 
 
+## Lazily imported modules
+
+#: Modules defining rarely used dockpanels, imported when first shown.
+#: See `gui.objfactory.register_lazy_types()`.
+_LAZY_TOOL_WIDGET_MODULES = {
+    "gui.previewwindow": ["MyPaintPreviewTool"],
+    "gui.optionspanel": ["MyPaintModeOptionsTool"],
+    "gui.scratchwindow": ["MyPaintScratchpadTool"],
+    "gui.history": ["MyPaintHistoryPanel"],
+}
+
+for _modname, _gtype_names in _LAZY_TOOL_WIDGET_MODULES.items():
+    gui.objfactory.register_lazy_types(_modname, _gtype_names)
+
+#: Non-dockable subwindows: {action-name: (module-name, class-name)}.
+#: Their modules are imported when they're first opened. The background
+#: window isn't listed: gui.document loads the default background with
+#: its module at startup anyway.
+_LAZY_SUBWINDOW_CLASSES = {
+    "BrushEditorWindow": ("gui.brusheditor", "BrushEditorWindow"),
+    "PreferencesWindow": ("gui.preferenceswindow", "PreferencesWindow"),
+    "InputTestWindow": ("gui.inputtestwindow", "InputTestWindow"),
+    "BrushIconEditorWindow": ("gui.brushiconeditor", "BrushIconEditorWindow"),
+}
+
+
 ## Utility methods
 
 
@@ -333,6 +353,11 @@ class Application (object):
             join(self.state_dirs.app_data, 'brushes'),
             join(self.state_dirs.user_data, 'brushes'),
             self,
+            index_path=join(self.state_dirs.user_config, u'brushindex.json'),
+            preview_cache_path=join(
+                lib.document.get_app_cache_root(),
+                u'brushpreviews',
+            ),
         )
         signal_callback_objs.append(self.filehandler)
         self.brushmodifier = brushmodifier.BrushModifier(self)
@@ -376,13 +401,10 @@ class Application (object):
         # Non-dockable subwindows
         # Loading is deferred as late as possible
         self._subwindow_classes = {
-            # action-name: action-class
+            # action-name: action-class, or (module-name, class-name)
             "BackgroundWindow": backgroundwindow.BackgroundWindow,
-            "BrushEditorWindow": brusheditor.BrushEditorWindow,
-            "PreferencesWindow": preferenceswindow.PreferencesWindow,
-            "InputTestWindow": inputtestwindow.InputTestWindow,
-            "BrushIconEditorWindow": brushiconeditor.BrushIconEditorWindow,
         }
+        self._subwindow_classes.update(_LAZY_SUBWINDOW_CLASSES)
         self._subwindows = {}
 
         # Statusbar init
@@ -449,6 +471,7 @@ class Application (object):
         """Saves the current settings to persistent storage."""
         self.brushmanager.save_brushes_for_devices()
         self.brushmanager.save_brush_history()
+        self.brushmanager.save_index()
         self.filehandler.save_scratchpad(self.scratchpad_filename)
         settingspath = join(self.user_confpath, u'settings.json')
         logger.debug("Writing app settings to %r", settingspath)
@@ -469,7 +492,11 @@ class Application (object):
         self._apply_pressure_mapping_settings()
         self._apply_button_mapping_settings()
         self._apply_autosave_settings()
-        self.preferences_window.update_ui()
+        self._apply_painting_settings()
+        # Don't create the preferences window just to update it: it
+        # reads the settings itself when it's first opened.
+        if "PreferencesWindow" in self._subwindows:
+            self.preferences_window.update_ui()
 
     def load_settings(self):
         """Loads the settings from persistent storage.
@@ -533,6 +560,7 @@ class Application (object):
 
             'document.autosave_backups': True,
             'document.autosave_interval': 10,
+            'document.threaded_painting': False,
 
             'display.colorspace': "srgb",
             # sRGB is a good default even for OS X since v10.6 / Snow
@@ -661,6 +689,11 @@ class Application (object):
         model.autosave_backups = active
         model.autosave_interval = interval
 
+    def _apply_painting_settings(self):
+        threaded = self.preferences.get("document.threaded_painting", False)
+        logger.debug("Applying painting settings: threaded=%r", threaded)
+        self.doc.model.threaded_painting = threaded
+
     def save_gui_config(self):
         Gtk.AccelMap.save(join(self.user_confpath, 'accelmap.conf'))
         wkspace = self.workspace
@@ -773,6 +806,12 @@ class Application (object):
             window = self._subwindows[name]
         elif name in self._subwindow_classes:
             window_class = self._subwindow_classes[name]
+            if isinstance(window_class, tuple):
+                module_name, class_name = window_class
+                logger.debug("Importing %r for subwindow %r",
+                             module_name, name)
+                module = importlib.import_module(module_name)
+                window_class = getattr(module, class_name)
             window = window_class()
             window.__toggle_action = self.find_action(name)
             window.connect("hide", self._subwindow_hide_cb)
@@ -845,6 +884,17 @@ class Application (object):
     def run_garbage_collector_cb(self, action):
         helpers.run_garbage_collector()
 
+    def print_instrumentation_cb(self, action):
+        """Starts collecting metrics, or prints and resets them"""
+        if not lib.instrumentation.enabled:
+            lib.instrumentation.enable()
+            logger.info("Collecting performance counters")
+            return
+        print(lib.instrumentation.format_summary(
+            lib.instrumentation.snapshot(),
+        ))
+        lib.instrumentation.reset()
+
     def crash_program_cb(self, action):
         """Tests exception handling."""
         raise Exception("This is a crash caused by the user.")
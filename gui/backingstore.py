@@ -0,0 +1,392 @@
+# This file is part of MyPaint.
+# Copyright (C) 2018 by the MyPaint Development Team
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+
+"""Persistent store of rendered display tiles for a canvas
+
+The canvas renderer draws the document via an intermediate image in
+model coordinates, scaled down to one of the mipmap levels. Cairo then
+applies the rest of the view transformation when painting it. Because
+that image doesn't depend on the view's translation or rotation, or on
+the exact zoom within a mipmap level, it can be kept between frames.
+
+The backing store here holds that image, tile by tile, for the region
+around the view. When the view is panned or rotated, most of its tiles
+are still valid and only newly exposed ones need rendering. Changes to
+the model invalidate the affected tiles. Tiles can also be rendered
+elsewhere, for example on a worker thread: updates made that way are
+tracked, and discarded if the tiles are invalidated in the meantime.
+
+The image is a `lib.pixbufsurface.CairoSurface`, so tiles rendered on
+the main thread can be written straight into it, in the ARGB32 format
+Cairo paints from, without any intermediate copies.
+
+When the view is zoomed far enough to need a different mipmap level,
+the store starts again from nothing at the new level. Its previous
+contents are kept as a fallback, and can be painted scaled up or down
+in place of tiles which haven't been rendered at the new level yet.
+
+"""
+
+## Imports
+
+from __future__ import division, print_function
+
+import logging
+
+import cairo
+
+from lib.helpers import Rect
+import lib.tiledsurface
+import lib.pixbufsurface
+import gui.redraw
+
+
+logger = logging.getLogger(__name__)
+
+
+## Constants
+
+N = lib.tiledsurface.N
+
+#: Largest backing image (in tiles, along each side) that will be kept.
+MAX_SIZE_TILES = 64
+
+#: Extra tiles allocated around the requested area when growing.
+MARGIN_TILES = 2
+
+
+## Class defs
+
+
+class TileBackingStore (object):
+    """Backing image of rendered tiles, at one mipmap level
+
+    The store covers a rectangle of tiles at its current mipmap level.
+    Each tile inside it is either valid, meaning its pixels are a
+    correct rendering of the document, or not. Tiles must be rendered
+    into the store with `update()` before `set_source()` shows them.
+
+    The rendering also depends on some renderer settings, like display
+    filters. These are summarized as a key, and the whole store is
+    invalidated when the key or the mipmap level changes. A change of
+    mipmap level keeps the old contents around as a fallback.
+
+    """
+
+    def __init__(self):
+        super(TileBackingStore, self).__init__()
+        self._surf = None
+        self._rect = None   # covered area, in tiles
+        self._level = None
+        self._key = None
+        self._valid = set()
+        self._prev = None   # (surf, rect, level, valid), or None
+        self._pending = {}  # {(tx, ty): token}, for deferred updates
+        self._next_token = 0
+
+    @property
+    def mipmap_level(self):
+        """The mipmap level currently covered by the store"""
+        return self._level
+
+    @property
+    def key(self):
+        """The summary of rendering settings the store is valid for"""
+        return self._key
+
+    @property
+    def surface(self):
+        """The store's own image, for rendering tiles straight into
+
+        :rtype: lib.pixbufsurface.CairoSurface
+
+        Its tiles are the store's tiles. After rendering into some of
+        them, pass the store's surface to `update()` to mark them as
+        valid. Only valid after a successful `prepare()`.
+
+        """
+        self._surf.image_surface.flush()
+        return self._surf
+
+    @property
+    def has_fallback(self):
+        """True if contents from an earlier mipmap level are available"""
+        return self._prev is not None
+
+    def drop_fallback(self):
+        """Forget the contents kept from an earlier mipmap level"""
+        self._prev = None
+
+    def invalidate_all(self):
+        """Mark every tile as needing to be rendered again"""
+        self._valid.clear()
+        self._pending.clear()
+        self._prev = None
+
+    def invalidate_model_area(self, x, y, w, h):
+        """Mark the tiles covering a model area as invalid
+
+        :param int x: Area left edge, in model (level 0) coordinates
+        :param int y: Area top edge, in model (level 0) coordinates
+        :param int w: Area width, or 0 for everything
+        :param int h: Area height, or 0 for everything
+
+        """
+        if w <= 0 or h <= 0:
+            self.invalidate_all()
+            return
+        _discard_model_area(self._valid, self._level, x, y, w, h)
+        if self._pending:
+            pending = set(self._pending)
+            _discard_model_area(pending, self._level, x, y, w, h)
+            for ti in list(self._pending):
+                if ti not in pending:
+                    del self._pending[ti]
+        if self._prev is not None:
+            prev_valid, prev_level = self._prev[3], self._prev[2]
+            _discard_model_area(prev_valid, prev_level, x, y, w, h)
+
+    def prepare(self, mipmap_level, key, tiles_rect):
+        """Make the store cover an area at a mipmap level
+
+        :param int mipmap_level: Mipmap level to cover
+        :param tuple key: Summary of the other rendering settings
+        :param lib.helpers.Rect tiles_rect: Area to cover, in tiles
+        :returns: True if the area can be served from the store
+        :rtype: bool
+
+        If the area lies outside the current store, the store is moved,
+        keeping the tiles it has in common with its old position. If
+        only the mipmap level changes, the old contents become the
+        fallback, unless nothing was ever rendered into them.
+
+        """
+        if tiles_rect.w > MAX_SIZE_TILES or tiles_rect.h > MAX_SIZE_TILES:
+            return False
+        if (mipmap_level, key) != (self._level, self._key):
+            if key != self._key:
+                self._prev = None
+            elif self._valid:
+                self._prev = (self._surf, self._rect, self._level,
+                              self._valid)
+            self._level = mipmap_level
+            self._key = key
+            self._valid = set()
+            self._pending.clear()
+            self._surf = None
+        if self._surf is not None and self._rect.contains(tiles_rect):
+            return True
+        mx = min(MARGIN_TILES, (MAX_SIZE_TILES - tiles_rect.w) // 2)
+        my = min(MARGIN_TILES, (MAX_SIZE_TILES - tiles_rect.h) // 2)
+        new_rect = Rect(
+            tiles_rect.x - mx, tiles_rect.y - my,
+            tiles_rect.w + 2 * mx, tiles_rect.h + 2 * my,
+        )
+        new_surf = lib.pixbufsurface.CairoSurface(
+            new_rect.x * N, new_rect.y * N,
+            new_rect.w * N, new_rect.h * N,
+        )
+        old_surf = self._surf
+        old_rect = self._rect
+        if old_surf is not None and old_rect.overlaps(new_rect):
+            cr = cairo.Context(new_surf.image_surface)
+            cr.translate(-new_surf.ex, -new_surf.ey)
+            cr.set_operator(cairo.OPERATOR_SOURCE)
+            old_surf.set_source(cr)
+            cr.paint()
+            self._valid = set(
+                ti for ti in self._valid
+                if new_rect.contains(Rect(ti[0], ti[1], 1, 1))
+            )
+        else:
+            self._valid.clear()
+        self._pending.clear()
+        self._surf = new_surf
+        self._rect = new_rect
+        return True
+
+    def missing(self, tiles, include_pending=True):
+        """Filter a list of tiles down to those needing rendering
+
+        :param iterable tiles: Tiles to check
+        :param bool include_pending: Include tiles being rendered
+            elsewhere, which `begin_update()` was called for
+        :rtype: list
+
+        """
+        if include_pending:
+            return [ti for ti in tiles if ti not in self._valid]
+        return [
+            ti for ti in tiles
+            if ti not in self._valid and ti not in self._pending
+        ]
+
+    def covers(self, tiles):
+        """Filter a list of tiles down to those inside the store's area"""
+        if self._rect is None:
+            return []
+        r = self._rect
+        return [
+            (tx, ty) for (tx, ty) in tiles
+            if r.x <= tx < r.x + r.w and r.y <= ty < r.y + r.h
+        ]
+
+    def update(self, surface, tiles):
+        """Copy rendered tiles into the store, and mark them as valid
+
+        :param lib.pixbufsurface.CairoSurface surface: Rendered pixels,
+            positioned at the store's mipmap level. If this is the
+            store's own `surface`, nothing needs copying.
+        :param list tiles: The tiles of the surface to copy
+
+        """
+        if not tiles:
+            return
+        for ti in tiles:
+            self._pending.pop(ti, None)
+        surface.mark_dirty()
+        if surface is not self._surf:
+            cr = cairo.Context(self._surf.image_surface)
+            cr.translate(-self._surf.ex, -self._surf.ey)
+            for r in gui.redraw.tiles_to_rects(tiles):
+                cr.rectangle(r.x * N, r.y * N, r.w * N, r.h * N)
+            cr.clip()
+            cr.set_operator(cairo.OPERATOR_SOURCE)
+            surface.set_source(cr)
+            cr.paint()
+        self._valid.update(tiles)
+
+    def begin_update(self, tiles):
+        """Note that some tiles are being rendered elsewhere
+
+        :param list tiles: Tiles inside the store's area
+        :returns: A token for `finish_update()` or `abort_update()`
+
+        """
+        token = self._next_token
+        self._next_token += 1
+        for ti in tiles:
+            self._pending[ti] = token
+        return token
+
+    def finish_update(self, token, surface, tiles):
+        """Copy in tiles rendered elsewhere, if they're still wanted
+
+        :param token: The token from the matching `begin_update()`
+        :param lib.pixbufsurface.CairoSurface surface: Rendered pixels
+        :param list tiles: The tiles that were rendered
+        :returns: The tiles which were copied into the store
+        :rtype: list
+
+        Tiles which have been invalidated since `begin_update()`, or
+        updated some other way, or which the store no longer covers,
+        are not copied.
+
+        """
+        accepted = [ti for ti in tiles if self._pending.get(ti) == token]
+        self.update(surface, accepted)
+        return accepted
+
+    def abort_update(self, token):
+        """Forget about tiles that won't be rendered elsewhere after all
+
+        :param token: The token from the matching `begin_update()`
+
+        Call this instead of `finish_update()` if the rendering failed
+        or was cancelled. Its tiles stop being pending, so they can be
+        rendered again.
+
+        """
+        for ti, t in list(self._pending.items()):
+            if t == token:
+                del self._pending[ti]
+
+    @property
+    def has_pending(self):
+        """True if any tiles are being rendered elsewhere"""
+        return bool(self._pending)
+
+    def set_source(self, cr):
+        """Set the store as a Cairo context's source
+
+        The context must be in the store's coordinate space: model
+        coordinates, scaled down to the store's mipmap level.
+
+        """
+        self._surf.set_source(cr)
+
+    def paint_fallback(self, cr, tiles):
+        """Paint tiles from the fallback contents, scaled as needed
+
+        :param cairo.Context cr: Context, as for `set_source()`
+        :param list tiles: Tiles at the current mipmap level
+        :returns: The tiles which the fallback could not supply
+        :rtype: list
+
+        For a fallback at a coarser level, a tile can be supplied if
+        the fallback tile containing it is valid. For a finer level,
+        the fallback tiles at its corners are checked instead of every
+        tile it contains, which is good enough for a temporary preview.
+
+        """
+        if self._prev is None or not tiles:
+            return list(tiles)
+        surf, _rect, level, valid = self._prev
+        d = level - self._level
+        covered = []
+        uncovered = []
+        for tx, ty in tiles:
+            if d >= 0:
+                ok = (tx >> d, ty >> d) in valid
+            else:
+                s = 1 << -d
+                x0, y0 = tx * s, ty * s
+                x1, y1 = x0 + s - 1, y0 + s - 1
+                ok = all(
+                    c in valid
+                    for c in ((x0, y0), (x1, y0), (x0, y1), (x1, y1))
+                )
+            if ok:
+                covered.append((tx, ty))
+            else:
+                uncovered.append((tx, ty))
+        if covered:
+            cr.save()
+            for r in gui.redraw.tiles_to_rects(covered):
+                cr.rectangle(r.x * N, r.y * N, r.w * N, r.h * N)
+            cr.clip()
+            cr.scale(2 ** d, 2 ** d)
+            surf.set_source(cr)
+            cr.paint()
+            cr.restore()
+        return uncovered
+
+
+## Helper funcs
+
+
+def _discard_model_area(valid, level, x, y, w, h):
+    """Discard the tiles covering a model area from a set of tiles"""
+    if not valid:
+        return
+    fac = 2 ** level
+    tx0 = int(x // (N * fac))
+    ty0 = int(y // (N * fac))
+    tx1 = int((x + w - 1) // (N * fac))
+    ty1 = int((y + h - 1) // (N * fac))
+    if (tx1 - tx0 + 1) * (ty1 - ty0 + 1) > len(valid):
+        doomed = [
+            (tx, ty) for (tx, ty) in valid
+            if tx0 <= tx <= tx1 and ty0 <= ty <= ty1
+        ]
+        valid.difference_update(doomed)
+        return
+    for ty in range(ty0, ty1 + 1):
+        for tx in range(tx0, tx1 + 1):
+            valid.discard((tx, ty))
@@ -0,0 +1,223 @@
+# This file is part of MyPaint.
+# Copyright (C) 2018 by the MyPaint Development Team
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+
+"""Persistent index of the brushes in the brush library folders
+
+Finding out what brushes are installed used to mean walking all of the
+brush folders at startup, and finding out what a brush is called or
+what it does meant parsing its settings. With thousands of brushes
+installed, that takes seconds.
+
+The index remembers the listing of each brush folder, keyed by the
+folder's modification time, so that unchanged folders don't need to be
+listed again. It also remembers a little metadata for each brush
+settings file, keyed by the file's path and modification time: the
+brush's name and its description. The index is saved as JSON, normally
+in the user config folder.
+
+"""
+
+## Imports
+
+from __future__ import division, print_function
+
+import os
+import io
+import json
+import logging
+
+from lib.brush import BrushInfo
+import lib.fileutils
+from lib.pycompat import unicode
+
+
+logger = logging.getLogger(__name__)
+
+
+## Class defs
+
+
+class BrushIndex (object):
+    """Cached brush folder listings and brush metadata
+
+    >>> import tempfile, shutil
+    >>> tmpdir = tempfile.mkdtemp(u"_brushindex")
+    >>> brushdir = os.path.join(tmpdir, u"brushes")
+    >>> os.makedirs(os.path.join(brushdir, u"group1"))
+    >>> for name in (u"a", u"group1/b"):
+    ...     path = os.path.join(brushdir, name + u".myb")
+    ...     with open(path, "w") as fp:
+    ...         n = fp.write(BrushInfo().save_to_string())
+    >>> idx1 = BrushIndex(os.path.join(tmpdir, u"index.json"))
+    >>> sorted(idx1.list_brushes(brushdir)) == [u"a", u"group1/b"]
+    True
+    >>> idx1.save()
+
+    A new index loads the saved listing, and only needs to look at the
+    folders' modification times:
+
+    >>> idx2 = BrushIndex(os.path.join(tmpdir, u"index.json"))
+    >>> idx2.list_brushes(brushdir) == idx1.list_brushes(brushdir)
+    True
+    >>> meta = idx2.get_metadata(os.path.join(brushdir, u"a.myb"), u"a")
+    >>> meta["name"] == u"a" and meta["description"] == u""
+    True
+    >>> shutil.rmtree(tmpdir)
+
+    """
+
+    #: Version of the saved JSON. Indexes with other versions are ignored.
+    VERSION = 1
+
+    def __init__(self, path=None):
+        """Initialize, loading the saved index if there is one
+
+        :param unicode path: Where the index is saved, or None to keep
+            the index in memory only.
+
+        """
+        super(BrushIndex, self).__init__()
+        self._path = path
+        self._dirs = {}  # {dir_path: {"mtime": float, "entries": [...]}}
+        self._brushes = {}  # {myb_path: {"mtime": float, ...}}
+        self._dirty = False
+        if path is not None and os.path.isfile(path):
+            try:
+                self._load()
+            except Exception:
+                logger.exception("Ignoring unreadable brush index %r", path)
+                self._dirs = {}
+                self._brushes = {}
+
+    def _load(self):
+        """Load the index from its file"""
+        with io.open(self._path, "r", encoding="utf-8") as fp:
+            data = json.load(fp)
+        if data.get("version") != self.VERSION:
+            logger.info("Ignoring brush index %r: old version", self._path)
+            return
+        self._dirs = data.get("dirs", {})
+        self._brushes = data.get("brushes", {})
+
+    def save(self):
+        """Save the index to its file, if it has changed"""
+        if self._path is None or not self._dirty:
+            return
+        data = {
+            "version": self.VERSION,
+            "dirs": self._dirs,
+            "brushes": self._brushes,
+        }
+        tmp_path = self._path + u".tmp"
+        try:
+            with io.open(tmp_path, "w", encoding="utf-8") as fp:
+                fp.write(unicode(json.dumps(data)))
+            lib.fileutils.replace(tmp_path, self._path)
+        except (IOError, OSError):
+            logger.exception("Failed to save brush index %r", self._path)
+            return
+        self._dirty = False
+
+    ## Folder listings
+
+    def list_brushes(self, path):
+        """Recursively list the brushes within a directory
+
+        :param unicode path: Brush folder
+        :returns: Brush names relative to path, using slashes for
+            subdirectories on all platforms.
+        :rtype: list
+
+        Only folders which have changed since they were indexed are
+        actually listed.
+
+        """
+        assert isinstance(path, unicode)  # make sure we get unicode filenames
+        result = []
+        self._list_dir(path, u"", result)
+        return result
+
+    def _list_dir(self, path, prefix, result):
+        """Append a folder's brushes to a list, recursively"""
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return
+        entry = self._dirs.get(path)
+        if entry is None or entry.get("mtime") != mtime:
+            entries = []
+            for name in os.listdir(path):
+                assert isinstance(name, unicode)
+                if name.endswith('.myb'):
+                    entries.append(name[:-4])
+                elif os.path.isdir(os.path.join(path, name)):
+                    entries.append(name + u"/")
+            entry = {"mtime": mtime, "entries": entries}
+            self._dirs[path] = entry
+            self._dirty = True
+        for name in entry["entries"]:
+            if name.endswith(u"/"):
+                self._list_dir(os.path.join(path, name[:-1]),
+                               prefix + name, result)
+            else:
+                result.append(prefix + name)
+
+    ## Brush metadata
+
+    def get_metadata(self, filename, name):
+        """Get the metadata for a brush settings file
+
+        :param unicode filename: Path to the brush's .myb file
+        :param unicode name: The brush's name within its library
+        :returns: A dict with "name" and "description" keys, or None
+            if the file could not be read.
+        :rtype: dict
+
+        The file is only parsed if it has changed since it was indexed.
+        Only what the brush lists need is indexed. Everything else,
+        including the brush's settings and icon, is fetched lazily by
+        `gui.brushmanager.ManagedBrush` when it is first used.
+
+        """
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            return None
+        entry = self._brushes.get(filename)
+        if entry is not None and entry.get("mtime") == mtime:
+            return entry
+        try:
+            with open(filename) as fp:
+                brushinfo = BrushInfo(fp.read())
+        except (IOError, ValueError, BrushInfo.ParseError) as e:
+            logger.warning("Failed to index brush %r: %s", filename, e)
+            return None
+        entry = {
+            "mtime": mtime,
+            "name": name,
+            "description": (
+                brushinfo.get_string_property("description") or u""
+            ),
+        }
+        self._brushes[filename] = entry
+        self._dirty = True
+        return entry
+
+
+## Module testing
+
+
+def _test():
+    """Run doctest strings"""
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    _test()
@@ -33,8 +33,9 @@ from . import dialogs
 from lib.brush import BrushInfo
 from lib.observable import event
 import lib.pixbuf
-from . import drawutils
 import gui.mode
+import gui.brushindex
+import gui.brushpreviews
 from lib.pycompat import unicode
 from lib.pycompat import xrange
 from lib.pycompat import PY3
@@ -183,14 +184,21 @@ class BrushManager (object):
 
     ## Initialization
 
-    def __init__(self, stock_brushpath, user_brushpath, app=None):
+    def __init__(self, stock_brushpath, user_brushpath, app=None,
+                 index_path=None, preview_cache_path=None):
         """Initialize, with paths and a ref to the main app.
 
         :param unicode/str stock_brushpath: MyPaint install's RO brushes.
         :param unicode/str user_brushpath: User-writable brush library.
         :param gui.application.Application app: Main app (use None for test).
+        :param unicode index_path: Where to keep the brush index
+            (see `gui.brushindex`), or None to not save it.
+        :param unicode preview_cache_path: Folder for generated brush
+            previews (see `gui.brushpreviews`), or None to not save them.
 
         The user_brushpath folder will be created if it does not yet exist.
+        Brushes are only listed at startup: their settings are loaded
+        when they are first used, and their previews when first shown.
 
         >>> from tempfile import mkdtemp
         >>> from shutil import rmtree
@@ -223,6 +231,16 @@ class BrushManager (object):
         #: the most recently saved or restored "context", a.k.a. brush key.
         self.selected_context = None
 
+        #: Listings and metadata of the brush folders.
+        self.index = gui.brushindex.BrushIndex(index_path)
+        # Names of the brushes found on disk, only set during startup
+        self._listed_brushes = frozenset()
+
+        #: Generated previews for brushes without saved ones.
+        self.previews = gui.brushpreviews.BrushPreviewCache(
+            preview_cache_path,
+        )
+
         if not os.path.isdir(self.user_brushpath):
             os.mkdir(self.user_brushpath)
         self._init_groups()
@@ -349,20 +367,11 @@ class BrushManager (object):
         """Recursively list the brushes within a directory.
 
         Return a list of brush names relative to path, using slashes
-        for subdirectories on all platforms.
+        for subdirectories on all platforms. Unchanged directories are
+        listed from the index.
 
         """
-        path += '/'
-        result = []
-        assert isinstance(path, unicode)  # make sure we get unicode filenames
-        for name in os.listdir(path):
-            assert isinstance(name, unicode)
-            if name.endswith('.myb'):
-                result.append(name[:-4])
-            elif os.path.isdir(path + name):
-                for name2 in self._list_brushes(path + name):
-                    result.append(name + '/' + name2)
-        return result
+        return self.index.list_brushes(path)
 
     def _init_unordered_groups(self, brush_cache):
         """Initialize the unordered subset of available brushes+groups.
@@ -377,9 +386,10 @@ class BrushManager (object):
         should therefore be called after `_init_ordered_groups()`.
 
         """
-        listbrushes = self._list_brushes
-        for name in (listbrushes(self.stock_brushpath)
-                     + listbrushes(self.user_brushpath)):
+        grouped = set()
+        for brushes in self.groups.values():
+            grouped.update(id(b) for b in brushes)
+        for name in self._list_all_brushes():
             if name.startswith(_DEVBRUSH_NAME_PREFIX):
                 # Device brushes are lazy-loaded in fetch_brush_for_device()
                 continue
@@ -397,11 +407,17 @@ class BrushManager (object):
                 i = int(i_str)
                 self.history[i] = b
             else:
-                if not self.is_in_brushlist(b):
+                if id(b) not in grouped:
                     logger.info("Unassigned brush %r: assigning to %r",
                                 name, FOUND_BRUSHES_GROUP)
                     brushes = self.groups.setdefault(FOUND_BRUSHES_GROUP, [])
                     brushes.insert(0, b)
+                    grouped.add(id(b))
+
+    def _list_all_brushes(self):
+        """List the stock brushes, then the user brushes"""
+        return (self._list_brushes(self.stock_brushpath)
+                + self._list_brushes(self.user_brushpath))
 
     def _init_default_brushkeys_and_history(self):
         """Assign sensible defaults for brushkeys and history.
@@ -446,10 +462,17 @@ class BrushManager (object):
         self.contexts = [None for i in xrange(_NUM_BRUSHKEYS)]
         self.history = [None for i in xrange(_BRUSH_HISTORY_SIZE)]
 
+        # Brushes which are known to exist can skip the check when their
+        # ManagedBrush is created.
+        self._listed_brushes = frozenset(self._list_all_brushes())
         brush_cache = {}
-        self._init_ordered_groups(brush_cache)
-        self._init_unordered_groups(brush_cache)
+        try:
+            self._init_ordered_groups(brush_cache)
+            self._init_unordered_groups(brush_cache)
+        finally:
+            self._listed_brushes = frozenset()
         self._init_default_brushkeys_and_history()
+        self.index.save()
 
         # clean up legacy stuff
         fn = os.path.join(self.user_brushpath, 'deleted.conf')
@@ -490,6 +513,14 @@ class BrushManager (object):
         its corresponding BrushInfo.
         """
 
+    @event
+    def preview_ready(self, brush):
+        """Event: a brush's preview has been generated in the background
+
+        Observer callbacks are invoked with the ManagedBrush whose preview
+        was requested with `ManagedBrush.request_preview()`.
+        """
+
     ## Initial and default brushes
 
     def select_initial_brush(self):
@@ -1003,6 +1034,10 @@ class BrushManager (object):
         for brush in self.history:
             brush.save()
 
+    def save_index(self):
+        """Saves the brush index, if it changed"""
+        self.index.save()
+
     ## Brush groups
 
     def get_group_brushes(self, group):
@@ -1110,7 +1145,8 @@ class ManagedBrush(object):
         super(ManagedBrush, self).__init__()
         self.bm = brushmanager
         self._preview = None
-        self._brushinfo = BrushInfo()
+        self._preview_requested = False
+        self._brushinfo = None  # created on demand
 
         #: The brush's relative filename, sans extension.
         self.name = name
@@ -1128,7 +1164,8 @@ class ManagedBrush(object):
         # Files are loaded later,
         # but throw an exception now if they don't exist.
         if persistent:
-            self._get_fileprefix()
+            if name not in brushmanager._listed_brushes:
+                self._get_fileprefix()
             assert self.name is not None
 
     ## Preview image: loaded on demand
@@ -1137,7 +1174,9 @@ class ManagedBrush(object):
         """Gets a preview image for the brush
 
         For persistent brushes, this loads the disk preview; otherwise a
-        fairly slow automated brush preview is used.
+        fairly slow automated brush preview is used. Automated previews
+        are cached on disk, keyed by the brush settings. Use
+        `request_preview()` to avoid blocking the UI while they render.
 
         >>> with BrushManager._mock() as (bm, tmpdir):
         ...     b = ManagedBrush(bm, name=None, persistent=False)
@@ -1171,10 +1210,65 @@ class ManagedBrush(object):
             self._load_preview()
         if self._preview is None:
             brushinfo = self.get_brushinfo()
-            self._preview = drawutils.render_brush_preview_pixbuf(brushinfo)
+            self._preview = self.bm.previews.render(brushinfo)
         return self._preview
 
+    def request_preview(self):
+        """Gets the preview image if it's ready, without blocking
+
+        :returns: The preview, or None if it is still being made
+        :rtype: GdkPixbuf.Pixbuf
+
+        Saved previews are loaded straight away, like `get_preview()`.
+        Automated previews which aren't in the disk cache are rendered
+        in the background, and the BrushManager's `preview_ready` event
+        is announced when they're done.
+
+        >>> with BrushManager._mock() as (bm, tmpdir):
+        ...     b = ManagedBrush(bm, name=None, persistent=False)
+        ...     b.request_preview() is None
+        True
+
+        """
+        if self._preview is None and self.name:
+            self._load_preview()
+        if self._preview is None and not self._preview_requested:
+            self._preview_requested = True
+            brushinfo = self.get_brushinfo()
+            pixbuf = self.bm.previews.request(
+                brushinfo,
+                self._preview_rendered_cb,
+            )
+            if pixbuf is not None:
+                self._preview_requested = False
+                self._preview = pixbuf
+        return self._preview
+
+    def _preview_rendered_cb(self, pixbuf):
+        """Receives a preview from the background renderer
+
+        If rendering failed, the pixbuf is None, and the preview can be
+        requested again.
+
+        >>> with BrushManager._mock() as (bm, tmpdir):
+        ...     b = ManagedBrush(bm, name=None, persistent=False)
+        ...     b._preview_requested = True
+        ...     b._preview_rendered_cb(None)
+        ...     (b._preview_requested, b._preview)
+        (False, None)
+
+        """
+        if not self._preview_requested:
+            return
+        self._preview_requested = False
+        if pixbuf is None:
+            return
+        if self._preview is None:
+            self._preview = pixbuf
+            self.bm.preview_ready(self)
+
     def set_preview(self, pixbuf):
+        self._preview_requested = False
         self._preview = pixbuf
 
     preview = property(get_preview, set_preview)
@@ -1194,6 +1288,10 @@ class ManagedBrush(object):
         ...             b.save()
 
         """
+        if self.persistent and not self._settings_loaded:
+            meta = self._get_metadata()
+            if meta is not None:
+                return meta["description"]
         return self.brushinfo.get_string_property("description")
 
     @description.setter
@@ -1224,6 +1322,8 @@ class ManagedBrush(object):
 
     def get_brushinfo(self):
         self._ensure_settings_loaded()
+        if self._brushinfo is None:
+            self._brushinfo = BrushInfo()
         return self._brushinfo
 
     def set_brushinfo(self, brushinfo):
@@ -1234,7 +1334,7 @@ class ManagedBrush(object):
     ## Display
 
     def __repr__(self):
-        if self._brushinfo.settings:
+        if self._brushinfo is not None and self._brushinfo.settings:
             pname = self._brushinfo.get_string_property("parent_brush_name")
             return "<ManagedBrush %r p=%s>" % (self.name, pname)
         else:
@@ -1437,6 +1537,8 @@ class ManagedBrush(object):
         filename = prefix + '.myb'
         with open(filename) as fp:
             brushinfo_str = fp.read()
+        if self._brushinfo is None:
+            self._brushinfo = BrushInfo()
         try:
             self._brushinfo.load_from_string(brushinfo_str)
         except BrushInfo.ParseError as e:
@@ -1471,12 +1573,29 @@ class ManagedBrush(object):
         return True
 
     def _ensure_settings_loaded(self):
-        """Ensures the brush's settings are loaded, if persistent"""
+        """Ensures the brush's settings are loaded, if persistent
+
+        The preview is left to `get_preview()`, which loads it when the
+        brush is first shown.
+
+        """
         if self.persistent and not self._settings_loaded:
+            if self.name is None:
+                warn("Attempt to load an unnamed brush, don't do that.",
+                     RuntimeWarning, 2)
+                return
             logger.debug("Loading %r...", self)
-            self.load()
+            self._load_settings()
             assert self._settings_loaded
 
+    def _get_metadata(self):
+        """Metadata for the brush's settings file, from the index"""
+        try:
+            prefix = self._get_fileprefix()
+        except IOError:
+            return None
+        return self.bm.index.get_metadata(prefix + u'.myb', self.name)
+
 
 class InvalidBrushpack (Exception):
     """Raised when brushpacks cannot be imported."""
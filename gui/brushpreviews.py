@@ -0,0 +1,252 @@
+# This file is part of MyPaint.
+# Copyright (C) 2018 by the MyPaint Development Team
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+
+"""Cached, background-rendered previews for brushes without saved ones
+
+Brushes picked from .ORA files, and other brushes without a saved
+preview image, get one made for them by
+`gui.drawutils.render_brush_preview_pixbuf()`. That paints a scribble
+with the brush, sometimes several times over, and is far too slow to
+do for a whole group of brushes while the brush list is being drawn.
+
+The cache here renders these previews on a worker thread instead, and
+keeps them on disk as PNG files named after a hash of the brush
+settings, so each distinct brush only ever needs to be rendered once.
+
+"""
+
+## Imports
+
+from __future__ import division, print_function
+
+import os
+import collections
+import threading
+import hashlib
+import logging
+
+from gi.repository import GLib
+from gi.repository import GdkPixbuf
+
+import lib.pixbuf
+import lib.fileutils
+from . import drawutils
+
+
+logger = logging.getLogger(__name__)
+
+
+## Class defs
+
+
+class BrushPreviewCache (object):
+    """Renders brush previews in the background, caching them on disk
+
+    Previews are requested with `request()`, which returns at once.
+    Previews which have been rendered before are loaded from the disk
+    cache, and other requests are queued for the worker thread. The
+    worker's results are passed to the requesters' callbacks on the
+    main thread, from a GLib idle callback.
+
+    >>> import tempfile, shutil
+    >>> from lib.brush import BrushInfo
+    >>> tmpdir = tempfile.mkdtemp(u"_brushpreviews")
+    >>> cache = BrushPreviewCache(tmpdir)
+    >>> bi = BrushInfo()
+    >>> cache.get_key(bi) == cache.get_key(bi.clone())
+    True
+    >>> cache.lookup(cache.get_key(bi)) is None
+    True
+    >>> pixbuf = cache.render(bi)
+    >>> cache.lookup(cache.get_key(bi)) is not None
+    True
+
+    Requesters are still called back if the preview can't be rendered,
+    but with None instead of a preview:
+
+    >>> import time
+    >>> real_render = drawutils.render_brush_preview_pixbuf
+    >>> def broken_render(brushinfo):
+    ...     raise RuntimeError("broken brush")
+    >>> drawutils.render_brush_preview_pixbuf = broken_render
+    >>> bi.set_base_value("radius_logarithmic", 1.5)
+    >>> results = []
+    >>> cache.request(bi, results.append) is None
+    True
+    >>> context = GLib.MainContext.default()
+    >>> deadline = time.time() + 10
+    >>> while not results and time.time() < deadline:
+    ...     _ = context.iteration(False)
+    >>> drawutils.render_brush_preview_pixbuf = real_render
+    >>> results
+    [None]
+    >>> shutil.rmtree(tmpdir)
+
+    """
+
+    #: Mixed into the keys, so previews can be invalidated when the
+    #: preview rendering code changes.
+    VERSION = 1
+
+    def __init__(self, path=None):
+        """Initialize
+
+        :param unicode path: Folder for the cached previews, or None to
+            not keep them on disk.
+
+        """
+        super(BrushPreviewCache, self).__init__()
+        self._path = path
+        self._jobs = collections.deque()  # [(key, brushinfo)]
+        self._pending = {}  # {key: [callback, ...]}
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    ## Keys and disk storage
+
+    def get_key(self, brushinfo):
+        """Get the cache key for a brush's settings
+
+        :param lib.brush.BrushInfo brushinfo: The brush's settings
+        :returns: A hash of all the settings used for painting
+        :rtype: str
+
+        Textual metadata like the brush's name and description doesn't
+        affect the preview, and isn't part of the key.
+
+        """
+        h = hashlib.sha1()
+        h.update(str(self.VERSION).encode("ascii"))
+        for array in brushinfo.get_engine_arrays():
+            h.update(array.tobytes())
+        return h.hexdigest()
+
+    def _get_filename(self, key):
+        if self._path is None:
+            return None
+        return os.path.join(self._path, key + u".png")
+
+    def lookup(self, key):
+        """Load a preview from the disk cache
+
+        :param str key: Cache key, from `get_key()`
+        :returns: The preview, or None if it isn't in the cache
+        :rtype: GdkPixbuf.Pixbuf
+
+        """
+        filename = self._get_filename(key)
+        if filename is None or not os.path.isfile(filename):
+            return None
+        try:
+            return GdkPixbuf.Pixbuf.new_from_file(filename)
+        except Exception:
+            logger.exception("Failed to load cached preview %r", filename)
+            return None
+
+    def _store(self, key, pixbuf):
+        """Save a rendered preview to the disk cache (any thread)"""
+        filename = self._get_filename(key)
+        if filename is None:
+            return
+        tmp_filename = filename + u".tmp"
+        try:
+            if not os.path.isdir(self._path):
+                os.makedirs(self._path)
+            lib.pixbuf.save(pixbuf, tmp_filename, "png")
+            lib.fileutils.replace(tmp_filename, filename)
+        except Exception:
+            logger.exception("Failed to cache preview %r", filename)
+
+    ## Rendering
+
+    def render(self, brushinfo):
+        """Get a preview now, rendering it on this thread if needed
+
+        :param lib.brush.BrushInfo brushinfo: The brush's settings
+        :returns: The preview
+        :rtype: GdkPixbuf.Pixbuf
+
+        """
+        key = self.get_key(brushinfo)
+        pixbuf = self.lookup(key)
+        if pixbuf is None:
+            pixbuf = drawutils.render_brush_preview_pixbuf(brushinfo)
+            self._store(key, pixbuf)
+        return pixbuf
+
+    def request(self, brushinfo, callback):
+        """Get a preview if it is cached, or queue it for rendering
+
+        :param lib.brush.BrushInfo brushinfo: The brush's settings
+        :param callable callback: Called as ``callback(pixbuf)`` on the
+            main thread once a queued preview has been rendered, or
+            as ``callback(None)`` if rendering it failed.
+        :returns: The cached preview, or None if it was queued
+        :rtype: GdkPixbuf.Pixbuf
+
+        The settings are copied, so the brushinfo may change after
+        this returns. Requests for brushes with the same settings are
+        rendered just once.
+
+        """
+        key = self.get_key(brushinfo)
+        pixbuf = self.lookup(key)
+        if pixbuf is not None:
+            return pixbuf
+        callbacks = self._pending.get(key)
+        if callbacks is not None:
+            callbacks.append(callback)
+            return None
+        self._pending[key] = [callback]
+        self._jobs.append((key, brushinfo.clone()))
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._worker,
+                name="BrushPreviewCache",
+            )
+            self._thread.daemon = True
+            self._thread.start()
+        self._wakeup.set()
+        return None
+
+    def _worker(self):
+        """Worker thread main loop"""
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            while self._jobs:
+                key, brushinfo = self._jobs.popleft()
+                try:
+                    pixbuf = drawutils.render_brush_preview_pixbuf(brushinfo)
+                except Exception:
+                    logger.exception("Failed to render brush preview")
+                    pixbuf = None
+                if pixbuf is not None:
+                    self._store(key, pixbuf)
+                GLib.idle_add(self._deliver_cb, key, pixbuf)
+
+    def _deliver_cb(self, key, pixbuf):
+        """Pass a rendered preview to its requesters (main thread)"""
+        callbacks = self._pending.pop(key, [])
+        for callback in callbacks:
+            callback(pixbuf)
+        return False
+
+
+## Module testing
+
+
+def _test():
+    """Run doctest strings"""
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    _test()
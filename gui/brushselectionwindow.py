@@ -55,8 +55,32 @@ def managedbrush_namefunc(managedbrush):
 
 
 def managedbrush_pixbuffunc(managedbrush):
-    """Returns pixbuf preview of a ManagedBrush."""
-    return managedbrush.preview
+    """Returns pixbuf preview of a ManagedBrush, or a placeholder.
+
+    Previews which have to be generated are made in the background.
+    The placeholder is returned until they're ready.
+
+    """
+    preview = managedbrush.request_preview()
+    if preview is None:
+        preview = _get_placeholder_pixbuf()
+    return preview
+
+
+_PLACEHOLDER_PIXBUF = None
+
+
+def _get_placeholder_pixbuf():
+    """Returns the icon shown while a brush's preview is generated."""
+    global _PLACEHOLDER_PIXBUF
+    if _PLACEHOLDER_PIXBUF is None:
+        pixbuf = GdkPixbuf.Pixbuf.new(
+            GdkPixbuf.Colorspace.RGB, True, 8,
+            brushmanager.PREVIEW_W, brushmanager.PREVIEW_H,
+        )
+        pixbuf.fill(0x80808040)  # translucent grey
+        _PLACEHOLDER_PIXBUF = pixbuf
+    return _PLACEHOLDER_PIXBUF
 
 
 ## Class definitions
@@ -86,6 +110,8 @@ class BrushList (pixbuflist.PixbufList):
         self.bm.groups_changed += self._groups_changed_cb
         self.bm.brushes_changed += self._brushes_changed_cb
         self.bm.brush_selected += self._brush_selected_cb
+        self.bm.preview_ready += self._preview_ready_cb
+        self._update_idle_cbid = None
         self.item_selected += self._item_selected_cb
         self.item_popup += self._item_popup_cb
 
@@ -138,6 +164,19 @@ class BrushList (pixbuflist.PixbufList):
     def _brush_selected_cb(self, bm, managed_brush, brushinfo):
         self.set_selected(managed_brush)
 
+    def _preview_ready_cb(self, bm, managed_brush):
+        # Previews tend to arrive in bursts: redraw once per burst.
+        if self._update_idle_cbid is not None:
+            return
+        if managed_brush not in self.bm.groups.get(self.group, []):
+            return
+        self._update_idle_cbid = GLib.idle_add(self._update_idle_cb)
+
+    def _update_idle_cb(self):
+        self._update_idle_cbid = None
+        self.update()
+        return False
+
     def remove_brush(self, brush):
         self.brushes.remove(brush)
         self.bm.brushes_changed(self.brushes)
@@ -7,14 +7,38 @@
 # (at your option) any later version.
 
 
-"""Display filter effects."""
+"""Display filter effects.
+
+The filter functions here do floating point math on whole tiles, which
+is far too slow to do for every tile of every redraw. Instead, the
+display uses `LookupTableFilter` objects. These run a filter function
+once over a lattice of colors, and keep the results as a lookup table,
+which is then applied to each tile by native code. Filters which treat
+each color channel separately use a 256-entry table per channel. Other
+filters use a 3D table, with trilinear interpolation between lattice
+points.
+
+Users can add their own filters as .cube 3D or 1D lookup table files,
+as written by many color grading tools.
+
+"""
 
 
 ## Imports
 from __future__ import division, print_function
 
+import os
+import io
+import logging
+
 import numpy as np
 
+import lib.mypaintlib
+from lib.pycompat import unicode
+
+
+logger = logging.getLogger(__name__)
+
 
 ## Constants
 
@@ -41,6 +65,18 @@ _SIM_TRITANOPIA_R_COEFFS = (0.972, 0.112, -0.084)
 _SIM_TRITANOPIA_G_COEFFS = (0.022, 0.818, 0.160)
 _SIM_TRITANOPIA_B_COEFFS = (-0.063, 0.881, 0.182)
 
+#: Lattice size for 3D lookup tables. With 52 points, every lattice
+#: point falls on an exact 8bpp value (multiples of 5). Filters which
+#: are linear between clipping points come out within one or two
+#: levels of the float math.
+LUT3D_SIZE = 52
+
+#: Folder for user lookup table files, inside the user data folder
+USER_LUTS_SUBDIR = u"displayfilters"
+
+#: File name extension of user lookup table files
+LUT_FILE_SUFFIX = u".cube"
+
 
 ## Filter functions
 
@@ -84,3 +120,242 @@ def sim_tritanopia(dst):
     np.clip(r, 0, 255, dst[..., 0])
     np.clip(g, 0, 255, dst[..., 1])
     np.clip(b, 0, 255, dst[..., 2])
+
+
+## Lookup table filters
+
+
+class LookupTableFilter (object):
+    """A display filter applied through a lookup table
+
+    Instances are callables which filter an NxNx4 8bpp RGBA tile in
+    place, like the filter functions above. The table is built from a
+    filter function the first time it is needed.
+
+    >>> f = LookupTableFilter(invert_colors, "invert", separable=True)
+    >>> f.lut.shape
+    (3, 256)
+    >>> [int(v) for v in f.lut[:, 0]], [int(v) for v in f.lut[:, 255]]
+    ([255, 255, 255], [0, 0, 0])
+    >>> f = LookupTableFilter(luma_only, "luma")
+    >>> f.lut.shape
+    (52, 52, 52, 3)
+    >>> [int(v) for v in f.lut[-1, 0, 0]]
+    [54, 54, 54]
+
+    The `cache_key` identifies what the filter does. Tiles filtered by
+    filters with the same key are interchangeable, so the layer stack
+    can cache them (see `lib.layer.tree.RootLayerStack.render()`).
+
+    """
+
+    def __init__(self, func, cache_key, separable=False, lut=None):
+        """Initialize
+
+        :param callable func: Filter function, or None if lut is given.
+            It is called once, with a float64 array of colors in the
+            range 0 to 255, shaped like a tile.
+        :param cache_key: Hashable key for the filter's output
+        :param bool separable: True if func transforms each color
+            channel independently of the others
+        :param numpy.ndarray lut: Ready-made table, either a 3x256 table
+            for each channel, or an SxSxSx3 table indexed [r][g][b]
+
+        """
+        super(LookupTableFilter, self).__init__()
+        self._func = func
+        self._separable = separable
+        self._lut = None
+        self.cache_key = cache_key
+        if lut is not None:
+            self._lut = np.ascontiguousarray(lut, dtype="uint8")
+
+    def __repr__(self):
+        return "<LookupTableFilter %r>" % (self.cache_key,)
+
+    @property
+    def lut(self):
+        """The lookup table, built on first access"""
+        if self._lut is None:
+            if self._separable:
+                self._lut = _build_channel_lut(self._func)
+            else:
+                self._lut = _build_lut3d(self._func, LUT3D_SIZE)
+        return self._lut
+
+    def __call__(self, dst):
+        """Filter an 8bpp RGBA tile in place"""
+        lut = self.lut
+        if lut.ndim == 2:
+            lib.mypaintlib.tile_apply_channel_lut(dst, lut)
+        else:
+            lib.mypaintlib.tile_apply_lut3d(dst, lut)
+
+
+def _to_lut_values(colors):
+    """Round and clip filtered float colors to uint8"""
+    return np.clip(np.around(colors), 0, 255).astype("uint8")
+
+
+def _build_channel_lut(func):
+    """Build a 3x256 table for a separable filter function"""
+    colors = np.zeros((1, 256, 4), dtype="float64")
+    colors[0, :, 0:3] = np.arange(256)[:, np.newaxis]
+    colors[..., 3] = 255
+    func(colors)
+    lut = _to_lut_values(colors[0, :, 0:3]).T
+    return np.ascontiguousarray(lut)
+
+
+def _build_lut3d(func, size):
+    """Build an SxSxSx3 table indexed [r][g][b] for a filter function"""
+    values = np.linspace(0.0, 255.0, size)
+    r, g, b = np.meshgrid(values, values, values, indexing="ij")
+    colors = np.empty((size * size, size, 4), dtype="float64")
+    colors[..., 0] = r.reshape(size * size, size)
+    colors[..., 1] = g.reshape(size * size, size)
+    colors[..., 2] = b.reshape(size * size, size)
+    colors[..., 3] = 255
+    func(colors)
+    lut = _to_lut_values(colors[..., 0:3]).reshape(size, size, size, 3)
+    return np.ascontiguousarray(lut)
+
+
+#: Lookup table versions of the built-in filters
+LUMA_ONLY = LookupTableFilter(luma_only, "luma_only")
+INVERT_COLORS = LookupTableFilter(invert_colors, "invert_colors",
+                                  separable=True)
+SIM_DEUTERANOPIA = LookupTableFilter(sim_deuteranopia, "sim_deuteranopia")
+SIM_PROTANOPIA = LookupTableFilter(sim_protanopia, "sim_protanopia")
+SIM_TRITANOPIA = LookupTableFilter(sim_tritanopia, "sim_tritanopia")
+
+
+## User lookup table files
+
+
+def load_cube_file(filename):
+    """Load a display filter from a .cube lookup table file
+
+    :param unicode filename: The file to load
+    :returns: The filter
+    :rtype: LookupTableFilter
+    :raises ValueError: if the file can't be parsed, or uses features
+        which aren't supported.
+    :raises IOError: if the file can't be read
+
+    Both 3D tables (``LUT_3D_SIZE``) and 1D tables (``LUT_1D_SIZE``)
+    are supported. 1D tables are resampled to 256 entries, and may
+    use any input domain. 3D tables must use the default input domain
+    of 0.0 to 1.0.
+
+    >>> import tempfile, shutil
+    >>> tmpdir = tempfile.mkdtemp(u"_displayfilter")
+    >>> cube = os.path.join(tmpdir, u"swap.cube")
+    >>> lines = [u'TITLE "swap red and blue"', u"LUT_3D_SIZE 2"]
+    >>> for b, g, r in np.ndindex(2, 2, 2):  # red changes fastest
+    ...     lines.append(u"%d %d %d" % (b, g, r))
+    >>> with io.open(cube, "w") as fp:
+    ...     n = fp.write(u"\\n".join(lines))
+    >>> f = load_cube_file(cube)
+    >>> [int(v) for v in f.lut[1, 0, 0]], [int(v) for v in f.lut[0, 0, 1]]
+    ([0, 0, 255], [255, 0, 0])
+    >>> shutil.rmtree(tmpdir)
+
+    """
+    size_1d = None
+    size_3d = None
+    domain_min = [0.0, 0.0, 0.0]
+    domain_max = [1.0, 1.0, 1.0]
+    rows = []
+    with io.open(filename, "r", encoding="utf-8", errors="replace") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line or line.startswith(u"#"):
+                continue
+            fields = line.split()
+            keyword = fields[0].upper()
+            try:
+                if keyword == u"TITLE":
+                    continue
+                elif keyword == u"LUT_1D_SIZE":
+                    size_1d = int(fields[1])
+                elif keyword == u"LUT_3D_SIZE":
+                    size_3d = int(fields[1])
+                elif keyword == u"DOMAIN_MIN":
+                    domain_min = [float(v) for v in fields[1:4]]
+                elif keyword == u"DOMAIN_MAX":
+                    domain_max = [float(v) for v in fields[1:4]]
+                elif keyword.startswith(u"LUT_"):
+                    raise ValueError("unsupported keyword %s" % keyword)
+                else:
+                    rows.append([float(v) for v in fields[0:3]])
+            except IndexError:
+                raise ValueError("incomplete line %r" % (line,))
+    if (size_1d is None) == (size_3d is None):
+        raise ValueError("needs one of LUT_1D_SIZE or LUT_3D_SIZE")
+    data = np.array(rows, dtype="float64")
+    if data.ndim != 2 or data.shape[1] != 3:
+        raise ValueError("table rows need 3 values each")
+    mtime = os.path.getmtime(filename)
+    cache_key = ("cube", os.path.abspath(filename), mtime)
+    if size_1d is not None:
+        if not (2 <= size_1d <= 65536) or len(data) != size_1d:
+            raise ValueError("expected %d table rows" % (size_1d,))
+        lut = np.empty((3, 256), dtype="float64")
+        for c in range(3):
+            inputs = np.linspace(domain_min[c], domain_max[c], size_1d)
+            lut[c] = np.interp(np.arange(256) / 255.0, inputs, data[:, c])
+        return LookupTableFilter(
+            None, cache_key,
+            lut=_to_lut_values(lut * 255),
+        )
+    if not (2 <= size_3d <= 256) or len(data) != size_3d ** 3:
+        raise ValueError("expected %d table rows" % (size_3d ** 3,))
+    if domain_min != [0.0, 0.0, 0.0] or domain_max != [1.0, 1.0, 1.0]:
+        raise ValueError("3D tables must use the default domain")
+    # Red changes fastest in the file, so it's indexed [b][g][r].
+    lut = data.reshape(size_3d, size_3d, size_3d, 3).transpose(2, 1, 0, 3)
+    return LookupTableFilter(None, cache_key, lut=_to_lut_values(lut * 255))
+
+
+def load_user_filters(path):
+    """Load all the lookup table files in a folder
+
+    :param unicode path: Folder to look in
+    :returns: (name, filter) pairs, sorted by name. Names are the file
+        names without their extension.
+    :rtype: list
+
+    Files which can't be loaded are skipped, and logged.
+
+    """
+    assert isinstance(path, unicode)
+    filters = []
+    if not os.path.isdir(path):
+        return filters
+    for basename in sorted(os.listdir(path)):
+        if not basename.lower().endswith(LUT_FILE_SUFFIX):
+            continue
+        filename = os.path.join(path, basename)
+        try:
+            lut_filter = load_cube_file(filename)
+        except (IOError, OSError, ValueError) as e:
+            logger.warning("Failed to load display filter %r: %s",
+                           filename, e)
+            continue
+        name = basename[:-len(LUT_FILE_SUFFIX)]
+        filters.append((name, lut_filter))
+    return filters
+
+
+## Module testing
+
+
+def _test():
+    """Run doctest strings"""
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    _test()
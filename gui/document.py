@@ -24,6 +24,8 @@ import math
 from warnings import warn
 import weakref
 import logging
+import threading
+import time
 
 from gi.repository import Gtk
 from gi.repository import Gdk
@@ -33,6 +35,7 @@ import lib.layer
 import lib.helpers
 from lib.helpers import clamp
 import lib.observable
+import lib.feedback
 from . import stategroup
 import gui.mode
 import gui.colorpicker   # purely for registration
@@ -1164,7 +1167,11 @@ class Document (CanvasController):  # TODO: rename to "DocumentController"
 
     def normalize_layer_mode_cb(self, action):
         """``NormalizeLayerMode`` GtkAction callback"""
-        self.model.normalize_layer_mode()
+        ui = _LayerOpProgressUI(self.app, C_(
+            "Layer operation progress dialog: title",
+            u"Normalizing layer",
+        ))
+        ui.call(self.model.normalize_layer_mode)
 
     def _update_normalize_layer_action(self, *_ignored):
         """Updates the Normalize Layer Mode action's sensitivity"""
@@ -1397,18 +1404,30 @@ class Document (CanvasController):  # TODO: rename to "DocumentController"
 
     def merge_layer_down_cb(self, action):
         """Action callback: squash current layer into the one below it"""
-        if self.model.merge_current_layer_down():
+        ui = _LayerOpProgressUI(self.app, C_(
+            "Layer operation progress dialog: title",
+            u"Merging layer down",
+        ))
+        if ui.call(self.model.merge_current_layer_down):
             self.layerblink_state.activate(action)
 
     def merge_visible_layers_cb(self, action):
         """Action callback: squash all visible layers into one"""
-        self.model.merge_visible_layers()
-        self.layerblink_state.activate(action)
+        ui = _LayerOpProgressUI(self.app, C_(
+            "Layer operation progress dialog: title",
+            u"Merging visible layers",
+        ))
+        if ui.call(self.model.merge_visible_layers):
+            self.layerblink_state.activate(action)
 
     def new_layer_merged_from_visible_cb(self, action):
         """Action callback: combine all visible layers into a new one"""
-        self.model.new_layer_merged_from_visible()
-        self.layerblink_state.activate(action)
+        ui = _LayerOpProgressUI(self.app, C_(
+            "Layer operation progress dialog: title",
+            u"Merging visible layers",
+        ))
+        if ui.call(self.model.new_layer_merged_from_visible):
+            self.layerblink_state.activate(action)
 
     def _update_merge_layer_down_action(self, *_ignored):
         """Updates the layer Merge Down action's sensitivity"""
@@ -2203,3 +2222,111 @@ class Document (CanvasController):  # TODO: rename to "DocumentController"
         mode = self.modes.top
         if getattr(mode, 'cull_nodes', False):
             mode.cull_nodes()
+
+
+class _LayerOpProgressUI (object):
+    """Progress and cancel UI for slow, cancellable layer operations
+
+    Merging and normalizing layers renders a lot of tiles, and that
+    work blocks the main loop while worker threads get on with it (see
+    `lib.tilebatch.map_tiles()`). This feeds the model operation a
+    Progress object and a cancel flag. If the operation is still
+    running after a short delay, a modal progress dialog with a Cancel
+    button is shown, and from then on the Progress observer processes
+    pending GTK events. Pressing Cancel or Escape sets the flag.
+
+    Cancelled operations leave the document unchanged.
+
+    """
+
+    #: Seconds to wait before showing the progress dialog.
+    DIALOG_DELAY = 0.25
+
+    def __init__(self, app, title):
+        """Initialize, ready to call()
+
+        :param gui.application.Application app: Main app object
+        :param unicode title: Text for the progress dialog
+
+        """
+        super(_LayerOpProgressUI, self).__init__()
+        self._app = app
+        self._title = title
+        self._cancel = None
+        self._start_time = None
+        self._dialog = None
+        self._progress_bar = None
+
+    def call(self, func, *args, **kwargs):
+        """Call a model method, giving it progress and cancel kwargs
+
+        :param callable func: Method which accepts the "progress"
+            and "cancel" keyword arguments.
+        :returns: The return value of func.
+
+        """
+        progress = lib.feedback.Progress()
+        progress.changed += self._progress_changed_cb
+        self._cancel = threading.Event()
+        kwargs = kwargs.copy()
+        kwargs["progress"] = progress
+        kwargs["cancel"] = self._cancel
+        self._start_time = time.time()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            if self._dialog is not None:
+                self._dialog.destroy()
+                self._dialog = None
+                self._progress_bar = None
+        if self._cancel.is_set():
+            self._app.show_transient_message(C_(
+                "Statusbar message: layer operation result",
+                u"Cancelled: {operation}",
+            ).format(operation=self._title))
+        return result
+
+    def _progress_changed_cb(self, progress):
+        if self._dialog is None:
+            if (time.time() - self._start_time) < self.DIALOG_DELAY:
+                return
+            self._show_dialog()
+        fraction = progress.fraction
+        if fraction is None:
+            self._progress_bar.pulse()
+        else:
+            self._progress_bar.set_fraction(fraction)
+        # Events are only processed while the modal dialog is up, so
+        # the document can't be edited while it is being merged.
+        while Gtk.events_pending():
+            Gtk.main_iteration()
+
+    def _show_dialog(self):
+        flags = (Gtk.DialogFlags.MODAL |
+                 Gtk.DialogFlags.DESTROY_WITH_PARENT)
+        dialog = Gtk.Dialog(
+            title=self._title,
+            parent=self._app.drawWindow,
+            flags=flags,
+            buttons=(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL),
+        )
+        dialog.set_position(Gtk.WindowPosition.CENTER_ON_PARENT)
+        dialog.connect("response", self._dialog_response_cb)
+
+        label = Gtk.Label()
+        label.set_text(self._title)
+        progress_bar = Gtk.ProgressBar()
+        progress_bar.set_size_request(400, -1)
+
+        dialog.vbox.set_border_width(16)
+        dialog.vbox.set_spacing(8)
+        dialog.vbox.pack_start(label, True, True, 0)
+        dialog.vbox.pack_start(progress_bar, True, True, 0)
+        dialog.show_all()
+        self._dialog = dialog
+        self._progress_bar = progress_bar
+
+    def _dialog_response_cb(self, dialog, response_id):
+        # Escape and closing the window also count as cancelling.
+        self._cancel.set()
+        dialog.set_response_sensitive(Gtk.ResponseType.CANCEL, False)
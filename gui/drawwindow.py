@@ -190,6 +190,8 @@ class DrawWindow (Gtk.Window):
         ag = self.action_group = self.app.builder.get_object("WindowActions")
         self.update_fullscreen_action()
 
+        self._init_user_display_filters(ag)
+
         # Set initial state from user prefs
         ag.get_action("ToggleScaleFeedback").set_active(
             self.app.preferences.get("ui.feedback.scale", False))
@@ -222,6 +224,7 @@ class DrawWindow (Gtk.Window):
         menupath = os.path.join(ui_dir, 'menu.xml')
         with open(menupath) as fp:
             menubar_xml = fp.read()
+        menubar_xml = self._add_user_display_filter_menuitems(menubar_xml)
         self.app.ui_manager.add_ui_from_string(menubar_xml)
         self.popupmenu = self._clone_menu(
             menubar_xml,
@@ -859,17 +862,64 @@ class DrawWindow (Gtk.Window):
 
     ## Display filter choice
 
+    _DISPLAY_FILTERS = {
+        "DisplayFilterNone": None,
+        "DisplayFilterLumaOnly": gui.displayfilter.LUMA_ONLY,
+        "DisplayFilterInvertColors": gui.displayfilter.INVERT_COLORS,
+        "DisplayFilterSimDeuteranopia": gui.displayfilter.SIM_DEUTERANOPIA,
+        "DisplayFilterSimProtanopia": gui.displayfilter.SIM_PROTANOPIA,
+        "DisplayFilterSimTritanopia": gui.displayfilter.SIM_TRITANOPIA,
+    }
+
+    #: Radio action values for user filters start here
+    _USER_DISPLAY_FILTER_VALUE_BASE = 100
+
+    def _init_user_display_filters(self, ag):
+        """Add radio actions for the user's lookup table files"""
+        self._user_display_filters = {}
+        self._user_display_filter_names = []
+        path = os.path.join(
+            self.app.user_datapath,
+            gui.displayfilter.USER_LUTS_SUBDIR,
+        )
+        group_action = ag.get_action("DisplayFilterNone")
+        user_filters = gui.displayfilter.load_user_filters(path)
+        for i, (name, lut_filter) in enumerate(user_filters):
+            action_name = "DisplayFilterUser%d" % (i,)
+            tooltip = C_(
+                "View→Display Filter: tooltip for user filters",
+                u"Filter colors using the lookup table file “{name}”",
+            ).format(name=name)
+            action = Gtk.RadioAction(
+                name=action_name,
+                label=name,
+                tooltip=tooltip,
+                value=self._USER_DISPLAY_FILTER_VALUE_BASE + i,
+            )
+            action.join_group(group_action)
+            ag.add_action(action)
+            self._user_display_filters[action_name] = lut_filter
+            self._user_display_filter_names.append(action_name)
+
+    def _add_user_display_filter_menuitems(self, menubar_xml):
+        """Add the user filters' actions to the Display Filter menu XML"""
+        if not self._user_display_filter_names:
+            return menubar_xml
+        ui_elt = ET.fromstring(menubar_xml)
+        menu_elt = ui_elt.find(".//menu[@action='DisplayFilterMenu']")
+        if menu_elt is None:
+            return menubar_xml
+        ET.SubElement(menu_elt, "separator")
+        for action_name in self._user_display_filter_names:
+            ET.SubElement(menu_elt, "menuitem", action=action_name)
+        return ET.tostring(ui_elt).decode("utf-8")
+
     def _display_filter_radioaction_changed_cb(self, action, newaction):
         """Handle changes to the Display Filter radioaction set."""
         newaction_name = newaction.get_name()
-        newfilter = {
-            "DisplayFilterNone": None,
-            "DisplayFilterLumaOnly": gui.displayfilter.luma_only,
-            "DisplayFilterInvertColors": gui.displayfilter.invert_colors,
-            "DisplayFilterSimDeuteranopia": gui.displayfilter.sim_deuteranopia,
-            "DisplayFilterSimProtanopia": gui.displayfilter.sim_protanopia,
-            "DisplayFilterSimTritanopia": gui.displayfilter.sim_tritanopia,
-        }.get(newaction_name)
+        newfilter = self._DISPLAY_FILTERS.get(newaction_name)
+        if newfilter is None:
+            newfilter = self._user_display_filters.get(newaction_name)
         for tdw in gui.tileddrawwidget.TiledDrawWidget.get_visible_tdws():
             if tdw.renderer.display_filter is newfilter:
                 continue
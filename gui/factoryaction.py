@@ -15,7 +15,8 @@ from warnings import warn
 
 import gi
 from gi.repository import Gtk
-from gi.repository import GObject
+
+from . import objfactory
 
 
 class FactoryAction (Gtk.Action):
@@ -83,7 +84,7 @@ class FactoryAction (Gtk.Action):
 
     def _construct(self, gtype_name):
         try:
-            gtype = GObject.type_from_name(gtype_name)
+            gtype = objfactory.type_from_name(gtype_name)
         except RuntimeError:
             warn("Cannot construct a new %s: not loaded?" % (gtype_name,),
                  RuntimeWarning)
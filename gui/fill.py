@@ -17,6 +17,7 @@ from gettext import gettext as _
 
 import gui.mode
 import gui.cursor
+from lib.morphology import MAX_RADIUS
 
 
 ## Class defs
@@ -101,7 +102,10 @@ class FloodFillMode (gui.mode.ScrollableModeMixin,
         tdw.doc.flood_fill(x, y, color.get_rgb(),
                            tolerance=opts.tolerance,
                            sample_merged=opts.sample_merged,
-                           make_new_layer=make_new_layer)
+                           make_new_layer=make_new_layer,
+                           gap_size=opts.gap_size,
+                           offset=opts.offset,
+                           feather=opts.feather)
         opts.make_new_layer = False
         return False
 
@@ -164,11 +168,24 @@ class FloodFillOptionsWidget (Gtk.Grid):
 
     TOLERANCE_PREF = 'flood_fill.tolerance'
     SAMPLE_MERGED_PREF = 'flood_fill.sample_merged'
+    GAP_SIZE_PREF = 'flood_fill.gap_size'
+    OFFSET_PREF = 'flood_fill.offset'
+    FEATHER_PREF = 'flood_fill.feather'
     # "make new layer" is a temportary toggle, and is not saved to prefs
 
     DEFAULT_TOLERANCE = 0.05
     DEFAULT_SAMPLE_MERGED = False
     DEFAULT_MAKE_NEW_LAYER = False
+    DEFAULT_GAP_SIZE = 0
+    DEFAULT_OFFSET = 0
+    DEFAULT_FEATHER = 0
+
+    # Pixel limits of the morphology options. Gaps are closed by
+    # shrinking and growing by half the gap size, so they can be up
+    # to twice the largest radius (see lib.tiledsurface.flood_fill).
+    MAX_GAP_SIZE = 2 * MAX_RADIUS
+    MAX_OFFSET = MAX_RADIUS
+    MAX_FEATHER = MAX_RADIUS
 
     def __init__(self):
         Gtk.Grid.__init__(self)
@@ -201,6 +218,32 @@ class FloodFillOptionsWidget (Gtk.Grid):
         scale.set_draw_value(False)
         self.attach(scale, 1, row, 1, 1)
 
+        row += 1
+        self._gap_size_adj = self._init_pixels_option(
+            row, _("Close Gaps:"),
+            _("Stop the fill leaking through gaps in outlines\n"
+              "up to this many pixels wide"),
+            self.GAP_SIZE_PREF, self.DEFAULT_GAP_SIZE,
+            0, self.MAX_GAP_SIZE,
+        )
+
+        row += 1
+        self._offset_adj = self._init_pixels_option(
+            row, _("Grow/Shrink:"),
+            _("Grow the filled area by this many pixels,\n"
+              "or shrink it if negative"),
+            self.OFFSET_PREF, self.DEFAULT_OFFSET,
+            -self.MAX_OFFSET, self.MAX_OFFSET,
+        )
+
+        row += 1
+        self._feather_adj = self._init_pixels_option(
+            row, _("Feather:"),
+            _("Width of the soft edge around the filled area, in pixels"),
+            self.FEATHER_PREF, self.DEFAULT_FEATHER,
+            0, self.MAX_FEATHER,
+        )
+
         row += 1
         label = Gtk.Label()
         label.set_markup(_("Source:"))
@@ -249,10 +292,46 @@ class FloodFillOptionsWidget (Gtk.Grid):
         align.add(button)
         self.attach(align, 0, row, 2, 1)
 
+    def _init_pixels_option(self, row, label_text, tooltip,
+                            pref, default, lower, upper):
+        """Adds a labelled slider for a whole number of pixels"""
+        prefs = self.app.preferences
+        label = Gtk.Label()
+        label.set_markup(label_text)
+        label.set_tooltip_text(tooltip)
+        label.set_alignment(1.0, 0.5)
+        label.set_hexpand(False)
+        self.attach(label, 0, row, 1, 1)
+        value = int(prefs.get(pref, default))
+        adj = Gtk.Adjustment(value=value, lower=lower, upper=upper,
+                             step_increment=1, page_increment=4,
+                             page_size=0)
+        adj.connect("value-changed", self._pixels_option_changed_cb, pref)
+        scale = Gtk.Scale()
+        scale.set_hexpand(True)
+        scale.set_adjustment(adj)
+        scale.set_digits(0)
+        scale.set_draw_value(True)
+        scale.set_value_pos(Gtk.PositionType.RIGHT)
+        self.attach(scale, 1, row, 1, 1)
+        return adj
+
     @property
     def tolerance(self):
         return float(self._tolerance_adj.get_value())
 
+    @property
+    def gap_size(self):
+        return int(round(self._gap_size_adj.get_value()))
+
+    @property
+    def offset(self):
+        return int(round(self._offset_adj.get_value()))
+
+    @property
+    def feather(self):
+        return int(round(self._feather_adj.get_value()))
+
     @property
     def make_new_layer(self):
         return bool(self._make_new_layer_toggle.get_active())
@@ -268,10 +347,16 @@ class FloodFillOptionsWidget (Gtk.Grid):
     def _tolerance_changed_cb(self, adj):
         self.app.preferences[self.TOLERANCE_PREF] = self.tolerance
 
+    def _pixels_option_changed_cb(self, adj, pref):
+        self.app.preferences[pref] = int(round(adj.get_value()))
+
     def _sample_merged_toggled_cb(self, checkbut):
         self.app.preferences[self.SAMPLE_MERGED_PREF] = self.sample_merged
 
     def _reset_clicked_cb(self, button):
         self._tolerance_adj.set_value(self.DEFAULT_TOLERANCE)
+        self._gap_size_adj.set_value(self.DEFAULT_GAP_SIZE)
+        self._offset_adj.set_value(self.DEFAULT_OFFSET)
+        self._feather_adj.set_value(self.DEFAULT_FEATHER)
         self._make_new_layer_toggle.set_active(self.DEFAULT_MAKE_NEW_LAYER)
         self._sample_merged_toggle.set_active(self.DEFAULT_SAMPLE_MERGED)
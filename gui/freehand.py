@@ -22,6 +22,7 @@ from gi.repository import GLib
 import numpy as np
 
 from lib.helpers import clamp
+from lib.pycompat import xrange
 import gui.mode
 from .drawutils import spline_4p
 
@@ -63,6 +64,12 @@ class FreehandMode (gui.mode.BrushworkModeMixin,
 
     MOTION_QUEUE_PRIORITY = GLib.PRIORITY_DEFAULT_IDLE
 
+    # Queued events are drained in batches, each painted atomically,
+    # until the queue is empty or about half a frame's time is spent.
+
+    MOTION_QUEUE_TIME_BUDGET = 0.008  # seconds
+    MOTION_QUEUE_BATCH_SIZE = 16  # raw events
+
     # The Right Thing To Do generally is to spend as little time as
     # possible directly handling each event received. Disconnecting
     # stroke rendering from event processing buys the user the ability
@@ -97,7 +104,7 @@ class FreehandMode (gui.mode.BrushworkModeMixin,
         pressure and tilt.
         """
 
-        def __init__(self):
+        def __init__(self, record_stats=False):
             object.__init__(self)
 
             self.last_event_had_pressure = False
@@ -117,6 +124,13 @@ class FreehandMode (gui.mode.BrushworkModeMixin,
             self.motion_processing_cbid = None
             self._last_queued_event_time = 0
 
+            # Debugging: queue latency statistics, and the monotonic
+            # times when the queued events were added.
+            self.stats = None
+            self._queue_times = deque()
+            if record_stats:
+                self.stats = MotionQueueStats()
+
             # Queued Event Handling
 
             # Pressure and tilt interpolation for events which
@@ -189,20 +203,43 @@ class FreehandMode (gui.mode.BrushworkModeMixin,
                          zxt, zyt, zvz, zvr) in self._zero_dtime_motions:
                         zt += step
                         zevent_data = (zt, zx, zy, zp, zxt, zyt, zvz, zvr)
-                        self.motion_queue.append(zevent_data)
+                        self._enqueue(zevent_data)
                     # Reset the backlog buffer
                     self._zero_dtime_motions = []
                 # Queue this event too
-                self.motion_queue.append(event_data)
+                self._enqueue(event_data)
                 # Update the timestamp used above
                 self._last_queued_event_time = time
 
-        def next_processing_events(self):
-            """Fetches zero or more events to process from the queue"""
-            if len(self.motion_queue) > 0:
+        def _enqueue(self, event_data):
+            self.motion_queue.append(event_data)
+            if self.stats is not None:
+                self._queue_times.append(GLib.get_monotonic_time())
+
+        def clear_motion_queue(self):
+            """Discard all queued events"""
+            self.motion_queue.clear()
+            self._queue_times.clear()
+
+        def next_processing_events(self, n=1):
+            """Fetches events to process from up to n queued events
+
+            :param int n: Maximum number of queued events to take
+            :returns: Interpolated events, ready to process
+            :rtype: list
+
+            """
+            events = []
+            stats = self.stats
+            if stats is not None:
+                now = GLib.get_monotonic_time()
+            for i in xrange(min(n, len(self.motion_queue))):
                 event = self.motion_queue.popleft()
-                for ievent in self.interp.feed(*event):
-                    yield ievent
+                if stats is not None:
+                    queued = self._queue_times.popleft()
+                    stats.record_latency((now - queued) / 1e6)
+                events.extend(self.interp.feed(*event))
+            return events
 
     def _reset_drawing_state(self):
         """Resets all per-TDW drawing state"""
@@ -211,7 +248,9 @@ class FreehandMode (gui.mode.BrushworkModeMixin,
     def _get_drawing_state(self, tdw):
         drawstate = self._drawing_state.get(tdw, None)
         if drawstate is None:
-            drawstate = self._DrawingState()
+            drawstate = self._DrawingState(
+                record_stats=getattr(self, "_debug", False),
+            )
             self._drawing_state[tdw] = drawstate
         return drawstate
 
@@ -480,15 +519,35 @@ class FreehandMode (gui.mode.BrushworkModeMixin,
     ## Motion queue processing
 
     def _motion_queue_idle_cb(self, tdw):
-        """Idle callback; processes each queued event"""
+        """Idle callback; processes queued events within a time budget
+
+        Queued events are taken in small batches, and each batch is
+        painted atomically. Batches are processed until the queue is
+        empty, or until the time budget for this call has been spent.
+
+        """
         drawstate = self._get_drawing_state(tdw)
         # Stop if asked to stop
         if drawstate.motion_processing_cbid is None:
-            drawstate.motion_queue = deque()
+            drawstate.clear_motion_queue()
             return False
-        # Forward one or more motion events to the canvas
-        for event in drawstate.next_processing_events():
-            self._process_queued_event(tdw, event)
+        # Forward batches of motion events to the canvas
+        t_start = GLib.get_monotonic_time()
+        t_end = t_start + int(self.MOTION_QUEUE_TIME_BUDGET * 1e6)
+        while drawstate.motion_queue:
+            t0 = GLib.get_monotonic_time()
+            if t0 > t_end:
+                break
+            events = drawstate.next_processing_events(
+                self.MOTION_QUEUE_BATCH_SIZE,
+            )
+            self._process_queued_events(tdw, events)
+            if drawstate.stats is not None:
+                t1 = GLib.get_monotonic_time()
+                drawstate.stats.record_batch(len(events), (t1 - t0) / 1e6)
+        if drawstate.stats is not None and drawstate.stats.age > 1.0:
+            logger.debug("Motion queue: %r", drawstate.stats)
+            drawstate.stats.reset()
         # Stop if the queue is now empty
         if len(drawstate.motion_queue) == 0:
             drawstate.motion_processing_cbid = None
@@ -496,8 +555,28 @@ class FreehandMode (gui.mode.BrushworkModeMixin,
         # Otherwise, continue being invoked
         return True
 
-    def _process_queued_event(self, tdw, event_data):
-        """Process one motion event from the motion queue"""
+    def _process_queued_events(self, tdw, events):
+        """Process a batch of events from the motion queue"""
+        model = tdw.doc
+        stroke_events = []
+        for event_data in events:
+            stroke_event = self._prepare_queued_event(tdw, event_data)
+            if stroke_event is not None:
+                stroke_events.append(stroke_event)
+        if not stroke_events:
+            return
+        self.stroke_to_batch(model, stroke_events)
+
+        # Update the TDW's idea of where we last painted
+        # FIXME: this should live in the model, not the view
+        for (dtime, x, y, pressure, xtilt, ytilt,
+             viewzoom, viewrotation) in reversed(stroke_events):
+            if pressure:
+                tdw.set_last_painting_pos((x, y))
+                break
+
+    def _prepare_queued_event(self, tdw, event_data):
+        """Turn one motion queue event into stroke_to() args, or None"""
         drawstate = self._get_drawing_state(tdw)
         time, x, y, pressure, xtilt, ytilt, viewzoom, viewrotation = event_data
         model = tdw.doc
@@ -506,7 +585,7 @@ class FreehandMode (gui.mode.BrushworkModeMixin,
         last_event_time = drawstate.last_handled_event_time
         drawstate.last_handled_event_time = time
         if not last_event_time:
-            return
+            return None
         dtime = (time - last_event_time) / 1000.0
         if self._debug:
             cavg = drawstate.avgtime
@@ -526,7 +605,7 @@ class FreehandMode (gui.mode.BrushworkModeMixin,
 
         current_layer = model._layers.current
         if not current_layer.get_paintable():
-            return
+            return None
 
         # Feed data to the brush engine.  Pressure and tilt cleanup
         # needs to be done here to catch all forwarded data after the
@@ -538,14 +617,9 @@ class FreehandMode (gui.mode.BrushworkModeMixin,
         pressure = clamp(pressure, 0.0, 1.0)
         xtilt = clamp(xtilt, -1.0, 1.0)
         ytilt = clamp(ytilt, -1.0, 1.0)
-        self.stroke_to(model, dtime, x, y, pressure,
-                       xtilt, ytilt,
-                       viewzoom, viewrotation)
-
-        # Update the TDW's idea of where we last painted
-        # FIXME: this should live in the model, not the view
-        if pressure:
-            tdw.set_last_painting_pos((x, y))
+        return (dtime, x, y, pressure,
+                xtilt, ytilt,
+                viewzoom, viewrotation)
 
     ## Mode options
 
@@ -580,6 +654,92 @@ class FreehandOptionsWidget (gui.mode.PaintingModeOptionsWidgetBase):
         return row
 
 
+class MotionQueueStats (object):
+    """Running statistics about motion queue processing
+
+    Recorded in debug mode. Latency is the time between an event being
+    queued and its being taken from the queue for painting.
+
+    >>> stats = MotionQueueStats()
+    >>> stats.record_latency(0.002)
+    >>> stats.record_latency(0.006)
+    >>> stats.record_batch(2, 0.003)
+    >>> stats.events, stats.batches, stats.max_latency
+    (2, 1, 0.006)
+    >>> round(stats.mean_latency, 3), stats.mean_batch_size
+    (0.004, 2.0)
+
+    """
+
+    def __init__(self):
+        super(MotionQueueStats, self).__init__()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        self.events = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.batches = 0
+        self.batch_events = 0
+        self.batch_time = 0.0
+        self._started = GLib.get_monotonic_time()
+
+    @property
+    def age(self):
+        """Seconds since the statistics were last reset"""
+        return (GLib.get_monotonic_time() - self._started) / 1e6
+
+    def record_latency(self, latency):
+        """Record one event taken from the queue
+
+        :param float latency: Seconds it spent in the queue
+
+        """
+        self.events += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def record_batch(self, nevents, duration):
+        """Record one batch of interpolated events being painted
+
+        :param int nevents: Number of events in the batch
+        :param float duration: Time taken to paint it, in seconds
+
+        """
+        self.batches += 1
+        self.batch_events += nevents
+        self.batch_time += duration
+
+    @property
+    def mean_latency(self):
+        """Mean time spent in the queue, in seconds"""
+        if not self.events:
+            return 0.0
+        return self.total_latency / self.events
+
+    @property
+    def mean_batch_size(self):
+        """Mean number of events painted per batch"""
+        if not self.batches:
+            return 0.0
+        return self.batch_events / self.batches
+
+    def __repr__(self):
+        return (
+            "<MotionQueueStats events=%d latency=%.1f/%.1fms "
+            "batches=%d size=%.1f paint=%.1fms>"
+            % (
+                self.events,
+                self.mean_latency * 1000,
+                self.max_latency * 1000,
+                self.batches,
+                self.mean_batch_size,
+                self.batch_time * 1000,
+            )
+        )
+
+
 class PressureAndTiltInterpolator (object):
     """Interpolates event sequences, filling in null pressure/tilt data
 
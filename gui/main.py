@@ -25,6 +25,7 @@ from optparse import OptionParser
 
 from lib.meta import MYPAINT_VERSION
 import lib.glib
+import lib.startupprofile
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +54,20 @@ def _init_gtk_workarounds():
     logger.debug("GTK workarounds added.")
 
 
+def _finish_startup_profile_after_first_frame(app):
+    """Finish startup profiling once the main canvas has been drawn"""
+    tdw = app.doc.tdw
+    handler_ids = []
+
+    def _first_draw_cb(widget, cr):
+        tdw.disconnect(handler_ids.pop())
+        lib.startupprofile.mark("first canvas frame")
+        lib.startupprofile.finish()
+        return False
+
+    handler_ids.append(tdw.connect_after("draw", _first_draw_cb))
+
+
 def main(datapath, iconspath, oldstyle_confpath=None, version=MYPAINT_VERSION):
     """Run MyPaint with `sys.argv_unicode`, called from the "mypaint" script.
 
@@ -95,6 +110,7 @@ def main(datapath, iconspath, oldstyle_confpath=None, version=MYPAINT_VERSION):
 
     # mypaintlib import is performed first in gui.application now.
     from gui import application
+    lib.startupprofile.mark("gui.application imported")
 
     # Default logfile basename.
     # If it's relative, it's resolved relative to the user config path.
@@ -190,6 +206,9 @@ def main(datapath, iconspath, oldstyle_confpath=None, version=MYPAINT_VERSION):
             version = version,
             fullscreen = options.fullscreen,
         )
+        lib.startupprofile.mark("app constructed")
+        if lib.startupprofile.get_profile() is not None:
+            _finish_startup_profile_after_first_frame(app)
 
         settings = Gtk.Settings.get_default()
         dark = app.preferences.get("ui.dark_theme_variant", True)
@@ -212,3 +231,4 @@ def main(datapath, iconspath, oldstyle_confpath=None, version=MYPAINT_VERSION):
         tracer.runfunc(run)
     else:
         run()
+
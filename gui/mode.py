@@ -797,6 +797,38 @@ class BrushworkModeMixin (InteractionMode):
         of brushwork.
 
         """
+        cmd = self.__get_stroke_brushwork(model, auto_split, layer)
+        cmd.stroke_to(dtime, x, y, pressure, xtilt, ytilt,
+                      viewzoom, viewrotation)
+        cmd.__last_pos = (x, y, xtilt, ytilt, viewzoom, viewrotation)
+
+    def stroke_to_batch(self, model, events, auto_split=True, layer=None):
+        """Feeds several updated stroke positions to the brush engine
+
+        :param lib.document.Document model: model on which to paint
+        :param list events: Tuples of `stroke_to()`'s position args,
+            ``(dtime, x, y, pressure, xtilt, ytilt, viewzoom,
+            viewrotation)``, in order
+        :param bool auto_split: Split ongoing brushwork if due
+        :param gui.layer.data.SimplePaintingLayer layer: explicit target layer
+
+        This has the same effect as calling `stroke_to()` for each
+        event, but the dabs are rendered in atomic batches, which is
+        much cheaper when input arrives faster than it can be painted.
+        Brushwork is still split where it would have been.
+
+        """
+        events = list(events)
+        while events:
+            cmd = self.__get_stroke_brushwork(model, auto_split, layer)
+            n = cmd.stroke_to_batch(events)
+            (dtime, x, y, pressure, xtilt, ytilt,
+             viewzoom, viewrotation) = events[n - 1]
+            cmd.__last_pos = (x, y, xtilt, ytilt, viewzoom, viewrotation)
+            del events[:n]
+
+    def __get_stroke_brushwork(self, model, auto_split, layer):
+        """Get the Brushwork for stroke_to(), splitting or starting it"""
         cmd = self.__active_brushwork.get(model, None)
         desc0 = None
         if auto_split and cmd and cmd.split_due:
@@ -812,9 +844,7 @@ class BrushworkModeMixin (InteractionMode):
                 layer=layer,
             )
             cmd = self.__active_brushwork[model]
-        cmd.stroke_to(dtime, x, y, pressure, xtilt, ytilt,
-                      viewzoom, viewrotation)
-        cmd.__last_pos = (x, y, xtilt, ytilt, viewzoom, viewrotation)
+        return cmd
 
     def leave(self, **kwds):
         """Leave mode, committing outstanding brushwork as necessary
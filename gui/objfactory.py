@@ -12,6 +12,7 @@
 
 from __future__ import division, print_function
 import logging
+import importlib
 from warnings import warn
 
 from gi.repository import GObject
@@ -21,6 +22,50 @@ from lib.observable import event
 logger = logging.getLogger(__name__)
 
 
+## Lazily imported types
+
+_LAZY_TYPE_MODULES = {}  # {gtype_name: module_name}
+
+
+def register_lazy_types(module_name, gtype_names):
+    """Registers types whose defining module is imported on demand.
+
+    :param str module_name: Absolute name of the defining module
+    :param iterable gtype_names: Names of the GObject types it defines
+
+    Modules defining rarely used panels and widgets need not be imported
+    at startup. Registering their types here allows `type_from_name()`,
+    and so the factories, to import them when they're first needed.
+
+    """
+    for gtype_name in gtype_names:
+        _LAZY_TYPE_MODULES[gtype_name] = module_name
+
+
+def type_from_name(gtype_name):
+    """Like GObject.type_from_name(), but imports lazy types' modules.
+
+    :param str gtype_name: a registered name (cf. __gtype_name__)
+    :raises RuntimeError: if the type is unknown even after importing.
+
+    >>> type_from_name("GtkLabel").name
+    'GtkLabel'
+    >>> type_from_name("NonExist12345")  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    RuntimeError: unknown type name: NonExist12345
+
+    """
+    try:
+        return GObject.type_from_name(gtype_name)
+    except RuntimeError:
+        module_name = _LAZY_TYPE_MODULES.get(gtype_name)
+        if module_name is None:
+            raise
+    logger.debug("Importing %r on demand for %r", module_name, gtype_name)
+    importlib.import_module(module_name)
+    return GObject.type_from_name(gtype_name)
+
+
 ## Class definitions
 
 class ConstructError (Exception):
@@ -138,7 +183,7 @@ class ObjFactory (object):
             return self._cache[key]
         logger.debug("Creating %r via factory", key)
         try:
-            gtype = GObject.type_from_name(gtype_name)
+            gtype = type_from_name(gtype_name)
         except RuntimeError:
             raise ConstructError(
                 "Cannot construct a '%s': module not imported?"
@@ -18,6 +18,7 @@ from gettext import gettext as _
 from gi.repository import Gtk
 
 from . import windowing
+from . import accelmap  # noqa: F401 (registration of GObject classes)
 
 
 logger = getLogger(__name__)
@@ -88,6 +89,9 @@ class PreferencesWindow (windowing.Dialog):
         # Signal hookup now everything is in the right initial state
         self._builder.connect_signals(self)
 
+        # The app only updates the window once it exists.
+        self.update_ui()
+
     def on_response(self, dialog, response, *args):
         if response == Gtk.ResponseType.ACCEPT:
             self.app.save_settings()
@@ -0,0 +1,325 @@
+# This file is part of MyPaint.
+# Copyright (C) 2018 by the MyPaint Development Team
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+
+"""Frame-paced scheduling of canvas redraws
+
+The document model announces every change it makes, however small, via
+`lib.document.Document.canvas_area_modified()`. While painting, that
+means one announcement per dab. Passing each one straight on to GTK as
+a separate invalidated area works, but the areas overlap heavily, and
+the redraw that follows can end up covering far more than what really
+changed.
+
+The scheduler here sits between the model and a canvas renderer. It
+collects the changed areas as a set of model tiles, and once per frame
+of the widget's frame clock it turns that set into a few display-space
+rectangles to invalidate. The renderer then only needs to render the
+tiles which overlap those rectangles.
+
+"""
+
+## Imports
+
+from __future__ import division, print_function
+
+import logging
+import math
+
+from lib.helpers import Rect
+from lib.helpers import rotated_rectangle_bbox
+import lib.tiledsurface
+
+
+logger = logging.getLogger(__name__)
+
+
+## Constants
+
+N = lib.tiledsurface.N
+
+#: Above this many dirty tiles, a frame just redraws everything.
+MAX_DIRTY_TILES = 16384
+
+#: Above this many rectangles, a frame invalidates their bbox instead.
+MAX_FRAME_RECTS = 32
+
+
+## Helper funcs
+
+
+def tiles_in_area(x, y, w, h):
+    """The model tiles overlapping a model area
+
+    >>> sorted(tiles_in_area(60, 0, 10, 10))
+    [(0, 0), (1, 0)]
+    >>> tiles_in_area(0, 0, 0, 0)
+    []
+
+    """
+    if w <= 0 or h <= 0:
+        return []
+    tx0 = int(x // N)
+    ty0 = int(y // N)
+    tx1 = int((x + w - 1) // N)
+    ty1 = int((y + h - 1) // N)
+    return [
+        (tx, ty)
+        for ty in range(ty0, ty1 + 1)
+        for tx in range(tx0, tx1 + 1)
+    ]
+
+
+def tiles_to_rects(tiles):
+    """Coalesce a set of tiles into a few rectangles of tiles
+
+    :param iterable tiles: Tile indices, as (tx, ty) tuples
+    :returns: Rectangles covering exactly the tiles, in tile units
+    :rtype: list of lib.helpers.Rect
+
+    Horizontal runs of tiles are found first, and then runs with the
+    same extent on consecutive rows are stacked.
+
+    >>> tiles = {(0, 0), (1, 0), (0, 1), (1, 1), (5, 1)}
+    >>> sorted(tuple(r) for r in tiles_to_rects(tiles))
+    [(0, 0, 2, 2), (5, 1, 1, 1)]
+
+    """
+    rows = {}
+    for tx, ty in tiles:
+        rows.setdefault(ty, []).append(tx)
+    # Horizontal runs, as {(tx0, tx1): Rect} for the most recent row
+    open_rects = {}
+    rects = []
+    for ty in sorted(rows.keys()):
+        runs = []
+        txs = sorted(rows[ty])
+        start = prev = txs[0]
+        for tx in txs[1:]:
+            if tx != prev + 1:
+                runs.append((start, prev))
+                start = tx
+            prev = tx
+        runs.append((start, prev))
+        next_open = {}
+        for run in runs:
+            rect = open_rects.get(run)
+            if rect is not None and rect.y + rect.h == ty:
+                rect.h += 1
+            else:
+                rect = Rect(run[0], ty, run[1] - run[0] + 1, 1)
+                rects.append(rect)
+            next_open[run] = rect
+        open_rects = next_open
+    return rects
+
+
+def tiles_in_polygon(points, n=N):
+    """The rows of tiles overlapping a convex polygon
+
+    :param list points: The polygon's vertices, as (x, y) pixel coords
+    :param int n: Tile size, in pixels
+    :returns: Spans of tiles, as (ty, tx0, tx1) with inclusive ends
+    :rtype: list
+
+    The polygon is scan-converted one row of tiles at a time: each row's
+    span comes from the extent of the polygon within the row, so the
+    cost depends on the number of rows, not the number of tiles.
+
+    >>> tiles_in_polygon([(0, 0), (128, 0), (128, 64), (0, 64)])
+    [(0, 0, 1)]
+    >>> diamond = [(64, 0), (128, 64), (64, 128), (0, 64)]
+    >>> tiles_in_polygon(diamond, n=32)
+    [(0, 1, 2), (1, 0, 3), (2, 0, 3), (3, 1, 2)]
+
+    """
+    if not points:
+        return []
+    ys = [y for (x, y) in points]
+    ty_min = int(math.floor(min(ys) / n))
+    ty_max = max(ty_min, int(math.ceil(max(ys) / n)) - 1)
+    edges = list(zip(points, points[1:] + points[:1]))
+    spans = []
+    for ty in range(ty_min, ty_max + 1):
+        y0 = ty * n
+        y1 = y0 + n
+        xs = [x for (x, y) in points if y0 <= y <= y1]
+        for (ax, ay), (bx, by) in edges:
+            if ay == by:
+                continue
+            for yb in (y0, y1):
+                if min(ay, by) <= yb <= max(ay, by):
+                    xs.append(ax + (yb - ay) * (bx - ax) / (by - ay))
+        if not xs:
+            continue
+        tx0 = int(math.floor(min(xs) / n))
+        tx1 = max(tx0, int(math.ceil(max(xs) / n)) - 1)
+        spans.append((ty, tx0, tx1))
+    return spans
+
+
+def tiles_display_rects(renderer, tiles, mipmap_level=0):
+    """Display-space bounding boxes for a set of tiles
+
+    :param renderer: Provides `model_to_display()`
+    :param iterable tiles: Tile indices, as (tx, ty) tuples
+    :param int mipmap_level: Mipmap level the tile indices refer to
+    :returns: Display rectangles covering the tiles
+    :rtype: list of lib.helpers.Rect
+
+    """
+    n = N * (2 ** mipmap_level)
+    display_rects = []
+    for r in tiles_to_rects(tiles):
+        x, y, w, h = r.x * n, r.y * n, r.w * n, r.h * n
+        corners = [(x, y), (x + w, y), (x, y + h), (x + w, y + h)]
+        corners = [renderer.model_to_display(*c) for c in corners]
+        display_rects.append(Rect(*rotated_rectangle_bbox(corners)))
+    return display_rects
+
+
+## Class defs
+
+
+class RedrawStats (object):
+    """Running statistics about the frames drawn by a renderer
+
+    >>> stats = RedrawStats()
+    >>> stats.record(0.010, 4)
+    >>> stats.record(0.030, 12)
+    >>> stats.frames, stats.max_tiles
+    (2, 12)
+    >>> round(stats.mean_frame_time, 3), stats.mean_tiles
+    (0.02, 8.0)
+
+    """
+
+    def __init__(self):
+        super(RedrawStats, self).__init__()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        self.frames = 0
+        self.total_time = 0.0
+        self.last_frame_time = 0.0
+        self.max_frame_time = 0.0
+        self.total_tiles = 0
+        self.last_tiles = 0
+        self.max_tiles = 0
+
+    def record(self, duration, ntiles):
+        """Record one frame
+
+        :param float duration: Time taken to draw the frame, in seconds
+        :param int ntiles: Number of tiles rendered for the frame
+
+        """
+        self.frames += 1
+        self.total_time += duration
+        self.last_frame_time = duration
+        self.max_frame_time = max(self.max_frame_time, duration)
+        self.total_tiles += ntiles
+        self.last_tiles = ntiles
+        self.max_tiles = max(self.max_tiles, ntiles)
+
+    @property
+    def mean_frame_time(self):
+        """Mean time taken to draw a frame, in seconds"""
+        if not self.frames:
+            return 0.0
+        return self.total_time / self.frames
+
+    @property
+    def mean_tiles(self):
+        """Mean number of tiles rendered per frame"""
+        if not self.frames:
+            return 0.0
+        return self.total_tiles / self.frames
+
+    def __repr__(self):
+        return (
+            "<RedrawStats frames=%d time=%.1f/%.1fms tiles=%.1f/%d>"
+            % (
+                self.frames,
+                self.mean_frame_time * 1000,
+                self.max_frame_time * 1000,
+                self.mean_tiles,
+                self.max_tiles,
+            )
+        )
+
+
+class RedrawScheduler (object):
+    """Coalesces model redraw requests, and issues them once per frame
+
+    :param gui.tileddrawwidget.CanvasRenderer renderer: Target widget
+
+    The renderer must provide `model_to_display()`, and the usual
+    `queue_draw()` and `queue_draw_area()` methods for display areas.
+    Frames are paced by the renderer's frame clock, using a tick
+    callback which is only installed while there is work to do.
+
+    """
+
+    def __init__(self, renderer):
+        super(RedrawScheduler, self).__init__()
+        self._renderer = renderer
+        self._dirty_tiles = set()
+        self._tick_id = None
+        self.stats = RedrawStats()
+
+    def model_area_changed(self, x, y, w, h):
+        """Schedule the redraw of a changed model area
+
+        A zero-sized area means that everything should be redrawn. This
+        happens immediately, discarding any areas already collected.
+
+        """
+        if w == 0 and h == 0:
+            self._dirty_tiles.clear()
+            self._renderer.queue_draw()
+            return
+        self._dirty_tiles.update(tiles_in_area(x, y, w, h))
+        if len(self._dirty_tiles) > MAX_DIRTY_TILES:
+            self._dirty_tiles.clear()
+            self._renderer.queue_draw()
+            return
+        if self._tick_id is None:
+            self._tick_id = self._renderer.add_tick_callback(self._tick_cb)
+
+    def _tick_cb(self, widget, frame_clock):
+        """Once per frame: invalidate display areas for the dirty tiles"""
+        self._tick_id = None
+        tiles = self._dirty_tiles
+        self._dirty_tiles = set()
+        if not tiles:
+            return False
+        renderer = self._renderer
+        display_rects = tiles_display_rects(renderer, tiles)
+        if len(display_rects) > MAX_FRAME_RECTS:
+            bbox = Rect()
+            for r in display_rects:
+                bbox.expand_to_include_rect(r)
+            display_rects = [bbox]
+        for r in display_rects:
+            renderer.queue_draw_area(*r)
+        return False
+
+
+## Module testing
+
+
+def _test():
+    """Run doctest strings"""
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    _test()
@@ -0,0 +1,188 @@
+# This file is part of MyPaint.
+# Copyright (C) 2018 by the MyPaint Development Team
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+
+"""Rendering canvas tiles on worker threads
+
+Canvas redraws happen in GTK draw handlers on the main thread. Most of
+them are quick, but a heavy one holds up input handling while it runs.
+The service here lets a renderer hand off tiles it doesn't need right
+away, for example when refining a progressive redraw.
+
+Work is submitted as `lib.layer.tree.RenderSnapshot` objects, which
+capture everything needed to render some tiles without touching the
+live document. Worker threads render them into 8bpc surfaces, and the
+finished jobs are passed back to the main thread via GLib idle
+callbacks. Snapshots don't update themselves, so their owners must
+check that the results still apply when they arrive.
+
+Every job is passed back exactly once, including ones which were
+cancelled or which failed, so that owners can release anything they
+set aside for it.
+
+"""
+
+## Imports
+
+from __future__ import division, print_function
+
+import threading
+import collections
+import logging
+
+from gi.repository import GLib
+
+import lib.tilebatch
+
+
+logger = logging.getLogger(__name__)
+
+
+## Constants
+
+#: Upper limit on the number of render threads.
+MAX_THREADS = 2
+
+
+## Class defs
+
+
+class RenderJob (object):
+    """A snapshot being rendered into a surface for some callback"""
+
+    def __init__(self, snapshot, surface, callback, *args):
+        super(RenderJob, self).__init__()
+        self.snapshot = snapshot
+        self.surface = surface
+        self.callback = callback
+        self.args = args
+        self.completed = False
+        self.error = None
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Stop the job early
+
+        Jobs can be cancelled from the main thread at any time up to
+        the point their callback is invoked. The callback is still
+        invoked, but the job won't be marked as completed.
+
+        """
+        self._cancel.set()
+
+    def _run(self):
+        """Render the job, recording any error (worker thread)"""
+        if self.cancelled:
+            return
+        try:
+            completed = self.snapshot.render(
+                self.surface,
+                cancel=self._cancel,
+            )
+        except Exception as ex:
+            logger.exception("Rendering failed for %r", self)
+            self.error = ex
+            return
+        self.completed = bool(completed) and not self.cancelled
+
+
+class RenderService (object):
+    """Renders tile snapshots on worker threads
+
+    Submitted jobs are started in order. Once a job is finished with,
+    its callback is invoked in the main thread as
+    ``callback(job, *args)``. This happens for every job, exactly once.
+    Only jobs whose tiles were all rendered have ``job.completed`` set:
+    for cancelled jobs it's False, and for failed jobs ``job.error``
+    holds the exception too.
+
+    """
+
+    def __init__(self, threads=None):
+        """Initialize, with no threads running yet
+
+        :param int threads: Number of worker threads to use.
+
+        """
+        super(RenderService, self).__init__()
+        if threads is None:
+            threads = min(MAX_THREADS, lib.tilebatch.default_threads())
+        self._nthreads = max(1, int(threads))
+        self._threads = []
+        self._jobs = collections.deque()
+        self._running = set()
+        self._cond = threading.Condition()
+
+    def submit(self, snapshot, surface, callback, *args):
+        """Queue a snapshot for rendering into a surface
+
+        :param lib.layer.tree.RenderSnapshot snapshot: What to render
+        :param surface: Writable 8bpc TileAccessible for the snapshot
+        :param callable callback: Called in the main thread when done
+        :param \*args: Extra args for the callback
+        :returns: The new job, which can be cancelled
+        :rtype: RenderJob
+
+        """
+        job = RenderJob(snapshot, surface, callback, *args)
+        with self._cond:
+            self._jobs.append(job)
+            self._start_threads()
+            self._cond.notify()
+        return job
+
+    def cancel_all(self):
+        """Cancel every job which hasn't yet called back
+
+        Queued jobs are passed back without being started. Jobs
+        already running stop soon after, and are passed back then.
+
+        """
+        with self._cond:
+            jobs = list(self._jobs)
+            self._jobs.clear()
+            running = list(self._running)
+        for job in jobs + running:
+            job.cancel()
+        for job in jobs:
+            GLib.idle_add(self._job_done_cb, job)
+
+    def _start_threads(self):
+        """Start worker threads as needed (lock held)"""
+        while len(self._threads) < self._nthreads:
+            t = threading.Thread(
+                target=self._worker,
+                name="RenderService-%d" % (len(self._threads),),
+            )
+            t.daemon = True
+            self._threads.append(t)
+            t.start()
+
+    def _worker(self):
+        """Worker thread main loop"""
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+                job = self._jobs.popleft()
+                self._running.add(job)
+            job._run()
+            with self._cond:
+                self._running.discard(job)
+            GLib.idle_add(self._job_done_cb, job)
+
+    def _job_done_cb(self, job):
+        """Pass a finished job back to its owner (main thread)"""
+        if job.cancelled:
+            job.completed = False
+        job.callback(job, *job.args)
+        return False
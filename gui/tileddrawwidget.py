@@ -17,6 +17,7 @@ import math
 import weakref
 import contextlib
 import logging
+import time
 
 from gi.repository import Gtk
 from gi.repository import Gdk
@@ -30,11 +31,44 @@ import lib.layer
 from . import cursor
 from .drawutils import render_checks
 import gui.style
+import gui.redraw
+import gui.backingstore
+import gui.renderservice
 import lib.color
+import lib.instrumentation
 from lib.pycompat import xrange
 
 logger = logging.getLogger(__name__)
 
+
+## Constants
+
+#: Time a progressive redraw may spend rendering tiles, in seconds.
+FRAME_RENDER_BUDGET = 0.008
+
+#: Time each idle refinement pass may spend rendering tiles, in seconds.
+IDLE_RENDER_BUDGET = 0.02
+
+#: Tiles rendered between checks of the time budgets.
+RENDER_CHUNK_TILES = 4
+
+#: How many mipmap levels coarser the quick preview renders are.
+PREVIEW_LEVEL_STEP = 3
+
+#: Tiles per job handed to the render service when refining.
+REFINE_JOB_TILES = 16
+
+#: Failed render service jobs before their tiles are rendered in the
+#: main thread instead. Retries back off exponentially until then.
+REFINE_MAX_FAILURES = 3
+
+#: Delay before the first retry of a failed render service job, in seconds.
+REFINE_RETRY_DELAY = 1.0 / 8
+
+# Canvas redraw times, see lib.instrumentation
+_FRAME_TIMER = lib.instrumentation.timer("canvas.frame")
+
+
 ## Class definitions
 
 
@@ -212,6 +246,8 @@ class TiledDrawWidget (Gtk.EventBox):
         root = model.layer_stack
         root.current_path_updated += renderer.current_layer_changed_cb
         root.layer_properties_changed += renderer.layer_props_changed_cb
+        root.layer_inserted += renderer.layer_stack_changed_cb
+        root.layer_deleted += renderer.layer_stack_changed_cb
         model.brush.brushinfo.observers.append(renderer.brush_modified_cb)
         model.frame_enabled_changed += renderer.frame_enabled_changed_cb
         model.frame_updated += renderer.frame_updated_cb
@@ -368,6 +404,10 @@ class TiledDrawWidget (Gtk.EventBox):
     def queue_draw_area(self):
         return self.renderer.queue_draw_area
 
+    @property
+    def redraw_stats(self):
+        return self.renderer.redraw_stats
+
     # Transform logic
 
     @contextlib.contextmanager
@@ -692,6 +732,8 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
         self._idle_redraw_priority = idle_redraw_priority
         self._idle_redraw_queue = []
         self._idle_redraw_src_id = None
+        self._redraw_scheduler = gui.redraw.RedrawScheduler(self)
+        self._backing_store = gui.backingstore.TileBackingStore()
 
         self.connect("state-changed", self._state_changed_cb)
 
@@ -741,10 +783,17 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
         self._fake_alpha_check_tile = None
         self._init_alpha_checks()
 
-        # Higher-quality mipmap choice
-        # Turn off for a speedup during dragging or scrolling
-        self._hq_rendering = True
-        self._restore_hq_rendering_timeout_id = None
+        # Progressive rendering.
+        # Redraws during interactive scrolling and zooming, and after
+        # a change of mipmap level, only render what fits into a time
+        # budget. The rest is previewed, and refined in idle time.
+        self._resume_refinement_timeout_id = None
+        self._refine_idle_id = None
+        self._refine_tiles = set()
+        self._refine_level = None
+        self._refine_failures = {}  # {(tx, ty): count}, at _refine_level
+        self._render_service = gui.renderservice.RenderService()
+        self._render_surface = None
 
         self.connect("configure-event", self._configure_event_cb)
 
@@ -786,6 +835,11 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
     def doc(self):
         return self._tdw.doc
 
+    @property
+    def redraw_stats(self):
+        """Frame time and tiles per frame (gui.redraw.RedrawStats)"""
+        return self._redraw_scheduler.stats
+
     @event
     def transformation_updated(self):
         """Event: transformation was updated"""
@@ -859,23 +913,18 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
     def canvas_modified_cb(self, model, x, y, w, h):
         """Handles area redraw notifications from the underlying model"""
 
+        self._backing_store.invalidate_model_area(x, y, w, h)
+
         if self._insensitive_state_content:
             return False
 
         if not self.get_window():
             return
 
-        if w == 0 and h == 0:
-            # Full redraw (used when background has changed).
-            # logger.debug('Full redraw')
-            self.queue_draw()
-            return
-
-        # Create an expose event with the event bbox rotated/zoomed.
-        corners = [(x, y), (x + w, y), (x, y + h), (x + w, y + h)]
-        corners = [self.model_to_display(x, y) for (x, y) in corners]
-        bbox = helpers.rotated_rectangle_bbox(corners)
-        self.queue_draw_area(*bbox)
+        # Changed areas are collected as model tiles, and invalidated
+        # once per frame. A zero-sized area means a full redraw, e.g.
+        # when the background has changed.
+        self._redraw_scheduler.model_area_changed(x, y, w, h)
 
     def queue_draw(self):
         if self._idle_redraw_priority is None:
@@ -930,8 +979,13 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
         self.update_cursor()
 
     def layer_props_changed_cb(self, rootstack, path, layer, changed):
+        self._backing_store.invalidate_all()
         self.update_cursor()
 
+    def layer_stack_changed_cb(self, rootstack, path):
+        """Handles layers being inserted or deleted"""
+        self._backing_store.invalidate_all()
+
     def frame_enabled_changed_cb(self, model, enabled):
         self.queue_draw()
 
@@ -1060,7 +1114,7 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
             return surf
 
         # Render just what we need.
-        transformation, surface, sparse, mipmap_level, clip_rect = \
+        transformation, model_bbox, mipmap_level, clip_rects = \
             self._render_prepare(cr)
         display_filter = None
         if use_filter:
@@ -1068,10 +1122,9 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
         self._render_execute(
             cr,
             transformation,
-            surface,
-            sparse,
+            model_bbox,
             mipmap_level,
-            clip_rect,
+            clip_rects,
             filter = display_filter,
         )
         surf.flush()
@@ -1110,32 +1163,41 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
             cr.set_source_rgb(tmp, tmp, tmp)
             cr.paint()
 
-        # Prep a pixbuf-surface aligned to the model to render into.
+        # Work out the model area to render.
         # This also applies the transformation.
-        transformation, surface, sparse, mipmap_level, clip_rect = \
+        t0 = time.time()
+        transformation, model_bbox, mipmap_level, clip_rects = \
             self._render_prepare(cr)
 
         # not sure if it is a good idea to clip so tightly
         # has no effect right now because device_bbox is always smaller
-        model_bbox = surface.x, surface.y, surface.w, surface.h
         cr.rectangle(*model_bbox)
         cr.clip()
 
-        # Clear the pixbuf to be rendered with a random red,
-        # to make it apparent if something is not being painted.
-        if self.visualize_rendering:
-            surface.pixbuf.fill(int(random.random() * 0xff) << 16)
-
-        # Render to the pixbuf, then paint it.
-        self._render_execute(
+        # Render what's needed, then paint it.
+        # Normally this goes via the backing store,
+        # but visualizations need every redraw to be real.
+        render_args = (
             cr,
             transformation,
-            surface,
-            sparse,
+            model_bbox,
             mipmap_level,
-            clip_rect,
-            filter = self.display_filter,
+            clip_rects,
         )
+        ntiles = None
+        if not self.visualize_rendering:
+            ntiles = self._render_execute_stored(
+                *render_args,
+                filter = self.display_filter
+            )
+        if ntiles is None:
+            ntiles = self._render_execute(
+                *render_args,
+                filter = self.display_filter
+            )
+        frame_time = time.time() - t0
+        self.redraw_stats.record(frame_time, ntiles)
+        _FRAME_TIMER.record(frame_time)
 
         # Using different random blues helps make one rendered bbox
         # distinct from the next when the user is painting.
@@ -1171,11 +1233,13 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
 
         :param cairo.Context cr: as passed to the "draw" event handler.
         :param tuple device_bbox: (x,y,w,h) widget extents
-        :returns: (clipregion, sparse)
+        :returns: (cliprects, sparse)
         :rtype: tuple
 
-        The clip region return value is a lib.helpers.Rect containing
-        the area to redraw in display coordinates, or None.
+        The clip rects return value is a list of lib.helpers.Rects
+        which together cover the area to redraw in display coordinates,
+        or None. When several separate areas were invalidated in the
+        same frame, there will be more than one rectangle.
 
         This also determines whether the redraw is "sparse", meaning
         that the clip region returned does not contain the centre of the
@@ -1226,66 +1290,43 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
                 or cy < rect.y
                 or cy > (rect.y + rect.h)
             )
+            rects = [rect]
+            # The individual rectangles of the clip region are better,
+            # if this pycairo can supply them.
+            try:
+                rect_list = cr.copy_clip_rectangle_list()
+            except (AttributeError, cairo.Error):
+                rect_list = None
+            if rect_list:
+                rects = [
+                    helpers.Rect(
+                        int(floor(x_)), int(floor(y_)),
+                        int(ceil(x_ + w_) - floor(x_)),
+                        int(ceil(y_ + h_) - floor(y_)),
+                    )
+                    for (x_, y_, w_, h_) in rect_list
+                ]
         else:
-            rect = None
+            rects = None
             sparse = False
 
-        return rect, sparse
-
-    def _tile_is_visible(self, tx, ty, transformation, clip_rect,
-                         translation_only):
-        """Tests whether an individual tile is visible.
-
-        This is sometimes worth doing during rendering, but not always.
-        Currently we use _render_get_clip_region()'s sparse flag to
-        determine whether this is necessary. The original logic for
-        this function was documented as...
-
-        > it is worth checking whether this tile really will be visible
-        > (to speed up the L-shaped expose event during scrolling)
-        > (speedup clearly visible; slowdown measurable when always
-        > executing this code)
-
-        I'm not 100% certain that GTK3 does panning redraws this way,
-        so perhaps this method is uneccessary for those?
-        However this method is always used when rendering during
-        painting, or other activities that send partial updates.
-
-        """
-        n = tiledsurface.N
-        if translation_only:
-            x, y = transformation.transform_point(tx * n, ty * n)
-            bbox = (int(x), int(y), n, n)
-        else:
-            corners = [
-                (tx * n, ty * n),
-                ((tx + 1) * n, ty * n),
-                (tx * n, (ty + 1) * n),
-                ((tx + 1) * n, (ty + 1) * n),
-            ]
-            corners = [
-                transformation.transform_point(x_, y_)
-                for (x_, y_) in corners
-            ]
-            bbox = helpers.rotated_rectangle_bbox(corners)
-        tile_rect = helpers.Rect(*bbox)
-        return clip_rect.overlaps(tile_rect)
+        return rects, sparse
 
     def _render_prepare(self, cr):
-        """Prepares a blank pixbuf & other details for later rendering.
+        """Prepares the details needed for rendering.
 
-        Called when handling "draw" events. The size and shape of the
-        returned pixbuf (wrapped in a tile-accessible and read/write
-        lib.pixbufsurface.Surface) is determined by the Cairo clipping
-        region that expresses what we've been asked to redraw, and by
-        the TDW's own view transformation of the document.
+        Called when handling "draw" events. The returned model bbox
+        (a lib.helpers.Rect, at the chosen mipmap level) is determined
+        by the Cairo clipping region that expresses what we've been
+        asked to redraw, and by the TDW's own view transformation of
+        the document.
 
         """
         # Determine what to draw, and the nature of the reveal.
         allocation = self.get_allocation()
         w, h = allocation.width, allocation.height
         device_bbox = (0, 0, w, h)
-        clip_rect, sparse = self._render_get_clip_region(cr, device_bbox)
+        clip_rects, _sparse = self._render_get_clip_region(cr, device_bbox)
         x, y, w, h = device_bbox
 
         # Use a copy of the cached translation matrix for this
@@ -1293,14 +1334,9 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
         # greater than zero.
         transformation = cairo.Matrix(*self._get_model_view_transformation())
 
-        # HQ rendering causes a very clear slowdown on some hardware.
-        # Probably could avoid this entirely by rendering differently,
-        # but for now, if the canvas is being panned around,
-        # just render more simply.
-        if self._hq_rendering:
-            mipmap_level = max(0, int(floor(log(1 / self.scale, 2))))
-        else:
-            mipmap_level = max(0, int(ceil(log(1 / self.scale, 2))))
+        # Always use the higher-quality mipmap choice. While the view
+        # is changing, progressive rendering keeps the redraws fast.
+        mipmap_level = max(0, int(floor(log(1 / self.scale, 2))))
 
         # OPTIMIZE: If we would render tile scanlines,
         # OPTIMIZE:  we could probably use the better one above...
@@ -1325,65 +1361,474 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
         x1, y1 = int(floor(x1)), int(floor(y1))
         x2, y2 = int(ceil(x2)), int(ceil(y2))
 
-        # We always render with alpha to get hardware acceleration,
-        # even when we could avoid using the alpha channel. Speedup
-        # factor 3 for ATI/Radeon Xorg driver (and hopefully others).
-        # https://bugs.freedesktop.org/show_bug.cgi?id=28670
+        model_bbox = helpers.Rect(x1, y1, x2 - x1 + 1, y2 - y1 + 1)
+        return transformation, model_bbox, mipmap_level, clip_rects
 
-        surface = pixbufsurface.Surface(x1, y1, x2 - x1 + 1, y2 - y1 + 1)
-        return transformation, surface, sparse, mipmap_level, clip_rect
-
-    def _render_execute(self, cr, transformation, surface, sparse,
-                        mipmap_level, clip_rect, filter=None):
-        """Renders tiles into a prepared pixbufsurface, then blits it.
+    @staticmethod
+    def _get_bbox_tiles_rect(model_bbox):
+        """The rectangle of tiles covering a model bbox"""
+        n = tiledsurface.N
+        x, y, w, h = model_bbox
+        tx0, ty0 = x // n, y // n
+        tx1, ty1 = (x + w - 1) // n, (y + h - 1) // n
+        return helpers.Rect(tx0, ty0, tx1 - tx0 + 1, ty1 - ty0 + 1)
+
+    def _get_tiles_to_render(self, tiles_rect, transformation, clip_rects):
+        """Cull a rectangle of tiles to those overlapping the clip region
+
+        :param lib.helpers.Rect tiles_rect: Candidate tiles
+        :param cairo.Matrix transformation: Model (at the mipmap level)
+            to display transformation
+        :param list clip_rects: Display rects to redraw, or None
+        :returns: Visible tiles, in row order
+        :rtype: list
 
+        Each clip rectangle is mapped back into model space, where it
+        becomes a rotated, scaled polygon. The tiles it overlaps are
+        found by scan-converting the polygon a row of tiles at a time,
+        which is much cheaper than testing each tile in turn. This
+        speeds up the L-shaped redraws when scrolling, partial updates
+        while painting, and full redraws of rotated views, whose
+        bounding boxes contain many tiles which are out of view.
 
         """
-        translation_only = self.is_translation_only()
-
-        if self.visualize_rendering:
-            surface.pixbuf.fill(int(random.random() * 0xff) << 16)
-
-        fake_alpha_check_tile = None
-        if not self._draw_real_alpha_checks:
-            fake_alpha_check_tile = self._fake_alpha_check_tile
-
-        # Determine which tiles to render.
-        tiles = list(surface.get_tiles())
-        if sparse:
-            tiles = [
-                (tx, ty) for (tx, ty) in tiles
-                if self._tile_is_visible(
-                    tx,
-                    ty,
-                    transformation,
-                    clip_rect,
-                    translation_only,
-                )
+        tx0, ty0 = tiles_rect.x, tiles_rect.y
+        tx1 = tx0 + tiles_rect.w - 1
+        ty1 = ty0 + tiles_rect.h - 1
+        if not clip_rects:
+            return [
+                (tx, ty)
+                for ty in xrange(ty0, ty1 + 1)
+                for tx in xrange(tx0, tx1 + 1)
             ]
-
-        # Composite each stack of tiles in the exposed area
-        # into the pixbufsurface.
+        to_model = cairo.Matrix(*transformation)
+        to_model.invert()
+        # Cairo needs a pixel or so beyond the edges for interpolation
+        pad = 0 if self.is_translation_only() else 2
+        rows = {}
+        for r in clip_rects:
+            x0, y0 = r.x - pad, r.y - pad
+            x1, y1 = r.x + r.w + pad, r.y + r.h + pad
+            corners = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+            corners = [to_model.transform_point(x, y) for (x, y) in corners]
+            for (ty, sx0, sx1) in gui.redraw.tiles_in_polygon(corners):
+                if not (ty0 <= ty <= ty1):
+                    continue
+                sx0 = max(sx0, tx0)
+                sx1 = min(sx1, tx1)
+                if sx0 <= sx1:
+                    rows.setdefault(ty, set()).update(xrange(sx0, sx1 + 1))
+        return [
+            (tx, ty)
+            for ty in sorted(rows)
+            for tx in sorted(rows[ty])
+        ]
+
+    def _get_opaque_base_tile(self):
+        """The fake alpha checks tile to render over, or None"""
+        if self._draw_real_alpha_checks:
+            return None
+        return self._fake_alpha_check_tile
+
+    def _render_tiles_to_surface(self, surface, tiles, mipmap_level,
+                                 filter=None):
+        """Composite each stack of tiles into an 8bpc surface"""
         self.doc._layers.render(
             surface,
             tiles,
             mipmap_level,
             overlay = self.overlay_layer,
-            opaque_base_tile = fake_alpha_check_tile,
+            opaque_base_tile = self._get_opaque_base_tile(),
             filter = filter,
         )
 
-        # Set the surface's underlying pixbuf as the source, then paint
-        # it with Cairo. We don't care if it's pixelized at high zoom-in
-        # levels: in fact, it'll look sharper and better.
-        Gdk.cairo_set_source_pixbuf(
-            cr, surface.pixbuf,
-            round(surface.x), round(surface.y)
+    def _get_render_surface(self, x, y, w, h):
+        """A cleared ARGB32 surface for a one-off render
+
+        The image memory is reused between calls when it's big enough,
+        so only use the returned surface until the next call.
+
+        """
+        surface = self._render_surface
+        if surface is not None and surface.fits(x, y, w, h):
+            surface = pixbufsurface.CairoSurface(
+                x, y, w, h,
+                image_surface=surface.image_surface,
+            )
+        else:
+            surface = pixbufsurface.CairoSurface(x, y, w, h)
+        self._render_surface = surface
+        return surface
+
+    def _render_execute(self, cr, transformation, model_bbox,
+                        mipmap_level, clip_rects, filter=None):
+        """Renders tiles into an ARGB32 image surface, then blits it.
+
+        :returns: the number of tiles rendered
+        :rtype: int
+
+        """
+        # We always render with alpha to get hardware acceleration,
+        # even when we could avoid using the alpha channel. Speedup
+        # factor 3 for ATI/Radeon Xorg driver (and hopefully others).
+        # https://bugs.freedesktop.org/show_bug.cgi?id=28670
+        surface = self._get_render_surface(*model_bbox)
+
+        # Clear the surface to be rendered with a random red,
+        # to make it apparent if something is not being painted.
+        if self.visualize_rendering:
+            vis_cr = cairo.Context(surface.image_surface)
+            vis_cr.set_source_rgb(random.random(), 0, 0)
+            vis_cr.paint()
+            surface.image_surface.flush()
+
+        tiles = self._get_tiles_to_render(
+            self._get_bbox_tiles_rect(model_bbox),
+            transformation,
+            clip_rects,
         )
+        self._render_tiles_to_surface(surface, tiles, mipmap_level, filter)
+
+        # Paint the image surface with Cairo directly. We don't care if
+        # it's pixelized at high zoom-in levels: in fact, it'll look
+        # sharper and better.
+        surface.mark_dirty()
+        surface.set_source(cr)
         if self.scale > self.pixelize_threshold:
             pattern = cr.get_source()
             pattern.set_filter(cairo.FILTER_NEAREST)
         cr.paint()
+        return len(tiles)
+
+    def _render_execute_stored(self, cr, transformation, model_bbox,
+                               mipmap_level, clip_rects, filter=None):
+        """Renders via the backing store, then blits it.
+
+        :returns: the number of tiles rendered, or None
+        :rtype: int
+
+        Only tiles which aren't already valid in the backing store are
+        rendered, so panning and rotating the view only renders newly
+        exposed tiles. If the area is too large for the backing store,
+        nothing is drawn and None is returned.
+
+        When rendering progressively, missing tiles are rendered
+        centre-first until the frame's time budget runs out. The rest
+        are previewed from the store's fallback contents, or from a
+        quick render at a coarser mipmap level, and are queued for
+        refinement on the render service's threads.
+
+        """
+        t0 = time.time()
+        n = tiledsurface.N
+        tiles_rect = self._get_bbox_tiles_rect(model_bbox)
+        key = self._get_backing_store_key(filter)
+        store = self._backing_store
+        if not store.prepare(mipmap_level, key, tiles_rect):
+            return None
+        deadline = None
+        if self._is_rendering_progressively():
+            deadline = t0 + FRAME_RENDER_BUDGET
+        if mipmap_level != self._refine_level:
+            self._refine_tiles.clear()
+            self._refine_failures.clear()
+            self._refine_level = mipmap_level
+
+        tiles = self._get_tiles_to_render(
+            tiles_rect,
+            transformation,
+            clip_rects,
+        )
+        if deadline is None:
+            todo = store.missing(tiles)
+        else:
+            todo = self._sort_tiles_centre_first(
+                store.missing(tiles, include_pending=False),
+                mipmap_level,
+            )
+        ntiles = self._render_store_tiles(
+            todo, mipmap_level, filter, deadline,
+        )
+        deferred = store.missing(tiles)
+
+        # Preview anything not rendered in time.
+        if deferred:
+            uncovered = store.paint_fallback(cr, deferred)
+            preview_level = min(
+                mipmap_level + PREVIEW_LEVEL_STEP,
+                tiledsurface.MAX_MIPMAP_LEVEL,
+            )
+            if uncovered and preview_level == mipmap_level:
+                ntiles += self._render_store_tiles(
+                    uncovered, mipmap_level, filter,
+                )
+                deferred = store.missing(deferred)
+            elif uncovered:
+                ntiles += self._paint_preview_tiles(
+                    cr, uncovered, mipmap_level, preview_level, filter,
+                )
+        if deferred or store.has_fallback:
+            self._refine_tiles.update(deferred)
+            self._queue_refinement()
+        if deferred:
+            deferred = set(deferred)
+            cr.save()
+            valid = [ti for ti in tiles if ti not in deferred]
+            for r in gui.redraw.tiles_to_rects(valid):
+                cr.rectangle(r.x * n, r.y * n, r.w * n, r.h * n)
+            cr.clip()
+
+        store.set_source(cr)
+        if self.scale > self.pixelize_threshold:
+            pattern = cr.get_source()
+            pattern.set_filter(cairo.FILTER_NEAREST)
+        cr.paint()
+        if deferred:
+            cr.restore()
+        return ntiles
+
+    def _get_backing_store_key(self, filter):
+        """Summarizes the settings the backing store's contents use"""
+        return (
+            id(filter),
+            id(self.overlay_layer),
+            self._draw_real_alpha_checks,
+        )
+
+    def _sort_tiles_centre_first(self, tiles, mipmap_level):
+        """Sort tiles by their distance from the centre of the view"""
+        n = tiledsurface.N * (2 ** mipmap_level)
+        cx, cy = self.get_center_model_coords()
+        cx, cy = cx / n - 0.5, cy / n - 0.5
+        return sorted(
+            tiles,
+            key = lambda ti: (ti[0] - cx) ** 2 + (ti[1] - cy) ** 2,
+        )
+
+    def _render_store_tiles(self, tiles, mipmap_level, filter,
+                            deadline=None):
+        """Render tiles into the backing store, in order
+
+        :param list tiles: Tiles to render
+        :param int mipmap_level: Mipmap level to render at
+        :param filter: Display filter to apply
+        :param float deadline: Stop rendering after this time
+        :returns: The number of tiles rendered, from the start of tiles
+        :rtype: int
+
+        Without a deadline, everything is rendered in one go.
+
+        """
+        store = self._backing_store
+        chunk_size = len(tiles)
+        if deadline is not None:
+            chunk_size = RENDER_CHUNK_TILES
+        done = 0
+        while done < len(tiles):
+            if deadline is not None and time.time() > deadline:
+                break
+            chunk = tiles[done:done + chunk_size]
+            surface = store.surface
+            self._render_tiles_to_surface(
+                surface, chunk, mipmap_level, filter,
+            )
+            store.update(surface, chunk)
+            done += len(chunk)
+        return done
+
+    def _render_failed_tiles(self, tiles, mipmap_level, filter):
+        """Render tiles the render service failed on, in this thread
+
+        If this fails too, the tiles are left as they are, showing the
+        preview, until something invalidates them.
+
+        """
+        logger.warning(
+            "Render service failed %d times on %d tile(s), "
+            "rendering them in the main thread",
+            REFINE_MAX_FAILURES, len(tiles),
+        )
+        try:
+            self._render_store_tiles(tiles, mipmap_level, filter)
+        except Exception:
+            logger.exception("Failed to render %d tile(s)", len(tiles))
+            return
+        for ti in tiles:
+            self._refine_failures.pop(ti, None)
+        rects = gui.redraw.tiles_display_rects(self, tiles, mipmap_level)
+        for r in rects:
+            self.queue_draw_area(*r)
+
+    def _paint_preview_tiles(self, cr, tiles, mipmap_level, preview_level,
+                             filter):
+        """Quickly paint tiles from a render at a coarser mipmap level
+
+        :returns: the number of coarse tiles rendered
+        :rtype: int
+
+        """
+        n = tiledsurface.N
+        d = preview_level - mipmap_level
+        coarse = sorted(set((tx >> d, ty >> d) for (tx, ty) in tiles))
+        cx0 = min(tx for (tx, ty) in coarse)
+        cy0 = min(ty for (tx, ty) in coarse)
+        cx1 = max(tx for (tx, ty) in coarse)
+        cy1 = max(ty for (tx, ty) in coarse)
+        surface = self._get_render_surface(
+            cx0 * n, cy0 * n,
+            (cx1 - cx0 + 1) * n, (cy1 - cy0 + 1) * n,
+        )
+        self._render_tiles_to_surface(surface, coarse, preview_level, filter)
+        surface.mark_dirty()
+        cr.save()
+        for r in gui.redraw.tiles_to_rects(tiles):
+            cr.rectangle(r.x * n, r.y * n, r.w * n, r.h * n)
+        cr.clip()
+        cr.scale(2 ** d, 2 ** d)
+        surface.set_source(cr)
+        cr.paint()
+        cr.restore()
+        return len(coarse)
+
+    def _is_rendering_progressively(self):
+        """True if redraws should be limited to a time budget"""
+        return (
+            self._resume_refinement_timeout_id is not None
+            or self._backing_store.has_fallback
+            or bool(self._refine_tiles)
+        )
+
+    def _queue_refinement(self):
+        """Start refining previewed tiles in idle time, if allowed"""
+        if self._refine_idle_id is not None:
+            return
+        if self._resume_refinement_timeout_id is not None:
+            return
+        self._refine_idle_id = GLib.idle_add(self._refine_idle_cb)
+
+    def _refine_idle_cb(self):
+        """Refines previewed tiles, centre-first
+
+        Tiles are handed to the render service in small batches if the
+        layer stack can be snapshotted. Otherwise they're rendered here,
+        a time budget's worth at a time. So are tiles the render service
+        has failed on `REFINE_MAX_FAILURES` times.
+
+        """
+        store = self._backing_store
+        level = self._refine_level
+        filter = self.display_filter
+        stale = (
+            self.doc is None
+            or store.mipmap_level != level
+            or store.key != self._get_backing_store_key(filter)
+        )
+        if stale:
+            self._refine_tiles.clear()
+            self._refine_failures.clear()
+            self._render_service.cancel_all()
+        tiles = store.missing(
+            store.covers(self._refine_tiles),
+            include_pending=False,
+        )
+        if not tiles:
+            self._refine_tiles.clear()
+            self._refine_idle_id = None
+            if not store.has_pending:
+                store.drop_fallback()
+            return False
+        tiles = self._sort_tiles_centre_first(tiles, level)
+        deadline = time.time() + IDLE_RENDER_BUDGET
+        # Tiles the render service keeps failing on are done here.
+        failures = self._refine_failures
+        failed = [ti for ti in tiles
+                  if failures.get(ti, 0) >= REFINE_MAX_FAILURES]
+        if failed:
+            failed_set = set(failed)
+            tiles = [ti for ti in tiles if ti not in failed_set]
+            self._refine_tiles.difference_update(failed_set)
+            self._render_failed_tiles(failed, level, filter)
+            if not tiles:
+                return True
+        ndone = self._submit_store_tiles(tiles, level, filter, deadline)
+        if ndone is None:
+            ndone = self._render_store_tiles(tiles, level, filter, deadline)
+            rects = gui.redraw.tiles_display_rects(self, tiles[:ndone], level)
+            for r in rects:
+                self.queue_draw_area(*r)
+        self._refine_tiles = set(tiles[ndone:])
+        return True
+
+    def _submit_store_tiles(self, tiles, mipmap_level, filter, deadline):
+        """Hand tiles to the render service for the backing store
+
+        :returns: The number of tiles submitted, from the start of
+            tiles, or None if the layer stack can't be snapshotted.
+        :rtype: int
+
+        """
+        n = tiledsurface.N
+        store = self._backing_store
+        done = 0
+        while done < len(tiles):
+            if time.time() > deadline:
+                break
+            chunk = tiles[done:done + REFINE_JOB_TILES]
+            snapshot = self.doc._layers.get_render_snapshot(
+                chunk,
+                mipmap_level,
+                overlay = self.overlay_layer,
+                opaque_base_tile = self._get_opaque_base_tile(),
+                filter = filter,
+            )
+            if snapshot is None:
+                return None
+            cx0 = min(tx for (tx, ty) in chunk)
+            cy0 = min(ty for (tx, ty) in chunk)
+            cx1 = max(tx for (tx, ty) in chunk)
+            cy1 = max(ty for (tx, ty) in chunk)
+            surface = pixbufsurface.CairoSurface(
+                cx0 * n, cy0 * n,
+                (cx1 - cx0 + 1) * n, (cy1 - cy0 + 1) * n,
+            )
+            token = store.begin_update(chunk)
+            self._render_service.submit(
+                snapshot, surface,
+                self._render_job_done_cb, token, mipmap_level,
+            )
+            done += len(chunk)
+        return done
+
+    def _render_job_done_cb(self, job, token, mipmap_level):
+        """Copies tiles rendered by the render service into the store"""
+        store = self._backing_store
+        if not job.completed:
+            # Failed or cancelled: let the tiles be rendered again.
+            store.abort_update(token)
+            if mipmap_level != self._refine_level:
+                return
+            self._refine_tiles.update(job.snapshot.tiles)
+            if job.error is not None:
+                # Retry later, backing off, not in a loop.
+                failures = self._refine_failures
+                count = 0
+                for ti in job.snapshot.tiles:
+                    failures[ti] = failures.get(ti, 0) + 1
+                    count = max(count, failures[ti])
+                delay = REFINE_RETRY_DELAY * 2 ** (count - 1)
+                self.defer_hq_rendering(delay)
+            elif not store.has_pending:
+                self._queue_refinement()
+            return
+        for ti in job.snapshot.tiles:
+            self._refine_failures.pop(ti, None)
+        surface = job.surface
+        tiles = store.finish_update(token, surface, job.snapshot.tiles)
+        rects = gui.redraw.tiles_display_rects(self, tiles, mipmap_level)
+        for r in rects:
+            self.queue_draw_area(*r)
+        if not store.has_pending:
+            self._queue_refinement()
 
     def scroll(self, dx, dy, ongoing=True):
         self.translation_x -= dx
@@ -1438,7 +1883,7 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
         self.queue_draw()
 
     def defer_hq_rendering(self, t=1.0 / 8):
-        """Use faster but lower-quality rendering for a brief period
+        """Render progressively for a brief period
 
         :param float t: The time to defer for, in seconds
 
@@ -1446,32 +1891,32 @@ class CanvasRenderer (Gtk.DrawingArea, DrawCursorMixin):
         from scroll or drag event handlers,
         or other times when the entire display
         may need to be redrawn repeatedly in short order.
-        It turns off normal rendering, and updates the future time
-        at which normal rendering will be automatically resumed.
-        Resumption of normal service entails a full redraw,
-        so choose `t` appropriately.
+        It limits each redraw's rendering to a small time budget,
+        and postpones the refinement of previewed areas
+        until the future time at which normal rendering resumes.
 
-        Normal rendering looks better (it uses a better mipmap),
+        Rendering everything for each redraw looks better,
         and it's OK for most screen updates.
         However it's slow enough to make rendering
-        lag appreciably when scrolling.
+        lag appreciably when scrolling or zooming.
 
         """
-        if self._restore_hq_rendering_timeout_id:
-            GLib.source_remove(self._restore_hq_rendering_timeout_id)
-            self._restore_hq_rendering_timeout_id = None
+        if self._resume_refinement_timeout_id:
+            GLib.source_remove(self._resume_refinement_timeout_id)
+            self._resume_refinement_timeout_id = None
         else:
             logger.debug("hq_rendering: deferring for %0.3fs...", t)
-            self._hq_rendering = False
-        self._restore_hq_rendering_timeout_id = GLib.timeout_add(
+        if self._refine_idle_id is not None:
+            GLib.source_remove(self._refine_idle_id)
+            self._refine_idle_id = None
+        self._resume_refinement_timeout_id = GLib.timeout_add(
             interval = int(t * 1000),
-            function = self._resume_hq_rendering_timeout_cb,
+            function = self._resume_refinement_timeout_cb,
         )
 
-    def _resume_hq_rendering_timeout_cb(self):
-        self._hq_rendering = True
-        self.queue_draw()
-        self._restore_hq_rendering_timeout_id = None
+    def _resume_refinement_timeout_cb(self):
+        self._resume_refinement_timeout_id = None
+        self._queue_refinement()
         logger.debug("hq_rendering: resumed")
         return False
 
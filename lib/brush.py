@@ -13,9 +13,12 @@ import copy
 import math
 import json
 
+import numpy as np
+
 from lib import mypaintlib
 from lib import helpers
 from lib import brushsettings
+import lib.cache
 from lib.pycompat import unicode
 from lib.pycompat import PY3
 
@@ -43,6 +46,12 @@ OLDFORMAT_BRUSHFILE_VERSION = 2
 BRUSH_SETTINGS = set([s.cname for s in brushsettings.settings])
 ALL_SETTINGS = BRUSH_SETTINGS.union(STRING_VALUE_SETTINGS)
 
+#: Number of parsed settings strings kept for reuse by BrushInfo.
+PARSED_BRUSH_CACHE_SIZE = 64
+
+#: Brush updates touching at least this many settings use one bulk call.
+BULK_UPDATE_MIN_SETTINGS = 8
+
 _BRUSHINFO_MATCH_IGNORES = [
     "color_h", "color_s", "color_v",
     "parent_brush_name",
@@ -184,6 +193,77 @@ def _oldfmt_transform_y(valuepair, func):
     return [basevalue, input_points_new]
 
 
+# Helper funcs for the parsed settings cache:
+
+def _copy_settings(settings):
+    """Copy a BrushInfo settings dict
+
+    The containers are copied, but lists of mapping points are shared.
+    BrushInfo never changes those in place, so this is as good as a
+    deep copy, and much faster.
+
+    >>> s1 = {"radius_logarithmic": [2.0, {"pressure": [[0, 0], [1, 1]]}]}
+    >>> s2 = _copy_settings(s1)
+    >>> s2["radius_logarithmic"][0] = 3.0
+    >>> s2["radius_logarithmic"][1].clear()
+    >>> s1
+    {'radius_logarithmic': [2.0, {'pressure': [[0, 0], [1, 1]]}]}
+
+    """
+    copied = {}
+    for cname, value in settings.items():
+        if isinstance(value, list):
+            copied[cname] = [value[0], dict(value[1])]
+        else:
+            copied[cname] = value
+    return copied
+
+
+def _settings_to_engine_arrays(settings):
+    """Convert a BrushInfo settings dict to arrays for the brush engine
+
+    :returns: base values, mapping point counts, and mapping points
+    :rtype: tuple
+
+    See `Brush.set_settings_from_arrays()` for the layout. The arrays
+    are read-only, so that they can be shared.
+
+    """
+    nsettings = len(brushsettings.settings)
+    ninputs = len(brushsettings.inputs)
+    npoints = 2
+    for setting in brushsettings.settings:
+        for points in settings[setting.cname][1].values():
+            npoints = max(npoints, len(points))
+    base = np.zeros(nsettings, 'float32')
+    counts = np.zeros((nsettings, ninputs), 'int32')
+    mappings = np.zeros((nsettings, ninputs, npoints, 2), 'float32')
+    for setting in brushsettings.settings:
+        base_value, inputs = settings[setting.cname]
+        base[setting.index] = base_value
+        for input_name, points in inputs.items():
+            input = brushsettings.inputs_dict.get(input_name)
+            if input is None or not points:
+                continue
+            counts[setting.index, input.index] = len(points)
+            mappings[setting.index, input.index, :len(points)] = points
+    for arr in (base, counts, mappings):
+        arr.flags.writeable = False
+    return (base, counts, mappings)
+
+
+class _ParsedSettings (object):
+    """Cached result of parsing a settings string"""
+
+    def __init__(self, settings):
+        super(_ParsedSettings, self).__init__()
+        self.settings = _copy_settings(settings)
+        self.engine_arrays = _settings_to_engine_arrays(settings)
+
+
+_parsed_settings_cache = lib.cache.LRUCache(capacity=PARSED_BRUSH_CACHE_SIZE)
+
+
 # Class defs:
 
 class BrushInfo (object):
@@ -195,6 +275,11 @@ class BrushInfo (object):
         super(BrushInfo, self).__init__()
         self.settings = {}
         self.cache_str = None
+        # Engine arrays for the settings, valid while the change serial
+        # is the one they were made for.
+        self._settings_serial = 0
+        self._engine_arrays = None
+        self._engine_arrays_serial = None
         self.observers = []
         for s in brushsettings.settings:
             self.reset_setting(s.cname)
@@ -206,6 +291,7 @@ class BrushInfo (object):
 
     def settings_changed_cb(self, settings):
         self.cache_str = None
+        self._settings_serial += 1
 
     def clone(self):
         """Returns a deep-copied duplicate."""
@@ -215,9 +301,8 @@ class BrushInfo (object):
 
     def load_from_brushinfo(self, other):
         """Updates the brush's Settings from (a clone of) ``brushinfo``."""
-        self.settings = copy.deepcopy(other.settings)
-        for f in self.observers:
-            f(ALL_SETTINGS)
+        self.settings = _copy_settings(other.settings)
+        self._notify_loaded(other.get_engine_arrays())
         self.cache_str = other.cache_str
 
     def load_defaults(self):
@@ -323,6 +408,13 @@ class BrushInfo (object):
     def load_from_string(self, settings_str):
         """Load a setting string, overwriting all current settings."""
 
+        parsed = _parsed_settings_cache.get(settings_str)
+        if parsed is not None:
+            self.settings = _copy_settings(parsed.settings)
+            self._notify_loaded(parsed.engine_arrays)
+            self.cache_str = settings_str
+            return
+
         settings_unicode = settings_str
         if not isinstance(settings_unicode, unicode):
             if not isinstance(settings_unicode, bytes):
@@ -338,9 +430,42 @@ class BrushInfo (object):
         else:
             raise BrushInfo.ParseError('brush format not recognized')
 
+        parsed = _ParsedSettings(self.settings)
+        _parsed_settings_cache[settings_str] = parsed
+        self._notify_loaded(parsed.engine_arrays)
+        self.cache_str = settings_str
+
+    def _notify_loaded(self, engine_arrays):
+        """Tell observers that all settings were replaced
+
+        :param tuple engine_arrays: Engine arrays for the new settings
+
+        The arrays are kept for `get_engine_arrays()`, unless something
+        changes the settings again while the observers are running.
+
+        """
+        if self.observers_hidden:
+            engine_arrays = None  # other changes may be pending
+        self._engine_arrays = engine_arrays
+        self._engine_arrays_serial = self._settings_serial + 1
         for f in self.observers:
             f(ALL_SETTINGS)
-        self.cache_str = settings_str
+
+    def get_engine_arrays(self):
+        """The settings, as arrays for the brush engine
+
+        :returns: base values, mapping point counts, and mapping points
+        :rtype: tuple
+
+        The arrays are read-only, and are made again only after the
+        settings have changed. See `Brush.set_settings_from_arrays()`.
+
+        """
+        if (self._engine_arrays is None or
+                self._engine_arrays_serial != self._settings_serial):
+            self._engine_arrays = _settings_to_engine_arrays(self.settings)
+            self._engine_arrays_serial = self._settings_serial
+        return self._engine_arrays
 
     def _load_old_format(self, settings_str):
         """Loads brush settings in the old (v2) format.
@@ -585,6 +710,9 @@ class Brush (mypaintlib.PythonBrush):
 
     def _update_from_brushinfo(self, settings):
         """Updates changed low-level settings from the BrushInfo"""
+        if len(settings) >= BULK_UPDATE_MIN_SETTINGS:
+            self.set_settings_from_arrays(*self.brushinfo.get_engine_arrays())
+            return
         for cname in settings:
             self._update_setting_from_brushinfo(cname)
 
@@ -14,6 +14,7 @@ from __future__ import division, print_function
 from warnings import warn
 from copy import deepcopy
 import weakref
+import collections
 from gettext import gettext as _
 from logging import getLogger
 
@@ -64,9 +65,13 @@ class CommandStack (object):
         This operation adds a new command to the undo stack after
         calling its redo() method to perform the work it represents.
         It also trims the undo stack.
+
+        If redo() raises an exception, for example because a long
+        operation was cancelled, the command is not pushed and the
+        stacks are left as they were.
         """
-        self._discard_redo()
         command.redo()
+        self._discard_redo()
         self.undo_stack.append(command)
         self.reduce_undo_history()
         self.stack_updated()
@@ -279,6 +284,8 @@ class Brushwork (Command):
         self._recording_finished = False
         self.split_due = False
         self._sshot_after_applied = False
+        # Jobs given to the document's painting thread, oldest first
+        self._paint_jobs = collections.deque()
 
     def __repr__(self):
         time = 0.0
@@ -414,6 +421,12 @@ class Brushwork (Command):
         An example of a mode which does just this can be found in gui/.
 
         """
+        if self.doc.painting_worker is not None:
+            self.stroke_to_batch([(
+                dtime, x, y, pressure,
+                xtilt, ytilt, viewzoom, viewrotation,
+            )])
+            return
         self._check_recording_started()
         model = self.doc
         layer = self._stroke_target_layer
@@ -443,6 +456,80 @@ class Brushwork (Command):
             xtilt, ytilt, dtime, viewzoom, viewrotation,
         )
 
+    def stroke_to_batch(self, events):
+        """Painting: forward several stroke position updates at once
+
+        :param list events: Position updates, as tuples of the args to
+            `stroke_to()`, in order
+        :returns: The number of events used, from the start of events
+        :rtype: int
+
+        This paints and records like successive calls to `stroke_to()`
+        would, but the target layer renders all the dabs in one atomic
+        batch. Processing stops after any event which makes `split_due`
+        true, so callers can split the brushwork before passing on the
+        remaining events.
+
+        If the document has a painting thread, all the events are
+        handed to it instead, and recorded straight away. Splits it
+        asks for are noticed by later calls.
+
+        """
+        if not events:
+            return 0
+        self._check_recording_started()
+        model = self.doc
+        layer = self._stroke_target_layer
+        if layer is None:
+            return len(events)  # wasn't suitable for painting
+        # Reset initial brush state if requested.
+        brush = model.brush
+        abrupt_event = None
+        if self._abrupt_start and not self._abrupt_start_done:
+            (dtime, x, y, pressure, xtilt, ytilt,
+             viewzoom, viewrotation) = events[0]
+            abrupt_event = (
+                x, y,
+                0.0,
+                xtilt, ytilt,
+                10.0,
+                viewzoom, viewrotation,
+            )
+            self._abrupt_start_done = True
+        # Paint, then record the positions which were used
+        layer_events = [
+            (x, y, pressure, xtilt, ytilt, dtime, zoom, rotation)
+            for (dtime, x, y, pressure, xtilt, ytilt, zoom, rotation)
+            in events
+        ]
+        worker = model.painting_worker
+        if worker is not None:
+            self._check_paint_jobs()
+            if abrupt_event is not None:
+                layer_events.insert(0, abrupt_event)
+            job = worker.submit(
+                layer, brush, layer_events,
+                reset_brush=(abrupt_event is not None),
+            )
+            self._paint_jobs.append(job)
+            n = len(events)
+        else:
+            if abrupt_event is not None:
+                brush.reset()
+                layer.stroke_to(brush, *abrupt_event)
+            n, self.split_due = layer.stroke_to_batch(brush, layer_events)
+        record_event = self._stroke_seq.record_event
+        for evt in events[:n]:
+            record_event(*evt)
+        return n
+
+    def _check_paint_jobs(self):
+        """Forget finished painting thread jobs, noting any splits"""
+        jobs = self._paint_jobs
+        while jobs and jobs[0].done:
+            if jobs.popleft().split:
+                self.split_due = True
+
     def stop_recording(self, revert=False):
         """Ends the recording phase
 
@@ -467,6 +554,10 @@ class Brushwork (Command):
 
         """
         self._check_recording_started()
+        worker = self.doc.painting_worker
+        if worker is not None:
+            worker.flush()
+        self._paint_jobs.clear()
         layer = self._stroke_target_layer
         self._stroke_target_layer = None  # prevent potential leak
         self._recording_finished = True
@@ -509,7 +600,8 @@ class FloodFill (Command):
     display_name = _("Flood Fill")
 
     def __init__(self, doc, x, y, color, bbox, tolerance,
-                 sample_merged, make_new_layer, **kwds):
+                 sample_merged, make_new_layer,
+                 gap_size=0, offset=0, feather=0, **kwds):
         super(FloodFill, self).__init__(doc, **kwds)
         self.x = x
         self.y = y
@@ -518,6 +610,9 @@ class FloodFill (Command):
         self.tolerance = tolerance
         self.sample_merged = sample_merged
         self.make_new_layer = make_new_layer
+        self.gap_size = gap_size
+        self.offset = offset
+        self.feather = feather
         self.new_layer = None
         self.new_layer_path = None
         self.snapshot = None
@@ -549,7 +644,9 @@ class FloodFill (Command):
             dst_layer = layers.current
         # Fill connected areas of the source into the destination
         src_layer.flood_fill(self.x, self.y, self.color, self.bbox,
-                             self.tolerance, dst_layer=dst_layer)
+                             self.tolerance, dst_layer=dst_layer,
+                             gap_size=self.gap_size, offset=self.offset,
+                             feather=self.feather)
 
     def undo(self):
         layers = self.doc.layer_stack
@@ -684,8 +781,10 @@ class NewLayerMergedFromVisible (Command):
 
     display_name = _("New Layer from Visible")
 
-    def __init__(self, doc, **kwds):
+    def __init__(self, doc, progress=None, cancel=None, **kwds):
         super(NewLayerMergedFromVisible, self).__init__(doc, **kwds)
+        self._progress = progress
+        self._cancel = cancel
         self._old_current_path = doc.layer_stack.current_path
         self._result_insert_path = None
         self._result_layer = None
@@ -702,8 +801,12 @@ class NewLayerMergedFromVisible (Command):
                 if path[0] < self._result_insert_path[0]:
                     self._result_insert_path = (path[0],)
                 self._paths_merged.append(path)
-            merged = rootstack.layer_new_merge_visible()
+            merged = rootstack.layer_new_merge_visible(
+                progress=self._progress,
+                cancel=self._cancel,
+            )
             self._result_layer = merged
+            self._progress = self._cancel = None
         assert self._result_insert_path is not None
         rootstack.deepinsert(self._result_insert_path, merged)
         self._result_final_path = rootstack.deepindex(merged)
@@ -726,8 +829,10 @@ class MergeVisibleLayers (Command):
 
     display_name = _("Merge Visible Layers")
 
-    def __init__(self, doc, **kwds):
+    def __init__(self, doc, progress=None, cancel=None, **kwds):
         super(MergeVisibleLayers, self).__init__(doc, **kwds)
+        self._progress = progress
+        self._cancel = cancel
         self._nothing_initially_visible = False
         self._old_current_path = doc.layer_stack.current_path
         self._result_layer = None
@@ -755,8 +860,12 @@ class MergeVisibleLayers (Command):
                 logger.debug("MergeVisibleLayers: no visible layers")
                 return
             # Otherwise, calculate and store the result
-            merged = rootstack.layer_new_merge_visible()
+            merged = rootstack.layer_new_merge_visible(
+                progress=self._progress,
+                cancel=self._cancel,
+            )
             self._result_layer = merged
+            self._progress = self._cancel = None
         # Every time around, remove the layers which were visible,
         # keeping refs to them in _paths_merged order.
         assert self._result_insert_path is not None
@@ -800,8 +909,10 @@ class MergeLayerDown (Command):
 
     display_name = _("Merge Down")
 
-    def __init__(self, doc, **kwds):
+    def __init__(self, doc, progress=None, cancel=None, **kwds):
         super(MergeLayerDown, self).__init__(doc, **kwds)
+        self._progress = progress
+        self._cancel = cancel
         rootstack = doc.layer_stack
         self._upper_path = tuple(rootstack.current_path)
         self._lower_path = rootstack.get_merge_down_target(self._upper_path)
@@ -813,9 +924,14 @@ class MergeLayerDown (Command):
         rootstack = self.doc.layer_stack
         merged = self._merged_layer
         if merged is None:
-            merged = rootstack.layer_new_merge_down(self._upper_path)
+            merged = rootstack.layer_new_merge_down(
+                self._upper_path,
+                progress=self._progress,
+                cancel=self._cancel,
+            )
             assert merged is not None
             self._merged_layer = merged
+            self._progress = self._cancel = None
         self._lower_layer = rootstack.deeppop(self._lower_path)
         self._upper_layer = rootstack.deeppop(self._upper_path)
         rootstack.deepinsert(self._upper_path, merged)
@@ -849,21 +965,29 @@ class NormalizeLayerMode (Command):
 
     display_name = _("Normalize Layer Mode")
 
-    def __init__(self, doc, layer=None, path=None, index=None, **kwds):
+    def __init__(self, doc, layer=None, path=None, index=None,
+                 progress=None, cancel=None, **kwds):
         super(NormalizeLayerMode, self).__init__(doc, **kwds)
         layers = self.doc.layer_stack
         self._path = layers.canonpath(layer=layer, path=path,
                                       index=index, usecurrent=True)
         self._old_layer = None
         self._old_current_path = None
+        self._progress = progress
+        self._cancel = cancel
 
     def redo(self):
         layers = self.doc.layer_stack
-        self._old_current_path = layers.current_path
         parent_path, idx = self._path[:-1], self._path[-1]
         parent = layers.deepget(parent_path)
+        normalized = layers.layer_new_normalized(
+            self._path,
+            progress=self._progress,
+            cancel=self._cancel,
+        )
+        self._progress = self._cancel = None
+        self._old_current_path = layers.current_path
         self._old_layer = parent[idx]
-        normalized = layers.layer_new_normalized(self._path)
         parent[idx] = normalized
         layers.current_path = self._path
 
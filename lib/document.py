@@ -42,12 +42,15 @@ from lib.observable import ObservableDict
 import lib.pixbuf
 from lib.errors import FileHandlingError
 from lib.errors import AllocationError
+from lib.errors import CancelledError
 import lib.idletask
 from lib.gettext import C_
 import lib.xml
 import lib.glib
 import lib.feedback
 import lib.layervis
+import lib.paintworker
+import lib.instrumentation
 from lib.pycompat import unicode
 
 logger = logging.getLogger(__name__)
@@ -310,7 +313,9 @@ class Document (object):
         self._autosave_countdown_id = None
         self._autosave_dirty = False
         if (not painting_only) and self._owns_cache_dir:
-            self._autosave_processor = lib.idletask.Processor()
+            self._autosave_processor = lib.idletask.Processor(
+                name="autosave",
+            )
             self.command_stack.stack_updated += self._command_stack_updated_cb
             self.effective_bbox_changed += self._effective_bbox_changed_cb
 
@@ -324,6 +329,10 @@ class Document (object):
         self._settings = ObservableDict()
         self.sync_pending_changes += self._settings_sync_pending_changes_cb
 
+        #: Optional painting thread, see `threaded_painting`.
+        self._painting_worker = None
+        self.sync_pending_changes += self._painting_sync_pending_changes_cb
+
         #: Sets of layer-views, identified by name.
         self._layer_view_manager = lib.layervis.LayerViewManager(self)
 
@@ -417,6 +426,7 @@ class Document (object):
         This method is called by the main app's exit routine
         after confirmation.
         """
+        self.threaded_painting = False
         self._cleanup_cache_dir()
 
     ## Document-specific settings dict.
@@ -515,6 +525,45 @@ class Document (object):
             self._stop_autosave_writes()
             self._stop_autosave_countdown()
 
+    ## Painting thread
+
+    @property
+    def threaded_painting(self):
+        """Whether brushwork is painted on a dedicated thread
+
+        When this is true, `lib.command.Brushwork` hands stroke events
+        to `painting_worker` instead of painting them straight away.
+        Turning it off waits for the thread to finish its work.
+
+        """
+        return self._painting_worker is not None
+
+    @threaded_painting.setter
+    def threaded_painting(self, enabled):
+        enabled = bool(enabled)
+        if enabled == self.threaded_painting:
+            return
+        if enabled:
+            self._painting_worker = lib.paintworker.PaintingWorker()
+        else:
+            worker = self._painting_worker
+            self._painting_worker = None
+            worker.stop()
+
+    @property
+    def painting_worker(self):
+        """The painting thread's worker, or None
+
+        :rtype: lib.paintworker.PaintingWorker
+
+        """
+        return self._painting_worker
+
+    def _painting_sync_pending_changes_cb(self, doc, **kwargs):
+        """Wait for the painting thread when the doc is synced"""
+        if self._painting_worker is not None:
+            self._painting_worker.flush()
+
     ## Autosave countdown, restarted by activity.
 
     def _restart_autosave_countdown(self):
@@ -574,6 +623,7 @@ class Document (object):
 
     ## Queued autosave writes: low priority & chunked
 
+    @lib.instrumentation.timed("autosave.queue")
     def _queue_autosave_writes(self):
         """Add autosaved backup tasks to the background processor
 
@@ -994,7 +1044,8 @@ class Document (object):
     ## Other painting/drawing
 
     def flood_fill(self, x, y, color, tolerance=0.1,
-                   sample_merged=False, make_new_layer=False):
+                   sample_merged=False, make_new_layer=False,
+                   gap_size=0, offset=0, feather=0):
         """Flood-fills a point on the current layer with a color
 
         :param x: Starting point X coordinate
@@ -1007,6 +1058,9 @@ class Document (object):
         :type sample_merged: bool
         :param make_new_layer: Write output to a new layer on top
         :type make_new_layer: bool
+        :param int gap_size: Close gaps up to this many pixels wide
+        :param int offset: Grow (>0) or shrink (<0) the fill, in pixels
+        :param int feather: Width of the fill's soft edge, in pixels
 
         Filling an infinite canvas requires limits. If the frame is
         enabled, this limits the maximum size of the fill, and filling
@@ -1030,7 +1084,9 @@ class Document (object):
         elif not self.frame_enabled:
             bbox.expandToIncludePoint(x, y)
         cmd = command.FloodFill(self, x, y, color, bbox, tolerance,
-                                sample_merged, make_new_layer)
+                                sample_merged, make_new_layer,
+                                gap_size=gap_size, offset=offset,
+                                feather=feather)
         self.do(cmd)
 
     ## Graphical refresh
@@ -1117,6 +1173,15 @@ class Document (object):
         self.sync_pending_changes()
         self.command_stack.do(cmd)
 
+    def _do_cancellable(self, cmd):
+        """Do a command which may raise CancelledError in its redo()"""
+        try:
+            self.do(cmd)
+        except CancelledError:
+            logger.info("Cancelled: %r", cmd)
+            return False
+        return True
+
     def update_last_command(self, **kwargs):
         """Updates the most recently done command"""
         self.sync_pending_changes()
@@ -1262,12 +1327,27 @@ class Document (object):
             cmd = cmd_class(self, name, layer=layer)
             self.do(cmd)
 
-    def normalize_layer_mode(self):
-        """Normalize current layer's mode and opacity"""
+    def normalize_layer_mode(self, progress=None, cancel=None):
+        """Normalize current layer's mode and opacity
+
+        :param lib.feedback.Progress progress: Unsized feedback object
+        :param threading.Event cancel: Set this to abandon the operation
+        :returns: False if the operation was cancelled
+        :rtype: bool
+
+        This and the other merge methods below do their rendering
+        before anything in the document is changed. If they are
+        cancelled, no command is recorded.
+
+        """
         layers = self.layer_stack
-        self.do(command.NormalizeLayerMode(self, layers.current))
+        cmd = command.NormalizeLayerMode(
+            self, layers.current,
+            progress=progress, cancel=cancel,
+        )
+        return self._do_cancellable(cmd)
 
-    def merge_current_layer_down(self):
+    def merge_current_layer_down(self, progress=None, cancel=None):
         """Merge the current layer into the one below"""
         rootstack = self.layer_stack
         cur_path = rootstack.current_path
@@ -1277,16 +1357,27 @@ class Document (object):
         if dst_path is None:
             logger.info("Merge Down is not possible here")
             return False
-        self.do(command.MergeLayerDown(self))
-        return True
+        cmd = command.MergeLayerDown(
+            self,
+            progress=progress, cancel=cancel,
+        )
+        return self._do_cancellable(cmd)
 
-    def merge_visible_layers(self):
+    def merge_visible_layers(self, progress=None, cancel=None):
         """Merge all visible layers into one & discard originals."""
-        self.do(command.MergeVisibleLayers(self))
+        cmd = command.MergeVisibleLayers(
+            self,
+            progress=progress, cancel=cancel,
+        )
+        return self._do_cancellable(cmd)
 
-    def new_layer_merged_from_visible(self):
+    def new_layer_merged_from_visible(self, progress=None, cancel=None):
         """Combine all visible layers into a new one & keep originals"""
-        self.do(command.NewLayerMergedFromVisible(self))
+        cmd = command.NewLayerMergedFromVisible(
+            self,
+            progress=progress, cancel=cancel,
+        )
+        return self._do_cancellable(cmd)
 
     ## Layer import/export
 
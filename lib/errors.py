@@ -55,4 +55,11 @@ class AllocationError (Exception):
     """
 
 
+class CancelledError (Exception):
+    """Indicates that a long-running operation was cancelled on request
 
+    Operations which accept a cancellation token raise this once they
+    notice the request, without making any lasting changes to the
+    document. Callers should treat it as a normal, silent outcome.
+
+    """
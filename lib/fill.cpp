@@ -19,6 +19,11 @@
 #include <glib.h>
 #include <mypaint-tiled-surface.h>
 
+#include <vector>
+#include <math.h>
+#include <deque>
+#include <map>
+
 
 
 // Pixel access helper for arrays in the tile format.
@@ -370,3 +375,563 @@ tile_flood_fill (PyObject *src, /* readonly HxWx4 array of uint16 */
     return result;
 }
 
+
+
+// Multi-tile fills.
+
+typedef std::pair<int, int> _floodfill_tile_index;
+typedef std::vector<_floodfill_point> _floodfill_seeds;
+typedef std::map<_floodfill_tile_index, _floodfill_seeds> _floodfill_seed_map;
+
+
+// Alpha access helper for single-channel "filled" tiles.
+
+static inline fix15_short_t*
+_floodfill_getalpha(PyArrayObject *array,
+                    const unsigned int x,
+                    const unsigned int y)
+{
+    const unsigned int xstride = PyArray_STRIDE(array, 1);
+    const unsigned int ystride = PyArray_STRIDE(array, 0);
+    return (fix15_short_t*)(PyArray_BYTES(array)
+                            + (y * ystride)
+                            + (x * xstride));
+}
+
+
+// True if the fill should update a pixel with the given src and fill alpha.
+
+static inline bool
+_floodfill_should_fill_alpha(const fix15_short_t src_col[4], // premult
+                             const fix15_short_t filled_alpha,
+                             const fix15_short_t targ_col[4],  // premult
+                             const fix15_t tolerance)
+{
+    if (filled_alpha != 0) {
+        return false;   // already filled
+    }
+    return _floodfill_color_match(src_col, targ_col, tolerance) > 0;
+}
+
+
+// Like _floodfill_should_fill_alpha(), but also respecting a blocked tile.
+
+static inline bool
+_floodfill_should_fill_at(PyArrayObject *src_arr,
+                          PyArrayObject *alpha_arr,
+                          PyArrayObject *blocked_arr,  // or NULL
+                          const int x, const int y,
+                          const fix15_short_t targ_col[4],
+                          const fix15_t tolerance)
+{
+    if (blocked_arr && *_floodfill_getalpha(blocked_arr, x, y) != 0) {
+        return false;
+    }
+    return _floodfill_should_fill_alpha(
+        _floodfill_getpixel(src_arr, x, y),
+        *_floodfill_getalpha(alpha_arr, x, y),
+        targ_col, tolerance
+    );
+}
+
+
+// Scanline flood fill of one tile into a single-channel filled tile.
+//
+// If a blocked tile is given, pixels where it is nonzero are never filled.
+// Overflows into the tiles to the N, E, S and W are appended to the
+// corresponding overflows vectors, as seed positions in those tiles.
+
+static void
+_floodfill_tile_alpha (PyArrayObject *src_arr,
+                       PyArrayObject *alpha_arr,
+                       PyArrayObject *blocked_arr,  // or NULL
+                       const _floodfill_seeds &seeds,
+                       const fix15_short_t targ[4],
+                       const fix15_t tolerance,
+                       const int min_x, const int min_y,
+                       const int max_x, const int max_y,
+                       _floodfill_seeds overflows[4])
+{
+    static const int n = MYPAINT_TILE_SIZE;
+    _floodfill_seeds queue;
+    queue.reserve(seeds.size());
+    for (size_t i = 0; i < seeds.size(); ++i) {
+        const int x = seeds[i].x;
+        const int y = seeds[i].y;
+        if (x < min_x || x > max_x || y < min_y || y > max_y) {
+            continue;
+        }
+        if (_floodfill_should_fill_at(src_arr, alpha_arr, blocked_arr,
+                                      x, y, targ, tolerance))
+        {
+            queue.push_back(seeds[i]);
+        }
+    }
+
+    while (! queue.empty()) {
+        const _floodfill_point pos = queue.back();
+        queue.pop_back();
+        const int x0 = pos.x;
+        const int y = pos.y;
+        // If another seed's run has already reached this pixel,
+        // its whole run has been filled.
+        if (*_floodfill_getalpha(alpha_arr, x0, y) != 0) {
+            continue;
+        }
+        // Westwards loop includes (x0,y), eastwards ignores it.
+        static const int x_delta[] = {-1, 1};
+        static const int x_offset[] = {0, 1};
+        for (int i=0; i<2; ++i) {
+            bool look_above = true;
+            bool look_below = true;
+            for ( int x = x0 + x_offset[i] ;
+                  x >= min_x && x <= max_x ;
+                  x += x_delta[i] )
+            {
+                const fix15_short_t *src_pixel
+                    = _floodfill_getpixel(src_arr, x, y);
+                fix15_short_t *alpha_pixel
+                    = _floodfill_getalpha(alpha_arr, x, y);
+                if (x != x0) {
+                    if (! _floodfill_should_fill_at(src_arr, alpha_arr,
+                                                    blocked_arr, x, y,
+                                                    targ, tolerance))
+                    {
+                        break;
+                    }
+                }
+                fix15_t alpha = fix15_one;
+                if (tolerance > 0) {
+                    alpha = _floodfill_color_match(targ, src_pixel,
+                                                   tolerance);
+                    // Zero alpha would mean "not yet filled"
+                    if (alpha == 0) {
+                        alpha = 0x0001;
+                    }
+                }
+                *alpha_pixel = alpha;
+                // Scanline: queue one seed per matching run above & below
+                if (y > min_y) {
+                    const bool match_above = _floodfill_should_fill_at(
+                        src_arr, alpha_arr, blocked_arr, x, y-1,
+                        targ, tolerance
+                    );
+                    if (match_above && look_above) {
+                        _floodfill_point p = {(unsigned int)x,
+                                              (unsigned int)(y-1)};
+                        queue.push_back(p);
+                    }
+                    look_above = ! match_above;
+                }
+                else if (y == 0) {
+                    _floodfill_point p = {(unsigned int)x,
+                                          (unsigned int)(n-1)};
+                    overflows[0].push_back(p);
+                }
+                if (y < max_y) {
+                    const bool match_below = _floodfill_should_fill_at(
+                        src_arr, alpha_arr, blocked_arr, x, y+1,
+                        targ, tolerance
+                    );
+                    if (match_below && look_below) {
+                        _floodfill_point p = {(unsigned int)x,
+                                              (unsigned int)(y+1)};
+                        queue.push_back(p);
+                    }
+                    look_below = ! match_below;
+                }
+                else if (y == n-1) {
+                    _floodfill_point p = {(unsigned int)x, 0};
+                    overflows[2].push_back(p);
+                }
+                if (x == 0) {
+                    _floodfill_point p = {(unsigned int)(n-1),
+                                          (unsigned int)y};
+                    overflows[3].push_back(p);
+                }
+                else if (x == n-1) {
+                    _floodfill_point p = {0, (unsigned int)y};
+                    overflows[1].push_back(p);
+                }
+            }
+        }
+    }
+}
+
+
+// Floor division, for tile indices of negative pixel coordinates.
+
+static inline int
+_floodfill_floordiv(const int a, const int b)
+{
+    return (a >= 0) ? (a / b) : -((-a + b - 1) / b);
+}
+
+
+// Parses a list of (x, y) tuples onto the end of a seeds vector.
+// Returns false, with an exception set, if that's not possible.
+
+static bool
+_floodfill_parse_seeds(PyObject *seq, _floodfill_seeds &seeds)
+{
+    static const int n = MYPAINT_TILE_SIZE;
+    PyObject *fast = PySequence_Fast(seq, "seeds must be sequences");
+    if (! fast) {
+        return false;
+    }
+    const Py_ssize_t len = PySequence_Fast_GET_SIZE(fast);
+    for (Py_ssize_t i = 0; i < len; ++i) {
+        PyObject *seed_tup = PySequence_Fast_GET_ITEM(fast, i);
+        int x = 0;
+        int y = 0;
+        if (! PyArg_ParseTuple(seed_tup, "ii", &x, &y)) {
+            Py_DECREF(fast);
+            return false;
+        }
+        _floodfill_point p = {(unsigned int)MAX(0, MIN(x, n-1)),
+                              (unsigned int)MAX(0, MIN(y, n-1))};
+        seeds.push_back(p);
+    }
+    Py_DECREF(fast);
+    return true;
+}
+
+
+PyObject *
+flood_fill_tiles (PyObject *src_tiles, /* {(tx, ty): HxWx4 uint16} */
+                  PyObject *filled, /* {(tx, ty): HxW uint16}, updated */
+                  PyObject *seeds, /* {(tx, ty): [(x, y), ...]} */
+                  PyObject *blocked, /* {(tx, ty): HxW uint16}, or None */
+                  int targ_r, int targ_g, int targ_b, int targ_a, //premult
+                  int bbox_x, int bbox_y, int bbox_w, int bbox_h,
+                  double tol) /* [0..1] */
+{
+    static const int n = MYPAINT_TILE_SIZE;
+    if (! (PyDict_Check(src_tiles) && PyDict_Check(filled)
+           && PyDict_Check(seeds)))
+    {
+        PyErr_SetString(PyExc_TypeError,
+                        "src_tiles, filled and seeds must be dicts");
+        return NULL;
+    }
+    if (blocked == Py_None) {
+        blocked = NULL;
+    }
+    else if (! PyDict_Check(blocked)) {
+        PyErr_SetString(PyExc_TypeError, "blocked must be a dict or None");
+        return NULL;
+    }
+    const fix15_t tolerance = (fix15_t)(  MIN(1.0, MAX(0.0, tol))
+                                        * fix15_one);
+    const fix15_short_t targ[4] = {
+            fix15_short_clamp(targ_r), fix15_short_clamp(targ_g),
+            fix15_short_clamp(targ_b), fix15_short_clamp(targ_a)
+        };
+    if (bbox_w <= 0 || bbox_h <= 0) {
+        return PyDict_New();
+    }
+    // Limits of the fill, in tiles and pixels
+    const int bbox_x1 = bbox_x + bbox_w - 1;
+    const int bbox_y1 = bbox_y + bbox_h - 1;
+    const int min_tx = _floodfill_floordiv(bbox_x, n);
+    const int min_ty = _floodfill_floordiv(bbox_y, n);
+    const int max_tx = _floodfill_floordiv(bbox_x1, n);
+    const int max_ty = _floodfill_floordiv(bbox_y1, n);
+
+    // Pending seeds, merged per tile, and the order to visit tiles in.
+    // A tile is in the queue if and only if it has pending seeds.
+    _floodfill_seed_map pending;
+    _floodfill_seed_map deferred;
+    std::deque<_floodfill_tile_index> queue;
+
+    PyObject *key = NULL;
+    PyObject *value = NULL;
+    Py_ssize_t dict_pos = 0;
+    while (PyDict_Next(seeds, &dict_pos, &key, &value)) {
+        int tx = 0;
+        int ty = 0;
+        if (! PyArg_ParseTuple(key, "ii", &tx, &ty)) {
+            return NULL;
+        }
+        if (tx < min_tx || tx > max_tx || ty < min_ty || ty > max_ty) {
+            continue;
+        }
+        const _floodfill_tile_index ti(tx, ty);
+        if (pending.find(ti) == pending.end()) {
+            queue.push_back(ti);
+        }
+        if (! _floodfill_parse_seeds(value, pending[ti])) {
+            return NULL;
+        }
+    }
+
+    while (! queue.empty()) {
+        const _floodfill_tile_index ti = queue.front();
+        queue.pop_front();
+        _floodfill_seeds tile_seeds;
+        tile_seeds.swap(pending[ti]);
+        pending.erase(ti);
+        const int tx = ti.first;
+        const int ty = ti.second;
+
+        PyObject *tile_key = Py_BuildValue("ii", tx, ty);
+        PyObject *src = PyDict_GetItem(src_tiles, tile_key);  // borrowed
+        if (! src) {
+            // Fill can't proceed here yet: defer to the caller.
+            _floodfill_seeds &d = deferred[ti];
+            d.insert(d.end(), tile_seeds.begin(), tile_seeds.end());
+            Py_DECREF(tile_key);
+            continue;
+        }
+        PyObject *alpha = PyDict_GetItem(filled, tile_key);  // borrowed
+        if (! alpha) {
+            npy_intp dims[] = {n, n};
+            PyObject *new_alpha = PyArray_ZEROS(2, dims, NPY_UINT16, 0);
+            if (! new_alpha) {
+                Py_DECREF(tile_key);
+                return NULL;
+            }
+            PyDict_SetItem(filled, tile_key, new_alpha);
+            Py_DECREF(new_alpha);
+            alpha = new_alpha;  // kept alive by the dict
+        }
+        PyObject *blocked_tile = NULL;  // borrowed
+        if (blocked) {
+            blocked_tile = PyDict_GetItem(blocked, tile_key);
+        }
+        Py_DECREF(tile_key);
+#ifdef HEAVY_DEBUG
+        assert(PyArray_Check(src));
+        assert(PyArray_Check(alpha));
+        assert(PyArray_DIM((PyArrayObject *)src, 0) == MYPAINT_TILE_SIZE);
+        assert(PyArray_DIM((PyArrayObject *)src, 1) == MYPAINT_TILE_SIZE);
+        assert(PyArray_DIM((PyArrayObject *)src, 2) == 4);
+        assert(PyArray_TYPE((PyArrayObject *)src) == NPY_UINT16);
+        assert(PyArray_DIM((PyArrayObject *)alpha, 0) == MYPAINT_TILE_SIZE);
+        assert(PyArray_DIM((PyArrayObject *)alpha, 1) == MYPAINT_TILE_SIZE);
+        assert(PyArray_TYPE((PyArrayObject *)alpha) == NPY_UINT16);
+#endif
+
+        // Pixel limits within this tile vary at the edges of the bbox
+        const int min_x = (tx == min_tx) ? (bbox_x - tx*n) : 0;
+        const int min_y = (ty == min_ty) ? (bbox_y - ty*n) : 0;
+        const int max_x = (tx == max_tx) ? (bbox_x1 - tx*n) : n-1;
+        const int max_y = (ty == max_ty) ? (bbox_y1 - ty*n) : n-1;
+
+        _floodfill_seeds overflows[4];
+        _floodfill_tile_alpha(
+            (PyArrayObject *)src, (PyArrayObject *)alpha,
+            (PyArrayObject *)blocked_tile,
+            tile_seeds, targ, tolerance,
+            min_x, min_y, max_x, max_y,
+            overflows
+        );
+
+        // Merge overflows into the seeds for the neighbouring tiles
+        static const int dtx[] = {0, 1, 0, -1};  // N E S W
+        static const int dty[] = {-1, 0, 1, 0};
+        for (int i = 0; i < 4; ++i) {
+            if (overflows[i].empty()) {
+                continue;
+            }
+            const int ntx = tx + dtx[i];
+            const int nty = ty + dty[i];
+            if (ntx < min_tx || ntx > max_tx || nty < min_ty || nty > max_ty) {
+                continue;
+            }
+            const _floodfill_tile_index nti(ntx, nty);
+            _floodfill_seed_map::iterator d = deferred.find(nti);
+            if (d != deferred.end()) {
+                d->second.insert(d->second.end(),
+                                 overflows[i].begin(), overflows[i].end());
+                continue;
+            }
+            if (pending.find(nti) == pending.end()) {
+                queue.push_back(nti);
+            }
+            _floodfill_seeds &p = pending[nti];
+            p.insert(p.end(), overflows[i].begin(), overflows[i].end());
+        }
+    }
+
+    // Return what's left over for the caller to feed back in
+    PyObject *result = PyDict_New();
+    for (_floodfill_seed_map::iterator d = deferred.begin();
+         d != deferred.end(); ++d)
+    {
+        const _floodfill_seeds &d_seeds = d->second;
+        PyObject *seed_list = PyList_New(d_seeds.size());
+        for (size_t i = 0; i < d_seeds.size(); ++i) {
+            PyList_SET_ITEM(seed_list, i,
+                            Py_BuildValue("ii", d_seeds[i].x, d_seeds[i].y));
+        }
+        PyObject *tile_key = Py_BuildValue("ii", d->first.first,
+                                                 d->first.second);
+        PyDict_SetItem(result, tile_key, seed_list);
+        Py_DECREF(tile_key);
+        Py_DECREF(seed_list);
+    }
+    return result;
+}
+
+
+// Fill morphology support.
+
+void
+tile_fill_match_alpha (PyObject *src,   /* readonly HxWx4 array of uint16 */
+                       PyObject *dst,   /* output HxW array of uint16 */
+                       int targ_r, int targ_g, int targ_b, int targ_a,
+                       double tol)      /* [0..1] */
+{
+    static const int n = MYPAINT_TILE_SIZE;
+    const fix15_t tolerance = (fix15_t)(  MIN(1.0, MAX(0.0, tol))
+                                        * fix15_one);
+    const fix15_short_t targ[4] = {
+            fix15_short_clamp(targ_r), fix15_short_clamp(targ_g),
+            fix15_short_clamp(targ_b), fix15_short_clamp(targ_a)
+        };
+    PyArrayObject *src_arr = ((PyArrayObject *)src);
+    PyArrayObject *dst_arr = ((PyArrayObject *)dst);
+#ifdef HEAVY_DEBUG
+    assert(PyArray_Check(src));
+    assert(PyArray_Check(dst));
+    assert(PyArray_DIM(src_arr, 0) == MYPAINT_TILE_SIZE);
+    assert(PyArray_DIM(src_arr, 1) == MYPAINT_TILE_SIZE);
+    assert(PyArray_DIM(src_arr, 2) == 4);
+    assert(PyArray_DIM(dst_arr, 0) == MYPAINT_TILE_SIZE);
+    assert(PyArray_DIM(dst_arr, 1) == MYPAINT_TILE_SIZE);
+    assert(PyArray_TYPE(src_arr) == NPY_UINT16);
+    assert(PyArray_TYPE(dst_arr) == NPY_UINT16);
+#endif
+    for (int y = 0; y < n; ++y) {
+        for (int x = 0; x < n; ++x) {
+            const fix15_short_t *src_pixel = _floodfill_getpixel(src_arr,
+                                                                 x, y);
+            *_floodfill_getalpha(dst_arr, x, y)
+                = _floodfill_color_match(targ, src_pixel, tolerance);
+        }
+    }
+}
+
+
+// One-dimensional squared Euclidean distance transform of a sampled
+// function (Felzenszwalb & Huttenlocher, 2012).
+
+static void
+_floodfill_edt_1d (const double *f, double *d, const int len,
+                   int *v, double *z)
+{
+    static const double inf = 1e30;
+    int k = 0;
+    v[0] = 0;
+    z[0] = -inf;
+    z[1] = inf;
+    for (int q = 1; q < len; ++q) {
+        double s = 0;
+        while (true) {
+            const int p = v[k];
+            s = ((f[q] + q*q) - (f[p] + p*p)) / (2*q - 2*p);
+            if (s > z[k]) {   // always true for k == 0
+                break;
+            }
+            --k;
+        }
+        ++k;
+        v[k] = q;
+        z[k] = s;
+        z[k+1] = inf;
+    }
+    k = 0;
+    for (int q = 0; q < len; ++q) {
+        while (z[k+1] < q) {
+            ++k;
+        }
+        const int p = v[k];
+        d[q] = (q-p)*(q-p) + f[p];
+    }
+}
+
+
+void
+tile_distance_field (PyObject *mask_tiles, /* 9 HxW uint16, rows from NW */
+                     PyObject *dst,        /* output HxW array of float32 */
+                     int radius,
+                     bool invert)
+{
+    static const int n = MYPAINT_TILE_SIZE;
+#ifdef HEAVY_DEBUG
+    assert(PySequence_Check(mask_tiles));
+    assert(PySequence_Size(mask_tiles) == 9);
+    assert(PyArray_Check(dst));
+    assert(PyArray_TYPE((PyArrayObject *)dst) == NPY_FLOAT32);
+#endif
+    radius = MAX(0, MIN(radius, n));
+    PyArrayObject *masks[9];
+    for (int i = 0; i < 9; ++i) {
+        PyObject *item = PySequence_GetItem(mask_tiles, i);
+        masks[i] = (PyArrayObject *)item;
+        Py_DECREF(item);  // kept alive by the sequence
+#ifdef HEAVY_DEBUG
+        assert(PyArray_Check(item));
+        assert(PyArray_TYPE(masks[i]) == NPY_UINT16);
+#endif
+    }
+    PyArrayObject *dst_arr = (PyArrayObject *)dst;
+
+    // Work in a window extending radius pixels beyond the central tile.
+    // Targets further out than that can't affect the clamped result.
+    const int w = n + 2*radius;
+    const int off = n - radius;   // window origin in the 3x3 tile block
+    const double far = 4.0 * w * w;  // "no target": beyond any radius
+    std::vector<double> cols((size_t)n * w);  // [y][x], central rows only
+    std::vector<double> f(w);
+    std::vector<double> d(w);
+    std::vector<int> v(w);
+    std::vector<double> z(w + 1);
+
+    // Vertical pass: squared distance to the nearest target in each column
+    for (int wx = 0; wx < w; ++wx) {
+        const int bx = off + wx;
+        const int tile_col = bx / n;
+        const int px = bx % n;
+        int last = -w;   // window row of the last target seen
+        std::vector<int> down(w);
+        for (int wy = 0; wy < w; ++wy) {
+            const int by = off + wy;
+            PyArrayObject *m = masks[(by / n) * 3 + tile_col];
+            const bool is_target
+                = ((*_floodfill_getalpha(m, px, by % n)) != 0) == invert;
+            if (is_target) {
+                last = wy;
+            }
+            down[wy] = wy - last;
+        }
+        last = 2*w;
+        for (int wy = w-1; wy >= 0; --wy) {
+            if (down[wy] == 0) {
+                last = wy;
+            }
+            const int dist = MIN(down[wy], last - wy);
+            if (wy >= radius && wy < radius + n) {
+                cols[(size_t)(wy - radius) * w + wx]
+                    = (dist >= w) ? far : (double)dist * dist;
+            }
+        }
+    }
+
+    // Horizontal pass over the central rows
+    const double max_d = radius;
+    for (int y = 0; y < n; ++y) {
+        for (int wx = 0; wx < w; ++wx) {
+            f[wx] = cols[(size_t)y * w + wx];
+        }
+        _floodfill_edt_1d(&f[0], &d[0], w, &v[0], &z[0]);
+        for (int x = 0; x < n; ++x) {
+            const double dist = sqrt(d[x + radius]);
+            float *p = (float *)(PyArray_BYTES(dst_arr)
+                                 + y * PyArray_STRIDE(dst_arr, 0)
+                                 + x * PyArray_STRIDE(dst_arr, 1));
+            *p = (float)MIN(dist, max_d);
+        }
+    }
+}
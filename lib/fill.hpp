@@ -30,5 +30,55 @@ tile_flood_fill (PyObject *src,     // readonly HxWx4 array of uint16
                  double tolerance);       // [0..1]
 
 
+// Flood-fills as many tiles as possible in a single call.
+//
+// Fill state is kept in compact single-channel "filled" tiles: HxW arrays of
+// uint16 holding the fill's alpha for each pixel. Missing ones are created
+// and added to `filled` as the fill reaches new tiles. Seeds are merged per
+// tile, and tiles are processed in FIFO order.
+//
+// Fills can only proceed into tiles present in `src_tiles`. Returns a dict
+// {(tx, ty): [(x1, y1), ...]} of the seeds which reached tiles not in
+// `src_tiles`. Feed this back in as `seeds`, along with the source tiles
+// it needs, to continue the fill. The fill is complete when the returned
+// dict is empty.
+//
+// Pixels are never filled where a tile in `blocked` is nonzero.
+
+PyObject *
+flood_fill_tiles (PyObject *src_tiles,  // dict {(tx, ty): HxWx4 uint16 array}
+                  PyObject *filled,     // dict {(tx, ty): HxW uint16 array}
+                  PyObject *seeds,      // dict {(tx, ty): [(x, y), ...]}
+                  PyObject *blocked,    // dict {(tx, ty): HxW uint16}, or None
+                  int targ_r, int targ_g, int targ_b, int targ_a, //premult
+                  int bbox_x, int bbox_y, int bbox_w, int bbox_h,
+                  double tolerance);    // [0..1]
+
+
+// Writes the fill alpha each pixel of a tile would get, were it reached.
+// Zero means the pixel does not match the target colour.
+
+void
+tile_fill_match_alpha (PyObject *src,   // readonly HxWx4 array of uint16
+                       PyObject *dst,   // output HxW array of uint16
+                       int targ_r, int targ_g, int targ_b, int targ_a,
+                       double tolerance);  // [0..1]
+
+
+// Euclidean distance field for a tile, looking across its borders.
+//
+// The mask is given as a 3x3 block of HxW uint16 tiles, in rows from the
+// northwest, with the tile of interest in the middle. Writes the distance
+// of each of its pixels to the nearest "target" pixel, clamped to radius.
+// Targets are the zero pixels of the mask, or the nonzero ones if invert
+// is true. The radius can be at most MYPAINT_TILE_SIZE.
+
+void
+tile_distance_field (PyObject *mask_tiles,  // sequence of 9 arrays
+                     PyObject *dst,         // output HxW array of float32
+                     int radius,
+                     bool invert);
+
+
 #endif //__HAVE_FILL_HPP
 
@@ -16,6 +16,8 @@ import collections
 
 from gi.repository import GLib
 
+import lib.instrumentation
+
 
 class Processor (object):
     """Queue of low priority tasks for background processing
@@ -27,12 +29,19 @@ class Processor (object):
 
     """
 
-    def __init__(self, priority=GLib.PRIORITY_LOW):
-        """Initialize, specifying a priority"""
+    def __init__(self, priority=GLib.PRIORITY_LOW, name="tasks"):
+        """Initialize, specifying a priority
+
+        :param int priority: GLib priority for the idle callback
+        :param str name: Names the processor's timer, which measures
+            each task call as "idle.<name>" (see lib.instrumentation).
+
+        """
         object.__init__(self)
         self._queue = collections.deque()
         self._priority = priority
         self._idle_id = None
+        self._timer = lib.instrumentation.timer("idle." + name)
 
     def has_work(self):
         return len(self._queue) > 0
@@ -81,7 +90,9 @@ class Processor (object):
             return False
         if len(self._queue) > 0:
             func, args, kwargs = self._queue[0]
+            t0 = self._timer.start()
             func_done = bool(func(*args, **kwargs))
+            self._timer.stop(t0)
             if not func_done:
                 self._queue.popleft()
         if len(self._queue) == 0:
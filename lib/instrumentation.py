@@ -0,0 +1,478 @@
+# This file is part of MyPaint.
+# Copyright (C) 2018 by the MyPaint Development Team
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+
+"""Lightweight timers, counters and histograms for the hot paths
+
+cProfile (see gui/profiling.py) shows where the time goes overall, but
+it slows everything down, and it can't say how many tiles are rendered
+per second, or how often the render cache is hit. The named metrics
+here are cheap enough to leave in the rendering, painting and idle
+processing code permanently.
+
+Metrics are created once, usually at module level, and updated from
+the code being measured::
+
+    _RENDER_TIMER = lib.instrumentation.timer("layers.render")
+    _TILES_COUNTER = lib.instrumentation.counter("layers.render.tiles")
+
+    def render(self, tiles):
+        t0 = _RENDER_TIMER.start()
+        ...
+        _TILES_COUNTER.add(len(tiles))
+        _RENDER_TIMER.stop(t0)
+
+Collection is off by default. While it is off, updates return after
+testing a single flag, and `Timer.start()` doesn't read the clock.
+Code inside very tight loops can test the module's `enabled` flag
+itself, and skip the method calls too.
+
+Collection is switched on by the launch script when the environment
+variable ``MYPAINT_INSTRUMENTATION`` is set. Its value names the JSON
+file the metrics are written to when the app exits, or use "-" to
+print a summary to stderr instead. It can also be started from the
+Help→Debug menu.
+
+This module must only import from the standard library.
+
+"""
+
+## Imports
+
+from __future__ import division, print_function
+
+import os
+import sys
+import time
+import json
+import bisect
+import atexit
+import functools
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+## Module constants
+
+#: Environment variable which switches on collection at startup
+ENV_VAR = "MYPAINT_INSTRUMENTATION"
+
+#: Default histogram bucket upper bounds for timers, in seconds
+TIMER_BOUNDS = (
+    0.0005, 0.001, 0.002, 0.005, 0.01, 0.02,
+    0.05, 0.1, 0.2, 0.5, 1.0,
+)
+
+#: Whether metrics are being collected. Read-only: use `enable()`.
+enabled = False
+
+_clock = getattr(time, "perf_counter", time.time)
+_lock = threading.Lock()
+_metrics = {}  # {name: metric}
+_start_time = None  # collection start, by _clock()
+
+
+## Class defs
+
+
+class Counter (object):
+    """A running total, such as a number of tiles or events
+
+    >>> c = Counter("example.count")
+    >>> c.add(10)
+    >>> c.value
+    0
+    >>> enable()
+    >>> c.add(10)
+    >>> c.add()
+    >>> c.value
+    11
+    >>> disable()
+
+    """
+
+    def __init__(self, name):
+        super(Counter, self).__init__()
+        self.name = name
+        self.value = 0
+
+    def add(self, n=1):
+        """Add to the total, if collecting"""
+        if not enabled:
+            return
+        with _lock:
+            self.value += n
+
+    def reset(self):
+        self.value = 0
+
+    def get_stats(self, elapsed):
+        """Get the total, and its rate per second, as a dict"""
+        rate = (self.value / elapsed) if elapsed > 0 else 0.0
+        return {"value": self.value, "rate": rate}
+
+
+class Histogram (object):
+    """Counts of values falling into fixed buckets
+
+    >>> h = Histogram("example.sizes", bounds=(1, 10, 100))
+    >>> enable()
+    >>> for v in (0, 1, 5, 50, 500, 5000):
+    ...     h.observe(v)
+    >>> disable()
+    >>> h.counts
+    [2, 1, 1, 2]
+
+    Each bucket counts the values up to and including its bound, and
+    above the previous one. The last bucket counts values above the
+    highest bound.
+
+    """
+
+    def __init__(self, name, bounds):
+        super(Histogram, self).__init__()
+        self.name = name
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)
+
+    def observe(self, value):
+        """Count a value, if collecting"""
+        if not enabled:
+            return
+        i = bisect.bisect_left(self.bounds, value)
+        with _lock:
+            self.counts[i] += 1
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+
+    def get_stats(self, elapsed):
+        """Get the bucket bounds and counts, as a dict"""
+        return {"bounds": list(self.bounds), "counts": list(self.counts)}
+
+
+class Timer (object):
+    """Durations of an operation, such as a render or an idle task
+
+    >>> t = Timer("example.time")
+    >>> t.start() is None
+    True
+    >>> enable()
+    >>> t0 = t.start()
+    >>> t.stop(t0)
+    >>> t.record(0.25)
+    >>> disable()
+    >>> t.count, t.max
+    (2, 0.25)
+
+    Timers keep a histogram of their durations, so that the odd slow
+    frame is visible even when the mean time is low.
+
+    """
+
+    def __init__(self, name, bounds=TIMER_BOUNDS):
+        super(Timer, self).__init__()
+        self.name = name
+        self.histogram = Histogram(name, bounds)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def start(self):
+        """Start timing one call
+
+        :returns: a token for `stop()`, or None if not collecting
+
+        """
+        if not enabled:
+            return None
+        return _clock()
+
+    def stop(self, t0):
+        """Finish timing one call
+
+        :param t0: The token returned by `start()`
+
+        """
+        if t0 is None:
+            return
+        self.record(_clock() - t0)
+
+    def record(self, duration):
+        """Record a duration measured elsewhere, if collecting
+
+        :param float duration: Time taken, in seconds
+
+        """
+        if not enabled:
+            return
+        i = bisect.bisect_left(self.histogram.bounds, duration)
+        with _lock:
+            self.count += 1
+            self.total += duration
+            if duration > self.max:
+                self.max = duration
+            self.histogram.counts[i] += 1
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram.reset()
+
+    def get_stats(self, elapsed):
+        """Get the call count, times, and call rate, as a dict"""
+        stats = self.histogram.get_stats(elapsed)
+        stats.update({
+            "count": self.count,
+            "total": self.total,
+            "mean": (self.total / self.count) if self.count else 0.0,
+            "max": self.max,
+            "rate": (self.count / elapsed) if elapsed > 0 else 0.0,
+        })
+        return stats
+
+
+## Metric registry
+
+
+def _get_metric(cls, name, *args):
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = cls(name, *args)
+            _metrics[name] = metric
+    if not isinstance(metric, cls):
+        raise TypeError("Metric %r is a %s, not a %s" % (
+            name, type(metric).__name__, cls.__name__,
+        ))
+    return metric
+
+
+def counter(name):
+    """Get the named counter, creating it if needed
+
+    :param str name: Dotted name, subsystem first
+    :rtype: Counter
+
+    """
+    return _get_metric(Counter, name)
+
+
+def histogram(name, bounds):
+    """Get the named histogram, creating it if needed
+
+    :param str name: Dotted name, subsystem first
+    :param tuple bounds: Bucket upper bounds, used if it is new
+    :rtype: Histogram
+
+    """
+    return _get_metric(Histogram, name, bounds)
+
+
+def timer(name):
+    """Get the named timer, creating it if needed
+
+    :param str name: Dotted name, subsystem first
+    :rtype: Timer
+
+    >>> timer("example.time") is timer("example.time")
+    True
+
+    """
+    return _get_metric(Timer, name)
+
+
+def timed(name):
+    """Decorator: times every call of a function with a named timer
+
+    >>> @timed("example.decorated")
+    ... def f(x):
+    ...     return x + 1
+    >>> enable()
+    >>> f(1)
+    2
+    >>> disable()
+    >>> timer("example.decorated").count
+    1
+
+    The wrapper costs an extra call even when not collecting, so use
+    `Timer.start()` and `Timer.stop()` inline in the hottest code.
+
+    """
+    t = timer(name)
+
+    def _decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            t0 = _clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                t.record(_clock() - t0)
+        return _wrapper
+
+    return _decorator
+
+
+## Collection control
+
+
+def enable():
+    """Start collecting"""
+    global enabled, _start_time
+    if _start_time is None:
+        _start_time = _clock()
+    enabled = True
+
+
+def disable():
+    """Stop collecting. The metrics keep their values."""
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Zero all the metrics, and restart the collection period"""
+    global _start_time
+    with _lock:
+        for metric in _metrics.values():
+            metric.reset()
+        _start_time = _clock() if enabled else None
+
+
+## Reporting
+
+
+def snapshot():
+    """Get the current values of all the metrics
+
+    :returns: A JSON-serializable dict. "elapsed" is the length of the
+        collection period in seconds, which the rates are based on.
+    :rtype: dict
+
+    Metrics which haven't been updated are left out.
+
+    >>> reset()
+    >>> c = counter("example.snapshot")
+    >>> enable()
+    >>> c.add(3)
+    >>> disable()
+    >>> snapshot()["counters"]["example.snapshot"]["value"]
+    3
+
+    """
+    elapsed = 0.0
+    if _start_time is not None:
+        elapsed = _clock() - _start_time
+    result = {
+        "elapsed": elapsed,
+        "counters": {},
+        "timers": {},
+        "histograms": {},
+    }
+    sections = (
+        (Counter, "counters", lambda m: m.value),
+        (Timer, "timers", lambda m: m.count),
+        (Histogram, "histograms", lambda m: sum(m.counts)),
+    )
+    with _lock:
+        metrics = list(_metrics.values())
+    for metric in metrics:
+        for cls, section, is_used in sections:
+            if type(metric) is cls:
+                if is_used(metric):
+                    result[section][metric.name] = metric.get_stats(elapsed)
+                break
+    return result
+
+
+def format_summary(snap):
+    """Format a snapshot as lines of text
+
+    :param dict snap: Metrics, as returned by `snapshot()`
+    :rtype: str
+
+    """
+    lines = ["Metrics for the last %0.1fs:" % (snap["elapsed"],)]
+    timers = snap["timers"]
+    if timers:
+        lines.append("  %-32s %8s %8s %9s %9s" % (
+            "timer", "calls", "per sec", "mean ms", "max ms",
+        ))
+        for name in sorted(timers):
+            s = timers[name]
+            lines.append("  %-32s %8d %8.1f %9.3f %9.3f" % (
+                name, s["count"], s["rate"],
+                s["mean"] * 1000, s["max"] * 1000,
+            ))
+    counters = snap["counters"]
+    if counters:
+        lines.append("  %-32s %8s %8s" % ("counter", "total", "per sec"))
+        for name in sorted(counters):
+            s = counters[name]
+            lines.append("  %-32s %8d %8.1f" % (name, s["value"], s["rate"]))
+    for name in sorted(snap["histograms"]):
+        s = snap["histograms"][name]
+        buckets = ["<=%g: %d" % b for b in zip(s["bounds"], s["counts"])]
+        buckets.append(">%g: %d" % (s["bounds"][-1], s["counts"][-1]))
+        lines.append("  %s: %s" % (name, ", ".join(buckets)))
+    return "\n".join(lines)
+
+
+def dump(output):
+    """Write a snapshot to a file as JSON, or summarize it
+
+    :param str output: File to write to, or "-" for stderr
+
+    """
+    snap = snapshot()
+    if output == "-":
+        print(format_summary(snap), file=sys.stderr)
+        return
+    tmp_output = output + ".tmp"
+    with open(tmp_output, "w") as fp:
+        json.dump(snap, fp, indent=2, sort_keys=True)
+    if os.path.exists(output) and sys.platform == "win32":
+        os.remove(output)
+    os.rename(tmp_output, output)
+
+
+def start(output):
+    """Start collecting, and dump the metrics when the app exits
+
+    :param str output: File to write to, or "-" for stderr
+
+    """
+    enable()
+    atexit.register(_dump_at_exit, output)
+
+
+def _dump_at_exit(output):
+    try:
+        dump(output)
+    except (IOError, OSError):
+        logger.exception("Failed to write metrics to %r", output)
+
+
+## Module testing
+
+
+def _test():
+    """Run doctest strings"""
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    _test()
@@ -682,7 +682,8 @@ class LayerBase (Renderable):
 
     ## Flood fill
 
-    def flood_fill(self, x, y, color, bbox, tolerance, dst_layer=None):
+    def flood_fill(self, x, y, color, bbox, tolerance, dst_layer=None,
+                   gap_size=0, offset=0, feather=0):
         """Fills a point on the surface with a color
 
         See PaintingLayer.flood_fill() for parameters and semantics.
@@ -906,9 +907,11 @@ class LayerBase (Renderable):
         """
         return self._thumbnail
 
-    def update_thumbnail(self):
+    def update_thumbnail(self, dirty=None):
         """Safely updates the cached preview thumbnail.
 
+        :param lib.helpers.Rect dirty: Changed area (None: everything)
+
         This method updates self.thumbnail using render_thumbnail() and
         the data bounding box, and eats any NotImplementedErrors.
 
@@ -922,6 +925,7 @@ class LayerBase (Renderable):
             self._thumbnail = self.render_thumbnail(
                 self.get_bbox(),
                 alpha=True,
+                dirty=dirty,
             )
         except NotImplementedError:
             self._thumbnail = None
@@ -956,6 +960,20 @@ class LayerBase (Renderable):
         """
         pass
 
+    ## Mipmaps
+
+    def build_mipmaps(self, limit=None):
+        """Rebuild some outdated downscaled copies of the layer's data
+
+        :param int limit: Max changed tiles to process (None: default)
+        :returns: True if there is more to do
+        :rtype: bool
+
+        This is called from a background task after the layer's content
+        changes. The base implementation does nothing.
+        """
+        return False
+
 
 class _StubLayerBase (LayerBase):
     """An instantiable (but broken) LayerBase, for testing."""
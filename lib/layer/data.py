@@ -39,6 +39,7 @@ import lib.layer.error
 import lib.autosave
 import lib.xml
 import lib.feedback
+import lib.instrumentation
 from . import rendering
 from lib.pycompat import PY3
 from lib.pycompat import unicode
@@ -52,6 +53,10 @@ else:
 
 logger = logging.getLogger(__name__)
 
+# Stroke painting metrics, see lib.instrumentation
+_STROKE_TIMER = lib.instrumentation.timer("stroke.paint")
+_STROKE_EVENTS = lib.instrumentation.counter("stroke.events")
+
 
 ## Base classes
 
@@ -324,7 +329,8 @@ class SurfaceBackedLayer (core.LayerBase, lib.autosave.Autosaveable):
 
     ## Flood fill
 
-    def flood_fill(self, x, y, color, bbox, tolerance, dst_layer=None):
+    def flood_fill(self, x, y, color, bbox, tolerance, dst_layer=None,
+                   gap_size=0, offset=0, feather=0):
         """Fills a point on the surface with a color
 
         See `PaintingLayer.flood_fill() for parameters and semantics. This
@@ -535,6 +541,14 @@ class SurfaceBackedLayer (core.LayerBase, lib.autosave.Autosaveable):
         removed, total = self._surface.remove_empty_tiles()
         return (removed, total)
 
+    ## Mipmaps
+
+    def build_mipmaps(self, limit=None):
+        """Rebuild mipmaps for changed tiles of the surface (batched)"""
+        if limit is None:
+            return self._surface.build_mipmaps()
+        return self._surface.build_mipmaps(limit=limit)
+
 
 class SurfaceBackedLayerMove (object):
     """Move object wrapper for surface-backed layers
@@ -1289,7 +1303,8 @@ class SimplePaintingLayer (SurfaceBackedLayer):
         """True if this layer currently accepts flood fill"""
         return not self.locked
 
-    def flood_fill(self, x, y, color, bbox, tolerance, dst_layer=None):
+    def flood_fill(self, x, y, color, bbox, tolerance, dst_layer=None,
+                   gap_size=0, offset=0, feather=0):
         """Fills a point on the surface with a color
 
         :param x: Starting point X coordinate
@@ -1302,12 +1317,18 @@ class SimplePaintingLayer (SurfaceBackedLayer):
         :type tolerance: float [0.0, 1.0]
         :param dst_layer: Optional target layer (default is self!)
         :type dst_layer: StrokemappedPaintingLayer
+        :param int gap_size: close gaps up to this many pixels wide
+        :param int offset: grow (>0) or shrink (<0) the fill, in pixels
+        :param int feather: width of the fill's soft edge, in pixels
 
         The `tolerance` parameter controls how much pixels are permitted to
         vary from the starting color.  We use the 4D Euclidean distance from
         the starting point to each pixel under consideration as a metric,
         scaled so that its range lies between 0.0 and 1.0.
 
+        The `gap_size`, `offset` and `feather` parameters are described in
+        `lib.tiledsurface.flood_fill()`.
+
         The default target layer is `self`. This method invalidates the filled
         area of the target layer's surface, queueing a redraw if it is part of
         a visible document.
@@ -1316,7 +1337,9 @@ class SimplePaintingLayer (SurfaceBackedLayer):
             dst_layer = self
         dst_layer.autosave_dirty = True   # XXX hmm, not working?
         self._surface.flood_fill(x, y, color, bbox, tolerance,
-                                 dst_surface=dst_layer._surface)
+                                 dst_surface=dst_layer._surface,
+                                 gap_size=gap_size, offset=offset,
+                                 feather=feather)
 
     ## Simple painting
 
@@ -1357,6 +1380,7 @@ class SimplePaintingLayer (SurfaceBackedLayer):
         SimplePaintingLayer and not recording strokes.
 
         """
+        t0 = _STROKE_TIMER.start()
         self._surface.begin_atomic()
         split = brush.stroke_to(
             self._surface.backend, x, y,
@@ -1364,8 +1388,51 @@ class SimplePaintingLayer (SurfaceBackedLayer):
         )
         self._surface.end_atomic()
         self.autosave_dirty = True
+        _STROKE_EVENTS.add()
+        _STROKE_TIMER.stop(t0)
         return split
 
+    def stroke_to_batch(self, brush, events, publish=None):
+        """Render several parts of a stroke to the canvas surface
+
+        :param brush: The brush to use for rendering dabs
+        :type brush: lib.brush.Brush
+        :param iterable events: Input event data, as tuples of the
+            args to `stroke_to()` which follow the brush, in order
+        :param callable publish: Called as ``publish(surface, x, y, w,
+            h)`` with the changed area, instead of notifying the
+            surface's observers. Used by painting threads.
+        :returns: The number of events used, and whether the stroke
+            should now be split
+        :rtype: tuple
+
+        This renders like successive calls to `stroke_to()`, but the
+        dabs for all the events are rendered inside one atomic batch,
+        so the surface's observers are only notified once. Rendering
+        stops after the first event which says that the stroke should
+        be split. The surface's tile lock is held while rendering.
+
+        """
+        t0 = _STROKE_TIMER.start()
+        n = 0
+        split = False
+        surface = self._surface
+        backend = surface.backend
+        with surface.tile_lock:
+            surface.begin_atomic()
+            for event in events:
+                n += 1
+                split = brush.stroke_to(backend, *event)
+                if split:
+                    break
+            bbox = surface.end_atomic(notify=(publish is None))
+        if publish is not None and bbox[2] > 0 and bbox[3] > 0:
+            publish(surface, *bbox)
+        self.autosave_dirty = True
+        _STROKE_EVENTS.add(n)
+        _STROKE_TIMER.stop(t0)
+        return (n, split)
+
     @contextlib.contextmanager
     def cairo_request(self, x, y, w, h, mode=lib.modes.DEFAULT_MODE):
         """Get a Cairo context for a given area, then put back changes.
@@ -1559,6 +1626,12 @@ class StrokemappedPaintingLayer (SimplePaintingLayer):
     ## Strokemap load and save
 
     def _load_strokemap_from_file(self, f, translate_x, translate_y):
+        """Load strokemap data from a "v2" format file.
+
+        Stroke shapes only store their data here. Their tiles get
+        decoded on first use, typically by get_stroke_info_at().
+
+        """
         assert not self.strokes
         brushes = []
         x = int(translate_x // N) * N
@@ -1590,7 +1663,11 @@ class StrokemappedPaintingLayer (SimplePaintingLayer):
     ## Strokemap querying
 
     def get_stroke_info_at(self, x, y):
-        """Get the stroke at the given point"""
+        """Get the stroke at the given point
+
+        Stroke shapes loaded from a file are decoded as they are tested.
+
+        """
         x, y = int(x), int(y)
         for s in reversed(self.strokes):
             if s.touches_pixel(x, y):
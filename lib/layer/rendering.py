@@ -42,6 +42,34 @@ class Opcode:
     POP = 4
 
 
+# Public functions:
+
+def snapshot_ops(ops, tiles, mipmap_level):
+    """Copy an ops list, replacing its data with unchanging snapshots
+
+    :param list ops: Ops list, from Renderable.get_render_ops()
+    :param iterable tiles: Tiles which will be rendered from the copy
+    :param int mipmap_level: Mipmap level they will be rendered at
+    :returns: New ops list, or None if some data can't be snapshotted
+
+    The ops' data objects need a "snapshot_tiles(tiles, mipmap_level)"
+    method returning a compositable or blittable snapshot. Rendering
+    from the returned list doesn't touch the original data, so it can
+    happen outside the main thread.
+
+    """
+    tiles = list(tiles)
+    snapped = []
+    for (opcode, opdata, mode, opacity) in ops:
+        if opdata is not None:
+            snapshot_tiles = getattr(opdata, "snapshot_tiles", None)
+            if snapshot_tiles is None:
+                return None
+            opdata = snapshot_tiles(tiles, mipmap_level)
+        snapped.append((opcode, opdata, mode, opacity))
+    return snapped
+
+
 # Classes and interfaces:
 
 class Spec (object):
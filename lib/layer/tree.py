@@ -17,11 +17,11 @@ from __future__ import division, print_function
 
 import re
 import logging
-from copy import copy
 from copy import deepcopy
 import os.path
 from warnings import warn
 import contextlib
+import weakref
 
 from gi.repository import GdkPixbuf
 from gi.repository import GLib
@@ -36,6 +36,8 @@ import lib.helpers as helpers
 from lib.observable import event
 import lib.pixbuf
 import lib.cache
+import lib.idletask
+import lib.tilebatch
 from lib.modes import DEFAULT_MODE
 from lib.modes import PASS_THROUGH_MODE
 from lib.modes import MODES_DECREASING_BACKDROP_ALPHA
@@ -45,12 +47,28 @@ from . import core
 from . import rendering
 import lib.feedback
 import lib.naming
+import lib.instrumentation
 from lib.pycompat import xrange
 
 
 logger = logging.getLogger(__name__)
 
 
+## Constants
+
+#: Tiles kept by each temporary rendering (flood fill source etc.)
+_TILE_RENDER_CACHE_SIZE = 1024
+
+# Hot-path metrics, see lib.instrumentation
+_RENDER_TIMER = lib.instrumentation.timer("layers.render")
+_RENDER_TILES = lib.instrumentation.counter("layers.render.tiles")
+_RENDER_CACHE_HITS = lib.instrumentation.counter("layers.render.cache_hits")
+_RENDER_CACHE_MISSES = lib.instrumentation.counter(
+    "layers.render.cache_misses",
+)
+_OPS_LIST_TIMER = lib.instrumentation.timer("layers.ops_list")
+
+
 ## Class defs
 
 
@@ -148,7 +166,13 @@ class RootLayerStack (group.LayerStack):
         # Layer thumbnail updates
         self.layer_content_changed += self._mark_layer_for_rethumb
         self._rethumb_layers = []
+        self._rethumb_dirty = {}  # {layer: Rect or None}, None = all
         self._rethumb_layers_timer_id = None
+        self._layer_previews = weakref.WeakKeyDictionary()
+        # Eager mipmap building in the background
+        self.layer_content_changed += self._queue_mipmap_build
+        self._mipmap_layers = []
+        self._mipmap_processor = lib.idletask.Processor(name="mipmaps")
 
     # Render cache management:
 
@@ -446,8 +470,26 @@ class RootLayerStack (group.LayerStack):
                 use_cache = spec.cacheable()
         key2 = (id(opaque_base_tile), dst_has_alpha)
 
+        # Cairo ARGB32 targets get their pixels converted straight from
+        # fix15 and cached in that form, unless a display filter needs
+        # to see RGBA first.
+        argb32 = target_surface_is_8bpc and getattr(surface, "argb32", False)
+        argb32_direct = argb32 and (filter is None)
+        if argb32_direct:
+            key2 += ("argb32",)
+
+        # Display filters which say what they do (see
+        # gui.displayfilter.LookupTableFilter) have their output cached
+        # too, alongside the unfiltered tiles, in the target's format.
+        filtered_key2 = None
+        filter_key = getattr(filter, "cache_key", None)
+        if use_cache and filter_key is not None:
+            filtered_key2 = key2 + ("filtered", filter_key, argb32)
+
         # Rendering loop.
         # Keep this as tight as possible, and consider C++ parallelization.
+        t0 = _RENDER_TIMER.start()
+        cache_hits = 0
         tiledims = (tiledsurface.N, tiledsurface.N, 4)
         dst_has_alpha_orig = dst_has_alpha
         for tx, ty in tiles:
@@ -457,12 +499,23 @@ class RootLayerStack (group.LayerStack):
             cache_hit = False
 
             with surface.tile_request(tx, ty, readonly=False) as dst:
+                dst_8bpc_target = dst
+
+                if filtered_key2 is not None:
+                    filtered = self._render_cache_get(key1, filtered_key2)
+                    if filtered is not None:
+                        dst[:] = filtered
+                        cache_hits += 1
+                        progress += 1
+                        continue
 
                 # Twirl out any 8bpc target here,
                 # if the render cache is empty for this tile.
                 if target_surface_is_8bpc:
                     dst_8bpc_orig = dst
                     dst = None
+                    if argb32 and not argb32_direct:
+                        dst_8bpc_orig = np.empty(tiledims, dtype='uint8')
                     if use_cache:
                         dst = self._render_cache_get(key1, key2)
 
@@ -470,36 +523,18 @@ class RootLayerStack (group.LayerStack):
                         dst = np.zeros(tiledims, dtype='uint16')
                     else:
                         cache_hit = True  # note: dtype is now uint8
+                        cache_hits += 1
 
                 if not cache_hit:
                     # Render to dst.
                     # dst is a fix15 rgba tile
-
-                    dst_over_opaque_base = None
-                    if dst_has_alpha and opaque_base_tile is not None:
-                        dst_over_opaque_base = dst
-                        lib.mypaintlib.tile_copy_rgba16_into_rgba16(
-                            opaque_base_tile,
-                            dst_over_opaque_base,
-                        )
-                        dst = np.zeros(tiledims, dtype='uint16')
-
-                    # Process the ops list.
-                    self._process_ops_list(
+                    dst_has_alpha = self._render_tile_over_base(
                         ops,
                         dst, dst_has_alpha,
                         tx, ty, mipmap_level,
+                        opaque_base_tile,
                     )
 
-                    if dst_over_opaque_base is not None:
-                        dst_has_alpha = False
-                        lib.mypaintlib.tile_combine(
-                            lib.mypaintlib.CombineNormal,
-                            dst, dst_over_opaque_base,
-                            False, 1.0,
-                        )
-                        dst = dst_over_opaque_base
-
                 # If the target tile is fix15 already, we're done.
                 if dst_8bpc_orig is None:
                     continue
@@ -508,39 +543,160 @@ class RootLayerStack (group.LayerStack):
                 if not cache_hit:
                     # Rendering just happened.
                     # Convert to 8bpc, and maybe store.
-                    if dst_has_alpha:
-                        conv = lib.mypaintlib.tile_convert_rgba16_to_rgba8
+                    if argb32_direct:
+                        lib.mypaintlib.tile_convert_rgba16_to_argb32(
+                            dst, dst_8bpc_orig, dst_has_alpha,
+                        )
+                    elif dst_has_alpha:
+                        lib.mypaintlib.tile_convert_rgba16_to_rgba8(
+                            dst, dst_8bpc_orig,
+                        )
                     else:
-                        conv = lib.mypaintlib.tile_convert_rgbu16_to_rgbu8
-                    conv(dst, dst_8bpc_orig)
+                        lib.mypaintlib.tile_convert_rgbu16_to_rgbu8(
+                            dst, dst_8bpc_orig,
+                        )
 
                     if use_cache:
-                        self._render_cache_set(key1, key2, dst_8bpc_orig)
+                        # These cached tiles must stay unfiltered: one
+                        # entry serves every display filter, and each
+                        # filter's output is cached separately under
+                        # filtered_key2. The filter below works in place,
+                        # and Cairo surfaces get reused, so copy those.
+                        cached = dst_8bpc_orig
+                        if filter is not None or argb32:
+                            cached = dst_8bpc_orig.copy()
+                        self._render_cache_set(key1, key2, cached)
                 else:
                     # An already 8pbc dst was loaded from the cache.
                     # It will match dst_has_alpha already.
                     dst_8bpc_orig[:] = dst
 
-                dst = dst_8bpc_orig
-
                 # Display filtering only happens when rendering
                 # 8bpc for the screen.
                 if filter is not None:
-                    filter(dst)
+                    filter(dst_8bpc_orig)
+                if argb32 and not argb32_direct:
+                    lib.mypaintlib.tile_convert_rgba8_to_argb32(
+                        dst_8bpc_orig, dst_8bpc_target,
+                    )
+                if filtered_key2 is not None:
+                    filtered = dst_8bpc_target.copy()
+                    self._render_cache_set(key1, filtered_key2, filtered)
 
             # end tile_request
             progress += 1
         progress.close()
+        _RENDER_TILES.add(len(tiles))
+        if use_cache:
+            _RENDER_CACHE_HITS.add(cache_hits)
+            _RENDER_CACHE_MISSES.add(len(tiles) - cache_hits)
+        _RENDER_TIMER.stop(t0)
+
+    @classmethod
+    def _render_tile_over_base(cls, ops, dst, dst_has_alpha,
+                               tx, ty, mipmap_level, opaque_base_tile):
+        """Process an ops list into dst, maybe over an opaque base tile
+
+        :returns: Whether dst still has meaningful alpha
+        :rtype: bool
+
+        If dst has alpha and an opaque base tile is given, the rendering
+        is composited over a copy of the base tile in dst, making it
+        opaque. Like `_process_ops_list()`, this is for fix15 data only.
+
+        """
+        if not (dst_has_alpha and opaque_base_tile is not None):
+            cls._process_ops_list(
+                ops,
+                dst, dst_has_alpha,
+                tx, ty, mipmap_level,
+            )
+            return dst_has_alpha
+        tiledims = (tiledsurface.N, tiledsurface.N, 4)
+        src = np.zeros(tiledims, dtype='uint16')
+        cls._process_ops_list(
+            ops,
+            src, dst_has_alpha,
+            tx, ty, mipmap_level,
+        )
+        lib.mypaintlib.tile_copy_rgba16_into_rgba16(opaque_base_tile, dst)
+        lib.mypaintlib.tile_combine(
+            lib.mypaintlib.CombineNormal,
+            src, dst,
+            False, 1.0,
+        )
+        return False
+
+    def get_render_snapshot(self, tiles, mipmap_level, overlay=None,
+                            opaque_base_tile=None, filter=None, spec=None):
+        """Capture what's needed to render some tiles later, elsewhere
+
+        :param iterable tiles: The tile indices to capture.
+        :param int mipmap_level: downscale degree. Ensure tile indices match.
+        :param lib.layer.core.LayerBase overlay: A global overlay layer.
+        :param numpy.ndarray opaque_base_tile: As for `render()`.
+        :param callable filter: Display filter (8bpc tile array mangler).
+        :param lib.layer.rendering.Spec spec: Explicit rendering spec.
+        :returns: A snapshot, or None if the stack can't be captured.
+        :rtype: RenderSnapshot
+
+        The snapshot renders 8bpc tiles, including Cairo ARGB32 ones,
+        exactly like `render()` would have done at the time of the call.
+        It holds no references to live layer data, so it can be rendered
+        on a worker thread while the document carries on changing. The
+        caller is responsible for noticing when its results have gone
+        stale.
 
-    def render_layer_preview(self, layer, size=256, bbox=None, **options):
+        """
+        tiles = list(tiles)
+        if spec is None:
+            spec = self._get_render_spec()
+        if overlay is not None:
+            spec.global_overlay = overlay
+        dst_has_alpha = not self.get_render_is_opaque(spec=spec)
+        ops = rendering.snapshot_ops(
+            self.get_render_ops(spec),
+            tiles,
+            mipmap_level,
+        )
+        if ops is None:
+            return None
+        cached = {}
+        if spec.cacheable():
+            key2 = (id(opaque_base_tile), dst_has_alpha)
+            key2_argb32 = key2 + ("argb32",)
+            for (tx, ty) in tiles:
+                key1 = (tx, ty, mipmap_level)
+                dst = self._render_cache_get(key1, key2)
+                if dst is not None:
+                    cached[(tx, ty)] = (dst.copy(), False)
+                elif filter is None:
+                    dst = self._render_cache_get(key1, key2_argb32)
+                    if dst is not None:
+                        cached[(tx, ty)] = (dst.copy(), True)
+        return RenderSnapshot(
+            ops, tiles, mipmap_level, dst_has_alpha,
+            opaque_base_tile=opaque_base_tile,
+            filter=filter,
+            cached=cached,
+        )
+
+    def render_layer_preview(self, layer, size=256, bbox=None, dirty=None,
+                             **options):
         """Render a standardized thumbnail/preview of a specific layer.
 
         :param lib.layer.core.LayerBase layer: The layer to preview.
         :param int size: Size of the output pixbuf.
         :param tuple bbox: Rectangle to render (x, y, w, h).
+        :param lib.helpers.Rect dirty: Area changed since the last call.
         :param **options: Passed to render().
         :rtype: GdkPixbuf.Pixbuf
 
+        The unscaled rendering made for each layer is kept. If "dirty"
+        is specified, and the previous call for the layer used the same
+        parameters, only the tiles of the preview which overlap the
+        dirty area are rendered again.
+
         """
         x, y, w, h = self._validate_layer_bbox_arg(layer, bbox)
 
@@ -558,18 +714,47 @@ class RootLayerStack (group.LayerStack):
 
         spec = self._get_render_spec_for_layer(layer)
 
-        surface = lib.pixbufsurface.Surface(x, y, w, h)
-        surface.pixbuf.fill(0x00000000)
-        tiles = list(surface.get_tiles())
-        self.render(surface, tiles, mipmap_level, spec=spec, **options)
+        key = (x, y, w, h, mipmap_level, tuple(sorted(options.items())))
+        cached = self._layer_previews.get(layer)
+        if dirty is not None and cached is not None and cached[0] == key:
+            surface = cached[1]
+            tiles = self._get_preview_tiles_in_area(
+                surface, dirty, mipmap_level,
+            )
+        else:
+            surface = lib.pixbufsurface.Surface(x, y, w, h)
+            surface.pixbuf.fill(0x00000000)
+            tiles = list(surface.get_tiles())
+        if tiles:
+            self.render(surface, tiles, mipmap_level, spec=spec, **options)
+        self._layer_previews[layer] = (key, surface)
 
         pixbuf = surface.pixbuf
         assert pixbuf.get_width() == w
         assert pixbuf.get_height() == h
         if not ((w == size) or (h == size)):
             pixbuf = helpers.scale_proportionally(pixbuf, size, size)
+        if pixbuf is surface.pixbuf:
+            # The kept surface will be rendered into again later.
+            pixbuf = pixbuf.copy()
         return pixbuf
 
+    @staticmethod
+    def _get_preview_tiles_in_area(surface, area, mipmap_level):
+        """Tiles of a preview surface overlapping an area in model space"""
+        if area.empty():
+            return []
+        fac = 2 ** mipmap_level
+        n = tiledsurface.N
+        tx0 = (area.x // fac) // n
+        ty0 = (area.y // fac) // n
+        tx1 = ((area.x + area.w - 1) // fac) // n
+        ty1 = ((area.y + area.h - 1) // fac) // n
+        return [
+            (tx, ty) for (tx, ty) in surface.get_tiles()
+            if (tx0 <= tx <= tx1) and (ty0 <= ty <= ty1)
+        ]
+
     def render_layer_as_pixbuf(self, layer, bbox=None, **options):
         """Render a layer as a GdkPixbuf.
 
@@ -615,10 +800,12 @@ class RootLayerStack (group.LayerStack):
 
         The result is used to implement flood_fill for layer types
         which don't contain their own tile-accessible data.
+        Its tiles are shared via the render cache with other renderings
+        of the same layer, until the next change to the layer stack.
 
         """
         spec = self._get_render_spec_for_layer(layer)
-        rendering = _TileRenderWrapper(self, spec)
+        rendering = _TileRenderWrapper(self, spec, cache_key=id(layer))
         return rendering
 
     def _get_render_spec_for_layer(self, layer):
@@ -707,6 +894,7 @@ class RootLayerStack (group.LayerStack):
         # On the other hand, this is sort of what a parallelized,
         # GIL-holding C++ loop body might look like.
 
+        t0 = _OPS_LIST_TIMER.start()
         stack = []
         for (opcode, opdata, mode, opacity) in ops:
             if opcode == rendering.Opcode.COMPOSITE:
@@ -743,6 +931,7 @@ class RootLayerStack (group.LayerStack):
                 "Ops list contains more PUSH operations "
                 "than POPs. Rendering is incomplete."
             )
+        _OPS_LIST_TIMER.stop(t0)
 
     ## Renderable implementation
 
@@ -1900,12 +2089,48 @@ class RootLayerStack (group.LayerStack):
 
     ## Layer merging
 
-    def layer_new_normalized(self, path):
+    @staticmethod
+    def _fill_new_surface_tiles(dstsurf, tiles, func,
+                                progress=None, cancel=None):
+        """Fill a batch of tiles of an unattached surface in parallel
+
+        :param lib.tiledsurface.MyPaintSurface dstsurf: Target surface
+        :param iterable tiles: The tile indices to fill
+        :param callable func: Work function, called as ``func(ti, dst)``
+        :param lib.feedback.Progress progress: Unsized feedback object
+        :param threading.Event cancel: Set this to abandon the batch
+        :raises lib.errors.CancelledError: if cancel was set
+
+        The writeable destination tiles are all requested up front, in
+        the calling thread, and the work function is then called for
+        each one via `lib.tilebatch.map_tiles()`. Work functions must
+        only read from the layers in the tree, and only write to the
+        `dst` array they are passed.
+
+        The target surface must not be part of the tree yet: nobody is
+        notified about the changes.
+
+        """
+        dst_tiles = {}
+        for tx, ty in tiles:
+            with dstsurf.tile_request(tx, ty, readonly=False) as dst:
+                dst_tiles[(tx, ty)] = dst
+        lib.tilebatch.map_tiles(
+            lambda ti: func(ti, dst_tiles[ti]),
+            dst_tiles.keys(),
+            progress=progress,
+            cancel=cancel,
+        )
+
+    def layer_new_normalized(self, path, progress=None, cancel=None):
         """Copy a layer to a normal painting layer that looks the same
 
         :param tuple path: Path to normalize
+        :param lib.feedback.Progress progress: Unsized feedback object
+        :param threading.Event cancel: Set this to abandon the operation
         :returns: New normalized layer
         :rtype: lib.layer.data.PaintingLayer
+        :raises lib.errors.CancelledError: if cancel was set
 
         The normalize operation does whatever is needed to convert a
         layer of any type into a normal painting layer with full opacity
@@ -1923,6 +2148,10 @@ class RootLayerStack (group.LayerStack):
         visible and tangible painting layers in the original, and it has
         the same name as the original, initially.
 
+        Tiles are rendered in parallel batches.
+        Because nothing in the tree changes,
+        a cancelled normalize can simply be abandoned.
+
         >>> from . import test
         >>> root, leaves = test.make_test_stack()
         >>> orig_walk = list(root.walk())
@@ -1933,12 +2162,16 @@ class RootLayerStack (group.LayerStack):
         >>> assert list(root.walk()) == orig_walk  # structure unchanged
 
         """
+        if progress is None:
+            progress = lib.feedback.Progress()
         srclayer = self.deepget(path)
         if not srclayer:
             raise ValueError("Path %r not found", path)
 
         # Simplest case
         if not srclayer.visible:
+            progress.items = 0
+            progress.close()
             return data.PaintingLayer(name=srclayer.name)
 
         # Backdrops need removing if they combine with this layer's data.
@@ -1949,8 +2182,12 @@ class RootLayerStack (group.LayerStack):
 
             # Optimizations for the tiled-surface types
             if isinstance(srclayer, data.PaintingLayer):
+                progress.items = 0
+                progress.close()
                 return deepcopy(srclayer)  # include strokes
             elif isinstance(srclayer, data.SurfaceBackedLayer):
+                progress.items = 0
+                progress.close()
                 return data.PaintingLayer.new_from_surface_backed_layer(
                     srclayer
                 )
@@ -1995,18 +2232,23 @@ class RootLayerStack (group.LayerStack):
         # then subtracting the before from the after.
         logger.debug("Normalize: bd_ops = %r", bd_ops)
         logger.debug("Normalize: src_ops = %r", src_ops)
-        dstsurf = dstlayer._surface
         tiledims = (tiledsurface.N, tiledsurface.N, 4)
-        for tx, ty in tiles:
-            bd = np.zeros(tiledims, dtype='uint16')
-            with dstsurf.tile_request(tx, ty, readonly=False) as dst:
+
+        def _normalize_tile(ti, dst):
+            tx, ty = ti
+            if bd_ops:
+                bd = np.zeros(tiledims, dtype='uint16')
                 self._process_ops_list(bd_ops, bd, True, tx, ty, 0)
                 lib.mypaintlib.tile_copy_rgba16_into_rgba16(bd, dst)
-                self._process_ops_list(src_ops, dst, True, tx, ty, 0)
-                if bd_ops:
-                    dst[:, :, 3] = 0  # minimize alpha (discard original)
-                    lib.mypaintlib.tile_flat2rgba(dst, bd)
-
+            self._process_ops_list(src_ops, dst, True, tx, ty, 0)
+            if bd_ops:
+                dst[:, :, 3] = 0  # minimize alpha (discard original)
+                lib.mypaintlib.tile_flat2rgba(dst, bd)
+
+        self._fill_new_surface_tiles(
+            dstlayer._surface, tiles, _normalize_tile,
+            progress=progress, cancel=cancel,
+        )
         return dstlayer
 
     def get_merge_down_target(self, path):
@@ -2037,12 +2279,15 @@ class RootLayerStack (group.LayerStack):
 
         return target_path
 
-    def layer_new_merge_down(self, path):
+    def layer_new_merge_down(self, path, progress=None, cancel=None):
         """Create a new layer containg the Merge Down of two layers
 
         :param tuple path: Path to the top layer to Merge Down
+        :param lib.feedback.Progress progress: Unsized feedback object
+        :param threading.Event cancel: Set this to abandon the operation
         :returns: New merged layer
         :rtype: lib.layer.data.PaintingLayer
+        :raises lib.errors.CancelledError: if cancel was set
 
         The current layer and the one below it are merged into a new
         layer, if that is possible, and the new layer is returned.
@@ -2075,11 +2320,18 @@ class RootLayerStack (group.LayerStack):
         target_path = self.get_merge_down_target(path)
         if not target_path:
             raise ValueError("Invalid path for Merge Down")
+        if progress is None:
+            progress = lib.feedback.Progress()
+        progress.items = 3
         # Normalize input
         merge_layers = []
         for p in [target_path, path]:
             assert p is not None
-            layer = self.layer_new_normalized(p)
+            layer = self.layer_new_normalized(
+                p,
+                progress=progress.open(),
+                cancel=cancel,
+            )
             merge_layers.append(layer)
         assert None not in merge_layers
         # Build output strokemap, determine set of data tiles to merge
@@ -2102,21 +2354,29 @@ class RootLayerStack (group.LayerStack):
             dstlayer.name = name
         logger.debug("Merge Down: normalized source=%r", merge_layers)
         # Rendering loop
-        dstsurf = dstlayer._surface
-        for tx, ty in tiles:
-            with dstsurf.tile_request(tx, ty, readonly=False) as dst:
-                for layer in merge_layers:
-                    layer._surface.composite_tile(
-                        dst, True,
-                        tx, ty, mipmap_level=0,
-                    )
+        def _merge_tile(ti, dst):
+            tx, ty = ti
+            for layer in merge_layers:
+                layer._surface.composite_tile(
+                    dst, True,
+                    tx, ty, mipmap_level=0,
+                )
+
+        self._fill_new_surface_tiles(
+            dstlayer._surface, tiles, _merge_tile,
+            progress=progress.open(), cancel=cancel,
+        )
+        progress.close()
         return dstlayer
 
-    def layer_new_merge_visible(self):
+    def layer_new_merge_visible(self, progress=None, cancel=None):
         """Create and return the merge of all currently visible layers
 
+        :param lib.feedback.Progress progress: Unsized feedback object
+        :param threading.Event cancel: Set this to abandon the operation
         :returns: New merged layer
         :rtype: lib.layer.data.PaintingLayer
+        :raises lib.errors.CancelledError: if cancel was set
 
         All visible layers are merged into a new PaintingLayer, which is
         returned. Nothing is inserted or removed from the stack.  The
@@ -2161,12 +2421,12 @@ class RootLayerStack (group.LayerStack):
         ).join(names)
         if name != '':
             dstlayer.name = name
-        dstsurf = dstlayer._surface
 
         # Render the entire tree, mostly normally.
         # Solo mode counts as normal, previewing mode does not.
         spec = self._get_render_spec(respect_previewing=False)
-        self.render(dstsurf, tiles, 0, spec=spec)
+        dst_has_alpha = not self.get_render_is_opaque(spec=spec)
+        ops = self.get_render_ops(spec)
 
         # Then subtract the background surface if it was rendered.
         # This leaves a ghost image.
@@ -2176,14 +2436,23 @@ class RootLayerStack (group.LayerStack):
         # Especially if they're really non-obvious to the user, like this.
         # Maybe it'd be better to split this op into two variants,
         # "Remove Background" and "Ignore Background"?
+        bgsurf = None
         if self._get_render_background(spec):
             bgsurf = self._background_layer._surface
-            for tx, ty in tiles:
-                with dstsurf.tile_request(tx, ty, readonly=False) as dst:
-                    with bgsurf.tile_request(tx, ty, readonly=True) as bg:
-                        dst[:, :, 3] = 0  # minimize alpha (discard original)
-                        lib.mypaintlib.tile_flat2rgba(dst, bg)
 
+        def _merge_tile(ti, dst):
+            tx, ty = ti
+            self._process_ops_list(ops, dst, dst_has_alpha, tx, ty, 0)
+            if bgsurf is None:
+                return
+            with bgsurf.tile_request(tx, ty, readonly=True) as bg:
+                dst[:, :, 3] = 0  # minimize alpha (discard original)
+                lib.mypaintlib.tile_flat2rgba(dst, bg)
+
+        self._fill_new_surface_tiles(
+            dstlayer._surface, tiles, _merge_tile,
+            progress=progress, cancel=cancel,
+        )
         return dstlayer
 
     ## Layer uniquifying (sort of the opposite of Merge Down)
@@ -2215,21 +2484,34 @@ class RootLayerStack (group.LayerStack):
         logger.debug("uniq: bd_ops = %r", bd_ops)
         logger.debug("uniq: targ_only_ops = %r", targ_only_ops)
         targ_surf = targ_layer._surface
-        tile_dims = (tiledsurface.N, tiledsurface.N, 4)
-        unchanged_tile_indices = set()
-        zeros = np.zeros(tile_dims, dtype='uint16')
-        for tx, ty in targ_surf.get_tiles():
-            bd_img = copy(zeros)
+        n = tiledsurface.N
+
+        def _compare_tile(ti):
+            tx, ty = ti
+            bd_img = np.zeros((n, n, 4), dtype='uint16')
             self._process_ops_list(bd_ops, bd_img, True, tx, ty, 0)
-            targ_img = copy(bd_img)
+            targ_img = np.empty((n, n, 4), dtype='uint16')
+            lib.mypaintlib.tile_copy_rgba16_into_rgba16(bd_img, targ_img)
             self._process_ops_list(targ_only_ops, targ_img, True, tx, ty, 0)
-            equal_channels = (targ_img == bd_img)   # NxNn4 dtype=bool
-            if equal_channels.all():
+            equal_px = np.ones((n, n), dtype='uint8')
+            count = lib.mypaintlib.tile_mask_equal_pixels(
+                targ_img, bd_img, equal_px,
+            )
+            return (count, equal_px)
+
+        comparisons = lib.tilebatch.map_tiles(
+            _compare_tile,
+            targ_surf.get_tiles(),
+        )
+        unchanged_tile_indices = set()
+        for (tx, ty), (count, equal_px) in comparisons.items():
+            if count == n*n:
                 unchanged_tile_indices.add((tx, ty))
-            elif pixels:
-                equal_px = equal_channels.all(axis=2, keepdims=True)  # NxNx1
+            elif pixels and count > 0:
                 with targ_surf.tile_request(tx, ty, readonly=False) as targ:
-                    targ *= np.invert(equal_px)
+                    lib.mypaintlib.tile_copy_masked(
+                        targ, targ, equal_px, True,
+                    )
 
         targ_surf.remove_tiles(unchanged_tile_indices)
 
@@ -2283,40 +2565,55 @@ class RootLayerStack (group.LayerStack):
         common_surf = common_layer._surface
         targ_group.append(common_layer)
 
-        # Process by tile
+        # Compare the children's renderings, by tile.
+        # Each child narrows down the mask of pixels common to all.
         n = tiledsurface.N
-        zeros_rgba = np.zeros((n, n, 4), dtype='uint16')
-        ones_bool = np.ones((n, n, 1), dtype='bool')
+        ops_lists = [child_ops[c] for c in normalized_child_layers]
+
+        def _compare_tile(ti):
+            tx, ty = ti
+            rgba0 = np.zeros((n, n, 4), dtype='uint16')
+            self._process_ops_list(ops_lists[0], rgba0, True, tx, ty, 0)
+            rgba = np.empty((n, n, 4), dtype='uint16')
+            common_px = np.ones((n, n), dtype='uint8')
+            count = n*n
+            for ops in ops_lists[1:]:
+                lib.mypaintlib.tile_clear_rgba16(rgba)
+                self._process_ops_list(ops, rgba, True, tx, ty, 0)
+                count = lib.mypaintlib.tile_mask_equal_pixels(
+                    rgba0, rgba, common_px,
+                )
+                if count == 0:
+                    break
+            return (count, common_px)
+
+        comparisons = lib.tilebatch.map_tiles(_compare_tile, union_tiles)
+
+        # Move the common pixels or tiles.
         common_data_tiles = set()
+        child_tiles = [
+            (child._surface, set(child.get_tile_coords()))
+            for child in normalized_child_layers
+        ]
         child0 = normalized_child_layers[0]
         child0_surf = child0._surface
-        for tx, ty in union_tiles:
-            common_px = copy(ones_bool)
-            rgba0 = None
-            for child in normalized_child_layers:
-                ops = child_ops[child]
-                rgba = copy(zeros_rgba)
-                self._process_ops_list(ops, rgba, True, tx, ty, 0)
-                if rgba0 is None:
-                    rgba0 = rgba
-                else:
-                    common_px &= (rgba0 == rgba).all(axis=2, keepdims=True)
-
-            if common_px.all():
+        for (tx, ty), (count, common_px) in comparisons.items():
+            if count == n*n:
                 with common_surf.tile_request(tx, ty, readonly=False) as d:
                     with child0_surf.tile_request(tx, ty, readonly=True) as s:
                         d[:] = s
                 common_data_tiles.add((tx, ty))
 
-            elif pixels and common_px.any():
+            elif pixels and count > 0:
                 with common_surf.tile_request(tx, ty, readonly=False) as d:
                     with child0_surf.tile_request(tx, ty, readonly=True) as s:
-                        d[:] = s * common_px
-                for child in normalized_child_layers:
-                    surf = child._surface
-                    if (tx, ty) in surf.get_tiles():
+                        lib.mypaintlib.tile_copy_masked(s, d, common_px, False)
+                for surf, tiles in child_tiles:
+                    if (tx, ty) in tiles:
                         with surf.tile_request(tx, ty, readonly=False) as d:
-                            d *= np.invert(common_px)
+                            lib.mypaintlib.tile_copy_masked(
+                                d, d, common_px, True,
+                            )
 
         # Remove the remaining complete common tiles.
         for child in normalized_child_layers:
@@ -2595,18 +2892,61 @@ class RootLayerStack (group.LayerStack):
         """Snapshots the state of the layer, for undo purposes"""
         return RootLayerStackSnapshot(self)
 
+    ## Mipmap maintenance
+
+    def _queue_mipmap_build(self, root, layer, *_ignored):
+        """Queue eager mipmap building for a layer whose content changed"""
+        if layer is self:
+            return
+        if layer not in self._mipmap_layers:
+            self._mipmap_layers.append(layer)
+        if not self._mipmap_processor.has_work():
+            self._mipmap_processor.add_work(self._build_mipmaps_cb)
+
+    def _build_mipmaps_cb(self):
+        """Background task: build one batch of mipmaps for a queued layer
+
+        Zoomed-out redraws then rarely have to regenerate mipmap tiles
+        themselves.
+
+        """
+        if not self._mipmap_layers:
+            return False
+        layer = self._mipmap_layers[0]
+        if not layer.build_mipmaps():
+            self._mipmap_layers.pop(0)
+        return bool(self._mipmap_layers)
+
     ## Layer preview thumbnails
 
     def _mark_all_layers_for_rethumb(self):
         self._rethumb_layers[:] = []
+        self._rethumb_dirty.clear()
         for path, layer in self.walk():
             self._rethumb_layers.append(layer)
+            self._rethumb_dirty[layer] = None
+        self._restart_rethumb_timer()
+
+    def _mark_layer_for_rethumb(self, root, layer, x=0, y=0, w=0, h=0):
+        dirty = None
+        if w > 0 and h > 0:
+            dirty = helpers.Rect(x, y, w, h)
+        self._queue_layer_for_rethumb(layer, dirty)
         self._restart_rethumb_timer()
 
-    def _mark_layer_for_rethumb(self, root, layer, *_ignored):
+    def _queue_layer_for_rethumb(self, layer, dirty):
+        """Queue a thumbnail update, accumulating its dirty area"""
         if layer not in self._rethumb_layers:
             self._rethumb_layers.append(layer)
-        self._restart_rethumb_timer()
+            if dirty is not None:
+                dirty = dirty.copy()
+            self._rethumb_dirty[layer] = dirty
+            return
+        queued = self._rethumb_dirty.get(layer)
+        if queued is None or dirty is None:
+            self._rethumb_dirty[layer] = None
+        else:
+            queued.expand_to_include_rect(dirty)
 
     def _restart_rethumb_timer(self):
         timer_id = self._rethumb_layers_timer_id
@@ -2622,20 +2962,25 @@ class RootLayerStack (group.LayerStack):
     def _rethumb_layers_timer_cb(self):
         if len(self._rethumb_layers) >= 1:
             layer0 = self._rethumb_layers.pop(-1)
+            dirty = self._rethumb_dirty.pop(layer0, None)
             path0 = self.deepindex(layer0)
             if not path0:
                 return True
-            layer0.update_thumbnail()
+            layer0.update_thumbnail(dirty=dirty)
             self.layer_thumbnail_updated(path0, layer0)
-            # Queue parent layers too
+            # Queue parent layers too, for the same area. Parent
+            # thumbnails are rebuilt only where their children changed.
             path = path0[:-1]
             parents = []
             while len(path) > 0:
                 layer = self.deepget(path)
-                if layer not in self._rethumb_layers:
+                if layer in self._rethumb_layers:
+                    self._queue_layer_for_rethumb(layer, dirty)
+                else:
                     parents.append(layer)
                 path = path[:-1]
-            self._rethumb_layers.extend(reversed(parents))
+            for layer in reversed(parents):
+                self._queue_layer_for_rethumb(layer, dirty)
             return True
         # Stop the timer when there is nothing more to be done.
         self._rethumb_layers_timer_id = None
@@ -2670,29 +3015,167 @@ class RootLayerStackSnapshot (group.LayerStackSnapshot):
         layer.current_path = self.current_path
 
 
+class RenderSnapshot (object):
+    """Tiles of a root layer stack, captured for rendering elsewhere
+
+    Made by `RootLayerStack.get_render_snapshot()`. Rendering from a
+    snapshot only reads data belonging to the snapshot, so it can be
+    done on a worker thread.
+
+    """
+
+    def __init__(self, ops, tiles, mipmap_level, dst_has_alpha,
+                 opaque_base_tile=None, filter=None, cached=None):
+        super(RenderSnapshot, self).__init__()
+        self._ops = ops
+        self.tiles = list(tiles)
+        self.mipmap_level = mipmap_level
+        self._dst_has_alpha = dst_has_alpha
+        self._opaque_base_tile = opaque_base_tile
+        self._filter = filter
+        self._cached = cached or {}
+
+    def render(self, surface, cancel=None):
+        """Render the captured tiles into an 8bpc surface
+
+        :param TileAccessible surface: 8bpc target, e.g. a pixbufsurface
+            or a Cairo ARGB32 `lib.pixbufsurface.CairoSurface`.
+        :param threading.Event cancel: Stop early if this gets set.
+        :returns: False if rendering was cancelled
+        :rtype: bool
+
+        """
+        tiledims = (tiledsurface.N, tiledsurface.N, 4)
+        argb32 = getattr(surface, "argb32", False)
+        argb32_direct = argb32 and (self._filter is None)
+        for tx, ty in self.tiles:
+            if cancel is not None and cancel.is_set():
+                return False
+            with surface.tile_request(tx, ty, readonly=False) as target:
+                dst_8bpc = target
+                if argb32 and not argb32_direct:
+                    dst_8bpc = np.empty(tiledims, dtype='uint8')
+                cached, cached_is_argb32 = self._cached.get(
+                    (tx, ty),
+                    (None, None),
+                )
+                if cached is not None and cached_is_argb32 == argb32_direct:
+                    dst_8bpc[:] = cached
+                else:
+                    dst = np.zeros(tiledims, dtype='uint16')
+                    dst_has_alpha = RootLayerStack._render_tile_over_base(
+                        self._ops,
+                        dst, self._dst_has_alpha,
+                        tx, ty, self.mipmap_level,
+                        self._opaque_base_tile,
+                    )
+                    if argb32_direct:
+                        lib.mypaintlib.tile_convert_rgba16_to_argb32(
+                            dst, dst_8bpc, dst_has_alpha,
+                        )
+                    elif dst_has_alpha:
+                        lib.mypaintlib.tile_convert_rgba16_to_rgba8(
+                            dst, dst_8bpc,
+                        )
+                    else:
+                        lib.mypaintlib.tile_convert_rgbu16_to_rgbu8(
+                            dst, dst_8bpc,
+                        )
+                if self._filter is not None:
+                    self._filter(dst_8bpc)
+                if argb32 and not argb32_direct:
+                    lib.mypaintlib.tile_convert_rgba8_to_argb32(
+                        dst_8bpc, target,
+                    )
+        return True
+
+
 class _TileRenderWrapper (TileAccessible, TileBlittable):
     """Adapts a RootLayerStack to support RO tile_request()s.
 
     The wrapping is very minimal.
-    Tiles are rendered into empty buffers on demand and cached.
+    Tiles are rendered into empty buffers on demand, or in parallel
+    batches by prefetch_tiles(), and cached in a bounded LRU cache.
     The tile request interface is therefore read only,
     and these wrappers should be used only as temporary objects.
 
+    Wrappers constructed with a cache_key also share their tiles with
+    the root's render cache, which is cleared whenever the stack
+    changes. Only fix15 tiles are shared. The display's 8bpc tiles
+    are dithered, so fills using them would differ from fills using
+    freshly rendered tiles.
+
     """
 
-    def __init__(self, root, spec, use_cache=True):
+    def __init__(self, root, spec, use_cache=True, cache_key=None):
         """Adapt a renderable object to support "tile_request()".
 
         :param RootLayerStack root: root of a tree.
         :param lib.layer.rendering.Spec spec: How to render it.
         :param bool use_cache: Cache rendered output.
+        :param cache_key: Key identifying spec in the root render cache.
 
         """
         super(_TileRenderWrapper, self).__init__()
         self._root = root
         self._ops = root.get_render_ops(spec)
         self._use_cache = bool(use_cache)
-        self._cache = {}
+        self._cache = lib.cache.LRUCache(capacity=_TILE_RENDER_CACHE_SIZE)
+        self._root_key2 = None
+        shareable = (
+            self._use_cache
+            and (cache_key is not None)
+            and (spec.current_overlay is None)
+            and (spec.global_overlay is None)
+        )
+        if shareable:
+            self._root_key2 = ("fix15", cache_key)
+
+    def _render_tile(self, ti):
+        """Render a new fix15 tile (safe to call from worker threads)"""
+        tx, ty = ti
+        tiledims = (tiledsurface.N, tiledsurface.N, 4)
+        dst = np.zeros(tiledims, 'uint16')
+        self._root.render_single_tile(
+            dst, True,
+            tx, ty, 0,
+            ops=self._ops,
+        )
+        return dst
+
+    def _get_shared_tile(self, ti):
+        """Look up a tile in the root's render cache, or return None"""
+        if self._root_key2 is None:
+            return None
+        key1 = (ti[0], ti[1], 0)
+        return self._root._render_cache_get(key1, self._root_key2)
+
+    def _store_tile(self, ti, dst):
+        self._cache[ti] = dst
+        if self._root_key2 is not None:
+            key1 = (ti[0], ti[1], 0)
+            self._root._render_cache_set(key1, self._root_key2, dst)
+
+    def prefetch_tiles(self, tiles):
+        """Render a batch of tiles ahead of time, in parallel.
+
+        :param iterable tiles: Tile indices, as (tx, ty) tuples.
+
+        """
+        if not self._use_cache:
+            return
+        todo = []
+        for ti in set(tiles):
+            if ti in self._cache:
+                continue
+            dst = self._get_shared_tile(ti)
+            if dst is not None:
+                self._cache[ti] = dst
+            else:
+                todo.append(ti)
+        rendered = lib.tilebatch.map_tiles(self._render_tile, todo)
+        for ti, dst in rendered.items():
+            self._store_tile(ti, dst)
 
     @contextlib.contextmanager
     def tile_request(self, tx, ty, readonly):
@@ -2708,19 +3191,18 @@ class _TileRenderWrapper (TileAccessible, TileBlittable):
         """
         if not readonly:
             raise ValueError("Only readonly tile requests are supported")
-        dst = None
-        if self._use_cache:
-            dst = self._cache.get((tx, ty), None)
+        ti = (tx, ty)
+        if not self._use_cache:
+            yield self._render_tile(ti)
+            return
+        dst = self._cache.get(ti, None)
         if dst is None:
-            tiledims = (tiledsurface.N, tiledsurface.N, 4)
-            dst = np.zeros(tiledims, 'uint16')
-            self._root.render_single_tile(
-                dst, True,
-                tx, ty, 0,
-                ops=self._ops,
-            )
-            if self._use_cache:
-                self._cache[(tx, ty)] = dst
+            dst = self._get_shared_tile(ti)
+            if dst is not None:
+                self._cache[ti] = dst
+            else:
+                dst = self._render_tile(ti)
+                self._store_tile(ti, dst)
         yield dst
 
     def get_bbox(self):
@@ -0,0 +1,311 @@
+# This file is part of MyPaint.
+# Copyright (C) 2018 by the MyPaint Development Team.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+
+"""Tiled morphology operations for flood fills
+
+The functions here operate on alpha tilemaps: dicts of single-channel
+fix15 tiles, ``{(tx, ty): array}``, as used by the flood fill code in
+`lib.tiledsurface`. Missing tiles are treated as being all zero.
+
+Everything is built on `mypaintlib.tile_distance_field()`, which looks
+across tile borders into the 3x3 block of tiles around each tile being
+processed. The radii used here are therefore limited to `MAX_RADIUS`.
+Tiles whose whole neighbourhood is uniform are skipped without calling
+into the native code, so costs depend on the length of the fill's
+outline rather than on its area.
+
+"""
+
+## Imports
+
+from __future__ import division, print_function
+
+import math
+
+import numpy as np
+
+from . import mypaintlib
+
+
+## Constants
+
+N = mypaintlib.TILE_SIZE
+FIX15_ONE = 1 << 15
+
+#: Largest radius that the operations here can look across, in pixels.
+MAX_RADIUS = N - 1
+
+_ZEROS = np.zeros((N, N), 'uint16')
+_ZEROS.flags.writeable = False
+_ONES = np.full((N, N), FIX15_ONE, 'uint16')
+_ONES.flags.writeable = False
+
+
+## Helpers
+
+
+def neighbourhood(ti):
+    """The 3x3 block of tile indices around a tile, in rows from the NW
+
+    >>> neighbourhood((0, 0))[:4]
+    [(-1, -1), (0, -1), (1, -1), (-1, 0)]
+    >>> neighbourhood((0, 0))[4]
+    (0, 0)
+
+    """
+    tx, ty = ti
+    return [(tx+dx, ty+dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+
+
+def dilated_tiles(tiles):
+    """Tile indices which a dilation of a tilemap could touch
+
+    >>> len(dilated_tiles({(0, 0): _ONES}))
+    9
+
+    """
+    result = set()
+    for ti in tiles:
+        result.update(neighbourhood(ti))
+    return result
+
+
+class TileStats (object):
+    """Cached emptiness and fullness tests for the tiles in a tilemap"""
+
+    def __init__(self, tiles):
+        self._tiles = tiles
+        self._empty = {}
+        self._full = {}
+
+    def empty(self, ti):
+        """True if a tile is all zeros, or absent"""
+        result = self._empty.get(ti)
+        if result is None:
+            tile = self._tiles.get(ti)
+            result = tile is None or not tile.any()
+            self._empty[ti] = result
+        return result
+
+    def full(self, ti):
+        """True if a tile has no zeros in it"""
+        result = self._full.get(ti)
+        if result is None:
+            tile = self._tiles.get(ti)
+            result = tile is not None and tile.all()
+            self._full[ti] = result
+        return result
+
+
+def distance_field(tiles, ti, radius, invert=False, stats=None):
+    """Distances from one tile's pixels to the nearest zero pixel
+
+    :param dict tiles: alpha tilemap
+    :param tuple ti: index of the tile to calculate distances for
+    :param int radius: maximum distance, at most N
+    :param bool invert: measure to the nearest nonzero pixel instead
+    :param TileStats stats: cached tile tests for tiles (optional)
+    :returns: distances, clamped to radius
+    :rtype: numpy.ndarray, NxN, float32
+
+    >>> tiles = {(0, 0): np.full((N, N), 1, 'uint16')}
+    >>> d = distance_field(tiles, (0, 0), 4)
+    >>> float(d[0, 0]), float(d[N//2, N//2])
+    (1.0, 4.0)
+    >>> d = distance_field(tiles, (1, 0), 4, invert=True)
+    >>> float(d[0, 0]), float(d[0, 2])
+    (1.0, 3.0)
+
+    """
+    if stats is None:
+        stats = TileStats(tiles)
+    idxs = neighbourhood(ti)
+    # Shortcuts for uniform neighbourhoods
+    if invert:
+        if stats.full(ti):
+            return np.zeros((N, N), 'float32')
+        if all(stats.empty(i) for i in idxs):
+            return np.full((N, N), radius, 'float32')
+    else:
+        if stats.empty(ti):
+            return np.zeros((N, N), 'float32')
+        if all(stats.full(i) for i in idxs):
+            return np.full((N, N), radius, 'float32')
+    masks = [tiles.get(i, _ZEROS) for i in idxs]
+    dist = np.empty((N, N), 'float32')
+    mypaintlib.tile_distance_field(masks, dist, int(radius), bool(invert))
+    return dist
+
+
+## Morphology operations
+
+
+def erode(tiles, radius):
+    """Shrink an alpha tilemap's nonzero areas by a number of pixels
+
+    :param dict tiles: alpha tilemap
+    :param int radius: pixels to shrink by, at most MAX_RADIUS
+    :returns: a new alpha tilemap
+    :rtype: dict
+
+    >>> tiles = {(0, 0): _ONES}
+    >>> eroded = erode(tiles, 2)
+    >>> int(eroded[(0, 0)][2, 2]), int(eroded[(0, 0)][1, 5])
+    (32768, 0)
+
+    """
+    radius = int(min(radius, MAX_RADIUS))
+    if radius <= 0:
+        return dict(tiles)
+    stats = TileStats(tiles)
+    result = {}
+    for ti, alpha in tiles.items():
+        if stats.empty(ti):
+            continue
+        dist = distance_field(tiles, ti, radius+1, stats=stats)
+        alpha = np.where(dist <= radius, 0, alpha).astype('uint16')
+        if alpha.any():
+            result[ti] = alpha
+    return result
+
+
+def dilate(tiles, radius, limit=None):
+    """Grow an alpha tilemap's nonzero areas by a number of pixels
+
+    :param dict tiles: alpha tilemap
+    :param int radius: pixels to grow by, at most MAX_RADIUS
+    :param dict limit: alpha tilemap for the grown pixels (optional)
+    :returns: a new alpha tilemap
+    :rtype: dict
+
+    Newly covered pixels are fully opaque, or they take their values
+    from `limit` if it is specified. Missing limit tiles are treated as
+    being all zero, i.e. no growth happens there.
+
+    >>> tiles = {(0, 0): _ONES}
+    >>> grown = dilate(tiles, 2)
+    >>> sorted(grown.keys())[:3]
+    [(-1, -1), (-1, 0), (-1, 1)]
+    >>> int(grown[(-1, 0)][0, N-2]), int(grown[(-1, 0)][0, N-3])
+    (32768, 0)
+
+    """
+    radius = int(min(radius, MAX_RADIUS))
+    if radius <= 0:
+        return dict(tiles)
+    stats = TileStats(tiles)
+    result = {}
+    for ti in dilated_tiles(tiles):
+        alpha = tiles.get(ti, _ZEROS)
+        if stats.full(ti):
+            result[ti] = alpha
+            continue
+        if limit is None:
+            grown_alpha = _ONES
+        else:
+            grown_alpha = limit.get(ti, None)
+            if grown_alpha is None:
+                if not stats.empty(ti):
+                    result[ti] = alpha
+                continue
+        dist = distance_field(tiles, ti, radius+1, invert=True, stats=stats)
+        grown = (dist <= radius) & (alpha == 0)
+        alpha = np.where(grown, grown_alpha, alpha).astype('uint16')
+        if alpha.any():
+            result[ti] = alpha
+    return result
+
+
+def feather(tiles, radius):
+    """Soften the edges of an alpha tilemap's nonzero areas
+
+    :param dict tiles: alpha tilemap
+    :param int radius: width of the soft edge, at most MAX_RADIUS
+    :returns: a new alpha tilemap
+    :rtype: dict
+
+    Alpha ramps linearly across the edge, as measured by the signed
+    distance to it. The ramp is centred on the original edge, so half
+    of it lies outside the original area.
+
+    >>> tiles = {(0, 0): _ONES}
+    >>> soft = feather(tiles, 8)
+    >>> inside = [int(soft[(0, 0)][N//2, x]) for x in range(6)]
+    >>> inside == sorted(inside)
+    True
+    >>> int(soft[(0, 0)][N//2, N//2])
+    32768
+    >>> 0 < int(soft[(-1, 0)][N//2, N-1]) < int(soft[(0, 0)][N//2, 0])
+    True
+
+    """
+    radius = int(min(radius, MAX_RADIUS))
+    if radius <= 1:
+        return dict(tiles)
+    reach = int(math.ceil(radius / 2.0)) + 1
+    stats = TileStats(tiles)
+    result = {}
+    for ti in dilated_tiles(tiles):
+        alpha = tiles.get(ti, _ZEROS)
+        d_out = distance_field(tiles, ti, reach, stats=stats)
+        d_in = distance_field(tiles, ti, reach, invert=True, stats=stats)
+        signed = np.where(alpha > 0, d_out, -d_in)
+        ramp = np.clip((signed - 0.5) / radius + 0.5, 0.0, 1.0)
+        base = np.where(alpha > 0, alpha, FIX15_ONE)
+        alpha = (base * ramp).astype('uint16')
+        if alpha.any():
+            result[ti] = alpha
+    return result
+
+
+def clip_to_bbox(tiles, bbox):
+    """Zero all pixels of an alpha tilemap outside a bounding box
+
+    :param dict tiles: alpha tilemap (modified in place)
+    :param tuple bbox: pixel bounding box, (x, y, w, h)
+
+    >>> tiles = {(0, 0): _ONES.copy(), (1, 0): _ONES.copy()}
+    >>> clip_to_bbox(tiles, (2, 0, N, N))
+    >>> int(tiles[(0, 0)][0, 1]), int(tiles[(0, 0)][0, 2])
+    (0, 32768)
+    >>> int(tiles[(1, 0)][0, 1]), int(tiles[(1, 0)][0, 2])
+    (32768, 0)
+
+    """
+    x, y, w, h = [int(c) for c in bbox]
+    for ti in list(tiles.keys()):
+        tx, ty = ti
+        x0 = min(N, max(0, x - tx*N))
+        y0 = min(N, max(0, y - ty*N))
+        x1 = min(N, max(0, x + w - tx*N))
+        y1 = min(N, max(0, y + h - ty*N))
+        if x0 >= x1 or y0 >= y1:
+            tiles.pop(ti)
+            continue
+        if (x0, y0, x1, y1) == (0, 0, N, N):
+            continue
+        alpha = tiles[ti].copy()
+        alpha[:y0, :] = 0
+        alpha[y1:, :] = 0
+        alpha[:, :x0] = 0
+        alpha[:, x1:] = 0
+        tiles[ti] = alpha
+
+
+## Module testing
+
+
+def _test():
+    """Run doctest strings"""
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    _test()
@@ -0,0 +1,198 @@
+# This file is part of MyPaint.
+# Copyright (C) 2018 by the MyPaint Development Team
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+
+"""Rendering brushwork on a dedicated painting thread
+
+Freehand input is handled on the main thread, which is also where the
+canvas gets redrawn. While a slow redraw is running, the dabs for new
+input have to wait for it, and the ink trails behind the stylus. The
+worker here lets the document paint on a thread of its own instead.
+
+Stroke events are handed to the worker through a deque. Its append()
+and popleft() are atomic, so submitting work never waits for painting
+to finish. The worker renders each job into the layer while holding
+the surface's `tile_lock` (see `lib.tiledsurface.MyPaintSurface`), so
+the main thread never sees its tiledicts or mipmaps half-updated. The
+areas changed are collected, and passed on to the surface's observers
+from the main thread, in a GLib idle callback.
+
+The brush engine needs the GIL, so the worker paints while the main
+thread doesn't hold it: while it waits in the GTK main loop, or runs
+the native compositing code, which releases it. Model code which needs
+the layer to be up to date must call `PaintingWorker.flush()` first.
+`lib.document.Document` does this whenever pending changes are synced.
+
+"""
+
+## Imports
+
+from __future__ import division, print_function
+
+import collections
+import threading
+import logging
+
+from gi.repository import GLib
+
+from lib.helpers import Rect
+
+
+logger = logging.getLogger(__name__)
+
+
+## Class defs
+
+
+class PaintJob (object):
+    """Stroke events to be painted onto a layer by the worker"""
+
+    def __init__(self, layer, brush, events, reset_brush=False):
+        """Initialize
+
+        :param lib.layer.data.SimplePaintingLayer layer: Target layer
+        :param lib.brush.Brush brush: Brush to paint with
+        :param list events: Input event data, as tuples of the args to
+            the layer's `stroke_to()` which follow the brush
+        :param bool reset_brush: Reset the brush before painting
+
+        """
+        super(PaintJob, self).__init__()
+        self.layer = layer
+        self.brush = brush
+        self.events = events
+        self.reset_brush = reset_brush
+        #: Set once the job has been painted (or has failed)
+        self.done = False
+        #: Set if any of the events said the stroke should be split
+        self.split = False
+
+    def _run(self, publish):
+        """Paint the job's events (worker thread)"""
+        if self.reset_brush:
+            self.brush.reset()
+        events = self.events
+        i = 0
+        while i < len(events):
+            n, split = self.layer.stroke_to_batch(
+                self.brush,
+                events[i:],
+                publish=publish,
+            )
+            self.split = self.split or split
+            i += n
+
+
+class PaintingWorker (object):
+    """Paints submitted jobs, in order, on a dedicated thread"""
+
+    def __init__(self):
+        super(PaintingWorker, self).__init__()
+        self._jobs = collections.deque()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopping = False
+        # Completion tracking, for flush()
+        self._submitted = 0
+        self._finished = 0
+        self._finished_cond = threading.Condition()
+        # Changed areas waiting to be published: {id(surf): [surf, Rect]}
+        self._dirty = {}
+        self._dirty_lock = threading.Lock()
+        self._publish_scheduled = False
+
+    def submit(self, layer, brush, events, reset_brush=False):
+        """Queue stroke events for painting (main thread)
+
+        :returns: The new job
+        :rtype: PaintJob
+
+        See `PaintJob` for the parameters. The job's `done` and `split`
+        flags can be polled to find out how painting went.
+
+        """
+        job = PaintJob(layer, brush, events, reset_brush=reset_brush)
+        self._submitted += 1
+        self._jobs.append(job)
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._worker,
+                name="PaintingWorker",
+            )
+            self._thread.daemon = True
+            self._thread.start()
+        self._wakeup.set()
+        return job
+
+    @property
+    def busy(self):
+        """True if any submitted jobs are not yet done"""
+        return self._finished < self._submitted
+
+    def flush(self):
+        """Wait for all submitted jobs to be painted (main thread)
+
+        Changed areas are published straight away, rather than waiting
+        for the idle callback.
+
+        """
+        with self._finished_cond:
+            while self._finished < self._submitted:
+                self._finished_cond.wait()
+        self._publish_cb()
+
+    def stop(self):
+        """Finish painting the submitted jobs, then end the thread"""
+        self.flush()
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        thread.join()
+        self._thread = None
+        self._stopping = False
+
+    def _worker(self):
+        """Worker thread main loop"""
+        while not self._stopping:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            while self._jobs:
+                job = self._jobs.popleft()
+                try:
+                    job._run(self._publish)
+                except Exception:
+                    logger.exception("Painting failed for %r", job)
+                job.done = True
+                with self._finished_cond:
+                    self._finished += 1
+                    self._finished_cond.notify_all()
+
+    def _publish(self, surface, x, y, w, h):
+        """Collect a changed area for publishing (worker thread)"""
+        with self._dirty_lock:
+            entry = self._dirty.get(id(surface))
+            if entry is None:
+                self._dirty[id(surface)] = [surface, Rect(x, y, w, h)]
+            else:
+                entry[1].expand_to_include_rect(Rect(x, y, w, h))
+            if self._publish_scheduled:
+                return
+            self._publish_scheduled = True
+        GLib.idle_add(self._publish_cb, priority=GLib.PRIORITY_HIGH_IDLE)
+
+    def _publish_cb(self):
+        """Notify observers about the changed areas (main thread)"""
+        with self._dirty_lock:
+            dirty = self._dirty
+            self._dirty = {}
+            self._publish_scheduled = False
+        for surface, rect in dirty.values():
+            surface.notify_observers(*rect)
+        return False
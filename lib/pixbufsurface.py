@@ -14,6 +14,8 @@ from __future__ import division, print_function
 import contextlib
 from logging import getLogger
 
+import numpy as np
+
 from gi.repository import GdkPixbuf
 from gi.repository import Gdk
 import cairo
@@ -187,6 +189,117 @@ class Surface (TileAccessible, TileBlittable):
         pixbuf.copy_area(0, 0, self.w, self.h, self.epixbuf, dx, dy)
 
 
+class CairoSurface (TileAccessible, TileBlittable):
+    """Wrapper for a Cairo image surface, with memory accessible by tile.
+
+    Like `Surface`, but the pixels live in a tile-aligned
+    cairo.ImageSurface in Cairo's ARGB32 format. Renderers can write
+    into it directly, and Cairo can paint from it without the extra
+    conversion and copy that `Gdk.cairo_set_source_pixbuf()` needs.
+
+    The tile arrays are NxNx4 uint8 views, but their pixels are
+    premultiplied native-endian ARGB32 words rather than RGBA bytes.
+    The `argb32` attribute tells renderers to convert accordingly.
+    After writing to the tiles, call `mark_dirty()` before letting
+    Cairo use the image surface.
+
+    """
+
+    #: Tile arrays hold Cairo ARGB32 pixels, not RGBA.
+    argb32 = True
+
+    def __init__(self, x, y, w, h, image_surface=None):
+        """Initialize, optionally reusing an existing image surface
+
+        :param int x: Left edge of the area to cover
+        :param int y: Top edge of the area to cover
+        :param int w: Width of the area to cover
+        :param int h: Height of the area to cover
+        :param cairo.ImageSurface image_surface: ARGB32 surface to
+            reuse. It must be at least as big as the tile-aligned area,
+            which is placed at its top left. All of it is cleared.
+
+        """
+        super(CairoSurface, self).__init__()
+        assert w > 0 and h > 0
+        self.x, self.y, self.w, self.h = x, y, w, h
+        tx = self.tx = x // N
+        ty = self.ty = y // N
+        self.ex = tx * N
+        self.ey = ty * N
+        tw = (x + w - 1) // N - tx + 1
+        th = (y + h - 1) // N - ty + 1
+        self.ew = tw * N
+        self.eh = th * N
+
+        reused = image_surface is not None
+        if not reused:
+            try:
+                image_surface = cairo.ImageSurface(
+                    cairo.FORMAT_ARGB32,
+                    self.ew, self.eh,
+                )
+            except Exception:
+                logger.exception("cairo.ImageSurface() failed")
+                raise AllocationError(_POSSIBLE_OOM_USERTEXT)
+        else:
+            assert image_surface.get_format() == cairo.FORMAT_ARGB32
+            assert image_surface.get_width() >= self.ew
+            assert image_surface.get_height() >= self.eh
+        image_surface.flush()
+        self.image_surface = image_surface
+
+        # Make it accessible by tile
+        stride = image_surface.get_stride()
+        arr = np.ndarray(
+            shape=(image_surface.get_height(), image_surface.get_width(), 4),
+            dtype='uint8',
+            buffer=image_surface.get_data(),
+            strides=(stride, 4, 1),
+        )
+        if reused:
+            arr[...] = 0
+        arr = arr[:self.eh, :self.ew, :]
+        self.tile_memory_dict = {}
+        for ty in range(th):
+            for tx in range(tw):
+                buf = arr[ty * N:(ty + 1) * N, tx * N:(tx + 1) * N, :]
+                self.tile_memory_dict[(self.tx + tx, self.ty + ty)] = buf
+
+    def fits(self, x, y, w, h):
+        """True if the image surface is big enough to cover an area"""
+        ew = ((x + w - 1) // N - x // N + 1) * N
+        eh = ((y + h - 1) // N - y // N + 1) * N
+        return (
+            self.image_surface.get_width() >= ew
+            and self.image_surface.get_height() >= eh
+        )
+
+    def get_bbox(self):
+        return lib.surface.get_tiles_bbox(self.get_tiles())
+
+    def get_tiles(self):
+        return self.tile_memory_dict
+
+    @contextlib.contextmanager
+    def tile_request(self, tx, ty, readonly):
+        """Access memory by tile (lib.surface.TileAccessible impl.)"""
+        yield self.tile_memory_dict[(tx, ty)]
+
+    def blit_tile_into(self, dst, dst_has_alpha, tx, ty):
+        assert dst.dtype == 'uint16', '16 bit dst expected'
+        src = self.tile_memory_dict[(tx, ty)]
+        mypaintlib.tile_convert_argb32_to_rgba16(src, dst)
+
+    def mark_dirty(self):
+        """Tell Cairo that the pixels were changed via the tiles"""
+        self.image_surface.mark_dirty()
+
+    def set_source(self, cr):
+        """Set the surface as a Cairo context's source, in place"""
+        cr.set_source_surface(self.image_surface, self.ex, self.ey)
+
+
 def render_as_pixbuf(surface, x=None, y=None, w=None, h=None,
                      alpha=False, mipmap_level=0,
                      progress=None,
@@ -17,6 +17,9 @@
 
 #include <glib.h>
 
+#include <vector>
+#include <string.h>
+
 #define NPY_NO_DEPRECATED_API NPY_1_7_API_VERSION
 #define NO_IMPORT_ARRAY
 #include <numpy/arrayobject.h>
@@ -67,6 +70,82 @@ void tile_downscale_rgba16(PyObject *src, PyObject *dst, int dst_x, int dst_y) {
 }
 
 
+// Fetches the data pointers from a sequence of job tuples of tile arrays,
+// with NULLs for Nones. Returns false with a Python exception set if the
+// argument isn't a sequence.
+
+static bool
+_tile_batch_get_data(PyObject *jobs, const int njobitems,
+                     std::vector<uint16_t *> &ptrs)
+{
+  PyObject *seq = PySequence_Fast(jobs, "jobs must be a sequence");
+  if (! seq) {
+    return false;
+  }
+  const int njobs = PySequence_Fast_GET_SIZE(seq);
+  ptrs.assign(njobs * njobitems, (uint16_t *)NULL);
+  for (int i=0; i<njobs; i++) {
+    PyObject *job = PySequence_Fast_GET_ITEM(seq, i);
+#ifdef HEAVY_DEBUG
+    assert(PySequence_Check(job));
+    assert(PySequence_Size(job) == njobitems);
+#endif
+    for (int j=0; j<njobitems; j++) {
+      PyObject *item = PySequence_GetItem(job, j);
+      if (item != Py_None) {
+        PyArrayObject* arr = ((PyArrayObject*)item);
+#ifdef HEAVY_DEBUG
+        assert(PyArray_Check(item));
+        assert(PyArray_DIM(arr, 0) == MYPAINT_TILE_SIZE);
+        assert(PyArray_DIM(arr, 1) == MYPAINT_TILE_SIZE);
+        assert(PyArray_DIM(arr, 2) == 4);
+        assert(PyArray_TYPE(arr) == NPY_UINT16);
+        assert(PyArray_ISCARRAY(arr));
+#endif
+        ptrs[i*njobitems + j] = (uint16_t *)PyArray_DATA(arr);
+      }
+      Py_DECREF(item);  // still referenced by the job
+    }
+  }
+  Py_DECREF(seq);
+  return true;
+}
+
+
+void tile_downscale_batch(PyObject *jobs) {
+  const int N = MYPAINT_TILE_SIZE;
+  const int stride = N * 4 * sizeof(uint16_t);
+  std::vector<uint16_t *> ptrs;
+  if (! _tile_batch_get_data(jobs, 5, ptrs)) {
+    return;
+  }
+  const int njobs = ptrs.size() / 5;
+
+  Py_BEGIN_ALLOW_THREADS
+#pragma omp parallel for
+  for (int i=0; i<njobs; i++) {
+    uint16_t *dst = ptrs[i*5];
+    if (! dst) {
+      continue;
+    }
+    for (int q=0; q<4; q++) {
+      const uint16_t *src = ptrs[i*5 + 1 + q];
+      const int dst_x = (q % 2) * (N/2);
+      const int dst_y = (q / 2) * (N/2);
+      if (src) {
+        tile_downscale_rgba16_c(src, stride, dst, stride, dst_x, dst_y);
+      }
+      else {
+        for (int y=0; y<N/2; y++) {
+          memset(dst + ((dst_y + y)*N + dst_x)*4, 0, (N/2)*4*sizeof(uint16_t));
+        }
+      }
+    }
+  }
+  Py_END_ALLOW_THREADS
+}
+
+
 void tile_copy_rgba16_into_rgba16_c(const uint16_t *src, uint16_t *dst) {
   memcpy(dst, src, MYPAINT_TILE_SIZE*MYPAINT_TILE_SIZE*4*sizeof(uint16_t));
 }
@@ -128,6 +207,57 @@ void tile_clear_rgba8(PyObject * dst) {
   }
 }
 
+// Copies one row segment, or clears it if there's no source tile.
+
+static inline void
+_tile_translate_row(uint16_t *dst, const uint16_t *src, int n)
+{
+  if (n <= 0) {
+    return;
+  }
+  if (src) {
+    memcpy(dst, src, n*4*sizeof(uint16_t));
+  }
+  else {
+    memset(dst, 0, n*4*sizeof(uint16_t));
+  }
+}
+
+
+void tile_translate_batch(PyObject *jobs, int dx, int dy) {
+  const int N = MYPAINT_TILE_SIZE;
+  dx = MAX(0, MIN(N-1, dx));
+  dy = MAX(0, MIN(N-1, dy));
+
+  // Collect the pixel pointers while we hold the GIL.
+  std::vector<uint16_t *> ptrs;
+  if (! _tile_batch_get_data(jobs, 5, ptrs)) {
+    return;
+  }
+  const int njobs = ptrs.size() / 5;
+
+  Py_BEGIN_ALLOW_THREADS
+#pragma omp parallel for
+  for (int i=0; i<njobs; i++) {
+    uint16_t *dst = ptrs[i*5];
+    if (! dst) {
+      continue;
+    }
+    for (int y=0; y<N; y++) {
+      // Row within the 2Nx2N block of sources
+      const int by = y + N - dy;
+      const uint16_t *w = ptrs[i*5 + ((by < N) ? 1 : 3)];
+      const uint16_t *e = ptrs[i*5 + ((by < N) ? 2 : 4)];
+      const int sy = by % N;
+      uint16_t *dst_row = dst + y*N*4;
+      _tile_translate_row(dst_row, w ? (w + (sy*N + N - dx)*4) : NULL, dx);
+      _tile_translate_row(dst_row + dx*4, e ? (e + sy*N*4) : NULL, N - dx);
+    }
+  }
+  Py_END_ALLOW_THREADS
+}
+
+
 void tile_clear_rgba16(PyObject * dst) {
   PyArrayObject* dst_arr = ((PyArrayObject*)dst);
 
@@ -427,6 +557,164 @@ void tile_convert_rgba8_to_rgba16(PyObject * src, PyObject * dst) {
 }
 
 
+// Cairo's ARGB32 format: premultiplied, each pixel a native-endian
+// 32-bit word with alpha in the top byte.
+
+static inline uint32_t
+argb32_pixel (const uint32_t r, const uint32_t g, const uint32_t b,
+              const uint32_t a)
+{
+  return (a << 24) | (r << 16) | (g << 8) | b;
+}
+
+
+void
+tile_convert_rgba16_to_argb32 (PyObject *src, PyObject *dst,
+                               bool has_alpha)
+{
+  PyArrayObject* src_arr = ((PyArrayObject*)src);
+  PyArrayObject* dst_arr = ((PyArrayObject*)dst);
+
+#ifdef HEAVY_DEBUG
+  assert(PyArray_Check(dst));
+  assert(PyArray_DIM(dst_arr, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(dst_arr, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(dst_arr, 2) == 4);
+  assert(PyArray_TYPE(dst_arr) == NPY_UINT8);
+  assert(PyArray_STRIDE(dst_arr, 1) == 4*sizeof(uint8_t));
+  assert(PyArray_STRIDE(dst_arr, 2) == sizeof(uint8_t));
+  assert(PyArray_STRIDE(dst_arr, 0) % sizeof(uint32_t) == 0);
+
+  assert(PyArray_Check(src));
+  assert(PyArray_DIM(src_arr, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(src_arr, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(src_arr, 2) == 4);
+  assert(PyArray_TYPE(src_arr) == NPY_UINT16);
+  assert(PyArray_ISBEHAVED(src_arr));
+  assert(PyArray_STRIDE(src_arr, 1) == 4*sizeof(uint16_t));
+  assert(PyArray_STRIDE(src_arr, 2) ==   sizeof(uint16_t));
+#endif
+
+  precalculate_dithering_noise_if_required();
+
+  for (int y=0; y<MYPAINT_TILE_SIZE; y++) {
+    int noise_idx = y*MYPAINT_TILE_SIZE*4;
+    const uint16_t *src_p = (uint16_t*)((char *)PyArray_DATA(src_arr)
+                                        + y*PyArray_STRIDES(src_arr)[0]);
+    uint32_t *dst_p = (uint32_t*)((char *)PyArray_DATA(dst_arr)
+                                  + y*PyArray_STRIDES(dst_arr)[0]);
+    for (int x=0; x<MYPAINT_TILE_SIZE; x++) {
+      const uint32_t r = *src_p++;
+      const uint32_t g = *src_p++;
+      const uint32_t b = *src_p++;
+      const uint32_t a = has_alpha ? *src_p : (1<<15);
+      src_p++;
+#ifdef HEAVY_DEBUG
+      assert(a<=(1<<15));
+      assert(r<=a);
+      assert(g<=a);
+      assert(b<=a);
+#endif
+      // The data is premultiplied already, so no division is needed.
+      // The same noise for all channels keeps each colour channel
+      // at or below alpha after dithering.
+      const uint32_t add = dithering_noise[noise_idx];
+      noise_idx += 4;
+      *dst_p++ = argb32_pixel((r * 255 + add) / (1<<15),
+                              (g * 255 + add) / (1<<15),
+                              (b * 255 + add) / (1<<15),
+                              (a * 255 + add) / (1<<15));
+    }
+  }
+}
+
+
+void
+tile_convert_rgba8_to_argb32 (PyObject *src, PyObject *dst)
+{
+  PyArrayObject* src_arr = ((PyArrayObject*)src);
+  PyArrayObject* dst_arr = ((PyArrayObject*)dst);
+
+#ifdef HEAVY_DEBUG
+  assert(PyArray_Check(dst));
+  assert(PyArray_DIM(dst_arr, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(dst_arr, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(dst_arr, 2) == 4);
+  assert(PyArray_TYPE(dst_arr) == NPY_UINT8);
+  assert(PyArray_STRIDE(dst_arr, 1) == 4*sizeof(uint8_t));
+  assert(PyArray_STRIDE(dst_arr, 0) % sizeof(uint32_t) == 0);
+
+  assert(PyArray_Check(src));
+  assert(PyArray_DIM(src_arr, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(src_arr, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(src_arr, 2) == 4);
+  assert(PyArray_TYPE(src_arr) == NPY_UINT8);
+  assert(PyArray_STRIDE(src_arr, 1) == 4*sizeof(uint8_t));
+  assert(PyArray_STRIDE(src_arr, 2) ==   sizeof(uint8_t));
+#endif
+
+  for (int y=0; y<MYPAINT_TILE_SIZE; y++) {
+    const uint8_t *src_p = (uint8_t*)((char *)PyArray_DATA(src_arr)
+                                      + y*PyArray_STRIDES(src_arr)[0]);
+    uint32_t *dst_p = (uint32_t*)((char *)PyArray_DATA(dst_arr)
+                                  + y*PyArray_STRIDES(dst_arr)[0]);
+    for (int x=0; x<MYPAINT_TILE_SIZE; x++) {
+      const uint32_t r = *src_p++;
+      const uint32_t g = *src_p++;
+      const uint32_t b = *src_p++;
+      const uint32_t a = *src_p++;
+      // premultiply alpha (with rounding)
+      *dst_p++ = argb32_pixel((r * a + 255/2) / 255,
+                              (g * a + 255/2) / 255,
+                              (b * a + 255/2) / 255,
+                              a);
+    }
+  }
+}
+
+
+void
+tile_convert_argb32_to_rgba16 (PyObject *src, PyObject *dst)
+{
+  PyArrayObject* src_arr = ((PyArrayObject*)src);
+  PyArrayObject* dst_arr = ((PyArrayObject*)dst);
+
+#ifdef HEAVY_DEBUG
+  assert(PyArray_Check(dst));
+  assert(PyArray_DIM(dst_arr, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(dst_arr, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(dst_arr, 2) == 4);
+  assert(PyArray_TYPE(dst_arr) == NPY_UINT16);
+  assert(PyArray_ISBEHAVED(dst_arr));
+  assert(PyArray_STRIDE(dst_arr, 1) == 4*sizeof(uint16_t));
+  assert(PyArray_STRIDE(dst_arr, 2) ==   sizeof(uint16_t));
+
+  assert(PyArray_Check(src));
+  assert(PyArray_DIM(src_arr, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(src_arr, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(src_arr, 2) == 4);
+  assert(PyArray_TYPE(src_arr) == NPY_UINT8);
+  assert(PyArray_STRIDE(src_arr, 1) == 4*sizeof(uint8_t));
+  assert(PyArray_STRIDE(src_arr, 0) % sizeof(uint32_t) == 0);
+#endif
+
+  for (int y=0; y<MYPAINT_TILE_SIZE; y++) {
+    const uint32_t *src_p = (uint32_t*)((char *)PyArray_DATA(src_arr)
+                                        + y*PyArray_STRIDES(src_arr)[0]);
+    uint16_t *dst_p = (uint16_t*)((char *)PyArray_DATA(dst_arr)
+                                  + y*PyArray_STRIDES(dst_arr)[0]);
+    for (int x=0; x<MYPAINT_TILE_SIZE; x++) {
+      const uint32_t px = *src_p++;
+      // convert to fixed point (with rounding), already premultiplied
+      *dst_p++ = (((px >> 16) & 0xff) * (1<<15) + 255/2) / 255;
+      *dst_p++ = (((px >> 8) & 0xff) * (1<<15) + 255/2) / 255;
+      *dst_p++ = ((px & 0xff) * (1<<15) + 255/2) / 255;
+      *dst_p++ = ((px >> 24) * (1<<15) + 255/2) / 255;
+    }
+  }
+}
+
+
 void tile_rgba2flat(PyObject * dst_obj, PyObject * bg_obj) {
   PyArrayObject* bg = ((PyArrayObject*)bg_obj);
   PyArrayObject* dst = ((PyArrayObject*)dst_obj);
@@ -530,6 +818,218 @@ void tile_flat2rgba(PyObject * dst_obj, PyObject * bg_obj) {
 }
 
 
+int tile_mask_equal_pixels(PyObject *a_obj, PyObject *b_obj,
+                           PyObject *mask_obj) {
+  PyArrayObject *a = (PyArrayObject *)a_obj;
+  PyArrayObject *b = (PyArrayObject *)b_obj;
+  PyArrayObject *mask = (PyArrayObject *)mask_obj;
+#ifdef HEAVY_DEBUG
+  assert(PyArray_Check(a_obj));
+  assert(PyArray_DIM(a, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(a, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(a, 2) == 4);
+  assert(PyArray_TYPE(a) == NPY_UINT16);
+  assert(PyArray_ISCARRAY(a));
+
+  assert(PyArray_Check(b_obj));
+  assert(PyArray_DIM(b, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(b, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(b, 2) == 4);
+  assert(PyArray_TYPE(b) == NPY_UINT16);
+  assert(PyArray_ISCARRAY(b));
+
+  assert(PyArray_Check(mask_obj));
+  assert(PyArray_DIM(mask, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(mask, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_TYPE(mask) == NPY_UINT8);
+  assert(PyArray_ISCARRAY(mask));
+#endif
+
+  const uint16_t *a_p = (const uint16_t *)PyArray_DATA(a);
+  const uint16_t *b_p = (const uint16_t *)PyArray_DATA(b);
+  uint8_t *mask_p = (uint8_t *)PyArray_DATA(mask);
+  int count = 0;
+
+  Py_BEGIN_ALLOW_THREADS
+  for (int i=0; i<MYPAINT_TILE_SIZE*MYPAINT_TILE_SIZE; i++) {
+    if (mask_p[i]) {
+      // Compare all four channels at once.
+      if (memcmp(a_p, b_p, 4*sizeof(uint16_t)) == 0) {
+        count++;
+      }
+      else {
+        mask_p[i] = 0;
+      }
+    }
+    a_p += 4;
+    b_p += 4;
+  }
+  Py_END_ALLOW_THREADS
+
+  return count;
+}
+
+
+void tile_copy_masked(PyObject *src_obj, PyObject *dst_obj,
+                      PyObject *mask_obj, bool invert) {
+  PyArrayObject *src = (PyArrayObject *)src_obj;
+  PyArrayObject *dst = (PyArrayObject *)dst_obj;
+  PyArrayObject *mask = (PyArrayObject *)mask_obj;
+#ifdef HEAVY_DEBUG
+  assert(PyArray_Check(src_obj));
+  assert(PyArray_DIM(src, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(src, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(src, 2) == 4);
+  assert(PyArray_TYPE(src) == NPY_UINT16);
+  assert(PyArray_ISCARRAY(src));
+
+  assert(PyArray_Check(dst_obj));
+  assert(PyArray_DIM(dst, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(dst, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(dst, 2) == 4);
+  assert(PyArray_TYPE(dst) == NPY_UINT16);
+  assert(PyArray_ISCARRAY(dst));
+
+  assert(PyArray_Check(mask_obj));
+  assert(PyArray_DIM(mask, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(mask, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_TYPE(mask) == NPY_UINT8);
+  assert(PyArray_ISCARRAY(mask));
+#endif
+
+  const uint16_t *src_p = (const uint16_t *)PyArray_DATA(src);
+  uint16_t *dst_p = (uint16_t *)PyArray_DATA(dst);
+  const uint8_t *mask_p = (const uint8_t *)PyArray_DATA(mask);
+
+  Py_BEGIN_ALLOW_THREADS
+  for (int i=0; i<MYPAINT_TILE_SIZE*MYPAINT_TILE_SIZE; i++) {
+    const bool keep = ((mask_p[i] != 0) != invert);
+    if (! keep) {
+      dst_p[0] = dst_p[1] = dst_p[2] = dst_p[3] = 0;
+    }
+    else if (dst_p != src_p) {
+      memcpy(dst_p, src_p, 4*sizeof(uint16_t));
+    }
+    src_p += 4;
+    dst_p += 4;
+  }
+  Py_END_ALLOW_THREADS
+}
+
+
+void tile_apply_channel_lut(PyObject *dst_obj, PyObject *lut_obj) {
+  PyArrayObject *dst = (PyArrayObject *)dst_obj;
+  PyArrayObject *lut = (PyArrayObject *)lut_obj;
+#ifdef HEAVY_DEBUG
+  assert(PyArray_Check(dst_obj));
+  assert(PyArray_DIM(dst, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(dst, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(dst, 2) == 4);
+  assert(PyArray_TYPE(dst) == NPY_UINT8);
+  assert(PyArray_STRIDE(dst, 1) == 4*sizeof(uint8_t));
+  assert(PyArray_STRIDE(dst, 2) ==   sizeof(uint8_t));
+
+  assert(PyArray_Check(lut_obj));
+  assert(PyArray_DIM(lut, 0) == 3);
+  assert(PyArray_DIM(lut, 1) == 256);
+  assert(PyArray_TYPE(lut) == NPY_UINT8);
+  assert(PyArray_ISCARRAY(lut));
+#endif
+
+  const uint8_t *lut_r = (const uint8_t *)PyArray_DATA(lut);
+  const uint8_t *lut_g = lut_r + 256;
+  const uint8_t *lut_b = lut_g + 256;
+
+  Py_BEGIN_ALLOW_THREADS
+  for (int y=0; y<MYPAINT_TILE_SIZE; y++) {
+    uint8_t *dst_p = (uint8_t *)((char *)PyArray_DATA(dst)
+                                 + y*PyArray_STRIDES(dst)[0]);
+    for (int x=0; x<MYPAINT_TILE_SIZE; x++) {
+      dst_p[0] = lut_r[dst_p[0]];
+      dst_p[1] = lut_g[dst_p[1]];
+      dst_p[2] = lut_b[dst_p[2]];
+      dst_p += 4;
+    }
+  }
+  Py_END_ALLOW_THREADS
+}
+
+
+void tile_apply_lut3d(PyObject *dst_obj, PyObject *lut_obj) {
+  PyArrayObject *dst = (PyArrayObject *)dst_obj;
+  PyArrayObject *lut = (PyArrayObject *)lut_obj;
+#ifdef HEAVY_DEBUG
+  assert(PyArray_Check(dst_obj));
+  assert(PyArray_DIM(dst, 0) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(dst, 1) == MYPAINT_TILE_SIZE);
+  assert(PyArray_DIM(dst, 2) == 4);
+  assert(PyArray_TYPE(dst) == NPY_UINT8);
+  assert(PyArray_STRIDE(dst, 1) == 4*sizeof(uint8_t));
+  assert(PyArray_STRIDE(dst, 2) ==   sizeof(uint8_t));
+
+  assert(PyArray_Check(lut_obj));
+  assert(PyArray_NDIM(lut) == 4);
+  assert(PyArray_DIM(lut, 0) >= 2);
+  assert(PyArray_DIM(lut, 0) <= 256);
+  assert(PyArray_DIM(lut, 1) == PyArray_DIM(lut, 0));
+  assert(PyArray_DIM(lut, 2) == PyArray_DIM(lut, 0));
+  assert(PyArray_DIM(lut, 3) == 3);
+  assert(PyArray_TYPE(lut) == NPY_UINT8);
+  assert(PyArray_ISCARRAY(lut));
+#endif
+
+  const int size = PyArray_DIM(lut, 0);
+  const uint8_t *lut_p = (const uint8_t *)PyArray_DATA(lut);
+
+  // Lattice cell and position within it, for each 8bpp value.
+  // Positions are in 255ths, so the weights stay integral.
+  int cell[256];
+  uint32_t frac[256];
+  for (int v=0; v<256; v++) {
+    const int pos = v * (size-1);
+    cell[v] = pos / 255;
+    frac[v] = pos % 255;
+    if (cell[v] == size-1) {
+      cell[v] = size-2;
+      frac[v] = 255;
+    }
+  }
+  const int step_b = 3;
+  const int step_g = step_b * size;
+  const int step_r = step_g * size;
+
+  Py_BEGIN_ALLOW_THREADS
+  for (int y=0; y<MYPAINT_TILE_SIZE; y++) {
+    uint8_t *dst_p = (uint8_t *)((char *)PyArray_DATA(dst)
+                                 + y*PyArray_STRIDES(dst)[0]);
+    for (int x=0; x<MYPAINT_TILE_SIZE; x++) {
+      const uint32_t fr = frac[dst_p[0]];
+      const uint32_t fg = frac[dst_p[1]];
+      const uint32_t fb = frac[dst_p[2]];
+      const uint8_t *c000 = lut_p + cell[dst_p[0]]*step_r
+                                  + cell[dst_p[1]]*step_g
+                                  + cell[dst_p[2]]*step_b;
+      for (int c=0; c<3; c++) {
+        // Interpolate along b, then g, then r. The largest sum is
+        // 255**4, which still fits in 32 bits.
+        const uint8_t *p = c000 + c;
+        const uint32_t c00 = p[0]*(255-fb) + p[step_b]*fb;
+        const uint32_t c01 = p[step_g]*(255-fb) + p[step_g+step_b]*fb;
+        const uint32_t c10 = p[step_r]*(255-fb) + p[step_r+step_b]*fb;
+        const uint32_t c11 = p[step_r+step_g]*(255-fb)
+                           + p[step_r+step_g+step_b]*fb;
+        const uint32_t c0 = c00*(255-fg) + c01*fg;
+        const uint32_t c1 = c10*(255-fg) + c11*fg;
+        const uint32_t sum = c0*(255-fr) + c1*fr;
+        dst_p[c] = (sum + (255*255*255)/2) / (255*255*255);
+      }
+      dst_p += 4;
+    }
+  }
+  Py_END_ALLOW_THREADS
+}
+
+
 void tile_perceptual_change_strokemap(PyObject * a_obj, PyObject * b_obj, PyObject * res_obj) {
 
   PyArrayObject *a = (PyArrayObject *)a_obj;
@@ -746,6 +1246,11 @@ tile_combine (enum CombineMode mode,
         return;
     }
     const TileDataCombineOp *op = combine_mode_info[mode];
+
+    // The caller holds references to both arrays, so the pixel data
+    // stays put while other Python threads run (see lib.tilebatch).
+    Py_BEGIN_ALLOW_THREADS
     op->combine_data(src_p, dst_p, dst_has_alpha, src_opacity);
+    Py_END_ALLOW_THREADS
 }
 
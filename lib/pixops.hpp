@@ -20,6 +20,14 @@
 void tile_downscale_rgba16(PyObject *src, PyObject *dst, int dst_x, int dst_y);
 
 
+// Builds a batch of mipmap tiles, each from the 2x2 block of tiles under
+// it at the next level down. "jobs" is a sequence of (dst, nw, ne, sw, se)
+// tuples of tile arrays, where sources may be None (transparent). Jobs
+// run in parallel, without the GIL.
+
+void tile_downscale_batch(PyObject *jobs);
+
+
 // Used to e.g. copy the background before starting to composite over it
 //
 // Simple array copying (numpy assignment operator) is about 13 times slower,
@@ -29,6 +37,16 @@ void tile_downscale_rgba16(PyObject *src, PyObject *dst, int dst_x, int dst_y);
 void tile_copy_rgba16_into_rgba16(PyObject *src, PyObject *dst);
 
 
+// Assembles translated tiles from 2x2 blocks of source tiles, for layer
+// moves. "jobs" is a sequence of (dst, nw, ne, sw, se) tuples of tile
+// arrays; sources may be None, meaning transparent. The pixel at (x, y)
+// in dst is taken from (x + N - dx, y + N - dy) in the 2Nx2N block. The
+// offsets must be in the range [0, N). Jobs run in parallel, without
+// the GIL.
+
+void tile_translate_batch(PyObject *jobs, int dx, int dy);
+
+
 // Clears a tile.
 // This zeroes the alpha channel too, so using it on rgbu data
 // may have unexpected consequences.
@@ -54,6 +72,25 @@ void tile_convert_rgbu16_to_rgbu8(PyObject *src, PyObject *dst);
 void tile_convert_rgba8_to_rgba16(PyObject *src, PyObject *dst);
 
 
+// Converts a 15ish-bit tile array to Cairo's premultiplied ARGB32,
+// as accessed via an NxNx4 uint8 view of a cairo.ImageSurface.
+// Without alpha, the alpha channel is ignored and output as opaque.
+// Used for rendering straight into Cairo surfaces for the display.
+
+void tile_convert_rgba16_to_argb32(PyObject *src, PyObject *dst,
+                                   bool has_alpha);
+
+
+// Converts 8bpp RGBA (non-premultiplied) to Cairo's ARGB32.
+
+void tile_convert_rgba8_to_argb32(PyObject *src, PyObject *dst);
+
+
+// Converts Cairo's ARGB32 back to a 15ish-bit tile array.
+
+void tile_convert_argb32_to_rgba16(PyObject *src, PyObject *dst);
+
+
 // Flatten a premultiplied rgba layer, using "bg" as background.
 // (bg is assumed to be flat, bg.alpha is ignored)
 //
@@ -73,6 +110,39 @@ void tile_rgba2flat(PyObject *dst_obj, PyObject *bg_obj);
 void tile_flat2rgba(PyObject * dst_obj, PyObject * bg_obj);
 
 
+// Compares two fix15 RGBA tiles pixel by pixel, and clears the entries in
+// an NxN uint8 mask where any channel differs. Entries already clear are
+// not compared. Returns the number of entries still set afterwards. Used
+// for Uniquify and Refactor, where a mask starting out all ones can be
+// narrowed down by several comparisons in turn.
+
+int tile_mask_equal_pixels(PyObject *a_obj, PyObject *b_obj,
+                           PyObject *mask_obj);
+
+
+// Copies the pixels of src where an NxN uint8 mask is set (or clear, if
+// "invert" is true) into dst, and zeroes the others. src and dst may be
+// the same tile, which erases the pixels not selected in place.
+
+void tile_copy_masked(PyObject *src_obj, PyObject *dst_obj,
+                      PyObject *mask_obj, bool invert);
+
+
+// Display filters for 8bpp RGBA tiles (non-premultiplied), applied in
+// place. Alpha is left unchanged. The tiles may be views with padded
+// rows, such as those of a GdkPixbuf.
+//
+// tile_apply_channel_lut() maps each color channel through its own row
+// of a 3x256 uint8 lookup table. tile_apply_lut3d() looks colors up in
+// an SxSxSx3 uint8 table, indexed [r][g][b], whose lattice spans 0..255
+// in each dimension. Colors between lattice points are interpolated
+// trilinearly.
+
+void tile_apply_channel_lut(PyObject *dst_obj, PyObject *lut_obj);
+
+void tile_apply_lut3d(PyObject *dst_obj, PyObject *lut_obj);
+
+
 // Calculates a 1-bit bitmap of the stroke shape using two snapshots of the
 // layer (the layer before and after the stroke). Used in strokemap.py
 //
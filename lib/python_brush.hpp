@@ -44,6 +44,47 @@ public:
     }
   }
 
+  // Set every setting's base value and input mappings in one go, from
+  // the arrays made by lib.brush.BrushInfo.get_engine_arrays(): base
+  // values (float32, [settings]), mapping point counts (int32,
+  // [settings, inputs]), and the points (float32, [settings, inputs,
+  // points, 2]).
+  void set_settings_from_arrays (PyObject * base_obj, PyObject * counts_obj, PyObject * points_obj)
+  {
+    PyArrayObject* base = (PyArrayObject*)base_obj;
+    PyArrayObject* counts = (PyArrayObject*)counts_obj;
+    PyArrayObject* points = (PyArrayObject*)points_obj;
+    assert(PyArray_ISCARRAY_RO(base) && PyArray_NDIM(base) == 1);
+    assert(PyArray_ISCARRAY_RO(counts) && PyArray_NDIM(counts) == 2);
+    assert(PyArray_ISCARRAY_RO(points) && PyArray_NDIM(points) == 4);
+    assert(PyArray_TYPE(base) == NPY_FLOAT32);
+    assert(PyArray_TYPE(counts) == NPY_INT32);
+    assert(PyArray_TYPE(points) == NPY_FLOAT32);
+    const int n_settings = PyArray_DIM(base, 0);
+    const int n_inputs = PyArray_DIM(counts, 1);
+    const int n_points = PyArray_DIM(points, 2);
+    assert(PyArray_DIM(counts, 0) == n_settings);
+    assert(PyArray_DIM(points, 0) == n_settings);
+    assert(PyArray_DIM(points, 1) == n_inputs);
+    assert(PyArray_DIM(points, 3) == 2);
+    const npy_float32 * base_p = (npy_float32*)PyArray_DATA(base);
+    const npy_int32 * counts_p = (npy_int32*)PyArray_DATA(counts);
+    const npy_float32 * points_p = (npy_float32*)PyArray_DATA(points);
+    for (int s=0; s<n_settings && s<MYPAINT_BRUSH_SETTINGS_COUNT; s++) {
+      set_base_value(s, base_p[s]);
+      for (int i=0; i<n_inputs && i<MYPAINT_BRUSH_INPUTS_COUNT; i++) {
+        const int si = s*n_inputs + i;
+        int n = counts_p[si];
+        if (n > n_points) n = n_points;
+        set_mapping_n(s, i, n);
+        const npy_float32 * p = points_p + si*n_points*2;
+        for (int j=0; j<n; j++) {
+          set_mapping_point(s, i, j, p[j*2], p[j*2+1]);
+        }
+      }
+    }
+  }
+
   // Same as Brush::stroke_to() but with minimal exception handling:
   // don't indicate that a split is pending should an exception happen
   // in the surface code (e.g. out-of-memory)
@@ -0,0 +1,275 @@
+# This file is part of MyPaint.
+# Copyright (C) 2018 by the MyPaint Development Team
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+
+"""Startup time profiling: import times, and startup milestones
+
+Profiling is switched on by the launch script when the environment
+variable ``MYPAINT_STARTUP_PROFILE`` is set. Its value names the file
+the report is written to when the first canvas frame has been drawn,
+or use "-" to print a summary to stderr instead. While profiling is
+active, every module import is timed, and the app's startup code
+records milestones with `mark()`.
+
+The report is JSON. It contains the milestones, as seconds since the
+launch script started, and the modules imported during startup, with
+the time spent importing each. An import's "self" time excludes the
+time spent importing the modules it imported in turn.
+
+See also: tests/startup.py, which runs the app and summarizes the
+reports from several cold starts.
+
+This module must only import from the standard library.
+
+"""
+
+## Imports
+
+from __future__ import division, print_function
+
+import os
+import sys
+import time
+import json
+import logging
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+
+logger = logging.getLogger(__name__)
+
+
+## Module constants
+
+#: Environment variable which switches on startup profiling
+ENV_VAR = "MYPAINT_STARTUP_PROFILE"
+
+
+## Class defs
+
+
+class ImportTimer (object):
+    """Times module imports, by wrapping the built-in __import__()
+
+    >>> timer = ImportTimer()
+    >>> timer.install()
+    >>> _ = sys.modules.pop("colorsys", None)
+    >>> import colorsys
+    >>> timer.uninstall()
+    >>> [r["module"] for r in timer.get_records()]
+    ['colorsys']
+    >>> r = timer.get_records()[0]
+    >>> 0 <= r["self"] <= r["total"]
+    True
+
+    Only modules which weren't loaded already are recorded.
+
+    """
+
+    def __init__(self):
+        super(ImportTimer, self).__init__()
+        self._orig_import = None
+        self._records = []  # [(module_names, total, self)]
+        self._child_times = []  # stack of accumulators
+
+    def install(self):
+        """Start timing imports"""
+        if self._orig_import is not None:
+            return
+        self._orig_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        """Stop timing imports"""
+        if self._orig_import is None:
+            return
+        builtins.__import__ = self._orig_import
+        self._orig_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(),
+                level=0):
+        """Replacement __import__(): times loads of new modules"""
+        orig_import = self._orig_import
+        new_names = self._get_new_module_names(name, globals, fromlist,
+                                               level)
+        if not new_names:
+            return orig_import(name, globals, locals, fromlist, level)
+        self._child_times.append(0.0)
+        t0 = time.time()
+        try:
+            return orig_import(name, globals, locals, fromlist, level)
+        finally:
+            total = time.time() - t0
+            children = self._child_times.pop()
+            if self._child_times:
+                self._child_times[-1] += total
+            loaded = [n for n in new_names if n in sys.modules]
+            if loaded:
+                self._records.append((loaded, total, total - children))
+
+    @staticmethod
+    def _get_new_module_names(name, globals, fromlist, level):
+        """Names of the modules an import might load which aren't loaded"""
+        if level > 0 and globals:
+            package = globals.get("__package__")
+            if package is None:
+                package = globals.get("__name__", "")
+                if "__path__" not in globals:
+                    package = package.rpartition(".")[0]
+            for i in range(1, level):
+                package = package.rpartition(".")[0]
+            name = ".".join(n for n in (package, name) if n)
+        elif level < 0:  # Python 2's implicit relative imports
+            return [name] if name not in sys.modules else []
+        candidates = []
+        if name:
+            candidates.append(name)
+        for sub in (fromlist or ()):
+            if sub != "*":
+                candidates.append(".".join(n for n in (name, sub) if n))
+        return [n for n in candidates if n not in sys.modules]
+
+    def get_records(self):
+        """Get the imports timed so far, slowest first
+
+        :returns: dicts with "module", "total", and "self" keys
+        :rtype: list
+
+        """
+        records = []
+        for names, total, self_time in self._records:
+            records.append({
+                "module": ", ".join(names),
+                "total": total,
+                "self": self_time,
+            })
+        records.sort(key=lambda r: r["total"], reverse=True)
+        return records
+
+
+class StartupProfile (object):
+    """Startup milestones and import times, for one run of the app"""
+
+    def __init__(self, output, start_time=None):
+        """Initialize
+
+        :param str output: File to write the report to, or "-"
+        :param float start_time: When the launch script started, as
+            returned by time.time(). Defaults to now.
+
+        """
+        super(StartupProfile, self).__init__()
+        self.output = output
+        if start_time is None:
+            start_time = time.time()
+        self.start_time = start_time
+        self.milestones = []  # [(name, seconds since start)]
+        self.imports = ImportTimer()
+
+    def mark(self, name):
+        """Record that startup has reached a milestone"""
+        elapsed = time.time() - self.start_time
+        self.milestones.append((name, elapsed))
+        logger.debug("Startup milestone %r at %0.3fs", name, elapsed)
+
+    def get_report(self):
+        """Get the profile's results, as a JSON-serializable dict"""
+        return {
+            "milestones": [
+                {"name": name, "time": t}
+                for (name, t) in self.milestones
+            ],
+            "imports": self.imports.get_records(),
+        }
+
+    def write_report(self, max_imports=25):
+        """Write the report to the output file, or summarize it"""
+        report = self.get_report()
+        if self.output != "-":
+            # Write it in one go: tests/startup.py polls for the file
+            tmp_output = self.output + ".tmp"
+            with open(tmp_output, "w") as fp:
+                json.dump(report, fp, indent=2)
+            os.rename(tmp_output, self.output)
+            return
+        print("Startup milestones (seconds since launch):", file=sys.stderr)
+        for m in report["milestones"]:
+            print("  %8.3f  %s" % (m["time"], m["name"]), file=sys.stderr)
+        print("Slowest imports (total, self):", file=sys.stderr)
+        for r in report["imports"][:max_imports]:
+            print("  %8.3f %8.3f  %s" % (r["total"], r["self"], r["module"]),
+                  file=sys.stderr)
+
+
+## Module interface
+
+_profile = None
+
+
+def start(output, start_time=None):
+    """Start profiling, and begin timing imports
+
+    :param str output: File to write the report to, or "-"
+    :param float start_time: When the launch script started
+    :returns: The new profile
+    :rtype: StartupProfile
+
+    """
+    global _profile
+    _profile = StartupProfile(output, start_time=start_time)
+    _profile.imports.install()
+    _profile.mark("profiling started")
+    return _profile
+
+
+def get_profile():
+    """Get the active profile
+
+    :returns: the profile started by `start()`, or None if not active
+    :rtype: StartupProfile
+
+    """
+    return _profile
+
+
+def mark(name):
+    """Record a startup milestone, if profiling is active"""
+    if _profile is not None:
+        _profile.mark(name)
+
+
+def finish():
+    """Stop profiling, and write the report"""
+    global _profile
+    profile = _profile
+    if profile is None:
+        return
+    _profile = None
+    profile.imports.uninstall()
+    profile.mark("profiling finished")
+    try:
+        profile.write_report()
+    except (IOError, OSError):
+        logger.exception("Failed to write startup profile %r",
+                         profile.output)
+
+
+## Module testing
+
+
+def _test():
+    """Run doctest strings"""
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    _test()
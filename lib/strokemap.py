@@ -36,14 +36,53 @@ class StrokeShape (object):
     information is stored in compressed memory blocks of the size of a
     tile (for fast lookup).
 
+    Shapes loaded from a file keep the saved "v2" byte string as-is
+    until the tile map is first needed. Picking a stroke or moving its
+    layer decodes it, but saving an undecoded shape only rewrites the
+    tile headers.
+
     """
     def __init__(self):
         """Construct a new, blank StrokeShape."""
         object.__init__(self)
-        self.tasks = idletask.Processor()
-        self.strokemap = {}
+        self.tasks = idletask.Processor(name="strokemap")
+        self._strokemap = {}
+        self._raw = None  # undecoded "v2" data, or None
+        self._raw_offset = (0, 0)  # tile offset to apply to _raw
         self.brush_string = None
 
+    @property
+    def strokemap(self):
+        """The tile map, {(tx, ty): _Tile}, decoded on first access."""
+        if self._raw is not None:
+            self._decode_raw()
+        return self._strokemap
+
+    def _decode_raw(self):
+        """Decode the raw saved data into the tile map."""
+        data = self._raw
+        otx, oty = self._raw_offset
+        self._raw = None
+        for tx, ty, i, j in _iter_raw_tiles(data):
+            tile = _Tile.new_from_compressed_bitmap(data[i:j])
+            self._strokemap[tx + otx, ty + oty] = tile
+
+    def is_decoded(self):
+        """True if the tile map has been decoded from saved data.
+
+        >>> shape = StrokeShape()
+        >>> shape.init_from_string(StrokeShape._mock().save_to_string(0, 0),
+        ...                        0, 0)
+        >>> shape.is_decoded()
+        False
+        >>> bool(shape.strokemap)
+        True
+        >>> shape.is_decoded()
+        True
+
+        """
+        return self._raw is None
+
     @classmethod
     def _mock(cls):
         surf = tiledsurface.MyPaintSurface._mock()
@@ -57,30 +96,23 @@ class StrokeShape (object):
         """Build a new StrokeShape from before+after pair of snapshots.
 
         :param before: snapshot of the layer before the stroke
-        :type before: lib.tiledsurface._TiledSurfaceSnapshot
+        :type before: lib.tiledsurface._SurfaceSnapshot
         :param after: snapshot of the layer after the stroke
-        :type after: lib.tiledsurface._TiledSurfaceSnapshot
+        :type after: lib.tiledsurface._SurfaceSnapshot
         :returns: A new StrokeShape, or None.
 
         If the snapshots haven't changed, None is returned. In this
         case, no StrokeShape should be recorded.
 
         """
-        before_dict = before.tiledict
-        after_dict = after.tiledict
-        before_tiles = set(before_dict.items())
-        after_tiles = set(after_dict.items())
-        changed_idxs = set(
-            pos for pos, data
-            in before_tiles.symmetric_difference(after_tiles)
-        )
+        changed_idxs = after.changed_tiles(before)
         if not changed_idxs:
             return None
         shape = cls()
         assert not shape.strokemap
         shape.tasks.add_work(_TileDiffUpdateTask(
-            before.tiledict,
-            after.tiledict,
+            before,
+            after,
             changed_idxs,
             shape.strokemap,
         ))
@@ -92,20 +124,17 @@ class StrokeShape (object):
         See lib.layer.data.PaintingLayer.load_from_openraster().
         Format: "v2" strokemap format.
 
+        The data is only stored here. It is decoded the first time the
+        tile map is needed.
+
         """
         if not isinstance(data, bytes):
             raise ValueError("data: expected bytes, not %r" % (type(data),))
-        assert not self.strokemap
+        assert not self._strokemap and self._raw is None
         assert translate_x % N == 0
         assert translate_y % N == 0
-        translate_x /= N
-        translate_y /= N
-        while data:
-            tx, ty, size = struct.unpack('>iiI', data[:3*4])
-            compressed_bitmap = data[3*4:size+3*4]
-            tile = _Tile.new_from_compressed_bitmap(compressed_bitmap)
-            self.strokemap[tx + translate_x, ty + translate_y] = tile
-            data = data[size+3*4:]
+        self._raw = data
+        self._raw_offset = (int(translate_x // N), int(translate_y // N))
 
     def save_to_string(self, translate_x, translate_y):
         """Return a compressed bytes string representing the stroke shape.
@@ -117,6 +146,15 @@ class StrokeShape (object):
         >>> isinstance(bstr, bytes)
         True
 
+        Undecoded shapes are saved without decoding them.
+
+        >>> shape2 = StrokeShape()
+        >>> shape2.init_from_string(bstr, N, -2*N)
+        >>> shape2.save_to_string(-N, 2*N) == bstr
+        True
+        >>> shape2.is_decoded()
+        False
+
         See lib.layer.data.PaintingLayer.save_to_openraster().
         Format: "v2" strokemap format.
 
@@ -126,18 +164,29 @@ class StrokeShape (object):
         translate_x = int(translate_x // N)
         translate_y = int(translate_y // N)
         self.tasks.finish_all()
-        data = b''
+        parts = []
+        if self._raw is not None:
+            data = self._raw
+            otx, oty = self._raw_offset
+            translate_x += otx
+            translate_y += oty
+            for tx, ty, i, j in _iter_raw_tiles(data):
+                tx = int(tx + translate_x)
+                ty = int(ty + translate_y)
+                parts.append(struct.pack('>iiI', tx, ty, j - i))
+                parts.append(data[i:j])
+            return b''.join(parts)
         if PY3:
-            sm_iter = self.strokemap.items()
+            sm_iter = self._strokemap.items()
         else:
-            sm_iter = self.strokemap.iteritems()
+            sm_iter = self._strokemap.iteritems()
         for (tx, ty), tile in sm_iter:
             compressed_bitmap = tile.to_bytes()
             tx = int(tx + translate_x)
             ty = int(ty + translate_y)
-            data += struct.pack('>iiI', tx, ty, len(compressed_bitmap))
-            data += compressed_bitmap
-        return data
+            parts.append(struct.pack('>iiI', tx, ty, len(compressed_bitmap)))
+            parts.append(compressed_bitmap)
+        return b''.join(parts)
 
     def _complete_tile_tasks(self, pred):
         """Complete all queued work on a subset of tiles.
@@ -215,6 +264,10 @@ class StrokeShape (object):
     def translate(self, dx, dy):
         """Translate the shape by (dx, dy)"""
         self.tasks.finish_all()
+        if self._raw is not None and dx % N == 0 and dy % N == 0:
+            otx, oty = self._raw_offset
+            self._raw_offset = (otx + int(dx // N), oty + int(dy // N))
+            return
         tmp = {}
         self.tasks.add_work(_TileTranslateTask(self.strokemap, tmp, dx, dy))
         self.tasks.add_work(_TileRecompressTask(tmp, self.strokemap))
@@ -248,8 +301,8 @@ class _TileDiffUpdateTask:
     def __init__(self, before, after, changed_idxs, targ):
         """Initialize, ready to update a target StrokeShape with diffs
 
-        :param dict before: Complete pre-stroke tiledict (RO, {xy:Tile})
-        :param dict after: Complete post-stroke tiledict (RO, {xy:Tile})
+        :param before: Pre-stroke snapshot or tiledict (RO, {xy:Tile})
+        :param after: Post-stroke snapshot or tiledict (RO, {xy:Tile})
         :param set changed_idxs: RW set of (x,y) tile indexes to process
         :param dict targ: Target strokemap (WO, {xy: bytes})
 
@@ -554,6 +607,29 @@ class _Tile:
 ## Helper funcs
 
 
+def _iter_raw_tiles(data):
+    """Iterate over the tile records in "v2" strokemap data.
+
+    :param bytes data: Saved stroke shape data.
+    :returns: Iterator yielding (tx, ty, start, end) tuples, where
+      data[start:end] is the compressed bitmap for tile (tx, ty).
+
+    This only reads the headers, and does not decompress anything.
+
+    >>> data = struct.pack('>iiI', 1, -2, 3) + b'abc'
+    >>> list(_iter_raw_tiles(data))
+    [(1, -2, 12, 15)]
+
+    """
+    i = 0
+    hsize = 3*4
+    while i < len(data):
+        tx, ty, size = struct.unpack('>iiI', data[i:i+hsize])
+        i += hsize
+        yield (tx, ty, i, i+size)
+        i += size
+
+
 class _TileIndexPredicate (object):
     """Tile index tester callable for processing subsets of tiles.
 
@@ -73,6 +73,17 @@ class TileAccessible (Bounded):
 
         """
 
+    def prefetch_tiles(self, tiles):
+        """Hint that some tiles will be requested read-only soon
+
+        :param iterable tiles: Tile indices, as (tx, ty) tuples
+
+        Implementations which have to generate their tiles may do the
+        work for the whole batch here, in parallel if they can. The
+        default implementation does nothing.
+
+        """
+
 
 class TileBlittable (Bounded):
     """Interface for unconditional copying by tile"""
@@ -0,0 +1,210 @@
+# This file is part of MyPaint.
+# Copyright (C) 2018 by the MyPaint Development Team.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+
+"""Running per-tile work across several threads
+
+Much of the per-tile work done in `lib` consists of short bursts of
+Python bookkeeping around long native calls like
+`mypaintlib.tile_combine()`, which release the GIL while they crunch
+pixels. Spreading a batch of tiles across a few worker threads lets
+those native parts run at the same time.
+
+The caller's thread blocks until the whole batch is done, so the
+document model is never touched concurrently with the main thread.
+Work functions should nevertheless only read from shared surfaces,
+and write only to data that belongs to the tile they were given.
+
+While it waits, the calling thread can report progress and poll for
+cancellation. Both happen in the calling thread, so `Progress`
+observers there are free to update the UI. The progress object's
+changed() event fires at least once per `POLL_INTERVAL` while worker
+threads are running, even if no tiles finished in that time. GUI
+observers can use it to process pending events, which is how a cancel
+button gets the chance to set the cancel flag.
+
+"""
+
+## Imports
+
+from __future__ import division, print_function
+
+import threading
+import multiprocessing
+import logging
+import time
+
+from lib.errors import CancelledError
+
+logger = logging.getLogger(__name__)
+
+
+## Constants
+
+#: Upper limit on the number of worker threads used for a batch.
+MAX_THREADS = 8
+
+#: Batches smaller than this are run in the calling thread.
+MIN_PARALLEL_BATCH = 4
+
+#: Seconds between progress reports and cancellation checks.
+POLL_INTERVAL = 0.1
+
+
+## Helpers
+
+
+def default_threads():
+    """Number of worker threads to use by default
+
+    >>> 1 <= default_threads() <= MAX_THREADS
+    True
+
+    """
+    try:
+        count = multiprocessing.cpu_count()
+    except NotImplementedError:
+        count = 1
+    return max(1, min(MAX_THREADS, count))
+
+
+def map_tiles(func, tiles, threads=None, progress=None, cancel=None):
+    """Call a function for each tile in a batch, using worker threads
+
+    :param callable func: work function, called as ``func(ti)``
+    :param iterable tiles: tile indices, as ``(tx, ty)`` tuples
+    :param int threads: number of threads (default: `default_threads()`)
+    :param lib.feedback.Progress progress: Unsized feedback object.
+    :param threading.Event cancel: Set this to stop work early.
+    :returns: the results of the calls, keyed by tile index
+    :rtype: dict
+    :raises lib.errors.CancelledError: if cancel was set during the run
+
+    Exceptions raised by the work function are re-raised in the calling
+    thread after all workers have finished. Only the first one is kept.
+
+    >>> tiles = [(x, y) for x in range(8) for y in range(3)]
+    >>> result = map_tiles(lambda ti: ti[0] * ti[1], tiles, threads=3)
+    >>> len(result), result[(7, 2)]
+    (24, 14)
+    >>> def fail(ti):
+    ...     raise ValueError("bad tile")
+    >>> map_tiles(fail, tiles, threads=3)
+    Traceback (most recent call last):
+    ...
+    ValueError: bad tile
+
+    Progress is reported in items of one tile each, and cancellation
+    stops the remaining work as soon as the workers notice it.
+
+    >>> import lib.feedback
+    >>> prog = lib.feedback.Progress()
+    >>> result = map_tiles(lambda ti: None, tiles, progress=prog)
+    >>> prog
+    <Progress 24.0/24>
+    >>> cancel = threading.Event()
+    >>> def cancel_at(ti):
+    ...     if ti == (4, 1):
+    ...         cancel.set()
+    >>> try:
+    ...     map_tiles(cancel_at, tiles, threads=2, cancel=cancel)
+    ... except CancelledError:
+    ...     print("cancelled")
+    cancelled
+
+    """
+    tiles = list(tiles)
+    if progress is not None:
+        progress.items = len(tiles)
+    if threads is None:
+        threads = default_threads()
+    threads = min(int(threads), len(tiles) // MIN_PARALLEL_BATCH)
+    if threads <= 1:
+        results = _map_tiles_serial(func, tiles, progress, cancel)
+    else:
+        results = _map_tiles_parallel(func, tiles, threads, progress, cancel)
+    if progress is not None:
+        progress.close()
+    return results
+
+
+def _map_tiles_serial(func, tiles, progress, cancel):
+    """Runs a batch in the calling thread (see `map_tiles()`)"""
+    results = {}
+    last_poll = time.time()
+    for ti in tiles:
+        if cancel is not None and cancel.is_set():
+            raise CancelledError("tile batch cancelled")
+        results[ti] = func(ti)
+        if progress is not None and time.time() - last_poll > POLL_INTERVAL:
+            progress.completed(len(results))
+            last_poll = time.time()
+    if cancel is not None and cancel.is_set():
+        raise CancelledError("tile batch cancelled")
+    return results
+
+
+def _map_tiles_parallel(func, tiles, threads, progress, cancel):
+    """Runs a batch in worker threads (see `map_tiles()`)"""
+    results = {}
+    errors = []
+    stop = threading.Event()
+    # Workers take interleaved slices so that neighbouring tiles,
+    # which often cost about the same, get spread out.
+    slices = [tiles[i::threads] for i in range(threads)]
+    counts = [0] * threads  # written by one worker each
+
+    def _worker(i, batch):
+        try:
+            for ti in batch:
+                if stop.is_set():
+                    return
+                if cancel is not None and cancel.is_set():
+                    stop.set()
+                    return
+                results[ti] = func(ti)
+                counts[i] += 1
+        except Exception as ex:
+            errors.append(ex)
+            stop.set()
+
+    workers = [
+        threading.Thread(target=_worker, args=(i, s))
+        for (i, s) in enumerate(slices)
+    ]
+    for w in workers:
+        w.daemon = True
+        w.start()
+    for w in workers:
+        while w.is_alive():
+            w.join(POLL_INTERVAL)
+            if progress is None:
+                continue
+            done = sum(counts)
+            if done > int(progress):
+                progress.completed(done)
+            else:
+                progress.changed()  # heartbeat, for event processing
+    if errors:
+        raise errors[0]
+    if cancel is not None and cancel.is_set():
+        raise CancelledError("tile batch cancelled")
+    return results
+
+
+## Module testing
+
+
+def _test():
+    """Run doctest strings"""
+    import doctest
+    doctest.testmod()
+
+
+if __name__ == '__main__':
+    _test()
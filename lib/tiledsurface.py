@@ -16,7 +16,9 @@ import time
 import sys
 import os
 import contextlib
+import math
 import logging
+import threading
 
 from gettext import gettext as _
 import numpy as np
@@ -32,6 +34,9 @@ from .errors import FileHandlingError
 import lib.fileutils
 import lib.modes
 import lib.feedback
+import lib.cache
+import lib.morphology
+import lib.instrumentation
 from lib.pycompat import xrange
 from lib.pycompat import PY3
 
@@ -42,6 +47,20 @@ logger = logging.getLogger(__name__)
 TILE_SIZE = N = mypaintlib.TILE_SIZE
 MAX_MIPMAP_LEVEL = mypaintlib.MAX_MIPMAP_LEVEL
 
+#: Changed tiles processed per call to MyPaintSurface.build_mipmaps()
+MIPMAP_BUILD_BATCH_SIZE = 256
+
+# Source tiles kept around between rounds of a flood fill.
+_FLOOD_FILL_SRC_CACHE_SIZE = 1024
+
+#: Longest chain of journaled snapshots before a full copy is made.
+SNAPSHOT_JOURNAL_MAX_DEPTH = 32
+
+# Tile request metrics, see lib.instrumentation
+_TILE_READS = lib.instrumentation.counter("tiles.reads")
+_TILE_WRITES = lib.instrumentation.counter("tiles.writes")
+_TILE_COPIES = lib.instrumentation.counter("tiles.copies")
+
 SYMMETRY_TYPES = tuple(range(mypaintlib.NumSymmetryTypes))
 SYMMETRY_STRINGS = {
     mypaintlib.SymmetryVertical: _("Vertical"),
@@ -90,7 +109,157 @@ del mipmap_dirty_tile.rgba
 ## Class defs: surfaces
 
 class _SurfaceSnapshot (object):
-    pass
+    """Saved tiles of a surface, for undo
+
+    Snapshots are journaled. Most of them only record the tiles which
+    changed since an earlier snapshot of the same surface, their
+    parent, so making one costs O(changed tiles), not O(all tiles).
+    Every `SNAPSHOT_JOURNAL_MAX_DEPTH` snapshots, a complete copy of
+    the tiledict is made instead. This limits the length of the chains
+    to walk, and how much superseded tile data they keep alive.
+
+    Snapshots are never modified after they're made. Their tiles are
+    all read-only.
+
+    """
+
+    def __init__(self, tiledict=None, parent=None, changes=None):
+        """Initialize, as a complete copy or as changes to a parent
+
+        :param dict tiledict: Complete {(tx, ty): _Tile} copy
+        :param _SurfaceSnapshot parent: Snapshot the changes apply to
+        :param dict changes: {(tx, ty): _Tile or None} for removals
+
+        """
+        super(_SurfaceSnapshot, self).__init__()
+        assert (tiledict is None) != (parent is None)
+        self._tiledict = tiledict
+        self._parent = parent
+        self._changes = changes or {}
+        self.depth = 0
+        if parent is not None:
+            self.depth = parent.depth + 1
+
+    @property
+    def tiledict(self):
+        """The complete tiledict, made on demand (read only)"""
+        if self._tiledict is None:
+            path = []
+            node = self
+            while node._tiledict is None:
+                path.append(node)
+                node = node._parent
+            tiledict = node._tiledict.copy()
+            for node in reversed(path):
+                for pos, t in node._changes.items():
+                    if t is None:
+                        tiledict.pop(pos, None)
+                    else:
+                        tiledict[pos] = t
+            self._tiledict = tiledict
+        return self._tiledict
+
+    def get(self, pos, default=None):
+        """Get the tile at a position, like dict.get()"""
+        node = self
+        while node._tiledict is None:
+            if pos in node._changes:
+                t = node._changes[pos]
+                return default if t is None else t
+            node = node._parent
+        return node._tiledict.get(pos, default)
+
+    def _changes_since(self, other):
+        """Positions which may differ from another snapshot, or None
+
+        The positions come from the journals linking the two snapshots.
+        None is returned if they aren't linked that way.
+
+        """
+        if other is self:
+            return set()
+        ancestors = set()
+        node = other
+        while node is not None:
+            ancestors.add(id(node))
+            node = node._parent
+        changed = set()
+        node = self
+        while node is not None and id(node) not in ancestors:
+            changed.update(node._changes)
+            node = node._parent
+        if node is None:
+            return None
+        common = node
+        node = other
+        while node is not common:
+            changed.update(node._changes)
+            node = node._parent
+        return changed
+
+    def changed_tiles(self, other):
+        """Positions where the tiles differ from another snapshot's
+
+        :param _SurfaceSnapshot other: Snapshot to compare against
+        :rtype: set
+
+        Snapshots of the same surface are compared via their journals,
+        in time proportional to the number of tiles changed between
+        them. Unrelated snapshots are compared tile by tile.
+
+        """
+        candidates = self._changes_since(other)
+        if candidates is None:
+            mine = set(self.tiledict.items())
+            theirs = set(other.tiledict.items())
+            return set(
+                pos for pos, t
+                in mine.symmetric_difference(theirs)
+            )
+        return set(
+            pos for pos in candidates
+            if self.get(pos) is not other.get(pos)
+        )
+
+
+class _TilesSnapshot (object):
+    """Unchanging tile data from a surface, for rendering elsewhere
+
+    Tiles snapshots are made by `MyPaintSurface.snapshot_tiles()`. They
+    support the same `composite_tile()` and `blit_tile_into()` calls as
+    the surface they were taken from, for the captured tiles and mipmap
+    level only. They don't refer back to the surface, so rendering from
+    them is safe while the surface is being changed.
+
+    """
+
+    def __init__(self, tiles, mipmap_level):
+        super(_TilesSnapshot, self).__init__()
+        self._tiles = tiles  # {(tx, ty): array}
+        self.mipmap_level = mipmap_level
+
+    def _get_tile(self, tx, ty, mipmap_level):
+        if mipmap_level != self.mipmap_level:
+            raise ValueError(
+                "Snapshot is for mipmap level %d, not %d"
+                % (self.mipmap_level, mipmap_level),
+            )
+        return self._tiles.get((tx, ty), transparent_tile.rgba)
+
+    def blit_tile_into(self, dst, dst_has_alpha, tx, ty, mipmap_level=0,
+                       *args, **kwargs):
+        """Copy one captured tile into a destination array"""
+        src = self._get_tile(tx, ty, mipmap_level)
+        MyPaintSurface._blit_tile_data(src, dst, dst_has_alpha)
+
+    def composite_tile(self, dst, dst_has_alpha, tx, ty, mipmap_level=0,
+                       opacity=1.0, mode=mypaintlib.CombineNormal,
+                       *args, **kwargs):
+        """Composite one captured tile over a NumPy array"""
+        src = self._get_tile(tx, ty, mipmap_level)
+        MyPaintSurface._composite_tile_data(
+            src, dst, dst_has_alpha, opacity, mode,
+        )
 
 
 # TODO:
@@ -101,6 +270,9 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
     The C++ part of this class is in tiledsurface.hpp
     """
 
+    #: Active _TiledSurfaceMove whose preview is displayed, if any
+    _move_preview = None
+
     def __init__(self, mipmap_level=0, mipmap_surfaces=None,
                  looped=False, looped_size=(0, 0)):
         super(MyPaintSurface, self).__init__()
@@ -110,6 +282,13 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
         self.tiledict = {}
         self.observers = []
 
+        # Snapshot journal: the last snapshot saved or loaded, and the
+        # tiles changed in place since then. Only valid while the
+        # tiledict is the one it was taken from.
+        self._sshot = None
+        self._sshot_tiledict = None
+        self._sshot_changed = set()
+
         # Used to implement repeating surfaces, like Background
         if looped_size[0] % N or looped_size[1] % N:
             raise ValueError('Looped size must be multiples of tile size')
@@ -117,6 +296,14 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
         self.looped_size = looped_size
 
         self.mipmap_level = mipmap_level
+        #: Guards the tiledicts of the surface and its mipmaps while a
+        #: painting thread writes to them. See lib.paintworker.
+        if mipmap_surfaces is None:
+            self.tile_lock = threading.RLock()
+        else:
+            self.tile_lock = mipmap_surfaces[0].tile_lock
+        # Level 0 tiles changed since their mipmaps were last built
+        self._mipmap_dirty = set()
         if mipmap_level == 0:
             assert mipmap_surfaces is None
             self._mipmaps = self._create_mipmap_surfaces()
@@ -173,10 +360,18 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
                 s.mipmap = None
         return mipmaps
 
-    def end_atomic(self):
+    def end_atomic(self, notify=True):
+        """Finish an atomic batch of dabs
+
+        :param bool notify: Notify the observers about the changed area
+        :returns: The changed area, as (x, y, w, h)
+        :rtype: tuple
+
+        """
         bbox = self._backend.end_atomic()
-        if (bbox[2] > 0 and bbox[3] > 0):
+        if notify and (bbox[2] > 0 and bbox[3] > 0):
             self.notify_observers(*bbox)
+        return bbox
 
     @property
     def backend(self):
@@ -211,6 +406,7 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
             if tx*N+N < x or ty*N+N < y or tx*N > x+w or ty*N > y+h:
                 trimmed.append((tx, ty))
                 self.tiledict.pop((tx, ty))
+                self._note_tiles_changed([(tx, ty)])
                 self._mark_mipmap_dirty(tx, ty)
             elif (tx*N < x and x < tx*N+N
                     or ty*N < y and y < ty*N+N
@@ -281,6 +477,10 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
         self._set_tile_numpy(tx, ty, numpy_tile, readonly)
 
     def _regenerate_mipmap(self, t, tx, ty):
+        with self.tile_lock:
+            return self._regenerate_mipmap_unlocked(t, tx, ty)
+
+    def _regenerate_mipmap_unlocked(self, t, tx, ty):
         t = _Tile()
         self.tiledict[(tx, ty)] = t
         empty = True
@@ -290,7 +490,7 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
                 src = self.parent.tiledict.get((tx*2 + x, ty*2 + y),
                                                transparent_tile)
                 if src is mipmap_dirty_tile:
-                    src = self.parent._regenerate_mipmap(
+                    src = self.parent._regenerate_mipmap_unlocked(
                         src,
                         tx*2 + x, ty*2 + y,
                     )
@@ -315,6 +515,11 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
             tx = tx % (self.looped_size[0] // N)
             ty = ty % (self.looped_size[1] // N)
 
+        # Called for every tile a dab touches: test the flag here,
+        # so that nothing else happens when metrics are off.
+        if lib.instrumentation.enabled:
+            (_TILE_READS if readonly else _TILE_WRITES).add()
+
         t = self.tiledict.get((tx, ty))
         if t is None:
             if readonly:
@@ -326,10 +531,13 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
             t = self._regenerate_mipmap(t, tx, ty)
         if t.readonly and not readonly:
             # shared memory, get a private copy for writing
+            _TILE_COPIES.add()
             t = t.copy()
             self.tiledict[(tx, ty)] = t
         if not readonly:
             # assert self.mipmap_level == 0
+            if self._sshot is not None:
+                self._sshot_changed.add((tx, ty))
             self._mark_mipmap_dirty(tx, ty)
         return t.rgba
 
@@ -340,6 +548,7 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
         # assert self.mipmap_level == 0
         if not self._mipmaps:
             return
+        self._mipmap_dirty.add((tx, ty))
         for level, mipmap in enumerate(self._mipmaps):
             if level == 0:
                 continue
@@ -349,6 +558,80 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
                 break
             mipmap.tiledict[(tx // fac, ty // fac)] = mipmap_dirty_tile
 
+    def has_dirty_mipmaps(self):
+        """True if build_mipmaps() has work to do"""
+        return bool(self._mipmap_dirty)
+
+    def build_mipmaps(self, limit=MIPMAP_BUILD_BATCH_SIZE):
+        """Eagerly rebuild the mipmap tiles above changed tiles
+
+        :param int limit: Max changed tiles to process (<=0: no limit)
+        :returns: whether there are more changed tiles to process
+        :rtype: bool
+
+        Changed tiles are processed in batches. Each mipmap level is
+        built from the level below, with one native call per level.
+        This is meant to be called from idle tasks, so that zoomed-out
+        redraws rarely have to regenerate mipmap tiles on demand.
+
+            >>> surf = MyPaintSurface()
+            >>> for tx in range(4):
+            ...     with surf.tile_request(tx, 0, readonly=False) as a:
+            ...         a[...] = 1<<15
+            >>> surf.has_dirty_mipmaps()
+            True
+            >>> surf.build_mipmaps(limit=3)
+            True
+            >>> surf.build_mipmaps()
+            False
+            >>> sorted(surf._mipmaps[1].tiledict.keys())
+            [(0, 0), (1, 0)]
+            >>> with surf._mipmaps[1].tile_request(1, 0, True) as a:
+            ...     (int(a[0, 0, 3]), int(a[N//2, 0, 3]))
+            (32768, 0)
+
+        """
+        if self.mipmap_level != 0:
+            raise ValueError("Only call this on the top-level surface.")
+        if not self._mipmaps:
+            self._mipmap_dirty.clear()
+            return False
+        with self.tile_lock:
+            if limit <= 0 or limit >= len(self._mipmap_dirty):
+                batch = self._mipmap_dirty
+                self._mipmap_dirty = set()
+            else:
+                batch = set()
+                for i in xrange(limit):
+                    batch.add(self._mipmap_dirty.pop())
+            parent = self
+            for mipmap in self._mipmaps[1:]:
+                targets = set((tx // 2, ty // 2) for (tx, ty) in batch)
+                jobs = []
+                for (tx, ty) in targets:
+                    srcs = []
+                    for (sx, sy) in ((0, 0), (1, 0), (0, 1), (1, 1)):
+                        st = (tx*2 + sx, ty*2 + sy)
+                        src = parent.tiledict.get(st)
+                        if src is mipmap_dirty_tile:
+                            # Dirty for some tile outside this batch.
+                            src = parent._regenerate_mipmap(src, *st)
+                        if src is None or src is transparent_tile:
+                            srcs.append(None)
+                        else:
+                            srcs.append(src.rgba)
+                    if all(src is None for src in srcs):
+                        mipmap.tiledict.pop((tx, ty), None)
+                        continue
+                    t = _Tile()
+                    mipmap.tiledict[(tx, ty)] = t
+                    jobs.append([t.rgba] + srcs)
+                if jobs:
+                    mypaintlib.tile_downscale_batch(jobs)
+                batch = targets
+                parent = mipmap
+            return bool(self._mipmap_dirty)
+
     def blit_tile_into(self, dst, dst_has_alpha, tx, ty, mipmap_level=0,
                        *args, **kwargs):
         """Copy one tile from this object into a destination array
@@ -362,33 +645,44 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
 
         # assert dst_has_alpha is True
 
+        if self._move_preview is not None:
+            src = self._move_preview.preview_tile(tx, ty, mipmap_level)
+            if src is not None:
+                self._blit_tile_data(src, dst, dst_has_alpha)
+                return
+
         if self.mipmap_level < mipmap_level:
             return self.mipmap.blit_tile_into(dst, dst_has_alpha, tx, ty,
                                               mipmap_level)
 
+        with self.tile_request(tx, ty, readonly=True) as src:
+            self._blit_tile_data(src, dst, dst_has_alpha)
+
+    @staticmethod
+    def _blit_tile_data(src, dst, dst_has_alpha):
+        """Copy a fix15 tile array into a fix15 or 8bpc destination"""
         assert dst.shape[2] == 4
         if dst.dtype not in ('uint16', 'uint8'):
             raise ValueError('Unsupported destination buffer type %r',
                              dst.dtype)
         dst_is_uint16 = (dst.dtype == 'uint16')
 
-        with self.tile_request(tx, ty, readonly=True) as src:
-            if src is transparent_tile.rgba:
-                # dst[:] = 0  # <-- notably slower than memset()
-                if dst_is_uint16:
-                    mypaintlib.tile_clear_rgba16(dst)
-                else:
-                    mypaintlib.tile_clear_rgba8(dst)
+        if src is transparent_tile.rgba:
+            # dst[:] = 0  # <-- notably slower than memset()
+            if dst_is_uint16:
+                mypaintlib.tile_clear_rgba16(dst)
+            else:
+                mypaintlib.tile_clear_rgba8(dst)
+        else:
+            if dst_is_uint16:
+                # this will do memcpy, not worth to bother skipping
+                # the u channel
+                mypaintlib.tile_copy_rgba16_into_rgba16(src, dst)
             else:
-                if dst_is_uint16:
-                    # this will do memcpy, not worth to bother skipping
-                    # the u channel
-                    mypaintlib.tile_copy_rgba16_into_rgba16(src, dst)
+                if dst_has_alpha:
+                    mypaintlib.tile_convert_rgba16_to_rgba8(src, dst)
                 else:
-                    if dst_has_alpha:
-                        mypaintlib.tile_convert_rgba16_to_rgba8(src, dst)
-                    else:
-                        mypaintlib.tile_convert_rgbu16_to_rgbu8(src, dst)
+                    mypaintlib.tile_convert_rgbu16_to_rgbu8(src, dst)
 
     def composite_tile(self, dst, dst_has_alpha, tx, ty, mipmap_level=0,
                        opacity=1.0, mode=mypaintlib.CombineNormal,
@@ -413,6 +707,14 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
             if mode not in lib.modes.MODES_EFFECTIVE_AT_ZERO_ALPHA:
                 return
 
+        # Interactive moves display a preview until they catch up.
+        if self._move_preview is not None:
+            src = self._move_preview.preview_tile(tx, ty, mipmap_level)
+            if src is not None:
+                self._composite_tile_data(src, dst, dst_has_alpha,
+                                          opacity, mode)
+                return
+
         # Tile request needed, but may need to satisfy it from a deeper
         # mipmap level.
         if self.mipmap_level < mipmap_level:
@@ -421,40 +723,200 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
             return
 
         # Tile request at the required level.
-        # Try optimizations again if we got the special marker tile
         with self.tile_request(tx, ty, readonly=True) as src:
-            if src is transparent_tile.rgba:
-                if dst_has_alpha:
-                    if mode in lib.modes.MODES_CLEARING_BACKDROP_AT_ZERO_ALPHA:
-                        mypaintlib.tile_clear_rgba16(dst)
-                        return
-                if mode not in lib.modes.MODES_EFFECTIVE_AT_ZERO_ALPHA:
+            self._composite_tile_data(src, dst, dst_has_alpha, opacity, mode)
+
+    @staticmethod
+    def _composite_tile_data(src, dst, dst_has_alpha, opacity, mode):
+        """Composite a fix15 tile array over a fix15 destination"""
+        # Try optimizations again if we got the special marker tile
+        if src is transparent_tile.rgba:
+            if dst_has_alpha:
+                if mode in lib.modes.MODES_CLEARING_BACKDROP_AT_ZERO_ALPHA:
+                    mypaintlib.tile_clear_rgba16(dst)
                     return
-            mypaintlib.tile_combine(mode, src, dst, dst_has_alpha, opacity)
+            if mode not in lib.modes.MODES_EFFECTIVE_AT_ZERO_ALPHA:
+                return
+        mypaintlib.tile_combine(mode, src, dst, dst_has_alpha, opacity)
 
     ## Snapshotting
 
+    def _note_tiles_changed(self, positions):
+        """Record tiledict entries changed in place, for the journal"""
+        if self._sshot is not None:
+            self._sshot_changed.update(positions)
+
+    def _set_snapshot_journal(self, sshot):
+        """Start journaling changes relative to a snapshot"""
+        self._sshot = sshot
+        self._sshot_tiledict = self.tiledict
+        self._sshot_changed = set()
+
+    def _get_snapshot_journal(self):
+        """The journal's base snapshot, if it's still valid, or None"""
+        if self.tiledict is not self._sshot_tiledict:
+            return None
+        return self._sshot
+
     def save_snapshot(self):
         """Creates and returns a snapshot of the surface
 
-        Snapshotting marks all the tiles of the surface as read-only,
-        then just shallow-copes the tiledict. It's quick. See
+        Snapshotting marks the tiles of the surface as read-only. See
         tile_request() for how new read/write tiles can be unlocked.
+        Usually, only the tiles changed since the previous snapshot
+        need recording, and snapshotting costs time proportional to
+        their number. If nothing changed, the previous snapshot is
+        returned again.
+
+        >>> surf = MyPaintSurface()
+        >>> with surf.tile_request(0, 0, readonly=False) as a:
+        ...     a[...] = 1 << 15
+        >>> sshot1 = surf.save_snapshot()
+        >>> surf.save_snapshot() is sshot1
+        True
+        >>> with surf.tile_request(1, 0, readonly=False) as a:
+        ...     a[...] = 1 << 15
+        >>> sshot2 = surf.save_snapshot()
+        >>> sorted(sshot2.changed_tiles(sshot1))
+        [(1, 0)]
+        >>> sorted(sshot2.tiledict.keys())
+        [(0, 0), (1, 0)]
 
         """
-        sshot = _SurfaceSnapshot()
-        if PY3:
-            tiles_iter = self.tiledict.values()
-        else:
-            tiles_iter = self.tiledict.itervalues()
-        for t in tiles_iter:
-            t.readonly = True
-        sshot.tiledict = self.tiledict.copy()
-        return sshot
+        with self.tile_lock:
+            parent = self._get_snapshot_journal()
+            changed = self._sshot_changed
+            if parent is not None and not changed:
+                return parent
+            if parent is not None:
+                # Only the changed tiles can be writable.
+                for pos in changed:
+                    t = self.tiledict.get(pos)
+                    if t is not None:
+                        t.readonly = True
+            else:
+                if PY3:
+                    tiles_iter = self.tiledict.values()
+                else:
+                    tiles_iter = self.tiledict.itervalues()
+                for t in tiles_iter:
+                    t.readonly = True
+            max_depth = SNAPSHOT_JOURNAL_MAX_DEPTH
+            if parent is not None and parent.depth < max_depth:
+                changes = dict(
+                    (pos, self.tiledict.get(pos))
+                    for pos in changed
+                )
+                sshot = _SurfaceSnapshot(parent=parent, changes=changes)
+            else:
+                sshot = _SurfaceSnapshot(tiledict=self.tiledict.copy())
+            self._set_snapshot_journal(sshot)
+            return sshot
+
+    def get_tile_snapshot(self, tx, ty, mipmap_level=0):
+        """Get one tile's data, as it will stay
+
+        :param int tx: Tile X coord, at mipmap_level
+        :param int ty: Tile Y coord, at mipmap_level
+        :param int mipmap_level: Mipmap level to get the tile from
+        :returns: A fix15 tile array which must not be modified
+        :rtype: numpy.ndarray
+
+        The tile is marked read-only, like `save_snapshot()` does, so
+        later writes to the surface go to a private copy of it.
+
+        """
+        if self._move_preview is not None:
+            src = self._move_preview.preview_tile(tx, ty, mipmap_level)
+            if src is not None:
+                return src.copy()
+        if self.mipmap_level < mipmap_level:
+            return self.mipmap.get_tile_snapshot(tx, ty, mipmap_level)
+        if self.looped:
+            tx = tx % (self.looped_size[0] // N)
+            ty = ty % (self.looped_size[1] // N)
+        t = self.tiledict.get((tx, ty), transparent_tile)
+        if t is mipmap_dirty_tile:
+            t = self._regenerate_mipmap(t, tx, ty)
+        t.readonly = True
+        return t.rgba
+
+    def snapshot_tiles(self, tiles, mipmap_level=0):
+        """Capture some tiles for rendering away from the surface
+
+        :param iterable tiles: Tile indices, at mipmap_level
+        :param int mipmap_level: Mipmap level to capture
+        :returns: A snapshot with composite_tile() and blit_tile_into()
+        :rtype: _TilesSnapshot
+
+        >>> surf = MyPaintSurface()
+        >>> with surf.tile_request(0, 0, readonly=False) as a:
+        ...     a[...] = 1 << 15
+        >>> sshot = surf.snapshot_tiles([(0, 0), (1, 0)])
+        >>> with surf.tile_request(0, 0, readonly=False) as a:
+        ...     a[...] = 0
+        >>> dst = np.zeros((N, N, 4), 'uint16')
+        >>> sshot.blit_tile_into(dst, True, 0, 0)
+        >>> int(dst[0, 0, 3])
+        32768
+
+        """
+        with self.tile_lock:
+            captured = {}
+            for tx, ty in tiles:
+                src = self.get_tile_snapshot(tx, ty, mipmap_level)
+                if src is not transparent_tile.rgba:
+                    captured[(tx, ty)] = src
+            return _TilesSnapshot(captured, mipmap_level)
 
     def load_snapshot(self, sshot):
-        """Loads a saved snapshot, replacing the internal tiledict"""
-        self._load_tiledict(sshot.tiledict)
+        """Loads a saved snapshot, replacing the internal tiledict
+
+        Snapshots of this surface are loaded using their journals, so
+        only the tiles which differ are looked at. This makes undo and
+        redo cost time proportional to the number of tiles they change.
+
+        >>> surf = MyPaintSurface()
+        >>> sshot1 = surf.save_snapshot()
+        >>> with surf.tile_request(3, 2, readonly=False) as a:
+        ...     a[...] = 1 << 15
+        >>> sshot2 = surf.save_snapshot()
+        >>> surf.load_snapshot(sshot1)
+        >>> list(surf.tiledict.keys())
+        []
+        >>> surf.load_snapshot(sshot2)
+        >>> list(surf.tiledict.keys())
+        [(3, 2)]
+
+        """
+        with self.tile_lock:
+            base = self._get_snapshot_journal()
+            dirty = None
+            if base is not None:
+                dirty = sshot._changes_since(base)
+            if dirty is None:
+                self._load_tiledict(sshot.tiledict)
+            else:
+                dirty.update(self._sshot_changed)
+                self._load_changed_tiles(sshot, dirty)
+            self._set_snapshot_journal(sshot)
+
+    def _load_changed_tiles(self, sshot, positions):
+        """Loads some tiles from a snapshot, and notifies the observers"""
+        dirty = []
+        for pos in positions:
+            t = sshot.get(pos)
+            if self.tiledict.get(pos) is t:
+                continue
+            if t is None:
+                del self.tiledict[pos]
+            else:
+                self.tiledict[pos] = t
+            self._mark_mipmap_dirty(*pos)
+            dirty.append(pos)
+        bbox = lib.surface.get_tiles_bbox(dirty)
+        if not bbox.empty():
+            self.notify_observers(*bbox)
 
     def _load_tiledict(self, d):
         """Efficiently loads a tiledict, and notifies the observers"""
@@ -643,10 +1105,23 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
         lib.surface.save_as_png(self, filename, *args, **kwargs)
 
     def get_bbox(self):
-        return lib.surface.get_tiles_bbox(self.tiledict)
+        with self.tile_lock:
+            tiles = list(self.tiledict)
+        return lib.surface.get_tiles_bbox(tiles)
 
     def get_tiles(self):
-        return self.tiledict
+        """Get a copy of the tile dict, safe from the painting thread
+
+        :returns: {(tx, ty): tile} for the tiles with data
+        :rtype: dict
+
+        A painting thread may add tiles at any time (see
+        `lib.paintworker`), so the live tiledict can't be iterated over
+        without holding the `tile_lock`. This returns a copy instead.
+
+        """
+        with self.tile_lock:
+            return dict(self.tiledict)
 
     def is_empty(self):
         return not self.tiledict
@@ -671,6 +1146,7 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
                 if rgba.any():
                     continue
                 surf.tiledict.pop(pos)
+                surf._note_tiles_changed([pos])
                 removed += 1
         return removed, total
 
@@ -687,6 +1163,7 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
             self.tiledict.pop(pos)
             removed.add(pos)
             self._mark_mipmap_dirty(tx, ty)
+        self._note_tiles_changed(removed)
 
         bbox = lib.surface.get_tiles_bbox(removed)
         self.notify_observers(*bbox)
@@ -706,7 +1183,8 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
             raise ValueError("Only call this on the top-level surface.")
         return _TiledSurfaceMove(self, x, y, sort=sort)
 
-    def flood_fill(self, x, y, color, bbox, tolerance, dst_surface):
+    def flood_fill(self, x, y, color, bbox, tolerance, dst_surface,
+                   gap_size=0, offset=0, feather=0):
         """Fills connected areas of this surface into another
 
         :param x: Starting point X coordinate
@@ -719,10 +1197,14 @@ class MyPaintSurface (TileAccessible, TileBlittable, TileCompositable):
         :type tolerance: float [0.0, 1.0]
         :param dst: Target surface
         :type dst: lib.tiledsurface.MyPaintSurface
+        :param int gap_size: close gaps up to this many pixels wide
+        :param int offset: grow (>0) or shrink (<0) the fill, in pixels
+        :param int feather: width of the fill's soft edge, in pixels
 
-        See also `lib.layer.Layer.flood_fill()` and `fill.flood_fill()`.
+        See also `lib.layer.Layer.flood_fill()` and `flood_fill()`.
         """
-        flood_fill(self, x, y, color, bbox, tolerance, dst_surface)
+        flood_fill(self, x, y, color, bbox, tolerance, dst_surface,
+                   gap_size=gap_size, offset=offset, feather=feather)
 
     @contextlib.contextmanager
     def cairo_request(self, x, y, w, h, mode=lib.modes.DEFAULT_MODE):
@@ -900,6 +1382,14 @@ class _TiledSurfaceMove (object):
     Moves can be processed non-interactively by calling all the
     different phases together, as above.
 
+    Each update() works out a plan saying which (up to four) snapshot
+    tiles make up each target tile. Processing then assembles whole
+    target tiles from their sources in batches, with one native call
+    per batch. Until all of an update's tiles are processed, the
+    surface displays a preview of the move assembled on the fly from
+    the snapshot (see preview_tile()), so the layer never looks
+    half-moved on screen.
+
     """
 
     def __init__(self, surface, x, y, sort=True):
@@ -916,26 +1406,28 @@ class _TiledSurfaceMove (object):
         object.__init__(self)
         self.surface = surface
         self.snapshot = surface.save_snapshot()
-        self.chunks = []
-        self.chunks[:] = self.snapshot.tiledict.keys()
         self.sort = sort
-        tx = x // N
-        ty = y // N
         self.start_pos = (x, y)
-        if self.sort:
-            self.chunks.sort(
-                key=lambda p: abs(tx - p[0]) + abs(ty - p[1]),
-            )
-        # High water mark of chunks processed so far.
-        # This is reset on every call to update().
-        self.chunks_i = 0
+        # Mipmap tiles as they were at the start, used for previewing.
+        # Tiles are never modified in place, so shallow copies suffice.
+        self._mipmap_tiledicts = [self.snapshot.tiledict]
+        surface.build_mipmaps(limit=0)
+        for mipmap in surface._mipmaps[1:]:
+            for ti, t in list(mipmap.tiledict.items()):
+                if t is mipmap_dirty_tile:
+                    mipmap._get_tile_numpy(ti[0], ti[1], True)
+            self._mipmap_tiledicts.append(mipmap.tiledict.copy())
+        self._snapshot_bbox = lib.surface.get_tiles_bbox(
+            self.snapshot.tiledict,
+        )
+        # Target tiles and their sources for the current update()
+        self.plan = []
+        self.plan_i = 0
+        self.offset = (0, 0)
         # Tile state tracking for individual update cycles
         self.written = set()
         self.blank_queue = []
-        # Tile offsets which we'll be applying,
-        # initially the move is zero.
-        self.slices_x = calc_translation_slices(0)
-        self.slices_y = calc_translation_slices(0)
+        self.cycle_updated = set()
 
     def update(self, dx, dy):
         """Updates the offset during a move
@@ -943,25 +1435,107 @@ class _TiledSurfaceMove (object):
         :param dx: New move offset: relative to the constructor x.
         :param dy: New move offset: relative to the constructor y.
 
-        This causes all the move's work to be re-queued.
+        This causes all the move's work to be re-queued, and redraws
+        the preview.
         """
+        dx = int(dx)
+        dy = int(dy)
+        old_bbox = self._get_moved_bbox(*self.offset)
+        self.offset = (dx, dy)
         # Nothing has been written in this pass yet
         self.written = set()
-        # Tile indices to be cleared during processing,
-        # unless they've been written to
-        self.blank_queue[:] = self.surface.tiledict.keys()  # fresh!
+        self.plan = self._make_plan(dx, dy)
+        self.plan_i = 0
+        # Tile indices to be cleared during processing.
+        targets = set(targ_t for (targ_t, srcs) in self.plan)
+        self.blank_queue[:] = [
+            t for t in self.surface.tiledict.keys()
+            if t not in targets
+        ]
+        # Show the preview straight away
+        self.surface._move_preview = self
+        old_bbox.expand_to_include_rect(self._get_moved_bbox(dx, dy))
+        if not old_bbox.empty():
+            self.surface.notify_observers(*old_bbox)
+
+    def _get_moved_bbox(self, dx, dy):
+        """Internal: bbox of the snapshot's data, after a move"""
+        bbox = self._snapshot_bbox.copy()
+        if not bbox.empty():
+            bbox.x += dx
+            bbox.y += dy
+        return bbox
+
+    def _make_plan(self, dx, dy):
+        """Internal: list target tiles and their sources for an offset
+
+        :returns: list of ``(targ_t, (nw, ne, sw, se))``
+        :rtype: list
+
+        Each source is a tile index in the snapshot, or None.
+        See `mypaintlib.tile_translate_batch()` for the layout.
+
+        """
+        tdx, dxr = divmod(dx, N)
+        tdy, dyr = divmod(dy, N)
+        xoffs = [tdx] if dxr == 0 else [tdx, tdx + 1]
+        yoffs = [tdy] if dyr == 0 else [tdy, tdy + 1]
+        src_tiles = self.snapshot.tiledict
+        targets = set()
+        for (tx, ty) in src_tiles:
+            for ox in xoffs:
+                for oy in yoffs:
+                    targets.add((tx + ox, ty + oy))
+        plan = []
+        for (tx, ty) in targets:
+            srcs = []
+            for sy in (ty - tdy - 1, ty - tdy):
+                for sx in (tx - tdx - 1, tx - tdx):
+                    st = (sx, sy)
+                    srcs.append(st if st in src_tiles else None)
+            plan.append(((tx, ty), tuple(srcs)))
         if self.sort:
             x, y = self.start_pos
-            tx = (x + dx) // N
-            ty = (y + dy) // N
-            self.blank_queue.sort(
-                key=lambda p: abs(tx - p[0]) + abs(ty - p[1]),
+            ptx = (x + dx) // N
+            pty = (y + dy) // N
+            plan.sort(
+                key=lambda p: abs(ptx - p[0][0]) + abs(pty - p[0][1]),
             )
-        # Calculate offsets
-        self.slices_x = calc_translation_slices(int(dx))
-        self.slices_y = calc_translation_slices(int(dy))
-        # Need to process every source chunk
-        self.chunks_i = 0
+        return plan
+
+    def preview_tile(self, tx, ty, mipmap_level):
+        """Get a display tile for an incompletely processed move
+
+        :param int tx: Tile X coord, at mipmap_level
+        :param int ty: Tile Y coord, at mipmap_level
+        :param int mipmap_level: Mipmap level being displayed
+        :returns: A tile array, or None if the surface is up to date
+        :rtype: numpy.ndarray
+
+        The preview is exact for level 0 tiles, which are assembled on
+        the fly from the snapshot. Tiles for deeper mipmap levels are
+        assembled from the mipmaps as they were before the move, so
+        they are only approximate.
+
+        """
+        if mipmap_level == 0 and (tx, ty) in self.written:
+            return None
+        mipmap_level = min(mipmap_level, len(self._mipmap_tiledicts) - 1)
+        tiledict = self._mipmap_tiledicts[mipmap_level]
+        fac = 2 ** mipmap_level
+        dx, dy = self.offset
+        tdx, dxr = divmod(dx // fac, N)
+        tdy, dyr = divmod(dy // fac, N)
+        srcs = []
+        for sy in (ty - tdy - 1, ty - tdy):
+            for sx in (tx - tdx - 1, tx - tdx):
+                t = tiledict.get((sx, sy))
+                srcs.append(None if t is None else t.rgba)
+        if all(src is None for src in srcs):
+            return transparent_tile.rgba
+        dst = np.empty((N, N, 4), 'uint16')
+        mypaintlib.tile_translate_batch([[dst] + srcs], dxr, dyr)
+        return dst
 
     def cleanup(self):
         """Cleans up after processing the move.
@@ -972,15 +1546,17 @@ class _TiledSurfaceMove (object):
 
         """
         # Process any remaining work. Caller should have done this already.
-        if self.chunks_i < len(self.chunks) or len(self.blank_queue) > 0:
+        if self.plan_i < len(self.plan) or len(self.blank_queue) > 0:
             logger.warning("Stuff left to do at end of move cleanup(). May "
                            "result in poor interactive appearance. "
-                           "chunks=%d/%d, blanks=%d", self.chunks_i,
-                           len(self.chunks), len(self.blank_queue))
+                           "chunks=%d/%d, blanks=%d", self.plan_i,
+                           len(self.plan), len(self.blank_queue))
             logger.warning("Doing cleanup now...")
             self.process(n=-1)
-        assert self.chunks_i >= len(self.chunks)
+        assert self.plan_i >= len(self.plan)
         assert len(self.blank_queue) == 0
+        if self.surface._move_preview is self:
+            self.surface._move_preview = None
         # Remove empty tiles created by Layer Move
         removed, total = self.surface.remove_empty_tiles()
         logger.debug(
@@ -991,21 +1567,31 @@ class _TiledSurfaceMove (object):
     def process(self, n=200):
         """Process a number of pending tile moves
 
-        :param int n: The number of source tiles to process in this call
+        :param int n: The number of target tiles to process in this call
         :returns: whether there are any more tiles to process
         :rtype: bool
 
         Specify zero or negative `n` to process all remaining tiles.
 
+        Observers are notified about the changed tiles only once the
+        current update is fully processed. Until then, the preview
+        stands in for them.
+
         """
-        updated = set()
+        updated = self.cycle_updated
         moves_remaining = self._process_moves(n, updated)
         blanks_remaining = self._process_blanks(n, updated)
         for pos in updated:
             self.surface._mark_mipmap_dirty(*pos)
-        bbox = lib.surface.get_tiles_bbox(updated)
-        self.surface.notify_observers(*bbox)
-        return blanks_remaining or moves_remaining
+        remaining = blanks_remaining or moves_remaining
+        if not remaining:
+            if self.surface._move_preview is self:
+                self.surface._move_preview = None
+            self.cycle_updated = set()
+            if updated:
+                bbox = lib.surface.get_tiles_bbox(updated)
+                self.surface.notify_observers(*bbox)
+        return remaining
 
     def _process_moves(self, n, updated):
         """Internal: process pending tile moves
@@ -1016,52 +1602,36 @@ class _TiledSurfaceMove (object):
         :rtype: bool
 
         """
-        if self.chunks_i > len(self.chunks):
+        if self.plan_i >= len(self.plan):
             return False
         if n <= 0:
-            n = len(self.chunks)  # process all remaining
-        is_integral = len(self.slices_x) == 1 and len(self.slices_y) == 1
-        for src_t in self.chunks[self.chunks_i:self.chunks_i + n]:
-            src_tx, src_ty = src_t
-            src_tile = self.snapshot.tiledict[src_t]
-            for slice_x in self.slices_x:
-                (src_x0, src_x1), (targ_tdx, targ_x0, targ_x1) = slice_x
-                for slice_y in self.slices_y:
-                    (src_y0, src_y1), (targ_tdy, targ_y0, targ_y1) = slice_y
-                    targ_tx = src_tx + targ_tdx
-                    targ_ty = src_ty + targ_tdy
-                    targ_t = targ_tx, targ_ty
-                    if is_integral:
-                        # We're lucky. Perform a straight data copy.
-                        self.surface.tiledict[targ_t] = src_tile.copy()
-                        updated.add(targ_t)
-                        self.written.add(targ_t)
-                        continue
-                    # Get a tile to write
-                    targ_tile = None
-                    if targ_t in self.written:
-                        # Reuse a target tile made earlier in this
-                        # update cycle
-                        targ_tile = self.surface.tiledict.get(targ_t, None)
-                    if targ_tile is None:
-                        # Create and store a new blank target tile
-                        # to avoid corruption
-                        targ_tile = _Tile()
-                        self.surface.tiledict[targ_t] = targ_tile
-                        self.written.add(targ_t)
-                    # Copy this source slice to the destination
-                    targ_tile.rgba[targ_y0:targ_y1, targ_x0:targ_x1] \
-                        = src_tile.rgba[src_y0:src_y1, src_x0:src_x1]
-                    updated.add(targ_t)
-            # The source tile has been fully processed at this point,
-            # and can be removed from the output dict if it hasn't
-            # also been written to.
-            if src_t in self.surface.tiledict and src_t not in self.written:
-                self.surface.tiledict.pop(src_t, None)
-                updated.add(src_t)
-        # Move on, and return whether we're complete
-        self.chunks_i += n
-        return self.chunks_i < len(self.chunks)
+            n = len(self.plan)  # process all remaining
+        batch = self.plan[self.plan_i:self.plan_i + n]
+        self.plan_i += len(batch)
+        dx, dy = self.offset
+        dxr = dx % N
+        dyr = dy % N
+        src_tiles = self.snapshot.tiledict
+        tiledict = self.surface.tiledict
+        jobs = []
+        for targ_t, srcs in batch:
+            if dxr == 0 and dyr == 0:
+                # We're lucky. Snapshot tiles are read-only, so the
+                # target can share the source's memory.
+                tiledict[targ_t] = src_tiles[srcs[3]]
+            else:
+                targ_tile = _Tile()
+                jobs.append([targ_tile.rgba] + [
+                    None if st is None else src_tiles[st].rgba
+                    for st in srcs
+                ])
+                tiledict[targ_t] = targ_tile
+            updated.add(targ_t)
+            self.written.add(targ_t)
+        self.surface._note_tiles_changed(t for (t, _srcs) in batch)
+        if jobs:
+            mypaintlib.tile_translate_batch(jobs, dxr, dyr)
+        return self.plan_i < len(self.plan)
 
     def _process_blanks(self, n, updated):
         """Internal: process blanking-out queue
@@ -1074,12 +1644,13 @@ class _TiledSurfaceMove (object):
         """
         if n <= 0:
             n = len(self.blank_queue)
-        while len(self.blank_queue) > 0 and n > 0:
-            t = self.blank_queue.pop(0)
+        batch = self.blank_queue[-n:]
+        del self.blank_queue[-n:]
+        for t in batch:
             if t not in self.written:
                 self.surface.tiledict.pop(t, None)
+                self.surface._note_tiles_changed([t])
                 updated.add(t)
-                n -= 1
         return len(self.blank_queue) > 0
 
 
@@ -1217,7 +1788,8 @@ class Background (Surface):
             return super(Background, self).load_from_numpy(arr, x, y)
 
 
-def flood_fill(src, x, y, color, bbox, tolerance, dst):
+def flood_fill(src, x, y, color, bbox, tolerance, dst,
+               gap_size=0, offset=0, feather=0):
     """Fills connected areas of one surface into another
 
     :param src: Source surface-like object
@@ -1232,6 +1804,9 @@ def flood_fill(src, x, y, color, bbox, tolerance, dst):
     :type tolerance: float [0.0, 1.0]
     :param dst: Target surface
     :type dst: lib.tiledsurface.MyPaintSurface
+    :param int gap_size: close gaps up to this many pixels wide
+    :param int offset: grow (>0) or shrink (<0) the fill, in pixels
+    :param int feather: width of the fill's soft edge, in pixels
 
     See also `lib.layer.Layer.flood_fill()`.
 
@@ -1247,27 +1822,25 @@ def flood_fill(src, x, y, color, bbox, tolerance, dst):
     ...         with surf2.tile_request(tx, ty,readonly=True) as t2:
     ...             assert (t2 == t1).all()
 
-    """
-    # Color to fill with
-    fill_r, fill_g, fill_b = color
+    Gaps in the source's outlines are closed by first filling only the
+    pixels which are further than half the gap size from any pixel that
+    doesn't match. That fill is then grown back out by the same amount,
+    over matching pixels only. Growing, shrinking, and feathering are
+    applied after that. All of these steps use the distance fields of
+    `lib.morphology`, and are limited to `lib.morphology.MAX_RADIUS`.
 
+    """
     # Limits
     tolerance = helpers.clamp(tolerance, 0.0, 1.0)
+    max_radius = lib.morphology.MAX_RADIUS
+    gap_radius = int(math.ceil(helpers.clamp(gap_size, 0, 2*max_radius) / 2))
+    offset = int(helpers.clamp(offset, -max_radius, max_radius))
+    feather = int(helpers.clamp(feather, 0, max_radius))
 
-    # Maximum area to fill: tile and in-tile pixel extents
-    bbx, bby, bbw, bbh = bbox
+    # Maximum area to fill
+    bbx, bby, bbw, bbh = [int(c) for c in bbox]
     if bbh <= 0 or bbw <= 0:
         return
-    bbbrx = bbx + bbw - 1
-    bbbry = bby + bbh - 1
-    min_tx = int(bbx // N)
-    min_ty = int(bby // N)
-    max_tx = int(bbbrx // N)
-    max_ty = int(bbbry // N)
-    min_px = int(bbx % N)
-    min_py = int(bby % N)
-    max_px = int(bbbrx % N)
-    max_py = int(bbbry % N)
 
     # Tile and pixel addressing for the seed point
     tx, ty = int(x // N), int(y // N)
@@ -1281,69 +1854,45 @@ def flood_fill(src, x, y, color, bbox, tolerance, dst):
         targ_g = 0
         targ_b = 0
         targ_a = 0
-
-    # Flood-fill loop
-    filled = {}
-    tileq = [
-        ((tx, ty),
-         [(px, py)])
-    ]
-    while len(tileq) > 0:
-        (tx, ty), seeds = tileq.pop(0)
-        # Bbox-derived limits
-        if tx > max_tx or ty > max_ty:
-            continue
-        if tx < min_tx or ty < min_ty:
-            continue
-        # Pixel limits within this tile...
-        min_x = 0
-        min_y = 0
-        max_x = N-1
-        max_y = N-1
-        # ... vary at the edges
-        if tx == min_tx:
-            min_x = min_px
-        if ty == min_ty:
-            min_y = min_py
-        if tx == max_tx:
-            max_x = max_px
-        if ty == max_ty:
-            max_y = max_py
-        # Flood-fill one tile
-        with src.tile_request(tx, ty, readonly=True) as src_tile:
-            dst_tile = filled.get((tx, ty), None)
-            if dst_tile is None:
-                dst_tile = np.zeros((N, N, 4), 'uint16')
-                filled[(tx, ty)] = dst_tile
-            overflows = mypaintlib.tile_flood_fill(
-                src_tile, dst_tile, seeds,
-                targ_r, targ_g, targ_b, targ_a,
-                fill_r, fill_g, fill_b,
-                min_x, min_y, max_x, max_y,
-                tolerance,
+    targ = (targ_r, targ_g, targ_b, targ_a)
+
+    # Fill the alpha tilemap, closing gaps if needed
+    source = _FloodFillSource(src, targ, tolerance)
+    seed = ((tx, ty), (px, py))
+    bbox = (bbx, bby, bbw, bbh)
+    filled = _flood_fill_alpha(source, seed, bbox, gap_radius)
+    if gap_radius > 0:
+        if filled:
+            limit = dict(
+                (ti, source.get(ti))
+                for ti in lib.morphology.dilated_tiles(filled)
             )
-            seeds_n, seeds_e, seeds_s, seeds_w = overflows
-        # Enqueue overflows in each cardinal direction
-        if seeds_n and ty > min_ty:
-            tpos = (tx, ty-1)
-            tileq.append((tpos, seeds_n))
-        if seeds_w and tx > min_tx:
-            tpos = (tx-1, ty)
-            tileq.append((tpos, seeds_w))
-        if seeds_s and ty < max_ty:
-            tpos = (tx, ty+1)
-            tileq.append((tpos, seeds_s))
-        if seeds_e and tx < max_tx:
-            tpos = (tx+1, ty)
-            tileq.append((tpos, seeds_e))
-
-    # Composite filled tiles into the destination surface
+            filled = lib.morphology.dilate(filled, gap_radius, limit=limit)
+        else:
+            # Seed was in a narrow area. Fill it normally.
+            filled = _flood_fill_alpha(source, seed, bbox, 0)
+
+    # Post-process the filled area
+    if offset > 0:
+        filled = lib.morphology.dilate(filled, offset)
+    elif offset < 0:
+        filled = lib.morphology.erode(filled, -offset)
+    if feather > 0:
+        filled = lib.morphology.feather(filled, feather)
+    lib.morphology.clip_to_bbox(filled, bbox)
+
+    # Composite filled tiles into the destination surface.
+    # The fill is stored as alpha only until this point.
+    fill_rgb = np.array(color, dtype='float64').reshape((1, 1, 3))
     mode = mypaintlib.CombineNormal
+    src_tile = np.empty((N, N, 4), 'uint16')
     if PY3:
         filled_items = filled.items()
     else:
         filled_items = filled.iteritems()
-    for (tx, ty), src_tile in filled_items:
+    for (tx, ty), alpha in filled_items:
+        src_tile[:, :, 3] = alpha
+        src_tile[:, :, :3] = alpha[:, :, np.newaxis] * fill_rgb
         with dst.tile_request(tx, ty, readonly=False) as dst_tile:
             mypaintlib.tile_combine(mode, src_tile, dst_tile, True, 1.0)
         dst._mark_mipmap_dirty(tx, ty)
@@ -1351,6 +1900,137 @@ def flood_fill(src, x, y, color, bbox, tolerance, dst):
     dst.notify_observers(*bbox)
 
 
+def _flood_fill_alpha(source, seed, bbox, gap_radius):
+    """Flood-fill into a new alpha tilemap (flood_fill() helper)
+
+    :param _FloodFillSource source: what to fill
+    :param tuple seed: starting point, as ((tx, ty), (px, py))
+    :param tuple bbox: limits of the fill, as pixel (x, y, w, h)
+    :param int gap_radius: avoid pixels this close to non-matching ones
+    :returns: alpha tilemap of the filled area, excluding empty tiles
+    :rtype: dict
+
+    """
+    bbx, bby, bbw, bbh = bbox
+    min_tx = bbx // N
+    min_ty = bby // N
+    max_tx = (bbx + bbw - 1) // N
+    max_ty = (bby + bbh - 1) // N
+    targ_r, targ_g, targ_b, targ_a = source.targ
+
+    # Flood-fill loop. Each native call fills as far as it can through
+    # the source tiles it's given, and returns the seeds it has for
+    # tiles outside that set. Those tiles and their neighbours are
+    # fetched for the next round.
+    filled = {}
+    (tx, ty), (px, py) = seed
+    seeds = {(tx, ty): [(px, py)]}
+    while seeds:
+        needed = set()
+        for (stx, sty) in seeds:
+            for ntx in xrange(max(min_tx, stx-1), min(max_tx, stx+1) + 1):
+                for nty in xrange(max(min_ty, sty-1), min(max_ty, sty+1) + 1):
+                    needed.add((ntx, nty))
+        if gap_radius > 0:
+            # The distance fields look one tile further out
+            source.prefetch(lib.morphology.dilated_tiles(needed))
+        else:
+            source.prefetch(needed)
+        src_tiles = {}
+        blocked = None
+        if gap_radius > 0:
+            blocked = {}
+        for ti in needed:
+            src_tiles[ti] = source.src_tile(ti)
+            if blocked is not None:
+                blocked[ti] = source.blocked_tile(ti, gap_radius)
+        seeds = mypaintlib.flood_fill_tiles(
+            src_tiles, filled, seeds, blocked,
+            targ_r, targ_g, targ_b, targ_a,
+            bbx, bby, bbw, bbh,
+            source.tolerance,
+        )
+    return dict((ti, a) for (ti, a) in filled.items() if a.any())
+
+
+class _FloodFillSource (object):
+    """Cached access to a fill's source tiles and their color matches
+
+    Instances behave like a read-only alpha tilemap (see
+    `lib.morphology`) of how well each source pixel matches the fill's
+    target color, as calculated by `mypaintlib.tile_fill_match_alpha()`.
+
+    """
+
+    def __init__(self, src, targ, tolerance):
+        """Initialize for a fill
+
+        :param src: Source surface-like object
+        :param tuple targ: premultiplied fix15 target RGBA color
+        :param float tolerance: the fill's tolerance [0.0, 1.0]
+
+        """
+        super(_FloodFillSource, self).__init__()
+        self._src = src
+        self.targ = tuple(targ)
+        self.tolerance = tolerance
+        cache_size = _FLOOD_FILL_SRC_CACHE_SIZE
+        self._src_tiles = lib.cache.LRUCache(capacity=cache_size)
+        self._matches = lib.cache.LRUCache(capacity=cache_size)
+        self._blocked = lib.cache.LRUCache(capacity=cache_size)
+        self._stats = lib.morphology.TileStats(self)
+
+    def prefetch(self, tiles):
+        """Fetch a batch of source tiles, letting the source prepare them
+
+        Sources which render their tiles, like the layer stack renderings
+        used for sample-merged fills, can do that in parallel.
+
+        """
+        missing = [ti for ti in tiles if ti not in self._src_tiles]
+        if not missing:
+            return
+        prefetch_tiles = getattr(self._src, "prefetch_tiles", None)
+        if prefetch_tiles is not None:
+            prefetch_tiles(missing)
+        for ti in missing:
+            self.src_tile(ti)
+
+    def src_tile(self, ti):
+        """Get a fix15 RGBA source tile"""
+        tile = self._src_tiles.get(ti)
+        if tile is None:
+            tx, ty = ti
+            with self._src.tile_request(tx, ty, readonly=True) as src_tile:
+                tile = src_tile
+            self._src_tiles[ti] = tile
+        return tile
+
+    def get(self, ti, default=None):
+        """Get the color match alpha for a tile (never missing)"""
+        match = self._matches.get(ti)
+        if match is None:
+            match = np.empty((N, N), 'uint16')
+            mypaintlib.tile_fill_match_alpha(
+                self.src_tile(ti), match,
+                *(self.targ + (self.tolerance,))
+            )
+            self._matches[ti] = match
+        return match
+
+    def blocked_tile(self, ti, radius):
+        """Get a tile marking pixels within radius of non-matching ones"""
+        blocked = self._blocked.get(ti)
+        if blocked is None:
+            dist = lib.morphology.distance_field(
+                self, ti, radius+1,
+                stats=self._stats,
+            )
+            blocked = (dist <= radius).astype('uint16')
+            self._blocked[ti] = blocked
+        return blocked
+
+
 class PNGFileUpdateTask (object):
     """Piecemeal callable: writes to or replaces a PNG file
 
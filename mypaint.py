@@ -23,6 +23,7 @@ It then passes control to gui.main.main() for command line launching.
 import sys
 import os
 import re
+import time
 import logging
 
 logger = logging.getLogger('mypaint')
@@ -410,6 +411,8 @@ def init_gettext(localepath):
 
 
 if __name__ == '__main__':
+    launch_time = time.time()
+
     # Console logging
     log_format = "%(levelname)s: %(name)s: %(message)s"
     console_handler = logging.StreamHandler(stream=sys.stderr)
@@ -445,6 +448,19 @@ if __name__ == '__main__':
     logger.debug('old_confpath: %r', old_confpath)
     logger.debug('localepath: %r', localepath)
 
+    # Startup profiling: see lib.startupprofile.
+    # Imports are timed from here on.
+    startup_profile = os.environ.get("MYPAINT_STARTUP_PROFILE")
+    if startup_profile:
+        import lib.startupprofile
+        lib.startupprofile.start(startup_profile, start_time=launch_time)
+
+    # Hot-path metrics: see lib.instrumentation.
+    instrumentation_output = os.environ.get("MYPAINT_INSTRUMENTATION")
+    if instrumentation_output:
+        import lib.instrumentation
+        lib.instrumentation.start(instrumentation_output)
+
     # Locale setting
     init_gettext(localepath)
 
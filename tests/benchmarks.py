@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+# This file is part of MyPaint.
+# Copyright (C) 2018 by the MyPaint Development Team
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Headless benchmarks for the rendering and file I/O core
+
+These benchmarks use only lib.document.Document, lib.layer and the
+test data in this folder, so they run without a display (in a CI
+container, for example). Results can be written as JSON, and compared
+against an earlier run to catch regressions:
+
+    python -m tests.benchmarks --list
+    python -m tests.benchmarks -c 5 --json results.json
+    python -m tests.benchmarks --compare results.json --threshold 1.2
+
+Each benchmark is a generator, in the style of the old GUI performance
+tests in tests/unported/performance.py. Work done before it yields
+`START_MEASUREMENT` is setup. Only the work done between that and the
+next `STOP_MEASUREMENT` is timed. A benchmark may measure several
+intervals, and their times are added up.
+
+"""
+
+## Imports
+
+from __future__ import division, print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+from os.path import join
+from optparse import OptionParser
+
+import numpy as np
+
+from . import paths
+from lib import brush
+from lib import tiledsurface
+from lib import pixbufsurface
+from lib import document
+from lib import command
+from lib import stroke
+import lib.meta
+
+
+## Module constants
+
+TEST_BIGIMAGE = "bigimage.ora"
+TEST_EVENTS = "painting30sec.dat"
+TEST_BRUSH = "brushes/v2/charcoal.myb"
+
+START_MEASUREMENT = "start"
+STOP_MEASUREMENT = "stop"
+
+#: Version of the JSON results format
+RESULTS_VERSION = 1
+
+ALL_BENCHMARKS = {}
+
+
+## Helpers
+
+
+def benchmark(func):
+    """Decorator: registers a benchmark generator function"""
+    ALL_BENCHMARKS[func.__name__] = func
+    return func
+
+
+def _load_doc(filename=TEST_BIGIMAGE):
+    doc = document.Document(painting_only=True)
+    doc.load(join(paths.TESTS_DIR, filename))
+    return doc
+
+
+def _load_events():
+    return np.loadtxt(join(paths.TESTS_DIR, TEST_EVENTS))
+
+
+def _load_brushinfo():
+    with open(join(paths.TESTS_DIR, TEST_BRUSH), "r") as fp:
+        return brush.BrushInfo(fp.read())
+
+
+def _render_target(doc, mipmap_level=0):
+    """An 8bpc surface covering the doc, and its tiles at a mipmap level"""
+    x, y, w, h = doc.get_bbox()
+    scale = 2 ** mipmap_level
+    surf = pixbufsurface.Surface(
+        x // scale, y // scale,
+        max(1, w // scale), max(1, h // scale),
+    )
+    return surf, list(surf.get_tiles())
+
+
+def _paint_events(layer, b, events, scale=1.0):
+    """Paint recorded input events onto a layer, like Brushwork does"""
+    t_old = events[0][0]
+    for t, x, y, pressure in events:
+        dtime = t - t_old
+        t_old = t
+        layer.stroke_to(
+            b,
+            x * scale, y * scale,
+            pressure,
+            0.0, 0.0,
+            dtime,
+            1.0,  # view zoom
+            0.0,  # view rotation
+        )
+
+
+## Benchmarks
+
+
+@benchmark
+def render():
+    """Render all of bigimage.ora, 1:1, with an empty render cache"""
+    doc = _load_doc()
+    surf, tiles = _render_target(doc)
+    doc.layer_stack._render_cache.clear()
+    yield START_MEASUREMENT
+    doc.layer_stack.render(surf, tiles, 0)
+    yield STOP_MEASUREMENT
+    doc.cleanup()
+
+
+@benchmark
+def render_cached():
+    """Render all of bigimage.ora, 1:1, from a warm render cache"""
+    doc = _load_doc()
+    surf, tiles = _render_target(doc)
+    doc.layer_stack.render(surf, tiles, 0)
+    yield START_MEASUREMENT
+    doc.layer_stack.render(surf, tiles, 0)
+    yield STOP_MEASUREMENT
+    doc.cleanup()
+
+
+@benchmark
+def render_zoomed_out():
+    """Render all of bigimage.ora at mipmap level 2 (25%)"""
+    doc = _load_doc()
+    surf, tiles = _render_target(doc, mipmap_level=2)
+    doc.layer_stack._render_cache.clear()
+    yield START_MEASUREMENT
+    doc.layer_stack.render(surf, tiles, 2)
+    yield STOP_MEASUREMENT
+    doc.cleanup()
+
+
+@benchmark
+def load_ora():
+    """Load bigimage.ora"""
+    doc = document.Document(painting_only=True)
+    filename = join(paths.TESTS_DIR, TEST_BIGIMAGE)
+    yield START_MEASUREMENT
+    doc.load(filename)
+    yield STOP_MEASUREMENT
+    doc.cleanup()
+
+
+@benchmark
+def save_ora():
+    """Save bigimage.ora, including its thumbnail and merged image"""
+    doc = _load_doc()
+    tmpdir = tempfile.mkdtemp(suffix="_benchmarks")
+    try:
+        yield START_MEASUREMENT
+        doc.save(join(tmpdir, "saved.ora"))
+        yield STOP_MEASUREMENT
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        doc.cleanup()
+
+
+@benchmark
+def flood_fill():
+    """Flood fill the middle of bigimage.ora's current layer"""
+    doc = _load_doc()
+    x, y, w, h = doc.get_bbox()
+    yield START_MEASUREMENT
+    doc.flood_fill(x + w // 2, y + h // 2, (0.9, 0.1, 0.4), tolerance=0.2)
+    doc.sync_pending_changes()
+    yield STOP_MEASUREMENT
+    doc.cleanup()
+
+
+@benchmark
+def flood_fill_merged():
+    """Flood fill the middle of bigimage.ora, sampling all layers"""
+    doc = _load_doc()
+    x, y, w, h = doc.get_bbox()
+    yield START_MEASUREMENT
+    doc.flood_fill(x + w // 2, y + h // 2, (0.9, 0.1, 0.4), tolerance=0.2,
+                   sample_merged=True)
+    doc.sync_pending_changes()
+    yield STOP_MEASUREMENT
+    doc.cleanup()
+
+
+@benchmark
+def paint():
+    """Paint 30s of recorded input onto a layer, with a charcoal brush"""
+    doc = document.Document(_load_brushinfo(), painting_only=True)
+    events = _load_events()
+    layer = doc.layer_stack.current
+    yield START_MEASUREMENT
+    _paint_events(layer, doc.brush, events, scale=2.0)
+    yield STOP_MEASUREMENT
+    doc.cleanup()
+
+
+@benchmark
+def stroke_replay():
+    """Replay a recorded 30s stroke with Stroke.render()"""
+    b = brush.Brush(_load_brushinfo())
+    events = _load_events()
+    recording = stroke.Stroke()
+    recording.start_recording(b)
+    surf = tiledsurface.Surface()
+    t_old = events[0][0]
+    surf.begin_atomic()
+    for t, x, y, pressure in events:
+        dtime = t - t_old
+        t_old = t
+        x *= 2
+        y *= 2
+        b.stroke_to(surf.backend, x, y, pressure, 0.0, 0.0, dtime, 1.0, 0.0)
+        recording.record_event(dtime, x, y, pressure, 0.0, 0.0, 1.0, 0.0)
+    surf.end_atomic()
+    recording.stop_recording()
+    target = tiledsurface.Surface()
+    yield START_MEASUREMENT
+    recording.render(target)
+    yield STOP_MEASUREMENT
+
+
+@benchmark
+def layer_move():
+    """Move bigimage.ora's current layer by an odd offset, then undo"""
+    doc = _load_doc()
+    path = doc.layer_stack.current_path
+    yield START_MEASUREMENT
+    cmd = command.MoveLayer(doc, path, 0, 0)
+    cmd.move_to(123, 45)
+    while cmd.process_move():
+        pass
+    doc.do(cmd)
+    doc.undo()
+    yield STOP_MEASUREMENT
+    doc.cleanup()
+
+
+@benchmark
+def layer_restack():
+    """Move bigimage.ora's current layer down the stack and back"""
+    doc = _load_doc()
+    doc.select_layer(path=(0,))
+    yield START_MEASUREMENT
+    doc.bubble_current_layer_down()
+    doc.bubble_current_layer_up()
+    doc.sync_pending_changes()
+    yield STOP_MEASUREMENT
+    doc.cleanup()
+
+
+## Running benchmarks
+
+
+def run_benchmark(func):
+    """Run a benchmark once
+
+    :returns: total seconds spent in its measured intervals
+    :rtype: float
+
+    """
+    gen = func()
+    total = 0.0
+    for res in gen:
+        assert res == START_MEASUREMENT, res
+        t0 = time.time()
+        res = next(gen)
+        total += time.time() - t0
+        assert res == STOP_MEASUREMENT, res
+    return total
+
+
+def run_benchmarks(names, count=3):
+    """Run benchmarks several times
+
+    :param list names: Benchmarks to run, from `ALL_BENCHMARKS`
+    :param int count: How many times to run each
+    :returns: results, in the JSON results format
+    :rtype: dict
+
+    """
+    results = {}
+    for name in names:
+        func = ALL_BENCHMARKS[name]
+        times = []
+        for i in range(count):
+            times.append(run_benchmark(func))
+            print("%s: run %d/%d: %0.4fs" % (name, i + 1, count, times[-1]),
+                  file=sys.stderr)
+        results[name] = {
+            "description": func.__doc__,
+            "times": times,
+            "min": min(times),
+            "median": float(np.median(times)),
+        }
+    return {
+        "version": RESULTS_VERSION,
+        "environment": {
+            "mypaint": lib.meta.MYPAINT_VERSION,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": _cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def _cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Compare results against a baseline run
+
+    :param dict results: Results from `run_benchmarks()`
+    :param dict baseline: Earlier results, loaded from JSON
+    :param float threshold: Slowdown ratio counted as a regression
+    :returns: names of the benchmarks which regressed
+    :rtype: list
+
+    Medians are compared.
+
+    """
+    regressions = []
+    print("Compared with the baseline (median, ratio):")
+    for name, result in sorted(results["results"].items()):
+        base = baseline.get("results", {}).get(name)
+        if not base or not base.get("median"):
+            print("  %-20s %8.4fs  (no baseline)" % (name, result["median"]))
+            continue
+        ratio = result["median"] / base["median"]
+        flag = ""
+        if ratio > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("  %-20s %8.4fs  %5.2fx%s"
+              % (name, result["median"], ratio, flag))
+    return regressions
+
+
+## Main
+
+
+def main():
+    parser = OptionParser("usage: %prog [options] [benchmark ...]")
+    parser.add_option(
+        "-l",
+        "--list",
+        action="store_true",
+        default=False,
+        help="list all available benchmarks",
+    )
+    parser.add_option(
+        "-c",
+        "--count",
+        metavar="N",
+        type="int",
+        default=3,
+        help="number of repetitions (default: 3)",
+    )
+    parser.add_option(
+        "-j",
+        "--json",
+        metavar="FILE",
+        help="write the results to FILE as JSON ('-' for stdout)",
+    )
+    parser.add_option(
+        "--compare",
+        metavar="FILE",
+        help="compare with earlier results saved as JSON",
+    )
+    parser.add_option(
+        "--threshold",
+        metavar="RATIO",
+        type="float",
+        default=1.2,
+        help="slowdown counted as a regression by --compare "
+             "(default: 1.2)",
+    )
+    options, names = parser.parse_args()
+
+    if options.list:
+        for name in sorted(ALL_BENCHMARKS):
+            print("%-20s %s" % (name, ALL_BENCHMARKS[name].__doc__))
+        sys.exit(0)
+
+    if not names:
+        names = sorted(ALL_BENCHMARKS)
+    for name in names:
+        if name not in ALL_BENCHMARKS:
+            print("Unknown benchmark:", name, file=sys.stderr)
+            sys.exit(1)
+
+    # Output files from the document code go into a scratch folder
+    old_cwd = os.getcwd()
+    tmpdir = tempfile.mkdtemp(suffix="_benchmarks")
+    os.chdir(tmpdir)
+    try:
+        results = run_benchmarks(names, count=options.count)
+    finally:
+        os.chdir(old_cwd)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if options.json == "-":
+        print(json.dumps(results, indent=2))
+    elif options.json:
+        with open(options.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+    if options.json != "-":
+        for name, result in sorted(results["results"].items()):
+            print("%-20s min %0.4fs, median %0.4fs"
+                  % (name, result["min"], result["median"]))
+
+    if options.compare:
+        with open(options.compare, "r") as fp:
+            baseline = json.load(fp)
+        if compare(results, baseline, options.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Tests that sample-merged flood fills don't depend on what the display
+# happens to have cached.
+
+from __future__ import division, print_function
+from os.path import join
+import unittest
+
+from . import paths
+from lib.document import Document
+from lib import pixbufsurface
+
+
+TEST_IMAGE = "smallimage.ora"
+FILL_COLOR = (0.9, 0.1, 0.4)
+
+
+class SampleMergedFill (unittest.TestCase):
+
+    def setUp(self):
+        self.doc = Document(painting_only=True)
+        self.doc.load(join(paths.TESTS_DIR, TEST_IMAGE))
+
+    def tearDown(self):
+        self.doc.cleanup()
+
+    def _render_for_display(self):
+        """Fill the root's render cache with 8bpc display tiles"""
+        x, y, w, h = self.doc.get_bbox()
+        surf = pixbufsurface.Surface(x, y, w, h)
+        root = self.doc.layer_stack
+        root.render(surf, list(surf.get_tiles()), 0)
+
+    def _fill(self, tolerance):
+        """Fill the middle with a new layer, and return its tiles"""
+        doc = self.doc
+        x, y, w, h = doc.get_bbox()
+        doc.flood_fill(
+            x + w // 2, y + h // 2, FILL_COLOR,
+            tolerance=tolerance,
+            sample_merged=True,
+            make_new_layer=True,
+        )
+        doc.sync_pending_changes()
+        surf = doc.layer_stack.current._surface
+        tiles = {}
+        for tx, ty in surf.get_tiles():
+            with surf.tile_request(tx, ty, readonly=True) as t:
+                tiles[(tx, ty)] = t.copy()
+        doc.undo()
+        return tiles
+
+    def _assert_same_tiles(self, a, b):
+        self.assertEqual(set(a), set(b))
+        for ti in a:
+            self.assertTrue(
+                (a[ti] == b[ti]).all(),
+                "tile %r differs" % (ti,),
+            )
+
+    def test_warm_cache_matches_cold(self):
+        """Fills match whether or not the display cached tiles first"""
+        for tolerance in (0.0, 0.02, 0.2):
+            self.doc.layer_stack._render_cache.clear()
+            cold = self._fill(tolerance)
+            self.doc.layer_stack._render_cache.clear()
+            self._render_for_display()
+            warm = self._fill(tolerance)
+            self._assert_same_tiles(cold, warm)
+
+    def test_repeated_fill_matches(self):
+        """Fills reusing the shared fix15 tiles match the first fill"""
+        self.doc.layer_stack._render_cache.clear()
+        first = self._fill(0.02)
+        second = self._fill(0.02)
+        self._assert_same_tiles(first, second)
+
+
+if __name__ == '__main__':
+    unittest.main()
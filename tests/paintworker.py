@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# Tests for the painting thread: job order, flushing and stopping,
+# concurrent tile access, and failures on the worker thread.
+
+from __future__ import division, print_function
+from os.path import join
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from . import paths
+from lib import brush
+from lib.layer.data import SimplePaintingLayer
+from lib import tiledsurface
+import lib.paintworker
+
+
+TEST_EVENTS = "painting30sec.dat"
+TEST_BRUSH = "brushes/v2/charcoal.myb"
+
+#: Input events per submitted job, like a few motion events per frame.
+EVENTS_PER_JOB = 8
+
+#: Only the start of the recording is needed.
+MAX_EVENTS = 800
+
+
+def _load_brushinfo():
+    with open(join(paths.TESTS_DIR, TEST_BRUSH), "r") as fp:
+        return brush.BrushInfo(fp.read())
+
+
+def _load_events():
+    """Recorded input, as args for stroke_to() following the brush"""
+    data = np.loadtxt(join(paths.TESTS_DIR, TEST_EVENTS))[:MAX_EVENTS]
+    events = []
+    t_old = data[0][0]
+    for t, x, y, pressure in data:
+        events.append((x, y, pressure, 0.0, 0.0, t - t_old, 1.0, 0.0))
+        t_old = t
+    return events
+
+
+def _get_tiles(layer):
+    surf = layer._surface
+    tiles = {}
+    with surf.tile_lock:
+        for tx, ty in surf.get_tiles():
+            with surf.tile_request(tx, ty, readonly=True) as t:
+                tiles[(tx, ty)] = t.copy()
+    return tiles
+
+
+class _RecordingLayer (object):
+    """Stand-in layer which records the events it's asked to paint"""
+
+    def __init__(self, painted, fail_on=None):
+        super(_RecordingLayer, self).__init__()
+        self._painted = painted
+        self._fail_on = fail_on
+
+    def stroke_to_batch(self, brush, events, publish=None):
+        for evt in events:
+            if evt == self._fail_on:
+                raise RuntimeError("painting failed")
+            time.sleep(0.0005)
+            self._painted.append(evt)
+        return (len(events), False)
+
+
+class _GrowingLayer (object):
+    """Stand-in layer which adds a new tile to a surface per event"""
+
+    def __init__(self, surface):
+        super(_GrowingLayer, self).__init__()
+        self._surface = surface
+
+    def stroke_to_batch(self, brush, events, publish=None):
+        surf = self._surface
+        for tx, ty in events:
+            with surf.tile_lock:
+                with surf.tile_request(tx, ty, readonly=False) as t:
+                    t[:] = 1
+        return (len(events), False)
+
+
+class JobHandling (unittest.TestCase):
+    """Job order and failures, with stand-in layers"""
+
+    def setUp(self):
+        self.worker = lib.paintworker.PaintingWorker()
+
+    def tearDown(self):
+        self.worker.stop()
+
+    def test_order(self):
+        """Jobs are painted in the order they were submitted"""
+        painted = []
+        layers = [_RecordingLayer(painted) for i in range(3)]
+        jobs = []
+        expected = []
+        for i in range(60):
+            events = [(i, j) for j in range(5)]
+            expected.extend(events)
+            layer = layers[i % len(layers)]
+            jobs.append(self.worker.submit(layer, None, events))
+        self.worker.flush()
+        self.assertFalse(self.worker.busy)
+        self.assertTrue(all(job.done for job in jobs))
+        self.assertEqual(painted, expected)
+
+    def test_exception(self):
+        """A failing job is marked done, and later jobs still run"""
+        painted = []
+        good = _RecordingLayer(painted)
+        bad = _RecordingLayer(painted, fail_on=("bad",))
+        job1 = self.worker.submit(good, None, [(1,), (2,)])
+        job2 = self.worker.submit(bad, None, [(3,), ("bad",), (4,)])
+        job3 = self.worker.submit(good, None, [(5,)])
+        self.worker.flush()
+        self.assertTrue(job1.done and job2.done and job3.done)
+        self.assertEqual(painted, [(1,), (2,), (3,), (5,)])
+
+    def test_stop_and_restart(self):
+        """Stopping paints what was submitted, and ends the thread"""
+        painted = []
+        layer = _RecordingLayer(painted)
+        for i in range(10):
+            self.worker.submit(layer, None, [(i,)])
+        self.worker.stop()
+        self.assertEqual(len(painted), 10)
+        self.assertIsNone(self.worker._thread)
+        alive = [t for t in threading.enumerate()
+                 if t.name == "PaintingWorker"]
+        self.assertEqual(alive, [])
+        job = self.worker.submit(layer, None, [(10,)])
+        self.worker.flush()
+        self.assertTrue(job.done)
+        self.assertEqual(len(painted), 11)
+
+
+class ConcurrentReads (unittest.TestCase):
+    """The main thread reads surfaces while the worker adds tiles"""
+
+    def test_bbox_and_tiles_while_painting(self):
+        """get_bbox() and get_tiles() work while jobs are running"""
+        surf = tiledsurface.MyPaintSurface()
+        layer = _GrowingLayer(surf)
+        worker = lib.paintworker.PaintingWorker()
+        side = 48
+        reads = 0
+        try:
+            for ty in range(side):
+                events = [(tx, ty) for tx in range(side)]
+                worker.submit(layer, None, events)
+            while worker.busy:
+                bbox = surf.get_bbox()
+                tiles = surf.get_tiles()
+                self.assertTrue(bbox.w <= side * tiledsurface.N)
+                self.assertTrue(len(tiles) <= side * side)
+                reads += 1
+            worker.flush()
+        finally:
+            worker.stop()
+        self.assertTrue(reads > 0)
+        n = tiledsurface.N
+        self.assertEqual(tuple(surf.get_bbox()), (0, 0, side * n, side * n))
+        self.assertEqual(len(surf.get_tiles()), side * side)
+
+
+class RealPainting (unittest.TestCase):
+    """Painting real brushwork into a layer on the worker thread"""
+
+    def setUp(self):
+        self.brushinfo = _load_brushinfo()
+        self.events = _load_events()
+
+    def _paint_direct(self):
+        """Paint everything on this thread, for comparison"""
+        layer = SimplePaintingLayer()
+        b = brush.Brush(self.brushinfo)
+        for i in range(0, len(self.events), EVENTS_PER_JOB):
+            chunk = self.events[i:i + EVENTS_PER_JOB]
+            layer.stroke_to_batch(b, chunk)
+        return layer
+
+    def test_matches_main_thread(self):
+        """Worker output matches painting the same jobs in this thread"""
+        expected = _get_tiles(self._paint_direct())
+
+        layer = SimplePaintingLayer()
+        surf = layer._surface
+        notified = []
+        surf.observers.append(lambda *bbox: notified.append(
+            (threading.current_thread(), bbox),
+        ))
+        b = brush.Brush(self.brushinfo)
+        worker = lib.paintworker.PaintingWorker()
+        reads = 0
+        try:
+            for i in range(0, len(self.events), EVENTS_PER_JOB):
+                chunk = self.events[i:i + EVENTS_PER_JOB]
+                worker.submit(layer, b, chunk)
+                # Read the layer while the worker paints into it.
+                _get_tiles(layer)
+                layer.get_bbox()
+                reads += 1
+            worker.flush()
+        finally:
+            worker.stop()
+
+        self.assertTrue(reads > 0)
+        actual = _get_tiles(layer)
+        self.assertEqual(set(actual), set(expected))
+        for ti in expected:
+            self.assertTrue(
+                (actual[ti] == expected[ti]).all(),
+                "tile %r differs" % (ti,),
+            )
+        # Changed areas are only published in the calling thread.
+        self.assertTrue(notified)
+        main = threading.current_thread()
+        self.assertTrue(all(t is main for (t, bbox) in notified))
+
+
+if __name__ == '__main__':
+    unittest.main()
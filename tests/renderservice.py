@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# Tests for the canvas render service's worker threads: ordering,
+# cancellation, failures, and releasing backing store tiles.
+
+from __future__ import division, print_function
+import threading
+import time
+import unittest
+
+from . import paths
+import lib.gichecks
+from gi.repository import GLib
+from lib.helpers import Rect
+import gui.backingstore
+import gui.renderservice
+
+
+#: Seconds to wait for callbacks before giving up.
+TIMEOUT = 10.0
+
+
+class _Snapshot (object):
+    """Stand-in for a RenderSnapshot, which just takes a while"""
+
+    def __init__(self, tiles, started, delay=0.0, gate=None, fail=False):
+        super(_Snapshot, self).__init__()
+        self.tiles = list(tiles)
+        self._started = started
+        self._delay = delay
+        self._gate = gate
+        self._fail = fail
+
+    def render(self, surface, cancel=None):
+        self._started.append(self)
+        if self._gate is not None:
+            self._gate.wait(TIMEOUT)
+        deadline = time.time() + self._delay
+        while time.time() < deadline:
+            if cancel is not None and cancel.is_set():
+                return False
+            time.sleep(0.001)
+        if self._fail:
+            raise RuntimeError("render failed")
+        return not (cancel is not None and cancel.is_set())
+
+
+class RenderServiceTest (unittest.TestCase):
+
+    def setUp(self):
+        self.started = []
+        self.done = []
+        self.threads = []
+        self._loop = GLib.MainLoop()
+        self._expected = 0
+
+    def _callback(self, job, *args):
+        self.threads.append(threading.current_thread())
+        self.done.append((job, args))
+        if len(self.done) >= self._expected:
+            self._loop.quit()
+
+    def _wait_for(self, n):
+        """Run the main loop until n callbacks have been received"""
+        self._expected = n
+        if len(self.done) < n:
+            timeout_id = GLib.timeout_add(
+                int(TIMEOUT * 1000),
+                self._loop.quit,
+            )
+            self._loop.run()
+            GLib.source_remove(timeout_id)
+        self.assertEqual(len(self.done), n)
+
+    def _snapshot(self, **kwargs):
+        return _Snapshot([(0, 0)], self.started, **kwargs)
+
+    def test_order(self):
+        """One thread runs jobs, and calls back, in submission order"""
+        service = gui.renderservice.RenderService(threads=1)
+        jobs = [
+            service.submit(self._snapshot(delay=0.005), None,
+                           self._callback, i)
+            for i in range(10)
+        ]
+        self._wait_for(len(jobs))
+        self.assertEqual([job for (job, args) in self.done], jobs)
+        self.assertEqual([args for (job, args) in self.done],
+                         [(i,) for i in range(10)])
+        self.assertTrue(all(job.completed for job in jobs))
+        main = threading.current_thread()
+        self.assertTrue(all(t is main for t in self.threads))
+
+    def test_concurrent(self):
+        """Several threads call back for every job, exactly once"""
+        service = gui.renderservice.RenderService(threads=2)
+        jobs = [
+            service.submit(self._snapshot(delay=0.002 * (i % 3)), None,
+                           self._callback)
+            for i in range(40)
+        ]
+        self._wait_for(len(jobs))
+        self.assertEqual(
+            sorted(id(job) for (job, args) in self.done),
+            sorted(id(job) for job in jobs),
+        )
+        self.assertTrue(all(job.completed for job in jobs))
+
+    def test_exception(self):
+        """Failed jobs call back, and the worker carries on"""
+        service = gui.renderservice.RenderService(threads=1)
+        bad = service.submit(self._snapshot(fail=True), None,
+                             self._callback)
+        good = service.submit(self._snapshot(), None, self._callback)
+        self._wait_for(2)
+        self.assertEqual([job for (job, args) in self.done], [bad, good])
+        self.assertFalse(bad.completed)
+        self.assertIsInstance(bad.error, RuntimeError)
+        self.assertTrue(good.completed)
+        self.assertIsNone(good.error)
+
+    def test_cancel_all(self):
+        """Cancelled jobs call back, but only running ones were started"""
+        service = gui.renderservice.RenderService(threads=1)
+        gate = threading.Event()
+        running = service.submit(self._snapshot(gate=gate, delay=TIMEOUT),
+                                 None, self._callback)
+        queued = [
+            service.submit(self._snapshot(), None, self._callback)
+            for i in range(5)
+        ]
+        while not self.started:
+            time.sleep(0.001)
+        service.cancel_all()
+        gate.set()
+        self._wait_for(len(queued) + 1)
+        self.assertEqual(len(self.started), 1)
+        self.assertFalse(running.completed)
+        self.assertTrue(all(job.cancelled for job in queued))
+        self.assertFalse(any(job.completed for job in queued))
+
+
+class BackingStoreRelease (unittest.TestCase):
+    """Tiles handed to failed jobs must stop being pending"""
+
+    def test_failed_job_releases_tiles(self):
+        store = gui.backingstore.TileBackingStore()
+        self.assertTrue(store.prepare(0, (), Rect(0, 0, 4, 4)))
+        tiles = [(tx, ty) for tx in range(2) for ty in range(2)]
+        other = [(3, 3)]
+        loop = GLib.MainLoop()
+        results = []
+
+        def _done_cb(job, token):
+            # Like the canvas renderer's callback.
+            if job.completed:
+                store.finish_update(token, job.surface, job.snapshot.tiles)
+            else:
+                store.abort_update(token)
+            results.append(job)
+            loop.quit()
+
+        token = store.begin_update(tiles)
+        store.begin_update(other)
+        self.assertEqual(store.missing(tiles, include_pending=False), [])
+
+        service = gui.renderservice.RenderService(threads=1)
+        snapshot = _Snapshot(tiles, [], fail=True)
+        service.submit(snapshot, None, _done_cb, token)
+        timeout_id = GLib.timeout_add(int(TIMEOUT * 1000), loop.quit)
+        loop.run()
+        GLib.source_remove(timeout_id)
+
+        self.assertEqual(len(results), 1)
+        self.assertIsNotNone(results[0].error)
+        self.assertEqual(store.missing(tiles, include_pending=False), tiles)
+        # Tiles pending for other jobs stay pending.
+        self.assertTrue(store.has_pending)
+        self.assertEqual(store.missing(other, include_pending=False), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# This file is part of MyPaint.
+# Copyright (C) 2018 by the MyPaint Development Team
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Startup benchmark: time to first canvas frame, and slowest imports
+
+Launches MyPaint from the source tree several times, with startup
+profiling switched on (see lib/startupprofile.py). Each run is stopped
+as soon as the first canvas frame has been drawn. The median times to
+each startup milestone are reported, along with the imports which took
+the longest. Run it from the top of the source tree after building:
+
+    python tests/startup.py -c 5
+    python tests/startup.py --fresh-config --target 1.0 --json
+
+Use --fresh-config to start each run with an empty config folder, so
+that the results don't depend on your own workspace layout.
+
+"""
+
+## Imports
+
+from __future__ import division, print_function
+
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+
+## Module constants
+
+TESTS_DIR = os.path.abspath(os.path.dirname(__file__))
+TOP_DIR = os.path.dirname(TESTS_DIR)
+
+#: Environment variable read by mypaint.py, see lib.startupprofile
+PROFILE_ENV_VAR = "MYPAINT_STARTUP_PROFILE"
+
+#: Milestone marking the end of startup
+FIRST_FRAME_MILESTONE = "first canvas frame"
+
+
+## Helpers
+
+
+def _median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2
+
+
+def run_once(fresh_config=False, timeout=60.0):
+    """Launch MyPaint once, and return its startup profile report
+
+    :param bool fresh_config: Use a new, empty config folder
+    :param float timeout: Give up after this many seconds
+    :returns: The report, with an extra "wall_time" entry
+    :rtype: dict
+
+    """
+    tmpdir = tempfile.mkdtemp(suffix="_mypaint_startup")
+    report_file = os.path.join(tmpdir, "report.json")
+    env = dict(os.environ)
+    env[PROFILE_ENV_VAR] = report_file
+    args = [sys.executable, os.path.join(TOP_DIR, "mypaint.py")]
+    if fresh_config:
+        config_dir = os.path.join(tmpdir, "config")
+        os.mkdir(config_dir)
+        args += ["--config", config_dir]
+    t0 = time.time()
+    child = subprocess.Popen(args, cwd=TOP_DIR, env=env)
+    try:
+        while not os.path.exists(report_file):
+            if child.poll() is not None:
+                raise RuntimeError(
+                    "MyPaint exited (status %r) before drawing its canvas"
+                    % (child.returncode,)
+                )
+            if time.time() - t0 > timeout:
+                raise RuntimeError("Timed out waiting for the first frame")
+            time.sleep(0.01)
+        wall_time = time.time() - t0
+        with open(report_file, "r") as fp:
+            report = json.load(fp)
+    finally:
+        if child.poll() is None:
+            child.terminate()
+            child.wait()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    report["wall_time"] = wall_time
+    return report
+
+
+def summarize(reports, max_imports=25):
+    """Combine several runs' reports, taking medians
+
+    :param list reports: Reports returned by `run_once()`
+    :param int max_imports: How many of the slowest imports to list
+    :rtype: dict
+
+    """
+    milestones = {}
+    order = []
+    for report in reports:
+        for m in report["milestones"]:
+            if m["name"] not in milestones:
+                order.append(m["name"])
+            milestones.setdefault(m["name"], []).append(m["time"])
+    imports = {}
+    for report in reports:
+        for r in report["imports"]:
+            entry = imports.setdefault(r["module"], ([], []))
+            entry[0].append(r["total"])
+            entry[1].append(r["self"])
+    import_rows = [
+        {"module": name, "total": _median(totals), "self": _median(selfs)}
+        for name, (totals, selfs) in imports.items()
+    ]
+    import_rows.sort(key=lambda r: r["self"], reverse=True)
+    return {
+        "runs": len(reports),
+        "wall_time": _median([r["wall_time"] for r in reports]),
+        "milestones": [
+            {"name": name, "time": _median(milestones[name])}
+            for name in order
+        ],
+        "imports": import_rows[:max_imports],
+    }
+
+
+def print_summary(summary):
+    print("Median of %d runs:" % (summary["runs"],))
+    print("  %8.3f  launch to report (wall clock)" % (summary["wall_time"],))
+    for m in summary["milestones"]:
+        print("  %8.3f  %s" % (m["time"], m["name"]))
+    print("Slowest imports, by own time (self, total):")
+    for r in summary["imports"]:
+        print("  %8.3f %8.3f  %s" % (r["self"], r["total"], r["module"]))
+
+
+## Main
+
+
+def main():
+    parser = OptionParser("usage: %prog [options]")
+    parser.add_option(
+        "-c",
+        "--count",
+        metavar="N",
+        type="int",
+        default=3,
+        help="number of runs (default: 3)",
+    )
+    parser.add_option(
+        "-f",
+        "--fresh-config",
+        action="store_true",
+        default=False,
+        help="start each run with an empty config folder",
+    )
+    parser.add_option(
+        "-n",
+        "--imports",
+        metavar="N",
+        type="int",
+        default=25,
+        help="number of slow imports to list (default: 25)",
+    )
+    parser.add_option(
+        "-t",
+        "--target",
+        metavar="SECONDS",
+        type="float",
+        help="fail if the median time to the first frame is over this",
+    )
+    parser.add_option(
+        "-j",
+        "--json",
+        action="store_true",
+        default=False,
+        help="print the summary as JSON",
+    )
+    options, args = parser.parse_args()
+    reports = []
+    for i in range(options.count):
+        print("Run %d of %d..." % (i + 1, options.count), file=sys.stderr)
+        reports.append(run_once(fresh_config=options.fresh_config))
+    summary = summarize(reports, max_imports=options.imports)
+    if options.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+    if options.target is not None:
+        first_frame = [m["time"] for m in summary["milestones"]
+                       if m["name"] == FIRST_FRAME_MILESTONE]
+        if not first_frame or first_frame[0] > options.target:
+            print("Startup is slower than the %0.3fs target"
+                  % (options.target,), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Tests for cancelling parallel tile batches, and the operations built
+# on top of them.
+
+from __future__ import division, print_function
+from os.path import join
+import threading
+import time
+import unittest
+
+from . import paths
+from lib.document import Document
+from lib.errors import CancelledError
+import lib.feedback
+import lib.tilebatch
+
+
+TEST_IMAGE = "bigimage.ora"
+
+
+def _cancel_after(progress, cancel, n):
+    """Set a cancel flag once n items of a progress object are done"""
+    def _changed_cb(prog):
+        if prog.items and int(prog) >= n:
+            cancel.set()
+    progress.changed += _changed_cb
+
+
+class MapTilesCancel (unittest.TestCase):
+
+    def setUp(self):
+        self._poll_interval = lib.tilebatch.POLL_INTERVAL
+        lib.tilebatch.POLL_INTERVAL = 0.01
+
+    def tearDown(self):
+        lib.tilebatch.POLL_INTERVAL = self._poll_interval
+
+    def test_cancel_part_way(self):
+        """Cancelled batches return nothing, so nothing gets applied"""
+        tiles = [(x, y) for x in range(16) for y in range(16)]
+        dst = {}
+        calls = []
+        progress = lib.feedback.Progress()
+        cancel = threading.Event()
+        _cancel_after(progress, cancel, 8)
+
+        def _work(ti):
+            calls.append(ti)
+            time.sleep(0.001)
+            return ti
+
+        with self.assertRaises(CancelledError):
+            dst.update(lib.tilebatch.map_tiles(
+                _work, tiles, threads=4,
+                progress=progress, cancel=cancel,
+            ))
+        self.assertEqual(dst, {})
+        self.assertTrue(8 <= len(calls) < len(tiles))
+
+    def test_heartbeat(self):
+        """Progress observers hear from slow batches regularly"""
+        tiles = [(x, 0) for x in range(8)]
+        progress = lib.feedback.Progress()
+        beats = []
+        progress.changed += lambda p: beats.append(int(p))
+        lib.tilebatch.map_tiles(
+            lambda ti: time.sleep(0.1), tiles, threads=8,
+            progress=progress,
+        )
+        # Sizing the batch accounts for one of these. The rest are
+        # from the wait loop, before any tiles had finished.
+        self.assertTrue(beats.count(0) > 2)
+
+
+class LayerOpCancel (unittest.TestCase):
+
+    def setUp(self):
+        self._poll_interval = lib.tilebatch.POLL_INTERVAL
+        lib.tilebatch.POLL_INTERVAL = 0
+        self.doc = Document(painting_only=True)
+        self.doc.load(join(paths.TESTS_DIR, TEST_IMAGE))
+
+    def tearDown(self):
+        lib.tilebatch.POLL_INTERVAL = self._poll_interval
+        self.doc.cleanup()
+
+    def _snapshot(self):
+        """Get the document's layers and their tile data"""
+        root = self.doc.layer_stack
+        layers = []
+        for path, layer in root.walk():
+            surf = getattr(layer, "_surface", None)
+            tiles = {}
+            if surf is not None:
+                for tx, ty in surf.get_tiles():
+                    with surf.tile_request(tx, ty, readonly=True) as t:
+                        tiles[(tx, ty)] = t.copy()
+            layers.append((path, layer, tiles))
+        return layers, len(self.doc.command_stack.undo_stack)
+
+    def _assert_unchanged(self, before):
+        layers0, undos0 = before
+        layers1, undos1 = self._snapshot()
+        self.assertEqual(undos0, undos1)
+        self.assertEqual(len(layers0), len(layers1))
+        for (p0, l0, t0), (p1, l1, t1) in zip(layers0, layers1):
+            self.assertEqual(p0, p1)
+            self.assertIs(l0, l1)
+            self.assertEqual(set(t0), set(t1))
+            for ti in t0:
+                self.assertTrue((t0[ti] == t1[ti]).all())
+
+    def _check_cancel(self, method):
+        before = self._snapshot()
+        progress = lib.feedback.Progress()
+        cancel = threading.Event()
+        _cancel_after(progress, cancel, 1)
+        result = method(progress=progress, cancel=cancel)
+        self.assertFalse(result)
+        self.assertTrue(cancel.is_set())
+        self._assert_unchanged(before)
+
+    def test_merge_visible_cancelled(self):
+        self._check_cancel(self.doc.merge_visible_layers)
+
+    def test_merge_down_cancelled(self):
+        self._check_cancel(self.doc.merge_current_layer_down)
+
+    def test_normalize_cancelled(self):
+        root = self.doc.layer_stack
+        root.current.opacity = 0.5
+        self._check_cancel(self.doc.normalize_layer_mode)
+
+
+if __name__ == '__main__':
+    unittest.main()